@@ -0,0 +1,320 @@
+"""
+Hot/cold archival
+
+Closed appointments (with their prescriptions), settled pharmacy and canteen
+sales (with their items) and income entries older than ARCHIVE_AFTER_DAYS
+are moved, a batch at a time, out of their live tables into ArchivedRecord
+rows: one per archived row, holding its field values and those of the rows
+archived along with it as JSON, plus the date, patient, kind and amount
+columns the reports filter and sum on. The live tables and their indexes
+stay the size of the recent past.
+
+ArchivedRecord can live in a separate database (ARCHIVE_DATABASE, routed by
+accounts.routers.ArchiveRouter). A batch is copied first and deleted from
+the live table second; the copy ignores rows already archived, so a run that
+stopped between the two just finishes the batch the next time. Rows still
+referenced from live tables (e.g. an appointment with lab orders) are left
+in place.
+
+Live rows are deleted without model signals: the dashboard rollups keep
+counting what was archived, and ``rebuild_rollups`` reads the archive too.
+Read-through helpers (load, total) give patient history and the finance
+reports the archived rows.
+"""
+import datetime
+import time
+import uuid
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+# model label -> what is archived and how it is summarised
+ARCHIVED = {}
+
+
+def archives(label, date_field, children=None, patient=None, amount=None, kind=None):
+    """Register ``func(queryset)``, narrowing ``label`` to the rows that are closed.
+
+    ``children`` maps related names of rows archived with each row to their
+    own children, e.g. ``{'prescriptions': {'medicines': {}}}``.
+    """
+    def decorator(func):
+        ARCHIVED[label] = {
+            'date_field': date_field,
+            'children': children or {},
+            'patient': patient,
+            'amount': amount,
+            'kind': kind,
+            'closed': func,
+        }
+        return func
+    return decorator
+
+
+# Sales first: a sale keeps its prescription's appointment live until it goes
+@archives('pharmacy.PharmacySale', 'sale_date', children={'items': {}}, patient='patient_id', amount='total_amount')
+def pharmacy_sale(queryset):
+    # Unpaid sales stay until they are settled
+    return queryset.filter(amount_paid__gte=F('total_amount'))
+
+
+@archives('survey.CanteenSale', 'sale_date', children={'items': {}}, patient='patient_id', amount='total_amount')
+def canteen_sale(queryset):
+    return queryset
+
+
+@archives(
+    'appointments.Appointment', 'appointment_date', children={'prescriptions': {'medicines': {}}},
+    patient='patient_id', amount='consultation_fee', kind='status',
+)
+def appointment(queryset):
+    return queryset.filter(status__in=('completed', 'cancelled', 'no_show'))
+
+
+@archives('finance.Income', 'date', amount='amount', kind='source')
+def income(queryset):
+    return queryset
+
+
+def database():
+    """Alias of the database holding ArchivedRecord"""
+    return getattr(settings, 'ARCHIVE_DATABASE', 'default')
+
+
+def horizon(days=None):
+    """First day that is kept live"""
+    days = getattr(settings, 'ARCHIVE_AFTER_DAYS', 365) if days is None else days
+    return timezone.localdate() - datetime.timedelta(days=days)
+
+
+def _plain(value):
+    """JSON-safe form of a field value, at full precision"""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, FieldFile):
+        return value.name
+    return value
+
+
+def _dump(instance, children):
+    data = {field.attname: _plain(field.value_from_object(instance)) for field in instance._meta.concrete_fields}
+    for name, grandchildren in children.items():
+        data[name] = [_dump(child, grandchildren) for child in getattr(instance, name).all()]
+    return data
+
+
+def _restore(model, data, children):
+    values = {
+        field.attname: None if data[field.attname] is None else field.to_python(data[field.attname])
+        for field in model._meta.concrete_fields if field.attname in data
+    }
+    instance = model(**values)
+    instance._state.adding = False
+    instance.archived = True
+    instance.archived_related = {
+        name: [_restore(model._meta.get_field(name).related_model, child, grandchildren) for child in data.get(name, [])]
+        for name, grandchildren in children.items()
+    }
+    return instance
+
+
+def _day(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    return value
+
+
+def _prefetch(children, prefix=''):
+    paths = []
+    for name, grandchildren in children.items():
+        paths.append(prefix + name)
+        paths.extend(_prefetch(grandchildren, f'{prefix}{name}__'))
+    return paths
+
+
+def _references(model, children, prefix=''):
+    """Lookups of live rows pointing at ``model`` (or the children archived with it)"""
+    paths = []
+    for relation in model._meta.related_objects:
+        if relation.name in children:
+            paths.extend(_references(relation.related_model, children[relation.name], f'{prefix}{relation.name}__'))
+        else:
+            paths.append(prefix + relation.name)
+    return paths
+
+
+def candidates(label, before):
+    """Closed ``label`` rows dated before ``before`` that can be archived, oldest first"""
+    spec = ARCHIVED[label]
+    model = apps.get_model(label)
+    date_field = spec['date_field']
+    cutoff = before
+    if isinstance(model._meta.get_field(date_field), models.DateTimeField):
+        cutoff = timezone.make_aware(datetime.datetime.combine(before, datetime.time.min))
+    queryset = spec['closed'](model._base_manager.filter(**{f'{date_field}__lt': cutoff}))
+    for path in _references(model, spec['children']):
+        queryset = queryset.exclude(**{f'{path}__isnull': False})
+    return queryset.order_by(date_field, 'pk')
+
+
+def _record(label, instance):
+    from .models import ArchivedRecord
+
+    spec = ARCHIVED[label]
+    return ArchivedRecord(
+        model=label,
+        object_id=instance.pk,
+        date=_day(getattr(instance, spec['date_field'])),
+        patient_id=getattr(instance, spec['patient']) if spec['patient'] else None,
+        kind=getattr(instance, spec['kind']) if spec['kind'] else '',
+        amount=(getattr(instance, spec['amount']) if spec['amount'] else None) or 0,
+        data=_dump(instance, spec['children']),
+    )
+
+
+def _delete(model, children, pks, using):
+    """Delete rows and the children archived with them, without signals"""
+    for name, grandchildren in children.items():
+        relation = model._meta.get_field(name)
+        child_pks = list(relation.related_model._base_manager.using(using).filter(
+            **{f'{relation.field.name}__in': pks}
+        ).values_list('pk', flat=True))
+        _delete(relation.related_model, grandchildren, child_pks, using)
+    model._base_manager.using(using).filter(pk__in=pks)._raw_delete(using)
+
+
+def archive_batch(label, before=None, batch_size=None):
+    """Move up to ``batch_size`` rows of ``label`` dated before ``before``.
+
+    Returns the number of rows moved; 0 when nothing is left to archive.
+    """
+    from .models import ArchivedRecord
+
+    spec = ARCHIVED[label]
+    model = apps.get_model(label)
+    batch_size = batch_size or getattr(settings, 'ARCHIVE_BATCH_SIZE', 500)
+    live = router.db_for_write(model)
+    rows = list(candidates(label, before or horizon()).prefetch_related(*_prefetch(spec['children']))[:batch_size])
+    if not rows:
+        return 0
+    records = [_record(label, row) for row in rows]
+    # One transaction when both live in the same database
+    with transaction.atomic(using=live):
+        with transaction.atomic(using=database()):
+            ArchivedRecord.objects.using(database()).bulk_create(records, ignore_conflicts=True)
+        _delete(model, spec['children'], [row.pk for row in rows], live)
+
+    def invalidate():
+        from patients import timeline
+
+        # The patients' timelines now show these rows as archived
+        timeline.invalidate(*{record.patient_id for record in records})
+    transaction.on_commit(invalidate, using=live)
+    return len(rows)
+
+
+def run(labels=None, before=None, batch_size=None, max_batches=None, pause=0, progress=None):
+    """Archive every registered model (or ``labels``) batch by batch.
+
+    ``max_batches`` bounds the work done per model in one run; ``pause``
+    seconds between batches leave room for the live traffic. Returns
+    ``{label: rows moved}``.
+    """
+    before = before or horizon()
+    moved = {}
+    for label in labels or ARCHIVED:
+        moved[label] = batches = 0
+        while max_batches is None or batches < max_batches:
+            count = archive_batch(label, before, batch_size)
+            if not count:
+                break
+            moved[label] += count
+            batches += 1
+            if progress:
+                progress(label, moved[label])
+            if pause:
+                time.sleep(pause)
+    return moved
+
+
+def records(label, start=None, end=None, patient_id=None):
+    """ArchivedRecord rows of ``label`` (or all), optionally between two days (inclusive) or for one patient"""
+    from .models import ArchivedRecord
+
+    rows = ArchivedRecord.objects.using(database()).all()
+    if label is not None:
+        rows = rows.filter(model=label)
+    if start:
+        rows = rows.filter(date__gte=start)
+    if end:
+        rows = rows.filter(date__lte=end)
+    if patient_id is not None:
+        rows = rows.filter(patient_id=patient_id)
+    return rows
+
+
+def load_patient(patient_id):
+    """Every archived row of one patient, in one query: ``{label: [instances]}``"""
+    loaded = {label: [] for label in ARCHIVED}
+    for label, data in records(None, patient_id=patient_id).values_list('model', 'data'):
+        loaded[label].append(_restore(apps.get_model(label), data, ARCHIVED[label]['children']))
+    return loaded
+
+
+def _repoint(data, field, old, new):
+    # Recursively, so the rows archived along (e.g. prescriptions) move too
+    if data.get(field) in old:
+        data[field] = new
+    for value in data.values():
+        if isinstance(value, list):
+            for child in value:
+                if isinstance(child, dict):
+                    _repoint(child, field, old, new)
+    return data
+
+
+def reassign_patient(old_ids, new_id):
+    """Point the archived rows of patients ``old_ids`` at ``new_id`` (a merge).
+
+    Returns the number of records changed.
+    """
+    from .models import ArchivedRecord
+
+    old = set(old_ids)
+    rows = list(ArchivedRecord.objects.using(database()).filter(patient_id__in=old))
+    for row in rows:
+        row.patient_id = new_id
+        row.data = _repoint(row.data, 'patient_id', old, new_id)
+    with transaction.atomic(using=database()):
+        ArchivedRecord.objects.using(database()).bulk_update(rows, ['patient_id', 'data'], batch_size=500)
+    return len(rows)
+
+
+def load(label, start=None, end=None, patient_id=None):
+    """Archived rows as unsaved model instances, newest first.
+
+    Instances have ``archived = True`` and the rows archived with them in
+    ``archived_related`` (e.g. ``archived_related['prescriptions']``).
+    """
+    model = apps.get_model(label)
+    children = ARCHIVED[label]['children']
+    return [_restore(model, data, children) for data in records(label, start, end, patient_id).values_list('data', flat=True)]
+
+
+def total(label, start=None, end=None, by_kind=False):
+    """Summed amount and count of archived rows (per kind with ``by_kind``)"""
+    rows = records(label, start, end)
+    if by_kind:
+        return {
+            row['kind']: {'total': row['total'], 'count': row['count']}
+            for row in rows.values('kind').annotate(total=Sum('amount'), count=Count('pk')).order_by()
+        }
+    result = rows.aggregate(total=Sum('amount'), count=Count('pk'))
+    return {'total': result['total'] or Decimal(0), 'count': result['count']}
@@ -0,0 +1,143 @@
+"""
+End-of-day close
+
+close_day() closes one business day in a single transaction and a bounded
+number of statements, whatever the day's volume:
+
+- appointments of the day (or earlier) still waiting or called become
+  no-shows in one UPDATE; the rollups move them over with one F() update per
+  doctor, day and status instead of a save per appointment
+- the day's dashboard rollups are recomputed from the source tables
+  (rollups.rebuild), so whatever bypassed the signals is folded in and the
+  totals stand as closed
+- every drug's stock is copied to the day's StockSnapshot rows
+- the per-day counters are dropped: booking counters up to the day (they are
+  reseeded from the appointments if needed again) and the daily document
+  sequences of earlier days. The day's own sequences stay, since documents
+  dated that day may still be numbered after the close.
+- cached PDFs older than DOCUMENT_CACHE_DAYS are deleted (accounts.documents)
+
+Running it again for the same day redoes each step and gives the same
+result. Each step's row count and seconds are stored on the day's DayClose
+row and returned.
+"""
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from . import rollups
+
+# Appointments left in these statuses at day end did not turn up
+LEFTOVER_STATUSES = ('waiting', 'called')
+
+
+def mark_no_shows(day):
+    """Mark appointments up to ``day`` still waiting or called as no-shows"""
+    from appointments.models import Appointment
+
+    leftovers = Appointment.objects.filter(appointment_date__lte=day, status__in=LEFTOVER_STATUSES)
+    groups = list(leftovers.order_by().values('appointment_date', 'doctor_id', 'status').annotate(
+        count=Count('pk'), fees=Sum('consultation_fee'),
+    ))
+    if not groups:
+        return 0
+    patient_ids = list(leftovers.order_by().values_list('patient_id', flat=True).distinct())
+    updated = leftovers.update(status='no_show')
+
+    # The UPDATE bypasses the signals: move the rollups over by hand
+    delta = defaultdict(lambda: [0, Decimal(0)])
+    for group in groups:
+        fees = group['fees'] or Decimal(0)
+        for status, sign in ((group['status'], -1), ('no_show', 1)):
+            key = ('appointments', group['appointment_date'], status, 0, group['doctor_id'])
+            delta[key][0] += sign * group['count']
+            delta[key][1] += sign * fees
+    rollups.apply(delta)
+
+    def invalidate():
+        from appointments import availability, queue_state, roster
+        from patients import timeline
+
+        roster.invalidate()
+        timeline.invalidate(*patient_ids)
+        for group in groups:
+            queue_state.invalidate(group['doctor_id'], group['appointment_date'])
+            availability.invalidate(group['doctor_id'], group['appointment_date'])
+    transaction.on_commit(invalidate)
+    return updated
+
+
+def freeze_rollups(day):
+    """Recompute the day's rollup rows from the source tables"""
+    return rollups.rebuild(start_date=day, end_date=day)
+
+
+def snapshot_stock(day):
+    """Copy every drug's stock and prices to the day's StockSnapshot rows"""
+    from pharmacy.models import Drug, StockSnapshot
+
+    StockSnapshot.objects.filter(date=day).delete()
+    snapshots = StockSnapshot.objects.bulk_create([
+        StockSnapshot(date=day, drug_id=drug_id, quantity=quantity, unit_price=unit_price, selling_price=selling_price)
+        for drug_id, quantity, unit_price, selling_price in Drug.objects.values_list(
+            'pk', 'quantity_in_stock', 'unit_price', 'selling_price'
+        ).iterator()
+    ], batch_size=500)
+    return len(snapshots)
+
+
+def reset_counters(day):
+    """Drop booking counters up to ``day`` and daily document sequences before it"""
+    from appointments.models import BookingCounter
+
+    from .models import DocumentSequence
+
+    counters, _ = BookingCounter.objects.filter(date__lte=day).delete()
+    # Daily periods are YYYYMMDD; yearly ones (e.g. patient ids) are left alone
+    sequences, _ = DocumentSequence.objects.alias(length=Length('period')).filter(
+        length=8, period__lt=day.strftime('%Y%m%d')
+    ).delete()
+    return counters + sequences
+
+
+def prune_documents(day):
+    """Delete cached PDFs nobody has printed for a while"""
+    from . import documents
+
+    return documents.prune()
+
+
+STEPS = (
+    ('no_shows', mark_no_shows),
+    ('rollups', freeze_rollups),
+    ('stock', snapshot_stock),
+    ('counters', reset_counters),
+    ('documents', prune_documents),
+)
+
+
+def close_day(day=None):
+    """Run every step for ``day`` (default today) and record the close.
+
+    Returns the DayClose row; its ``summary`` maps each step to the rows it
+    touched and the seconds it took.
+    """
+    from .models import DayClose
+
+    day = day or timezone.localdate()
+    started = time.perf_counter()
+    summary = {}
+    with transaction.atomic():
+        for name, step in STEPS:
+            step_started = time.perf_counter()
+            rows = step(day)
+            summary[name] = {'rows': rows, 'seconds': round(time.perf_counter() - step_started, 3)}
+        closed, _ = DayClose.objects.update_or_create(
+            date=day, defaults={'duration': round(time.perf_counter() - started, 3), 'summary': summary},
+        )
+    return closed
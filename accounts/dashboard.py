@@ -0,0 +1,79 @@
+"""
+Dashboard query helpers
+
+Role dashboards show many counters over the same rows (waiting, completed,
+cancelled, ...). ``tally()`` computes all of them with one conditional
+aggregate per model instead of one ``.filter().count()`` per counter, and
+``QueryCounter``/``counted_queries`` record how many queries a dashboard
+ran so tests can hold each view to a query budget.
+"""
+import functools
+import logging
+
+from django.db import connections
+from django.db.models import Count, Q
+
+logger = logging.getLogger(__name__)
+
+
+def tally(queryset, **counters):
+    """Compute several counters over ``queryset`` in a single query.
+
+    Each keyword is either a ``Q`` (count of matching rows), ``None`` (count
+    of all rows) or an aggregate expression such as
+    ``Sum('amount', filter=Q(...))``. Empty sums come back as 0.
+
+        tally(appointments, waiting=Q(status='waiting'), total=None)
+    """
+    aggregates = {}
+    for name, counter in counters.items():
+        if counter is None:
+            aggregates[name] = Count('pk')
+        elif isinstance(counter, Q):
+            aggregates[name] = Count('pk', filter=counter)
+        else:
+            aggregates[name] = counter
+    results = queryset.order_by().aggregate(**aggregates)
+    return {name: value if value is not None else 0 for name, value in results.items()}
+
+
+class QueryCounter:
+    """Count the queries run while active, on every database connection.
+
+    Works with DEBUG off (unlike ``connection.queries``):
+
+        with QueryCounter() as counter:
+            ...
+        counter.count
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._wrappers = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        for connection in connections.all():
+            wrapper = connection.execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._wrappers:
+            self._wrappers.pop().__exit__(*exc_info)
+
+
+def counted_queries(view):
+    """Record the number of queries a view ran on ``response.query_count``"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with QueryCounter() as counter:
+            response = view(request, *args, **kwargs)
+        response.query_count = counter.count
+        logger.debug('%s ran %d queries', view.__name__, counter.count)
+        return response
+    return wrapper
@@ -0,0 +1,225 @@
+"""
+PDF documents
+
+Print pages (prescriptions, lab reports, vouchers) are rendered to HTML by
+their templates as before, and turned into PDF by a backend (BACKENDS,
+chosen with DOCUMENT_PDF_BACKEND). A PDF is cached on disk under the hash of
+the backend and the HTML it was made from, so a reprint of an unchanged
+document is a file read, and any change to the data shows up as new HTML
+and a new render.
+
+render_batch() prints many documents as one multi-page PDF: the pages not
+in the cache are rendered by a pool of DOCUMENT_RENDER_WORKERS processes
+and the results merged with pypdf. The batch is cached as well, under the
+hashes of its pages.
+
+``close_day`` removes the cached files not used for DOCUMENT_CACHE_DAYS.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+import django
+from django.conf import settings
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# name -> render function ``func(html, base_url) -> bytes``
+BACKENDS = {}
+
+
+class PDFUnavailable(Exception):
+    """The PDF backend cannot run here"""
+
+
+def backend(name):
+    """Register ``func(html, base_url)`` as a PDF backend"""
+    def decorator(func):
+        BACKENDS[name] = func
+        return func
+    return decorator
+
+
+def _static_fetcher(url):
+    """Serve /static/ URLs from the static files on disk instead of over HTTP"""
+    from django.contrib.staticfiles import finders
+    from weasyprint import default_url_fetcher
+
+    path = urlsplit(url).path
+    if path.startswith(settings.STATIC_URL):
+        name = path[len(settings.STATIC_URL):]
+        found = finders.find(name) or os.path.join(settings.STATIC_ROOT, name)
+        if os.path.exists(found):
+            return {'file_obj': open(found, 'rb'), 'mime_type': mimetypes.guess_type(found)[0]}
+    return default_url_fetcher(url)
+
+
+@backend('weasyprint')
+def weasyprint_backend(html, base_url):
+    try:
+        import weasyprint
+    except (ImportError, OSError) as error:
+        raise PDFUnavailable(f'WeasyPrint: {error}')
+    return weasyprint.HTML(string=html, base_url=base_url, url_fetcher=_static_fetcher).write_pdf()
+
+
+def backend_name():
+    return getattr(settings, 'DOCUMENT_PDF_BACKEND', 'weasyprint')
+
+
+def _resolve(name):
+    # A registered name, or a dotted path to a render function
+    return BACKENDS[name] if name in BACKENDS else import_string(name)
+
+
+def _convert(name, html, base_url):
+    """Render one PDF (run in the pool's worker processes as well)"""
+    return _resolve(name)(html, base_url)
+
+
+def cache_root():
+    return str(getattr(settings, 'DOCUMENT_CACHE_ROOT', os.path.join(settings.BASE_DIR, 'data', 'pdf_cache')))
+
+
+def digest(html):
+    """Cache key of the PDF made from ``html`` by the configured backend"""
+    return hashlib.sha256(f'{backend_name()}\n{html}'.encode()).hexdigest()
+
+
+def _path(key):
+    return os.path.join(cache_root(), key[:2], f'{key}.pdf')
+
+
+def cached(key):
+    """The cached PDF for ``key``, or None"""
+    path = _path(key)
+    try:
+        with open(path, 'rb') as pdf:
+            content = pdf.read()
+    except FileNotFoundError:
+        return None
+    # Reprinted documents stay in the cache (see prune)
+    os.utime(path)
+    return content
+
+
+def _store(key, pdf):
+    # Written aside and moved into place: readers never see half a file
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, partial = tempfile.mkstemp(suffix='.pdf', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            output.write(pdf)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def render_pdf(html, base_url=None):
+    """PDF of ``html``, from the cache when it was rendered before"""
+    key = digest(html)
+    pdf = cached(key)
+    if pdf is None:
+        pdf = _convert(backend_name(), html, base_url)
+        _store(key, pdf)
+    return pdf
+
+
+def _workers():
+    return getattr(settings, 'DOCUMENT_RENDER_WORKERS', min(4, os.cpu_count() or 1))
+
+
+def render_many(pages, base_url=None):
+    """PDFs of several HTML pages, rendering the uncached ones in parallel"""
+    keys = [digest(html) for html in pages]
+    pdfs = [cached(key) for key in keys]
+    missing = [index for index, pdf in enumerate(pdfs) if pdf is None]
+    workers = min(_workers(), len(missing))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            rendered = pool.map(_convert, [backend_name()] * len(missing), [pages[index] for index in missing], [base_url] * len(missing))
+            for index, pdf in zip(missing, rendered):
+                pdfs[index] = pdf
+    else:
+        for index in missing:
+            pdfs[index] = _convert(backend_name(), pages[index], base_url)
+    for index in missing:
+        _store(keys[index], pdfs[index])
+    return pdfs
+
+
+def merge(pdfs):
+    """One PDF with the pages of ``pdfs`` in order"""
+    if len(pdfs) == 1:
+        return pdfs[0]
+    try:
+        from pypdf import PdfWriter
+    except ImportError as error:
+        raise PDFUnavailable(f'pypdf: {error}')
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(BytesIO(pdf))
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def render_batch(pages, base_url=None):
+    """One PDF of all ``pages`` (HTML strings), cached as a whole"""
+    key = hashlib.sha256('\n'.join(['batch'] + [digest(html) for html in pages]).encode()).hexdigest()
+    pdf = cached(key)
+    if pdf is None:
+        pdf = merge(render_many(pages, base_url))
+        _store(key, pdf)
+    return pdf
+
+
+def prune(days=None):
+    """Delete cached PDFs not used for ``days`` days; returns how many"""
+    days = getattr(settings, 'DOCUMENT_CACHE_DAYS', 30) if days is None else days
+    cutoff = time.time() - days * 24 * 60 * 60
+    removed = 0
+    for directory, _, names in os.walk(cache_root()):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def pdf_response(pdf, filename):
+    response = HttpResponse(pdf, content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="{filename}"'
+    return response
+
+
+def wants_pdf(request):
+    return request.GET.get('format') == 'pdf'
+
+
+def print_response(request, template_name, context, filename):
+    """The print page, or its PDF with ``?format=pdf``.
+
+    Without a working backend the HTML page is served, for the browser to
+    print as before.
+    """
+    if wants_pdf(request):
+        html = render_to_string(template_name, context, request=request)
+        try:
+            return pdf_response(render_pdf(html, request.build_absolute_uri('/')), filename)
+        except PDFUnavailable as error:
+            logger.warning('Serving %s as HTML: %s', template_name, error)
+    return render(request, template_name, context)
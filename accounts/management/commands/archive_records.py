@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Move closed appointments, settled sales and income older than the '
+        'archive horizon out of the live tables (accounts/archive.py). Safe to '
+        'stop and run again; each run continues where the last one ended.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Keep this many days live (default ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--model', action='append', dest='labels', help='Only this model, e.g. finance.Income')
+        parser.add_argument('--batch-size', type=int, help='Rows moved per transaction (default ARCHIVE_BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, help='Stop each model after this many batches')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to wait between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would move')
+
+    def handle(self, *args, **options):
+        labels = options['labels'] or list(archive.ARCHIVED)
+        unknown = set(labels) - set(archive.ARCHIVED)
+        if unknown:
+            raise CommandError(f"Not archived: {', '.join(sorted(unknown))}")
+        before = archive.horizon(options['days'])
+
+        if options['dry_run']:
+            for label in labels:
+                self.stdout.write(f'{label}: {archive.candidates(label, before).count()} rows before {before}')
+            return
+
+        moved = archive.run(
+            labels, before=before, batch_size=options['batch_size'], max_batches=options['max_batches'],
+            pause=options['pause'], progress=lambda label, count: self.stdout.write(f'{label}: {count} rows moved'),
+        )
+        for label, count in moved.items():
+            self.stdout.write(self.style.SUCCESS(f'{label}: archived {count} rows dated before {before}'))
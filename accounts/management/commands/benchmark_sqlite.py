@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from accounts import sqlite
+
+PROFILES = {
+    # production_settings before WAL tuning
+    'default': {'timeout': 20},
+    'tuned': sqlite.options(timeout=20),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent booking throughput on a scratch SQLite database '
+        'with the plain and the tuned connection settings (accounts/sqlite.py)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent writers')
+        parser.add_argument('--bookings', type=int, default=50, help='Appointments booked per writer')
+        parser.add_argument('--reads', type=int, default=2, help='Queue reads after each booking')
+
+    def handle(self, *args, **options):
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite')
+
+        original = connections.settings[DEFAULT_DB_ALIAS]
+        workdir = tempfile.mkdtemp(prefix='benchmark_sqlite_')
+        results = {}
+        try:
+            for name, db_options in PROFILES.items():
+                self.use_database(dict(original, NAME=os.path.join(workdir, f'{name}.sqlite3'), OPTIONS=db_options))
+                call_command('migrate', verbosity=0)
+                # The plain profile is measured without the lock retries too
+                retries = getattr(settings, 'SQLITE_LOCK_RETRIES', 3) if name == 'tuned' else 0
+                with override_settings(
+                    SQLITE_LOCK_RETRIES=retries,
+                    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                ):
+                    results[name] = self.run(options['threads'], options['bookings'], options['reads'])
+        finally:
+            self.use_database(original)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self.stdout.write(f"{'Profile':<10} {'Booked':>7} {'Failed':>7} {'Seconds':>8} {'Bookings/s':>11}")
+        for name, (booked, failed, elapsed) in results.items():
+            self.stdout.write(f'{name:<10} {booked:>7} {failed:>7} {elapsed:>8.2f} {booked / elapsed:>11.1f}')
+
+    def use_database(self, settings_dict):
+        """Point the default alias at ``settings_dict`` for this and new threads"""
+        connections[DEFAULT_DB_ALIAS].close()
+        del connections[DEFAULT_DB_ALIAS]
+        connections.settings[DEFAULT_DB_ALIAS] = settings_dict
+
+    def run(self, threads, bookings, reads):
+        from django.contrib.auth import get_user_model
+        from appointments.broadcast import broadcaster
+        from appointments.models import Appointment
+        from appointments.queue_state import ACTIVE_STATUSES
+        from patients.models import Patient
+
+        User = get_user_model()
+        today = timezone.localdate()
+        patient = Patient.objects.create(
+            first_name='Benchmark', last_name='Patient', date_of_birth='1990-01-01', gender='M',
+            phone='01700000000', address='-', city='-', emergency_contact_name='-',
+            emergency_contact_phone='01700000000', emergency_contact_relation='-',
+        )
+        # One doctor per writer: serial numbers are per doctor and day, and
+        # this measures database locking, not serial allocation
+        doctors = [
+            User.objects.create_user(username=f'benchmark_doctor_{index}', role='DOCTOR')
+            for index in range(threads)
+        ]
+        counts = {'booked': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def writer(doctor):
+            try:
+                for _ in range(bookings):
+                    try:
+                        Appointment.objects.create(patient=patient, doctor=doctor, appointment_date=today)
+                        for _ in range(reads):
+                            list(Appointment.objects.filter(
+                                doctor=doctor, appointment_date=today, status__in=ACTIVE_STATUSES
+                            ))
+                        outcome = 'booked'
+                    except OperationalError:
+                        outcome = 'failed'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=writer, args=(doctor,)) for doctor in doctors]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        broadcaster.flush()
+        return counts['booked'], counts['failed'], elapsed
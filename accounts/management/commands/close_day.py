@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from accounts import closing
+
+
+class Command(BaseCommand):
+    help = (
+        'Close a business day: mark leftover appointments as no-shows, freeze '
+        'the day\'s rollups, snapshot drug stock, reset the per-day counters and '
+        'prune the PDF cache (accounts/closing.py). Safe to run again for the same day.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to close (YYYY-MM-DD, default today)')
+
+    def handle(self, *args, **options):
+        day = None
+        if options['date']:
+            day = parse_date(options['date'])
+            if day is None:
+                raise CommandError(f"Invalid date: {options['date']}")
+
+        closed = closing.close_day(day)
+        for name, step in closed.summary.items():
+            self.stdout.write(f"{name}: {step['rows']} rows in {step['seconds']:.3f}s")
+        self.stdout.write(self.style.SUCCESS(f'Closed {closed.date} in {closed.duration:.3f}s'))
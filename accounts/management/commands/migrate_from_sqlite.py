@@ -0,0 +1,162 @@
+import os
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+SOURCE_ALIAS = 'sqlite_source'
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy every table from an SQLite database file (or another configured '
+        'database) into the target database, e.g. PostgreSQL. Both must be '
+        'migrated to the current schema (--migrate-source migrates the source); '
+        'the target is emptied first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', help='Path to the SQLite database file')
+        parser.add_argument(
+            '--source-database',
+            help='Copy from this configured database alias instead of a file',
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Target database alias')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT batch')
+        parser.add_argument(
+            '--migrate-source', action='store_true',
+            help='Apply missing migrations to the source first (changes the source database)',
+        )
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Do not ask before emptying the target database',
+        )
+
+    def handle(self, *args, **options):
+        source_path = options['source']
+        if bool(source_path) == bool(options['source_database']):
+            raise CommandError('Give either an SQLite file or --source-database')
+        if source_path and not os.path.isfile(source_path):
+            raise CommandError(f'SQLite file not found: {source_path}')
+
+        target = connections[options['database']]
+        if options['source_database'] == options['database'] or (
+            source_path and target.vendor == 'sqlite'
+            and os.path.abspath(str(target.settings_dict['NAME'])) == os.path.abspath(source_path)
+        ):
+            raise CommandError('Source and target are the same database')
+
+        executor = MigrationExecutor(target)
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            raise CommandError(f"Target has unapplied migrations; run 'migrate --database {options['database']}' first")
+
+        if options['source_database']:
+            self.check_then_copy(connections[options['source_database']], target, options)
+            return
+
+        connections.settings[SOURCE_ALIAS] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': source_path},
+        })[DEFAULT_DB_ALIAS]
+        try:
+            self.check_then_copy(connections[SOURCE_ALIAS], target, options)
+        finally:
+            connections[SOURCE_ALIAS].close()
+            del connections[SOURCE_ALIAS]
+            del connections.settings[SOURCE_ALIAS]
+
+    def check_then_copy(self, source, target, options):
+        # Rows are copied column for column: both sides need the current schema
+        executor = MigrationExecutor(source)
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if plan and not options['migrate_source']:
+            names = ', '.join(f'{migration.app_label}.{migration.name}' for migration, _ in plan[:5])
+            more = f' and {len(plan) - 5} more' if len(plan) > 5 else ''
+            raise CommandError(
+                f'Source has {len(plan)} unapplied migrations ({names}{more}). Migrate it first, '
+                'or pass --migrate-source to apply them to the source before copying'
+            )
+
+        if options['interactive']:
+            answer = input(
+                f"This will DELETE all data in database '{options['database']}' "
+                f"({target.settings_dict['NAME']}) and replace it with "
+                f"{options['source'] or options['source_database']}.\n"
+                + ('The source will be migrated first.\n' if plan else '')
+                + "Type 'yes' to continue: "
+            )
+            if answer != 'yes':
+                raise CommandError('Cancelled')
+
+        if plan:
+            self.stdout.write(f'Applying {len(plan)} migrations to the source')
+            call_command('migrate', database=source.alias, interactive=False, verbosity=0)
+        self.copy(source, target, options['batch_size'])
+
+    def copy(self, source, target, batch_size):
+        source_tables = set(source.introspection.table_names())
+        all_models = [
+            model for model in apps.get_models(include_auto_created=True)
+            if model._meta.managed and not model._meta.proxy
+        ]
+        models = [model for model in all_models if model._meta.db_table in source_tables]
+        missing = [model._meta.db_table for model in all_models if model not in models]
+        if missing:
+            self.stdout.write(self.style.WARNING(f"Not in the source, left empty: {', '.join(missing)}"))
+
+        # Foreign keys are deferred until commit, so table order doesn't matter
+        with transaction.atomic(using=target.alias):
+            target.ops.execute_sql_flush(target.ops.sql_flush(
+                no_style(), [model._meta.db_table for model in all_models], allow_cascade=True,
+            ))
+            for model in models:
+                copied = self.copy_model(model, source, target, batch_size)
+                self.stdout.write(f'  {model._meta.label}: {copied} rows')
+
+            with target.cursor() as cursor:
+                for sql in target.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+
+            mismatched = []
+            for model in models:
+                expected = model._base_manager.using(source.alias).count()
+                actual = model._base_manager.using(target.alias).count()
+                if expected != actual:
+                    mismatched.append(f'{model._meta.label} ({expected} in source, {actual} copied)')
+            if mismatched:
+                raise CommandError(f"Row counts differ, nothing was committed: {', '.join(mismatched)}")
+
+        self.stdout.write(self.style.SUCCESS(f'Copied {len(models)} tables; row counts verified'))
+
+    def copy_model(self, model, source, target, batch_size):
+        """Stream one table across in batches of raw INSERTs.
+
+        Not bulk_create(): it would replace auto_now/auto_now_add
+        timestamps with the current time.
+        """
+        fields = model._meta.local_concrete_fields
+        quote = target.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        rows = model._base_manager.using(source.alias).order_by('pk').values_list(
+            *[field.attname for field in fields]
+        ).iterator(chunk_size=batch_size)
+
+        copied = 0
+        batch = []
+        with target.cursor() as cursor:
+            for row in rows:
+                batch.append([field.get_db_prep_save(value, target) for field, value in zip(fields, row)])
+                if len(batch) >= batch_size:
+                    cursor.executemany(sql, batch)
+                    copied += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+                copied += len(batch)
+        return copied
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from accounts import profiling
+
+
+class Command(BaseCommand):
+    help = 'Show queries, DB time and template time per view (see accounts.profiling)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Number of views to show')
+        parser.add_argument('--duplicates', action='store_true', help='List repeated queries per view')
+        parser.add_argument('--reset', action='store_true', help='Clear the report')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            profiling.store.reset()
+            self.stdout.write(self.style.SUCCESS('Query report reset'))
+            return
+
+        rows = profiling.store.report()[:options['limit']]
+        if not rows:
+            self.stdout.write('No requests recorded in the last %d hours' % profiling.store.hours)
+            return
+
+        self.stdout.write(
+            f"{'View':<45} {'Reqs':>6} {'Avg Q':>7} {'Max Q':>6} {'Over':>5} "
+            f"{'Avg DB ms':>10} {'Avg Tpl ms':>11} {'Repeated':>9}"
+        )
+        for row in rows:
+            line = (
+                f"{row['view_name']:<45} {row['requests']:>6} {row['avg_queries']:>7.1f} "
+                f"{row['max_queries']:>6} {row['over_budget']:>5} {row['avg_db_ms']:>10.1f} "
+                f"{row['avg_template_ms']:>11.1f} {row['duplicate_requests']:>9}"
+            )
+            if row['over_budget']:
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
+            if options['duplicates']:
+                for sql, count in row['duplicates']:
+                    self.stdout.write(f'    +{count} {sql[:150]}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from accounts import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily dashboard rollups from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start_date', help='First day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end_date', help='Last day to rebuild (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        dates = {}
+        for option in ('start_date', 'end_date'):
+            value = options[option]
+            if value and parse_date(value) is None:
+                raise CommandError(f'Invalid date: {value}')
+            dates[option] = parse_date(value) if value else None
+
+        written = rollups.rebuild(**dates)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} rollup rows'))
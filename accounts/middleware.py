@@ -28,3 +28,28 @@ class AutoLoginMiddleware:
         
         response = self.get_response(request)
         return response
+
+
+class QueryBudgetMiddleware:
+    """
+    Profiles queries, DB time and template time of each request and adds
+    them to the per-view report (see accounts.profiling).
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        from django.conf import settings
+        from . import profiling
+        
+        if not getattr(settings, 'QUERY_PROFILING', True):
+            return self.get_response(request)
+        
+        with profiling.profile_request() as profile:
+            response = self.get_response(request)
+        
+        match = request.resolver_match
+        if match is not None:
+            profiling.store.record(match.view_name, profile)
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_documentsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(help_text='e.g., income, appointments, lab_orders', max_length=30)),
+                ('date', models.DateField()),
+                ('source', models.CharField(blank=True, help_text='Income source, expense type or status', max_length=30)),
+                ('department_id', models.PositiveIntegerField(default=0, help_text='finance.Department id, 0 for none')),
+                ('doctor_id', models.PositiveIntegerField(default=0, help_text="Doctor's user id, 0 for none")),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'ordering': ['-date', 'metric'],
+                'unique_together': {('metric', 'date', 'source', 'department_id', 'doctor_id')},
+            },
+        ),
+    ]
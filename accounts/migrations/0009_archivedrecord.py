@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_dailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='Model label, e.g. appointments.Appointment', max_length=50)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('date', models.DateField(help_text='Day the row belongs to')),
+                ('patient_id', models.PositiveIntegerField(blank=True, help_text='patients.Patient id, if any', null=True)),
+                ('kind', models.CharField(blank=True, help_text='Income source or appointment status', max_length=30)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('data', models.JSONField(help_text='Field values, with the related rows archived along')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-date', '-object_id'],
+                'indexes': [models.Index(fields=['model', 'date'], name='accounts_ar_model_f5fc0f_idx'), models.Index(fields=['patient_id', 'model'], name='accounts_ar_patient_45dd52_idx')],
+                'unique_together': {('model', 'object_id')},
+            },
+        ),
+    ]
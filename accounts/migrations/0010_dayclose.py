@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_archivedrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayClose',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('closed_at', models.DateTimeField(auto_now=True)),
+                ('duration', models.FloatField(default=0, help_text='Seconds the last close took')),
+                ('summary', models.JSONField(default=dict, help_text='Rows touched and seconds taken per step')),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+    ]
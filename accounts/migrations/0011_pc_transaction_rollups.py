@@ -0,0 +1,42 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def rollup_pc_transactions(apps, schema_editor):
+    """Seed the pc_commission/pc_admin rollups from the existing transactions"""
+    PCTransaction = apps.get_model('accounts', 'PCTransaction')
+    DailyRollup = apps.get_model('accounts', 'DailyRollup')
+
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for date, commission, admin in PCTransaction.objects.values_list(
+        'transaction_date', 'commission_amount', 'admin_amount'
+    ).iterator():
+        day = timezone.localdate(date) if timezone.is_aware(date) else date.date()
+        for metric, amount in (('pc_commission', commission), ('pc_admin', admin)):
+            totals[(metric, day)][0] += 1
+            totals[(metric, day)][1] += amount or 0
+
+    DailyRollup.objects.filter(metric__in=('pc_commission', 'pc_admin')).delete()
+    DailyRollup.objects.bulk_create([
+        DailyRollup(metric=metric, date=day, count=count, total=total)
+        for (metric, day), (count, total) in totals.items()
+    ], batch_size=500)
+
+
+def remove_pc_rollups(apps, schema_editor):
+    DailyRollup = apps.get_model('accounts', 'DailyRollup')
+    DailyRollup.objects.filter(metric__in=('pc_commission', 'pc_admin')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_dayclose'),
+    ]
+
+    operations = [
+        migrations.RunPython(rollup_pc_transactions, remove_pc_rollups),
+    ]
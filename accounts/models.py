@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.conf import settings
+from .sequences import next_number
 
 class User(AbstractUser):
     """Custom User model with role-based access"""
@@ -246,17 +247,7 @@ class PCTransaction(models.Model):
         if not self.transaction_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_txn = PCTransaction.objects.filter(
-                transaction_number__startswith=f'PC{date_str}'
-            ).order_by('transaction_number').last()
-            
-            if last_txn:
-                last_number = int(last_txn.transaction_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.transaction_number = f'PC{date_str}{new_number:04d}'
+            self.transaction_number = next_number('PC', date_str, PCTransaction, 'transaction_number')
         
         # Calculate commission and admin amounts
         self.commission_amount = (self.total_amount * self.commission_percentage) / 100
@@ -272,3 +263,76 @@ class PCTransaction(models.Model):
             self.pc_member.total_referrals += 1
             self.pc_member.save()
 
+
+class DocumentSequence(models.Model):
+    """Counter row used to mint document numbers (APT..., RX..., PH...)"""
+    
+    prefix = models.CharField(max_length=10)
+    period = models.CharField(max_length=8, blank=True, help_text="e.g., 20251027 for daily, 2025 for yearly")
+    last_value = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['prefix', 'period']
+    
+    def __str__(self):
+        return f"{self.prefix}{self.period} - {self.last_value}"
+
+
+class DailyRollup(models.Model):
+    """Per-day dashboard totals, kept up to date by accounts.rollups"""
+    
+    metric = models.CharField(max_length=30, help_text="e.g., income, appointments, lab_orders")
+    date = models.DateField()
+    source = models.CharField(max_length=30, blank=True, help_text="Income source, expense type or status")
+    department_id = models.PositiveIntegerField(default=0, help_text="finance.Department id, 0 for none")
+    doctor_id = models.PositiveIntegerField(default=0, help_text="Doctor's user id, 0 for none")
+    
+    count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['-date', 'metric']
+        unique_together = ['metric', 'date', 'source', 'department_id', 'doctor_id']
+    
+    def __str__(self):
+        return f"{self.date} {self.metric} {self.source} - {self.count} / {self.total}"
+
+
+class ArchivedRecord(models.Model):
+    """A closed row moved out of its live table by accounts.archive"""
+    
+    model = models.CharField(max_length=50, help_text="Model label, e.g. appointments.Appointment")
+    object_id = models.PositiveBigIntegerField()
+    date = models.DateField(help_text="Day the row belongs to")
+    patient_id = models.PositiveIntegerField(null=True, blank=True, help_text="patients.Patient id, if any")
+    kind = models.CharField(max_length=30, blank=True, help_text="Income source or appointment status")
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    data = models.JSONField(help_text="Field values, with the related rows archived along")
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-date', '-object_id']
+        unique_together = ['model', 'object_id']
+        indexes = [
+            models.Index(fields=['model', 'date']),
+            models.Index(fields=['patient_id', 'model']),
+        ]
+    
+    def __str__(self):
+        return f"{self.model} #{self.object_id} ({self.date})"
+
+
+class DayClose(models.Model):
+    """A business day closed by accounts.closing (manage.py close_day)"""
+    
+    date = models.DateField(unique=True)
+    closed_at = models.DateTimeField(auto_now=True)
+    duration = models.FloatField(default=0, help_text="Seconds the last close took")
+    summary = models.JSONField(default=dict, help_text="Rows touched and seconds taken per step")
+    
+    class Meta:
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.date} closed at {self.closed_at:%Y-%m-%d %H:%M}"
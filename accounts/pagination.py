@@ -0,0 +1,133 @@
+"""
+Keyset pagination
+
+Long lists (appointments, patients) are paged by seeking past the boundary
+row of the page already shown instead of with OFFSET: the next page is
+``WHERE (keys) come after <cursor> ORDER BY keys LIMIT per_page + 1``, which
+an index on the keys answers as fast on the thousandth page as on the first.
+A cursor holds the ordering values of a boundary row, encoded for URLs.
+
+The ordering must end in a unique field (usually ``id``) and its fields
+must not be NULL. There is no page count: counting would scan the rows the
+seek avoids.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """The cursor was not produced by this ordering"""
+
+
+class KeysetPage:
+    """One page of rows with the cursors of its neighbours"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _keys(queryset, ordering):
+    """``[(field, descending)]`` for ordering names such as ``'-appointment_date'``"""
+    keys = []
+    for name in ordering:
+        field = queryset.model._meta.pk if name.lstrip('-') == 'pk' else queryset.model._meta.get_field(name.lstrip('-'))
+        keys.append((field, name.startswith('-')))
+    return keys
+
+
+def _encode(value):
+    # Full precision: DjangoJSONEncoder would cut datetimes to milliseconds
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(keys, row):
+    values = [getattr(row, field.attname) for field, _ in keys]
+    data = json.dumps(values, default=_encode, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(keys, cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise InvalidCursor(cursor)
+        return [field.to_python(value) for (field, _), value in zip(keys, values)]
+    except (binascii.Error, UnicodeDecodeError, ValueError, ValidationError):
+        raise InvalidCursor(cursor)
+
+
+def _seek(keys, values, backwards):
+    """Rows after ``values`` in key order (before them when ``backwards``)"""
+    condition = Q()
+    for index, ((field, descending), value) in enumerate(zip(keys, values)):
+        lookup = 'lt' if descending != backwards else 'gt'
+        step = Q(**{f'{field.name}__{lookup}': value})
+        for (equal_field, _), equal_value in zip(keys[:index], values[:index]):
+            step &= Q(**{equal_field.name: equal_value})
+        condition = step if index == 0 else condition | step
+    return condition
+
+
+def paginate(queryset, ordering, after=None, before=None, per_page=25):
+    """The page of ``queryset`` after cursor ``after`` (or before ``before``).
+
+    Without a cursor the first page is returned. Raises InvalidCursor for a
+    cursor that cannot be decoded.
+    """
+    keys = _keys(queryset, ordering)
+    backwards = before is not None and after is None
+    cursor = before if backwards else after
+    if cursor is not None:
+        queryset = queryset.filter(_seek(keys, decode_cursor(keys, cursor), backwards))
+    order = [
+        f'-{field.name}' if descending != backwards else field.name
+        for field, descending in keys
+    ]
+    rows = list(queryset.order_by(*order)[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+        # Going back from a page means that page follows this one
+        has_next, has_previous = bool(rows), more
+    else:
+        has_next, has_previous = more, cursor is not None and bool(rows)
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(keys, rows[-1]) if has_next else None,
+        previous_cursor=encode_cursor(keys, rows[0]) if has_previous else None,
+    )
+
+
+def cursor_url(request, after=None, before=None):
+    """The current URL (filters included) moved to another cursor"""
+    query = request.GET.copy()
+    query.pop('after', None)
+    query.pop('before', None)
+    if after:
+        query['after'] = after
+    if before:
+        query['before'] = before
+    return f'{request.path}?{query.urlencode()}'
@@ -0,0 +1,244 @@
+"""
+Per-view query profiling
+
+QueryBudgetMiddleware (accounts.middleware) profiles every request: number
+of SQL queries, time spent in the database, queries that ran more than once
+with the same SQL (the signature of an N+1 loop) and time spent rendering
+templates (through the DjangoTemplates backend below).
+
+Each process merges its profiles per URL name and flushes them to the cache
+every QUERY_PROFILE_FLUSH_INTERVAL seconds in hourly buckets. report()
+sums the last QUERY_PROFILE_HOURS buckets, so the report rolls forward on
+its own and is shared by every worker when the cache is (Redis in
+production).
+"""
+import contextlib
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'query_profile'
+
+# Duplicate signatures kept per view and bucket
+MAX_DUPLICATES = 10
+
+_current = contextvars.ContextVar('query_profile', default=None)
+
+
+def signature(sql):
+    """SQL with parameter lists collapsed, so ``IN (%s, %s)`` matches ``IN (%s)``"""
+    return re.sub(r'\((?:%s, )*%s\)', '(...)', ' '.join(sql.split()))
+
+
+class RequestProfile:
+    """Queries, DB time and template time of one request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.signatures = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.signatures[signature(sql)] += 1
+
+    @property
+    def duplicates(self):
+        """``{signature: extra executions}`` for SQL that ran more than once"""
+        return {sql: count - 1 for sql, count in self.signatures.items() if count > 1}
+
+
+@contextlib.contextmanager
+def profile_request():
+    """Profile the queries and templates run inside the block"""
+    profile = RequestProfile()
+    token = _current.set(profile)
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        try:
+            yield profile
+        finally:
+            _current.reset(token)
+
+
+class Template(django_backend.Template):
+    """Template that adds its render time to the current request profile"""
+
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.template_time += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The standard Django template backend, timed for query profiling"""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+def budget_for(view_name):
+    """Query budget of a view (QUERY_BUDGETS overrides QUERY_BUDGET)"""
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'QUERY_BUDGET', 50))
+
+
+def empty_stats():
+    return {
+        'requests': 0,
+        'queries': 0,
+        'max_queries': 0,
+        'db_time': 0.0,
+        'max_db_time': 0.0,
+        'template_time': 0.0,
+        'over_budget': 0,
+        'duplicate_requests': 0,
+        'duplicates': {},
+    }
+
+
+def merge(stats, other):
+    """Add ``other`` into ``stats`` (both as returned by empty_stats())"""
+    for key in ('requests', 'queries', 'db_time', 'template_time', 'over_budget', 'duplicate_requests'):
+        stats[key] += other[key]
+    stats['max_queries'] = max(stats['max_queries'], other['max_queries'])
+    stats['max_db_time'] = max(stats['max_db_time'], other['max_db_time'])
+    duplicates = Counter(stats['duplicates'])
+    duplicates.update(other['duplicates'])
+    stats['duplicates'] = dict(duplicates.most_common(MAX_DUPLICATES))
+    return stats
+
+
+class ProfileStore:
+    """Per-process buffer of view stats, flushed to the cache periodically"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    @property
+    def hours(self):
+        return getattr(settings, 'QUERY_PROFILE_HOURS', 24)
+
+    def bucket(self, now=None):
+        return int((now or time.time()) // 3600)
+
+    def record(self, view_name, profile):
+        """Add one request's profile to the stats of ``view_name``"""
+        stats = empty_stats()
+        stats.update({
+            'requests': 1,
+            'queries': profile.queries,
+            'max_queries': profile.queries,
+            'db_time': profile.db_time,
+            'max_db_time': profile.db_time,
+            'template_time': profile.template_time,
+            'duplicates': profile.duplicates,
+        })
+        budget = budget_for(view_name)
+        if profile.queries > budget:
+            stats['over_budget'] = 1
+            logger.warning(
+                '%s ran %d queries (budget %d, %.1f ms in the database)',
+                view_name, profile.queries, budget, profile.db_time * 1000
+            )
+        if profile.duplicates:
+            stats['duplicate_requests'] = 1
+
+        with self._lock:
+            merge(self._pending.setdefault(view_name, empty_stats()), stats)
+            due = time.monotonic() - self._last_flush >= getattr(settings, 'QUERY_PROFILE_FLUSH_INTERVAL', 30)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Merge this process's pending stats into the current cache bucket"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        bucket = self.bucket()
+        timeout = self.hours * 3600
+        views = cache.get(f'{KEY_PREFIX}:views', set())
+        for view_name, stats in pending.items():
+            key = f'{KEY_PREFIX}:{bucket}:{view_name}'
+            cache.set(key, merge(cache.get(key) or empty_stats(), stats), timeout)
+        cache.set(f'{KEY_PREFIX}:views', views | set(pending), timeout)
+
+    def report(self):
+        """Stats per view over the last QUERY_PROFILE_HOURS, worst first"""
+        self.flush()
+        views = cache.get(f'{KEY_PREFIX}:views', set())
+        current = self.bucket()
+        buckets = range(current - self.hours + 1, current + 1)
+        keys = [f'{KEY_PREFIX}:{bucket}:{view_name}' for view_name in views for bucket in buckets]
+        found = cache.get_many(keys)
+
+        rows = []
+        for view_name in views:
+            stats = empty_stats()
+            for bucket in buckets:
+                bucket_stats = found.get(f'{KEY_PREFIX}:{bucket}:{view_name}')
+                if bucket_stats:
+                    merge(stats, bucket_stats)
+            if not stats['requests']:
+                continue
+            requests = stats['requests']
+            stats.update({
+                'view_name': view_name,
+                'budget': budget_for(view_name),
+                'avg_queries': stats['queries'] / requests,
+                'avg_db_ms': stats['db_time'] * 1000 / requests,
+                'max_db_ms': stats['max_db_time'] * 1000,
+                'avg_template_ms': stats['template_time'] * 1000 / requests,
+                'duplicates': sorted(stats['duplicates'].items(), key=lambda item: -item[1]),
+            })
+            rows.append(stats)
+        rows.sort(key=lambda row: (-row['avg_queries'], row['view_name']))
+        return rows
+
+    def reset(self):
+        """Forget all recorded stats"""
+        with self._lock:
+            self._pending = {}
+        views = cache.get(f'{KEY_PREFIX}:views', set())
+        current = self.bucket()
+        cache.delete_many([
+            f'{KEY_PREFIX}:{bucket}:{view_name}'
+            for view_name in views
+            for bucket in range(current - self.hours + 1, current + 1)
+        ] + [f'{KEY_PREFIX}:views'])
+
+
+store = ProfileStore()
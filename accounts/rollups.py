@@ -0,0 +1,305 @@
+"""
+Daily dashboard rollups
+
+The admin dashboard reads its period totals from DailyRollup rows (one per
+metric, day, source, department and doctor) instead of aggregating the raw
+tables on every page load.
+
+Rows are maintained incrementally: each tracked model remembers the values
+it was loaded with, and on save/delete the difference between its old and
+new contributions is applied with atomic ``F()`` updates in the same
+transaction. Bulk operations (``QuerySet.update``, ``bulk_create``, raw SQL)
+bypass model signals: pass the rows they changed to bulk_changed(), or run
+``manage.py rebuild_rollups`` after them. Rows moved out by accounts.archive
+keep their contribution.
+"""
+import datetime
+import itertools
+from collections import defaultdict
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import archive
+
+# Metrics that are summed over all time rather than a period
+ALL_TIME_METRICS = ('patients', 'lab_unpaid', 'pharmacy_unpaid')
+
+# model label -> (date field, contributing fields, contribute function)
+TRACKED = {}
+
+
+def tracks(label, date_field, *fields):
+    """Register ``func(values)`` as the rollup contribution of model ``label``"""
+    def decorator(func):
+        TRACKED[label] = (date_field, (date_field,) + fields, func)
+        return func
+    return decorator
+
+
+def _day(value):
+    """Local calendar day of a date/datetime (or its string form)"""
+    if isinstance(value, str):
+        value = parse_datetime(value) or parse_date(value)
+    if isinstance(value, datetime.datetime):
+        return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    return value
+
+
+def _amount(value):
+    return Decimal(str(value or 0))
+
+
+@tracks('finance.Income', 'date', 'source', 'department_id', 'amount')
+def income(values):
+    yield 'income', values['source'], values['department_id'], 0, 1, values['amount']
+
+
+@tracks('finance.Expense', 'date', 'expense_type', 'department_id', 'amount')
+def expense(values):
+    yield 'expense', values['expense_type'], values['department_id'], 0, 1, values['amount']
+
+
+@tracks('patients.Patient', 'registered_at')
+def patient(values):
+    yield 'patients', '', 0, 0, 1, 0
+
+
+@tracks('appointments.Appointment', 'appointment_date', 'status', 'doctor_id', 'consultation_fee')
+def appointment(values):
+    yield 'appointments', values['status'], 0, values['doctor_id'], 1, values['consultation_fee']
+
+
+@tracks('lab.LabOrder', 'ordered_at', 'status', 'ordered_by_id', 'total_amount', 'is_paid')
+def lab_order(values):
+    yield 'lab_orders', values['status'], 0, values['ordered_by_id'], 1, values['total_amount']
+    if not values['is_paid']:
+        yield 'lab_unpaid', '', 0, 0, 1, values['total_amount']
+
+
+@tracks('pharmacy.PharmacySale', 'sale_date', 'total_amount', 'amount_paid')
+def pharmacy_sale(values):
+    yield 'pharmacy_sales', '', 0, 0, 1, values['total_amount']
+    if _amount(values['amount_paid']) < _amount(values['total_amount']):
+        yield 'pharmacy_unpaid', '', 0, 0, 1, values['total_amount']
+
+
+@tracks('survey.CanteenSale', 'sale_date', 'total_amount')
+def canteen_sale(values):
+    yield 'canteen_sales', '', 0, 0, 1, values['total_amount']
+
+
+@tracks('accounts.PCTransaction', 'transaction_date', 'commission_amount', 'admin_amount')
+def pc_transaction(values):
+    yield 'pc_commission', '', 0, 0, 1, values['commission_amount']
+    yield 'pc_admin', '', 0, 0, 1, values['admin_amount']
+
+
+def contributions(label, values):
+    """``{(metric, date, source, department_id, doctor_id): [count, total]}``"""
+    date_field, _, func = TRACKED[label]
+    day = _day(values[date_field])
+    result = defaultdict(lambda: [0, Decimal(0)])
+    if day is None:
+        return result
+    for metric, source, department_id, doctor_id, count, total in func(values):
+        key = (metric, day, source or '', department_id or 0, doctor_id or 0)
+        result[key][0] += count
+        result[key][1] += _amount(total)
+    return result
+
+
+def apply(delta):
+    """Add ``{key: [count, total]}`` to the rollup rows"""
+    from .models import DailyRollup
+
+    for (metric, day, source, department_id, doctor_id), (count, total) in delta.items():
+        if not count and not total:
+            continue
+        rows = DailyRollup.objects.filter(
+            metric=metric, date=day, source=source,
+            department_id=department_id, doctor_id=doctor_id,
+        )
+        changes = {'count': F('count') + count, 'total': F('total') + total}
+        if rows.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                DailyRollup.objects.create(
+                    metric=metric, date=day, source=source,
+                    department_id=department_id, doctor_id=doctor_id,
+                    count=count, total=total,
+                )
+        except IntegrityError:
+            # Another worker created the row first
+            rows.update(**changes)
+
+
+def _difference(old, new):
+    delta = defaultdict(lambda: [0, Decimal(0)])
+    for key, (count, total) in new.items():
+        delta[key][0] += count
+        delta[key][1] += total
+    for key, (count, total) in old.items():
+        delta[key][0] -= count
+        delta[key][1] -= total
+    return delta
+
+
+def bulk_changed(label, old=(), new=()):
+    """Apply the difference of rows written in bulk, bypassing signals.
+
+    ``old`` and ``new`` are the tracked values (dicts, or instances) of the
+    rows before and after: only ``new`` for rows from ``bulk_create``, both
+    for a ``QuerySet.update``, only ``old`` for a bulk delete.
+    """
+    fields = TRACKED[label][1]
+
+    def summed(rows):
+        result = defaultdict(lambda: [0, Decimal(0)])
+        for values in rows:
+            if not isinstance(values, dict):
+                values = _current(values, fields)
+            for key, (count, total) in contributions(label, values).items():
+                result[key][0] += count
+                result[key][1] += total
+        return result
+
+    apply(_difference(summed(old), summed(new)))
+
+
+def _current(instance, fields):
+    return {field: instance.__dict__.get(field) for field in fields}
+
+
+def _remember(sender, instance, **kwargs):
+    # Values as loaded; deferred fields are fetched in pre_save if needed
+    fields = TRACKED[sender._meta.label][1]
+    if all(field in instance.__dict__ for field in fields):
+        instance._rollup_values = _current(instance, fields)
+    else:
+        instance._rollup_values = None
+
+
+def _before_save(sender, instance, **kwargs):
+    if instance._state.adding or getattr(instance, '_rollup_values', None) is not None:
+        return
+    fields = TRACKED[sender._meta.label][1]
+    instance._rollup_values = sender._base_manager.filter(pk=instance.pk).values(*fields).first()
+
+
+def _saved(sender, instance, created, update_fields=None, **kwargs):
+    label = sender._meta.label
+    fields = TRACKED[label][1]
+    old = None if created else getattr(instance, '_rollup_values', None)
+    new = _current(instance, fields)
+    if old is not None and update_fields is not None:
+        # Only the listed fields were written
+        written = {sender._meta.get_field(name).attname for name in update_fields}
+        new = {field: new[field] if field in written else old[field] for field in fields}
+    apply(_difference(contributions(label, old) if old else {}, contributions(label, new)))
+    instance._rollup_values = new
+
+
+def _deleted(sender, instance, **kwargs):
+    label = sender._meta.label
+    values = getattr(instance, '_rollup_values', None) or _current(instance, TRACKED[label][1])
+    apply(_difference(contributions(label, values), {}))
+
+
+def connect():
+    """Hook the tracked models' signals up (called from AccountsConfig.ready)"""
+    for label in TRACKED:
+        model = apps.get_model(label)
+        uid = f'accounts.rollups.{label}'
+        post_init.connect(_remember, sender=model, dispatch_uid=uid)
+        pre_save.connect(_before_save, sender=model, dispatch_uid=uid)
+        post_save.connect(_saved, sender=model, dispatch_uid=uid)
+        post_delete.connect(_deleted, sender=model, dispatch_uid=uid)
+
+
+def rebuild(start_date=None, end_date=None):
+    """Recompute the rollup rows (optionally only for a date range).
+
+    Returns the number of rows written.
+    """
+    from .models import DailyRollup
+
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for label, (date_field, fields, _) in TRACKED.items():
+        model = apps.get_model(label)
+        lookup = date_field
+        if isinstance(model._meta.get_field(date_field), models.DateTimeField):
+            lookup = f'{date_field}__date'
+        queryset = model._base_manager.all()
+        if start_date:
+            queryset = queryset.filter(**{f'{lookup}__gte': start_date})
+        if end_date:
+            queryset = queryset.filter(**{f'{lookup}__lte': end_date})
+        rows = queryset.values(*fields).iterator()
+        if label in archive.ARCHIVED:
+            # Rows moved to the archive still count
+            rows = itertools.chain(rows, archive.records(label, start_date, end_date).values_list('data', flat=True).iterator())
+        for values in rows:
+            for key, (count, total) in contributions(label, values).items():
+                totals[key][0] += count
+                totals[key][1] += total
+
+    rows = [
+        DailyRollup(
+            metric=metric, date=day, source=source,
+            department_id=department_id, doctor_id=doctor_id,
+            count=count, total=total,
+        )
+        for (metric, day, source, department_id, doctor_id), (count, total) in totals.items()
+        if count or total
+    ]
+    with transaction.atomic():
+        existing = DailyRollup.objects.all()
+        if start_date:
+            existing = existing.filter(date__gte=start_date)
+        if end_date:
+            existing = existing.filter(date__lte=end_date)
+        existing.delete()
+        DailyRollup.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+class Totals:
+    """Summed rollups, looked up by metric and optionally source"""
+
+    def __init__(self, rows):
+        self._rows = defaultdict(lambda: {'count': 0, 'total': Decimal(0)})
+        for row in rows:
+            for key in ((row['metric'], None), (row['metric'], row['source'])):
+                self._rows[key]['count'] += row['count_sum'] or 0
+                self._rows[key]['total'] += row['total_sum'] or 0
+
+    def count(self, metric, source=None):
+        return self._rows[(metric, source)]['count']
+
+    def total(self, metric, source=None):
+        return self._rows[(metric, source)]['total']
+
+
+def totals(start_date=None, end_date=None, metrics=None):
+    """Totals per metric/source between two days (inclusive), in one query"""
+    from .models import DailyRollup
+
+    rows = DailyRollup.objects.all()
+    if start_date:
+        rows = rows.filter(date__gte=start_date)
+    if end_date:
+        rows = rows.filter(date__lte=end_date)
+    if metrics:
+        rows = rows.filter(metric__in=metrics)
+    return Totals(
+        rows.order_by().values('metric', 'source').annotate(
+            count_sum=Sum('count'), total_sum=Sum('total')
+        )
+    )
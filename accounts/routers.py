@@ -0,0 +1,23 @@
+from . import archive
+
+
+class ArchiveRouter:
+    """Keeps ArchivedRecord in settings.ARCHIVE_DATABASE (see accounts.archive)"""
+
+    def _is_archive(self, model):
+        return model._meta.label == 'accounts.ArchivedRecord'
+
+    def db_for_read(self, model, **hints):
+        return archive.database() if self._is_archive(model) else None
+
+    def db_for_write(self, model, **hints):
+        return archive.database() if self._is_archive(model) else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = archive.database()
+        if alias == 'default':
+            return None
+        if app_label == 'accounts' and model_name == 'archivedrecord':
+            return db == alias
+        # Nothing else goes in the archive database
+        return False if db == alias else None
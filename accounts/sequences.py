@@ -0,0 +1,96 @@
+"""
+Document number allocation
+
+Every numbered document (appointments, prescriptions, sales, ...) draws its
+number from a DocumentSequence row keyed by prefix and period. The counter is
+bumped with a single atomic UPDATE, so concurrent inserts never read the same
+"last row" and never collide on the unique number column.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+
+# Per-process blocks handed out by next_value(): {(prefix, period): (next, end)}
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def _legacy_max(stem, model, field):
+    """Highest number already issued under ``stem`` before the counter existed"""
+    if model is None:
+        return 0
+    last = model.objects.filter(**{f'{field}__startswith': stem}).order_by(
+        Length(field).desc(), f'-{field}'
+    ).values_list(field, flat=True).first()
+    if not last or not last[len(stem):].isdigit():
+        return 0
+    return int(last[len(stem):])
+
+
+def reserve(prefix, period='', count=1, model=None, field=None):
+    """Reserve ``count`` consecutive values and return the first one.
+
+    ``model``/``field`` are only used the first time a prefix/period is seen,
+    to continue numbering after rows created before the counter existed.
+    """
+    from .models import DocumentSequence
+
+    sequences = DocumentSequence.objects.filter(prefix=prefix, period=period)
+    with transaction.atomic():
+        if not sequences.update(last_value=F('last_value') + count):
+            seed = _legacy_max(f'{prefix}{period}', model, field)
+            try:
+                with transaction.atomic():
+                    DocumentSequence.objects.create(
+                        prefix=prefix, period=period, last_value=seed + count
+                    )
+                return seed + 1
+            except IntegrityError:
+                # Another worker created the row first
+                sequences.update(last_value=F('last_value') + count)
+        last_value = sequences.values_list('last_value', flat=True).get()
+    return last_value - count + 1
+
+
+def advance(prefix, period, value, model=None, field=None):
+    """Make sure the counter is at least ``value``, e.g. after numbers were imported"""
+    from .models import DocumentSequence
+
+    with transaction.atomic():
+        sequence, created = DocumentSequence.objects.get_or_create(
+            prefix=prefix, period=period,
+            defaults={'last_value': max(value, _legacy_max(f'{prefix}{period}', model, field))},
+        )
+        if not created:
+            DocumentSequence.objects.filter(pk=sequence.pk, last_value__lt=value).update(last_value=value)
+
+
+def next_value(prefix, period='', model=None, field=None):
+    """Return the next value for prefix/period.
+
+    With DOCUMENT_SEQUENCE_BLOCK_SIZE > 1 each process reserves a block of
+    values at once and serves the rest from memory. Blocks are only used
+    outside transactions: a rollback would undo the reservation but not the
+    in-memory block.
+    """
+    block_size = getattr(settings, 'DOCUMENT_SEQUENCE_BLOCK_SIZE', 1)
+    if block_size <= 1 or connection.in_atomic_block:
+        return reserve(prefix, period, 1, model, field)
+
+    key = (prefix, period)
+    with _blocks_lock:
+        start, end = _blocks.get(key, (0, 0))
+        if start >= end:
+            start = reserve(prefix, period, block_size, model, field)
+            end = start + block_size
+        _blocks[key] = (start + 1, end)
+    return start
+
+
+def next_number(prefix, period='', model=None, field=None, width=4):
+    """Return the next document number, e.g. ``APT202510270001``"""
+    value = next_value(prefix, period, model, field)
+    return f'{prefix}{period}{value:0{width}d}'
@@ -0,0 +1,86 @@
+"""
+SQLite tuning for single-box deployments
+
+options() builds the DATABASES OPTIONS for an SQLite database: PRAGMAs run
+on every new connection (WAL journal, synchronous=NORMAL, larger page cache,
+memory-mapped reads, in-memory temp tables, busy timeout) and IMMEDIATE
+transactions, so a transaction takes the write lock when it starts instead
+of failing with "database is locked" when it tries to upgrade a read lock.
+
+retry_on_locked() covers the remaining lock errors on the busiest writes
+(appointment, pharmacy sale and income saves): outside a transaction the
+write is retried a few times with backoff before the error reaches the user.
+
+Compare the settings with ``python manage.py benchmark_sqlite``.
+"""
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+logger = logging.getLogger(__name__)
+
+PRAGMAS = {
+    # Readers don't block the writer and vice versa
+    'journal_mode': 'WAL',
+    # Safe with WAL: a power cut can lose the last commits, never corrupt
+    'synchronous': 'NORMAL',
+    # Milliseconds to wait for the write lock before "database is locked"
+    'busy_timeout': 20000,
+    # Page cache per connection; negative values are KiB (64 MB)
+    'cache_size': -64000,
+    # Read the first 256 MB through mmap instead of read() calls
+    'mmap_size': 268435456,
+    # Sorts and temporary indexes in memory
+    'temp_store': 'MEMORY',
+}
+
+
+def init_command(**overrides):
+    """PRAGMA statements for PRAGMAS updated with ``overrides``"""
+    pragmas = {**PRAGMAS, **overrides}
+    return ''.join(f'PRAGMA {name}={value};' for name, value in pragmas.items())
+
+
+def options(timeout=20, **overrides):
+    """OPTIONS for a tuned SQLite entry in DATABASES (``timeout`` in seconds)"""
+    overrides.setdefault('busy_timeout', int(timeout * 1000))
+    return {
+        'timeout': timeout,
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': init_command(**overrides),
+    }
+
+
+def is_locked(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_locked(func):
+    """Retry ``func`` when SQLite reports the database as locked.
+
+    Only retried outside transactions (an error inside one must roll the
+    whole transaction back), and a Model.save() whose row was already
+    written is not repeated. SQLITE_LOCK_RETRIES sets the number of retries,
+    SQLITE_LOCK_RETRY_DELAY the first backoff in seconds.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        state = getattr(args[0], '_state', None) if args else None
+        adding = state.adding if state else False
+        retries = getattr(settings, 'SQLITE_LOCK_RETRIES', 3)
+        delay = getattr(settings, 'SQLITE_LOCK_RETRY_DELAY', 0.05)
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                written = adding and not state.adding
+                if attempt == retries or written or connection.in_atomic_block or not is_locked(exc):
+                    raise
+                logger.warning('%s: %s, retrying (%d/%d)', func.__qualname__, exc, attempt + 1, retries)
+                time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
@@ -1,3 +1,885 @@
-from django.test import TestCase
+"""
+Tests for accounts module services
+"""
+import datetime
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.db.models import Q, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, closing, documents, profiling, rollups, sequences, sqlite
+from .dashboard import QueryCounter, tally
+from .models import ArchivedRecord, DailyRollup, DayClose, DocumentSequence, PCMember, PCTransaction
+from appointments.models import Appointment, BookingCounter, Medicine, Prescription
+from finance.models import Expense, Income
+from lab.models import LabOrder
+from patients.models import Patient
+from pharmacy.models import Drug, StockSnapshot
+
+User = get_user_model()
+
+# Calls of fake_pdf made in this process
+pdf_calls = []
+
+
+def fake_pdf(html, base_url):
+    """Stand-in PDF backend: a short PDF-looking digest of the page"""
+    pdf_calls.append(html)
+    return b'%PDF-fake ' + hashlib.sha1(html.encode()).hexdigest().encode()
+
+
+def broken_pdf(html, base_url):
+    raise documents.PDFUnavailable('no backend here')
+
+
+class DocumentSequenceTestCase(TestCase):
+    """Test document number allocation"""
+
+    def setUp(self):
+        sequences._blocks.clear()
+
+    def test_numbers_are_sequential_per_prefix_and_period(self):
+        """Each prefix/period pair counts independently"""
+        self.assertEqual(sequences.next_number('APT', '20251027'), 'APT202510270001')
+        self.assertEqual(sequences.next_number('APT', '20251027'), 'APT202510270002')
+        self.assertEqual(sequences.next_number('APT', '20251028'), 'APT202510280001')
+        self.assertEqual(sequences.next_number('RX', '20251027'), 'RX202510270001')
+
+    def test_continues_after_legacy_numbers(self):
+        """A new counter starts after numbers issued before it existed"""
+        Income.objects.bulk_create([
+            Income(income_number='INC202510270007', source='OTHER', amount=10, date='2025-10-27'),
+            Income(income_number='INC202510270012', source='OTHER', amount=10, date='2025-10-27'),
+        ])
+        number = sequences.next_number('INC', '20251027', Income, 'income_number')
+        self.assertEqual(number, 'INC202510270013')
+
+    def test_reserve_returns_first_value_of_block(self):
+        """reserve() hands out consecutive ranges"""
+        self.assertEqual(sequences.reserve('LAB', '20251027', count=50), 1)
+        self.assertEqual(sequences.reserve('LAB', '20251027', count=10), 51)
+        self.assertEqual(DocumentSequence.objects.get(prefix='LAB').last_value, 60)
+
+    def test_model_save_uses_counter(self):
+        """Model saves draw their number from the counter"""
+        first = Income.objects.create(source='OTHER', amount=10, date='2025-10-27')
+        second = Income.objects.create(source='OTHER', amount=10, date='2025-10-27')
+        self.assertEqual(int(second.income_number[-4:]), int(first.income_number[-4:]) + 1)
+        self.assertEqual(DocumentSequence.objects.get(prefix='INC').last_value, 2)
+
+
+@override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=10)
+class DocumentSequenceBlockTestCase(TransactionTestCase):
+    """Test per-process block pre-allocation"""
+
+    def setUp(self):
+        sequences._blocks.clear()
+
+    def test_block_is_served_from_memory(self):
+        """Only one counter UPDATE per block"""
+        values = [sequences.next_value('PH', '20251027') for _ in range(15)]
+        self.assertEqual(values, list(range(1, 16)))
+        self.assertEqual(DocumentSequence.objects.get(prefix='PH').last_value, 20)
+
+
+class DocumentSequenceConcurrencyTestCase(TransactionTestCase):
+    """Hammer the allocator from many threads"""
+
+    threads = 8
+    per_thread = 25
+
+    def setUp(self):
+        sequences._blocks.clear()
+
+    def _hammer(self):
+        results = []
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(self.per_thread):
+                    results.append(sequences.next_value('CNT', '20251027'))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results, errors
+
+    def test_no_duplicates_under_contention(self):
+        """Every value is handed out exactly once"""
+        results, errors = self._hammer()
+        total = self.threads * self.per_thread
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), list(range(1, total + 1)))
+        self.assertEqual(DocumentSequence.objects.get(prefix='CNT').last_value, total)
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=20)
+    def test_no_duplicates_with_blocks(self):
+        """Blocks never overlap between threads"""
+        results, errors = self._hammer()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), len(set(results)))
+        self.assertEqual(len(results), self.threads * self.per_thread)
+
+
+class DailyRollupTestCase(TestCase):
+    """Test the incremental dashboard rollups"""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.admin = User.objects.create_user(username='admin', password='testpass123', role='ADMIN')
+        self.doctor = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR')
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth='1990-01-01', gender='M',
+            phone='01700000000', address='Bazar Road', city='Naogaon',
+            emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+
+    def rollup(self, metric, source=''):
+        row = DailyRollup.objects.filter(metric=metric, source=source, date=self.today).first()
+        return (row.count, row.total) if row else (0, 0)
+
+    def rows(self):
+        return sorted(
+            DailyRollup.objects.exclude(count=0, total=0).values_list(
+                'metric', 'date', 'source', 'department_id', 'doctor_id', 'count', 'total'
+            )
+        )
+
+    def test_income_is_rolled_up_on_save_and_delete(self):
+        """Creating, editing and deleting income adjusts the day's row"""
+        income = Income.objects.create(source='lab', amount=100, date=self.today)
+        Income.objects.create(source='lab', amount=50, date=self.today)
+        self.assertEqual(self.rollup('income', 'lab'), (2, Decimal('150')))
+
+        income = Income.objects.get(pk=income.pk)
+        income.amount = 80
+        income.save()
+        self.assertEqual(self.rollup('income', 'lab'), (2, Decimal('130')))
+
+        income.delete()
+        self.assertEqual(self.rollup('income', 'lab'), (1, Decimal('50')))
+
+    def test_changes_move_between_sources(self):
+        """A status change moves the appointment to the new status row"""
+        appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=self.today, serial_number=1
+        )
+        self.assertEqual(self.rollup('appointments', 'waiting')[0], 1)
+
+        appointment.status = 'completed'
+        appointment.save(update_fields=['status'])
+        self.assertEqual(self.rollup('appointments', 'waiting')[0], 0)
+        self.assertEqual(self.rollup('appointments', 'completed'), (1, Decimal('500')))
+
+    def test_paying_clears_outstanding(self):
+        """Paid lab orders drop out of the unpaid total"""
+        order = LabOrder.objects.create(patient=self.patient, ordered_by=self.doctor, total_amount=300)
+        self.assertEqual(self.rollup('lab_unpaid'), (1, Decimal('300')))
+
+        # Deferred fields are read back from the database before the update
+        order = LabOrder.objects.only('id').get(pk=order.pk)
+        order.is_paid = True
+        order.save()
+        self.assertEqual(self.rollup('lab_unpaid'), (0, Decimal('0')))
+        self.assertEqual(self.rollup('lab_orders', 'ORDERED'), (1, Decimal('300')))
+
+    def test_rebuild_matches_incremental_rows(self):
+        """The management command recomputes exactly what the signals maintained"""
+        Income.objects.create(source='pharmacy', amount=70, date=self.today)
+        Expense.objects.create(expense_type='RENT', amount=40, date=self.today, description='Rent')
+        LabOrder.objects.create(patient=self.patient, ordered_by=self.doctor, total_amount=300)
+        incremental = self.rows()
+
+        # Rows written behind the signals' back are picked up by a rebuild
+        Income.objects.bulk_create([
+            Income(income_number='INC-OLD', source='pharmacy', amount=5, date=self.today)
+        ])
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollup('income', 'pharmacy'), (2, Decimal('75')))
+
+        Income.objects.filter(income_number='INC-OLD').delete()
+        rollups.rebuild(start_date=self.today, end_date=self.today)
+        self.assertEqual(self.rows(), incremental)
+
+    def test_admin_dashboard_reads_rollups(self):
+        """Dashboard totals are answered from the rollup rows"""
+        Income.objects.create(source='appointment', amount=500, date=self.today)
+        Income.objects.create(source='lab', amount=200, date=self.today - datetime.timedelta(days=400))
+        Expense.objects.create(expense_type='RENT', amount=100, date=self.today, description='Rent')
+        LabOrder.objects.create(patient=self.patient, ordered_by=self.doctor, total_amount=300)
+
+        self.client.login(username='admin', password='testpass123')
+        response = self.client.get(reverse('accounts:admin_dashboard'), {'period': 'month'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_income'], Decimal('500'))
+        self.assertEqual(response.context['appointment_income'], Decimal('500'))
+        self.assertEqual(response.context['profit'], Decimal('400'))
+        self.assertEqual(response.context['total_patients'], 1)
+        self.assertEqual(response.context['outstanding_lab_payments'], Decimal('300'))
+        self.assertEqual(response.context['departments_performance']['lab']['orders'], 1)
+
+
+class DashboardQueryTestCase(TestCase):
+    """Role dashboards compute their counters in a bounded number of queries"""
+
+    # Upper bound of queries per dashboard, including session/user lookups
+    QUERY_BUDGETS = {
+        'admin_dashboard': 8,
+        'doctor_dashboard': 9,
+        # + 7 the first time, to build the doctor roster and today's slots
+        'receptionist_dashboard': 16,
+        'pharmacy_dashboard': 8,
+    }
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.doctor = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR')
+        for index, status in enumerate(['waiting', 'waiting', 'in_consultation', 'completed', 'cancelled']):
+            self.book(index + 1, status)
+
+    def book(self, serial_number, status):
+        patient = Patient.objects.create(
+            first_name=f'Patient{serial_number}', last_name='Uddin', date_of_birth='1990-01-01',
+            gender='M', phone=f'0170000{serial_number:04d}', address='Bazar Road', city='Naogaon',
+            emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+        return Appointment.objects.create(
+            patient=patient, doctor=self.doctor, appointment_date=self.today,
+            serial_number=serial_number, status=status,
+        )
+
+    def get(self, name, role='ADMIN'):
+        user = User.objects.create_user(username=f'{name}_user', password='testpass123', role=role)
+        self.client.force_login(user)
+        response = self.client.get(reverse(f'accounts:{name}'))
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(response.query_count, self.QUERY_BUDGETS[name], name)
+        return response
+
+    def test_tally_counts_in_one_query(self):
+        """All counters come back from a single aggregate"""
+        with self.assertNumQueries(1):
+            stats = tally(
+                Appointment.objects.all(),
+                total=None,
+                waiting=Q(status='waiting'),
+                fees=Sum('consultation_fee', filter=Q(status='completed')),
+                none=Sum('consultation_fee', filter=Q(status='no_show')),
+            )
+        self.assertEqual(stats, {'total': 5, 'waiting': 2, 'fees': Decimal('500'), 'none': 0})
+
+    def test_query_counter(self):
+        """QueryCounter counts queries without DEBUG"""
+        with QueryCounter() as counter:
+            list(Appointment.objects.all())
+            Patient.objects.count()
+        self.assertEqual(counter.count, 2)
+
+    def test_doctor_dashboard(self):
+        """Queue counters for the logged-in doctor"""
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse('accounts:doctor_dashboard'))
+        self.assertLessEqual(response.query_count, self.QUERY_BUDGETS['doctor_dashboard'])
+        context = response.context
+        self.assertEqual(
+            (context['waiting_count'], context['in_consultation_count'],
+             context['completed_count'], context['cancelled_count']),
+            (2, 1, 1, 1)
+        )
+
+    def test_receptionist_dashboard(self):
+        """Today's appointment counters"""
+        response = self.get('receptionist_dashboard', role='RECEPTIONIST')
+        self.assertEqual(response.context['today_appointments_count'], 5)
+        self.assertEqual(response.context['waiting_appointments'], 2)
+        self.assertEqual(response.context['walk_in_patients'], 5)
+
+    def test_other_dashboards_stay_within_budget(self):
+        """Admin and pharmacy dashboards render within budget"""
+        self.get('admin_dashboard')
+        self.get('pharmacy_dashboard', role='PHARMACY')
+
+    def test_query_count_does_not_grow_with_data(self):
+        """More appointments do not mean more queries"""
+        self.client.force_login(self.doctor)
+        before = self.client.get(reverse('accounts:doctor_dashboard')).query_count
+        for serial_number in range(6, 16):
+            self.book(serial_number, 'waiting')
+        after = self.client.get(reverse('accounts:doctor_dashboard')).query_count
+        self.assertEqual(before, after)
+
+
+class QueryProfilingTestCase(TestCase):
+    """Test the per-view query report"""
+
+    def setUp(self):
+        cache.clear()
+        profiling.store.reset()
+        self.admin = User.objects.create_user(username='admin', password='testpass123', role='ADMIN')
+        for index in range(3):
+            User.objects.create_user(username=f'doctor{index}', password='testpass123', role='DOCTOR')
+        self.client.force_login(self.admin)
+
+    def report_row(self, view_name):
+        rows = {row['view_name']: row for row in profiling.store.report()}
+        return rows[view_name]
+
+    def test_requests_are_profiled_per_view(self):
+        """Queries, DB time, template time and repeated queries are recorded"""
+        self.client.get(reverse('accounts:doctor_management'))
+        self.client.get(reverse('accounts:doctor_management'))
+
+        row = self.report_row('accounts:doctor_management')
+        self.assertEqual(row['requests'], 2)
+        self.assertGreater(row['max_queries'], 2)
+        self.assertGreater(row['db_time'], 0)
+        self.assertGreater(row['template_time'], 0)
+
+    def test_repeated_queries_are_detected(self):
+        """The same SQL run in a loop shows up as a duplicate signature"""
+        with profiling.profile_request() as profile:
+            for user in User.objects.filter(role='DOCTOR'):
+                Appointment.objects.filter(doctor=user).count()
+        self.assertEqual(profile.queries, 4)
+        [(sql, extra)] = profile.duplicates.items()
+        self.assertIn('appointments_appointment', sql)
+        self.assertEqual(extra, 2)
+
+    @override_settings(QUERY_BUDGETS={'accounts:doctor_management': 3})
+    def test_over_budget_requests_are_logged(self):
+        """Views above their budget are counted and logged"""
+        with self.assertLogs('accounts.profiling', 'WARNING'):
+            self.client.get(reverse('accounts:doctor_management'))
+        row = self.report_row('accounts:doctor_management')
+        self.assertEqual((row['over_budget'], row['budget']), (1, 3))
+
+    def test_signature_collapses_parameter_lists(self):
+        """IN lists of any length share one signature"""
+        self.assertEqual(
+            profiling.signature('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            profiling.signature('SELECT *  FROM t WHERE id IN (%s)'),
+        )
+
+    def test_report_page_is_admin_only(self):
+        """Only admins can see the report"""
+        self.client.get(reverse('accounts:doctor_management'))
+        response = self.client.get(reverse('accounts:query_report'))
+        self.assertContains(response, 'accounts:doctor_management')
+
+        receptionist = User.objects.create_user(username='reception', password='testpass123')
+        self.client.force_login(receptionist)
+        response = self.client.get(reverse('accounts:query_report'))
+        self.assertRedirects(response, reverse('accounts:dashboard'), fetch_redirect_response=False)
+
+    def test_management_command(self):
+        """The command prints the report and can reset it"""
+        self.client.get(reverse('accounts:doctor_management'))
+        out = StringIO()
+        call_command('query_report', '--duplicates', stdout=out)
+        self.assertIn('accounts:doctor_management', out.getvalue())
+
+        call_command('query_report', '--reset', stdout=StringIO())
+        self.assertEqual(profiling.store.report(), [])
+
+
+class MigrateFromSqliteTestCase(TransactionTestCase):
+    """Test copying an SQLite database into another database"""
+
+    target_alias = 'copy_target'
+    # Resolved in setUpClass, after the target alias is registered
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # Throwaway target databases (see setUp)
+        cls.paths = []
+        connections.settings[cls.target_alias] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ''},
+        })[DEFAULT_DB_ALIAS]
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.target_alias].close()
+        del connections[cls.target_alias]
+        del connections.settings[cls.target_alias]
+        for path in cls.paths:
+            os.remove(path)
+
+    def setUp(self):
+        # Fresh, empty target file for every test
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.paths.append(path)
+        connections[self.target_alias].close()
+        del connections[self.target_alias]
+        connections.settings[self.target_alias]['NAME'] = path
+
+        self.doctor = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR')
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth='1990-01-01', gender='M',
+            phone='01700000000', address='Bazar Road', city='Naogaon',
+            emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+        self.registered_at = timezone.now() - datetime.timedelta(days=400)
+        Patient.objects.filter(pk=self.patient.pk).update(registered_at=self.registered_at)
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=timezone.localdate(), serial_number=1
+        )
+
+    def migrate_from_sqlite(self):
+        out = StringIO()
+        call_command(
+            'migrate_from_sqlite', source_database=DEFAULT_DB_ALIAS,
+            database=self.target_alias, interactive=False, batch_size=2, stdout=out,
+        )
+        return out.getvalue()
+
+    def test_copies_every_table(self):
+        """Rows, ids and timestamps arrive unchanged and counts are verified"""
+        call_command('migrate', database=self.target_alias, verbosity=0)
+        output = self.migrate_from_sqlite()
+        self.assertIn('row counts verified', output)
+
+        copied = Patient.objects.using(self.target_alias).get()
+        self.assertEqual(copied.pk, self.patient.pk)
+        self.assertEqual(copied.registered_at, self.registered_at)
+        self.assertEqual(Appointment.objects.using(self.target_alias).get().doctor_id, self.doctor.id)
+        self.assertEqual(
+            User.objects.using(self.target_alias).count(), User.objects.count()
+        )
+
+        # Running it again replaces rather than duplicates
+        self.migrate_from_sqlite()
+        self.assertEqual(Patient.objects.using(self.target_alias).count(), 1)
+
+    def test_requires_migrated_target(self):
+        """An unmigrated target is refused"""
+        with self.assertRaises(CommandError):
+            self.migrate_from_sqlite()
+
+    def test_sequences_continue_after_copied_ids(self):
+        """The target's id sequences are reset past the copied rows"""
+        call_command('migrate', database=self.target_alias, verbosity=0)
+        target = connections[self.target_alias]
+        reset = []
+        sequence_reset_sql = target.ops.sequence_reset_sql
+
+        def recording_reset_sql(style, models):
+            reset.extend(models)
+            return sequence_reset_sql(style, models)
+
+        target.ops.sequence_reset_sql = recording_reset_sql
+        try:
+            self.migrate_from_sqlite()
+        finally:
+            del target.ops.sequence_reset_sql
+        self.assertIn(Patient, reset)
+        self.assertIn(Appointment, reset)
+
+        # New rows in the target take ids after the copied ones
+        user = User.objects.db_manager(self.target_alias).create_user(username='new', password='testpass123')
+        self.assertGreater(user.pk, self.doctor.pk)
+
+    def test_requires_migrated_source(self):
+        """A source behind the current schema is refused, or migrated on request"""
+        call_command('migrate', database=self.target_alias, verbosity=0)
+        call_command('migrate', 'lab', '0001', database=self.target_alias, verbosity=0)
+        options = {'source_database': self.target_alias, 'interactive': False, 'stdout': StringIO()}
+
+        with self.assertRaisesMessage(CommandError, 'lab.0002_result_values'):
+            call_command('migrate_from_sqlite', **options)
+        self.assertEqual(Patient.objects.count(), 1)
+
+        call_command('migrate_from_sqlite', migrate_source=True, **options)
+        self.assertIn('row counts verified', options['stdout'].getvalue())
+        self.assertIn('lab_resultvalue', connections[self.target_alias].introspection.table_names())
+        self.assertEqual(Patient.objects.count(), 0)
+
+
+@override_settings(SQLITE_LOCK_RETRIES=3, SQLITE_LOCK_RETRY_DELAY=0)
+class SqliteTuningTestCase(TransactionTestCase):
+    """Test the SQLite connection profile and lock retries"""
+
+    def flaky(self, failures, message='database is locked'):
+        calls = []
+
+        @sqlite.retry_on_locked
+        def write():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError(message)
+            return 'saved'
+
+        return write, calls
+
+    def test_options_apply_pragmas_on_connect(self):
+        """The init command switches a new database to WAL"""
+        options = sqlite.options(timeout=5)
+        self.assertEqual(options['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('PRAGMA busy_timeout=5000;', options['init_command'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            db = sqlite3.connect(os.path.join(directory, 'tuned.sqlite3'))
+            try:
+                db.executescript(options['init_command'])
+                self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+                self.assertEqual(db.execute('PRAGMA synchronous').fetchone()[0], 1)
+                self.assertEqual(db.execute('PRAGMA temp_store').fetchone()[0], 2)
+            finally:
+                db.close()
+
+    def test_locked_write_is_retried(self):
+        write, calls = self.flaky(failures=2)
+        self.assertEqual(write(), 'saved')
+        self.assertEqual(len(calls), 3)
+
+    def test_gives_up_after_retries(self):
+        write, calls = self.flaky(failures=10)
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 4)
+
+    def test_other_errors_are_not_retried(self):
+        write, calls = self.flaky(failures=1, message='no such table: x')
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 1)
+
+    def test_not_retried_inside_transaction(self):
+        """The caller's transaction has to roll back as a whole"""
+        write, calls = self.flaky(failures=1)
+        with self.assertRaises(OperationalError):
+            with transaction.atomic():
+                write()
+        self.assertEqual(len(calls), 1)
+
+    def test_written_row_is_not_saved_again(self):
+        """A save that failed after its INSERT is not repeated"""
+        instance = Income(source='OTHER', amount=10, date='2025-10-27')
+        calls = []
+
+        @sqlite.retry_on_locked
+        def save(obj):
+            calls.append(1)
+            obj._state.adding = False
+            raise OperationalError('database is locked')
+
+        with self.assertRaises(OperationalError):
+            save(instance)
+        self.assertEqual(len(calls), 1)
+
+
+class ArchiveTestCase(TestCase):
+    """Test moving old rows to the archive and reading them back"""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.old = self.today - datetime.timedelta(days=400)
+        self.doctor = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR')
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth='1990-01-01', gender='M',
+            phone='01700000000', address='Bazar Road', city='Naogaon',
+            emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+
+    def appointment(self, date, status='completed', serial_number=None):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=date,
+            serial_number=serial_number, status=status, consultation_fee=500,
+        )
+
+    def test_closed_rows_move_with_their_children(self):
+        appointment = self.appointment(self.old)
+        prescription = Prescription.objects.create(
+            appointment=appointment, patient=self.patient, doctor=self.doctor, diagnosis='Fever',
+        )
+        Medicine.objects.create(
+            prescription=prescription, medicine_name='Napa', dosage='500mg', frequency='1+0+1', duration='3 days',
+        )
+        waiting = self.appointment(self.old, status='waiting')
+        recent = self.appointment(self.today)
+
+        moved = archive.run()
+        self.assertEqual(moved['appointments.Appointment'], 1)
+        self.assertEqual(set(Appointment.objects.values_list('pk', flat=True)), {waiting.pk, recent.pk})
+        self.assertFalse(Prescription.objects.exists())
+        self.assertFalse(Medicine.objects.exists())
+
+        restored, = archive.load('appointments.Appointment', patient_id=self.patient.pk)
+        self.assertTrue(restored.archived)
+        self.assertEqual((restored.pk, restored.appointment_date, restored.doctor), (appointment.pk, self.old, self.doctor))
+        self.assertEqual(restored.archived_related['prescriptions'][0].archived_related['medicines'][0].medicine_name, 'Napa')
+
+    def test_rows_referenced_from_live_tables_stay(self):
+        appointment = self.appointment(self.old)
+        LabOrder.objects.create(patient=self.patient, appointment=appointment, ordered_by=self.doctor)
+        self.assertEqual(archive.run()['appointments.Appointment'], 0)
+        self.assertTrue(Appointment.objects.filter(pk=appointment.pk).exists())
+
+    def test_batches_resume(self):
+        for serial_number in range(1, 6):
+            self.appointment(self.old, serial_number=serial_number)
+        self.assertEqual(archive.run(batch_size=2, max_batches=1)['appointments.Appointment'], 2)
+        # A run interrupted after the copy: the rows are archived again harmlessly
+        leftover = Appointment.objects.order_by('pk').first()
+        ArchivedRecord.objects.create(
+            model='appointments.Appointment', object_id=leftover.pk, date=self.old, data={'id': leftover.pk},
+        )
+        self.assertEqual(archive.run(batch_size=2)['appointments.Appointment'], 3)
+        self.assertFalse(Appointment.objects.exists())
+        self.assertEqual(ArchivedRecord.objects.filter(model='appointments.Appointment').count(), 5)
+
+    def test_reports_and_rollups_still_see_archived_rows(self):
+        Income.objects.create(source='CONSULTATION', amount=300, date=self.old)
+        Income.objects.create(source='CONSULTATION', amount=200, date=self.today)
+        self.appointment(self.old)
+        before = sorted(DailyRollup.objects.exclude(count=0).values_list('metric', 'date', 'source', 'count', 'total'))
+
+        call_command('archive_records', stdout=StringIO())
+        self.assertEqual(Income.objects.count(), 1)
+        self.assertEqual(archive.total('finance.Income'), {'total': Decimal('300'), 'count': 1})
+        self.assertEqual(archive.total('finance.Income', start=self.today), {'total': Decimal(0), 'count': 0})
+
+        # Archiving does not touch the rollups, and a rebuild reads the archive
+        rows = lambda: sorted(DailyRollup.objects.exclude(count=0).values_list('metric', 'date', 'source', 'count', 'total'))
+        self.assertEqual(rows(), before)
+        rollups.rebuild()
+        self.assertEqual(rows(), before)
+
+        from finance.views import income_total
+        self.assertEqual(income_total(), Decimal('500'))
+
+    def test_patient_detail_lists_archived_appointments(self):
+        self.appointment(self.old)
+        self.appointment(self.today)
+        archive.run()
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse('patients:patient_detail', args=[self.patient.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['appointments']), 2)
+        self.assertContains(response, 'Archived')
+
+    def test_dry_run(self):
+        self.appointment(self.old)
+        out = StringIO()
+        call_command('archive_records', '--dry-run', '--model', 'appointments.Appointment', stdout=out)
+        self.assertIn('appointments.Appointment: 1 rows', out.getvalue())
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class CloseDayTestCase(TestCase):
+    """Test the end-of-day close"""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.doctor = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR')
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth='1990-01-01', gender='M',
+            phone='01700000000', address='Bazar Road', city='Naogaon',
+            emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+
+    def appointment(self, status='waiting', date=None):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=date or self.today, status=status,
+        )
+
+    def rows(self):
+        return sorted(
+            DailyRollup.objects.exclude(count=0, total=0).values_list('metric', 'date', 'source', 'doctor_id', 'count', 'total')
+        )
+
+    def test_leftover_appointments_become_no_shows(self):
+        waiting = self.appointment()
+        called = self.appointment('called', self.today - datetime.timedelta(days=3))
+        in_room = self.appointment('in_consultation')
+        tomorrow = self.appointment(date=self.today + datetime.timedelta(days=1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(closing.mark_no_shows(self.today), 2)
+        statuses = dict(Appointment.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[waiting.pk], 'no_show')
+        self.assertEqual(statuses[called.pk], 'no_show')
+        self.assertEqual(statuses[in_room.pk], 'in_consultation')
+        self.assertEqual(statuses[tomorrow.pk], 'waiting')
+
+        # The rollups moved exactly as a rebuild computes them
+        incremental = self.rows()
+        rollups.rebuild()
+        self.assertEqual(self.rows(), incremental)
+
+    def test_statements_do_not_grow_with_the_day(self):
+        def statements(day, appointments):
+            for _ in range(appointments):
+                self.appointment(date=day)
+            Drug.objects.create(
+                drug_code=f'D{appointments}', generic_name='Paracetamol', brand_name='Napa', form='TABLET',
+                strength='500mg', manufacturer='Beximco', quantity_in_stock=10, unit_price=1, selling_price=2,
+            )
+            with CaptureQueriesContext(connection) as queries:
+                closing.close_day(day)
+            return len(queries)
+
+        few = statements(self.today - datetime.timedelta(days=2), 2)
+        self.assertEqual(statements(self.today - datetime.timedelta(days=1), 20), few)
+
+    def test_close_is_idempotent(self):
+        self.appointment()
+        Drug.objects.create(
+            drug_code='D1', generic_name='Paracetamol', brand_name='Napa', form='TABLET',
+            strength='500mg', manufacturer='Beximco', quantity_in_stock=40, unit_price=1, selling_price=2,
+        )
+        member = PCMember.objects.create(member_type='GENERAL', name='Karim', phone='01900000000', commission_percentage=10)
+        PCTransaction.objects.create(pc_member=member, total_amount=1000, commission_percentage=10)
+        self.assertTrue(BookingCounter.objects.filter(date=self.today).exists())
+        yesterday = (self.today - datetime.timedelta(days=1)).strftime('%Y%m%d')
+        DocumentSequence.objects.create(prefix='LAB', period=yesterday, last_value=9)
+        DocumentSequence.objects.create(prefix='LAB', period=self.today.strftime('%Y%m%d'), last_value=3)
+
+        out = StringIO()
+        call_command('close_day', stdout=out)
+        self.assertIn(f'Closed {self.today}', out.getvalue())
+        closed = DayClose.objects.get(date=self.today)
+        self.assertEqual(closed.summary['no_shows']['rows'], 1)
+        self.assertEqual(closed.summary['stock']['rows'], 1)
+        self.assertEqual(StockSnapshot.objects.get(date=self.today).quantity, 40)
+        self.assertFalse(BookingCounter.objects.exists())
+        periods = set(DocumentSequence.objects.values_list('period', flat=True))
+        self.assertNotIn(yesterday, periods)
+        self.assertTrue({self.today.strftime('%Y%m%d'), str(self.today.year)} <= periods)
+        rows = self.rows()
+        self.assertIn(('pc_commission', self.today, '', 0, 1, Decimal('100')), rows)
+        self.assertIn(('pc_admin', self.today, '', 0, 1, Decimal('900')), rows)
+
+        closing.close_day()
+        self.assertEqual(DayClose.objects.count(), 1)
+        self.assertEqual(DayClose.objects.get().summary['no_shows']['rows'], 0)
+        self.assertEqual(StockSnapshot.objects.count(), 1)
+        self.assertEqual(self.rows(), rows)
+
+
+class DocumentTestCase(TestCase):
+    """Test the cached PDF rendering of print pages"""
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings = override_settings(
+            DOCUMENT_PDF_BACKEND='accounts.tests.fake_pdf', DOCUMENT_CACHE_ROOT=cache_dir.name, DOCUMENT_RENDER_WORKERS=1,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.cache_dir = cache_dir.name
+        pdf_calls.clear()
+
+        self.user = User.objects.create_user(username='reception', password='testpass123', role='RECEPTIONIST')
+        self.doctor = User.objects.create_user(
+            username='doctor', password='testpass123', role='DOCTOR', first_name='Abdul', last_name='Karim',
+        )
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth='1990-01-01', gender='M',
+            phone='01700000000', address='Bazar Road', city='Naogaon',
+            emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+        self.appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=timezone.localdate(),
+        )
+        self.client.force_login(self.user)
+
+    def prescription(self, diagnosis='Fever'):
+        prescription = Prescription.objects.create(
+            appointment=self.appointment, patient=self.patient, doctor=self.doctor, diagnosis=diagnosis,
+        )
+        Medicine.objects.create(
+            prescription=prescription, medicine_name='Napa', dosage='500mg', frequency='1+0+1', duration='5 days',
+        )
+        return prescription
+
+    def test_reprint_is_served_from_the_cache(self):
+        prescription = self.prescription()
+        url = reverse('appointments:prescription_print', args=[prescription.pk])
+
+        first = self.client.get(url, {'format': 'pdf'})
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertIn(prescription.prescription_number, first['Content-Disposition'])
+        self.assertTrue(first.content.startswith(b'%PDF'))
+        second = self.client.get(url, {'format': 'pdf'})
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(len(pdf_calls), 1)
+
+        # Changed data is new HTML, rendered afresh
+        Prescription.objects.filter(pk=prescription.pk).update(diagnosis='Typhoid')
+        self.assertNotEqual(self.client.get(url, {'format': 'pdf'}).content, first.content)
+        self.assertEqual(len(pdf_calls), 2)
+
+        # Without ?format=pdf the print page is HTML as before
+        self.assertTrue(self.client.get(url)['Content-Type'].startswith('text/html'))
+
+    @override_settings(DOCUMENT_PDF_BACKEND='accounts.tests.broken_pdf')
+    def test_falls_back_to_html_without_a_backend(self):
+        url = reverse('accounts:reception_print_voucher', args=[self.appointment.pk])
+        response = self.client.get(url, {'format': 'pdf'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+    def test_pool_renders_pages_in_order(self):
+        pages = [f'<p>Page {number}</p>' for number in range(3)]
+        with self.settings(DOCUMENT_RENDER_WORKERS=2):
+            pdfs = documents.render_many(pages)
+        # Rendered in the worker processes, not here
+        self.assertEqual(pdf_calls, [])
+        self.assertEqual(pdfs, [fake_pdf(page, None) for page in pages])
+        self.assertEqual(documents.render_many(pages), pdfs)
+        self.assertEqual(len(pdf_calls), 3)
+
+    def test_batch_prints_pending_prescriptions(self):
+        prescription = self.prescription()
+        url = reverse('accounts:reception_print_prescriptions')
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['X-Prescription-Ids'], str(prescription.pk))
+        self.assertEqual(self.client.get(url).content, response.content)
+        self.assertEqual(len(pdf_calls), 1)
+
+        Prescription.objects.filter(pk=prescription.pk).update(is_printed=True)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_prune_removes_unused_files(self):
+        old = documents.render_pdf('<p>Old</p>')
+        documents.render_pdf('<p>New</p>')
+        path = os.path.join(self.cache_dir, documents.digest('<p>Old</p>')[:2], f"{documents.digest('<p>Old</p>')}.pdf")
+        month_ago = timezone.now().timestamp() - 31 * 24 * 60 * 60
+        os.utime(path, (month_ago, month_ago))
+
+        self.assertEqual(documents.prune(), 1)
+        self.assertIsNone(documents.cached(documents.digest('<p>Old</p>')))
+        self.assertIsNotNone(documents.cached(documents.digest('<p>New</p>')))
+        self.assertEqual(documents.render_pdf('<p>Old</p>'), old)
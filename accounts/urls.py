@@ -14,8 +14,9 @@ urlpatterns = [
     # Reception Features - TODO: implement these views
     # path('reception/register-patient/', views.reception_register_patient, name='reception_register_patient'),
     # path('reception/billing/', views.reception_billing, name='reception_billing'),
-    # path('reception/voucher/<int:appointment_id>/', views.reception_print_voucher, name='reception_print_voucher'),
-    # path('reception/prescription/<int:prescription_id>/', views.reception_print_prescription, name='reception_print_prescription'),
+    path('reception/voucher/<int:appointment_id>/', views.reception_print_voucher, name='reception_print_voucher'),
+    path('reception/prescription/<int:prescription_id>/', views.reception_print_prescription, name='reception_print_prescription'),
+    path('reception/prescriptions/print/', views.reception_print_prescriptions, name='reception_print_prescriptions'),
     # path('reception/doctor-serials/<int:doctor_id>/', views.reception_doctor_serials, name='reception_doctor_serials'),
     
     path('lab-dashboard/', views.lab_dashboard, name='lab_dashboard'),
@@ -33,6 +34,7 @@ urlpatterns = [
     path('doctor-management/', views.doctor_management, name='doctor_management'),
     path('system-settings/', views.system_settings, name='system_settings'),
     path('activity-logs/', views.activity_logs, name='activity_logs'),
+    path('query-report/', views.query_report, name='query_report'),
     path('vitals/<int:appointment_id>/', views.patient_vitals_entry, name='patient_vitals_entry'),
     path('payment/<int:appointment_id>/', views.payment_collection, name='payment_collection'),
     
@@ -7,10 +7,12 @@ from django.utils import timezone
 from datetime import timedelta
 from patients.models import Patient
 from appointments.models import Appointment, Prescription, Medicine
+from appointments.transitions import IN_CONSULTATION, claim_next
 from lab.models import LabTest, LabOrder, LabResult
 from pharmacy.models import Drug, PharmacySale, SaleItem
 from finance.models import Income, Expense, Investor
 from survey.models import CanteenSale, CanteenItem, FeedbackSurvey
+from .dashboard import counted_queries, tally
 
 def landing_page(request):
     """Public landing page for the hospital website"""
@@ -40,6 +42,7 @@ def dashboard(request):
 
 
 @login_required
+@counted_queries
 def admin_dashboard(request):
     """Enhanced Admin dashboard with comprehensive management features"""
     from datetime import timedelta
@@ -71,76 +74,49 @@ def admin_dashboard(request):
         start_date = today
         end_date = today
     
-    # Financial calculations
-    income = Income.objects.filter(
-        date__range=[start_date, end_date]
-    ).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+    # Period and all-time totals come from the daily rollups (accounts.rollups)
+    from accounts import rollups
+    period_totals = rollups.totals(start_date, end_date)
+    all_time_totals = rollups.totals(metrics=rollups.ALL_TIME_METRICS)
     
-    expenses = Expense.objects.filter(
-        date__range=[start_date, end_date]
-    ).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+    # Financial calculations
+    income = period_totals.total('income')
+    expenses = period_totals.total('expense')
     
     profit = income - expenses
     profit_margin = (profit / income * 100) if income > 0 else 0
     
     # Sales breakdown by department
-    appointment_income = Income.objects.filter(
-        date__range=[start_date, end_date],
-        source='appointment'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    lab_income = Income.objects.filter(
-        date__range=[start_date, end_date],
-        source='lab'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    pharmacy_income = Income.objects.filter(
-        date__range=[start_date, end_date],
-        source='pharmacy'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    canteen_income = Income.objects.filter(
-        date__range=[start_date, end_date],
-        source='canteen'
-    ).aggregate(total=Sum('amount'))['total'] or 0
+    appointment_income = period_totals.total('income', 'appointment')
+    lab_income = period_totals.total('income', 'lab')
+    pharmacy_income = period_totals.total('income', 'pharmacy')
+    canteen_income = period_totals.total('income', 'canteen')
     
     # Patient and appointment statistics
-    total_patients = Patient.objects.count()
-    new_patients_period = Patient.objects.filter(
-        registered_at__date__range=[start_date, end_date]
-    ).count()
+    total_patients = all_time_totals.count('patients')
+    new_patients_period = period_totals.count('patients')
     
-    period_appointments = Appointment.objects.filter(
-        appointment_date__range=[start_date, end_date]
-    ).count()
-    
-    completed_appointments = Appointment.objects.filter(
-        appointment_date__range=[start_date, end_date],
-        status='completed'
-    ).count()
+    period_appointments = period_totals.count('appointments')
+    completed_appointments = period_totals.count('appointments', 'completed')
     
     # Staff statistics
-    total_staff = User.objects.filter(is_active=True).count()
-    doctors_count = User.objects.filter(role='DOCTOR', is_active=True).count()
-    nurses_count = User.objects.filter(role='NURSE', is_active=True).count()
+    staff = tally(
+        User.objects.filter(is_active=True),
+        total_staff=None,
+        doctors_count=Q(role='DOCTOR'),
+        nurses_count=Q(role='NURSE'),
+    )
+    total_staff = staff['total_staff']
+    doctors_count = staff['doctors_count']
+    nurses_count = staff['nurses_count']
     other_staff = total_staff - doctors_count - nurses_count
     
     # Department performance
     departments_performance = {
         'appointments': {'revenue': appointment_income, 'count': period_appointments},
-        'lab': {'revenue': lab_income, 'orders': LabOrder.objects.filter(
-            ordered_at__date__range=[start_date, end_date]
-        ).count()},
-        'pharmacy': {'revenue': pharmacy_income, 'sales': PharmacySale.objects.filter(
-            sale_date__date__range=[start_date, end_date]
-        ).count()},
-        'canteen': {'revenue': canteen_income, 'orders': CanteenSale.objects.filter(
-            sale_date__date__range=[start_date, end_date]
-        ).count()}
+        'lab': {'revenue': lab_income, 'orders': period_totals.count('lab_orders')},
+        'pharmacy': {'revenue': pharmacy_income, 'sales': period_totals.count('pharmacy_sales')},
+        'canteen': {'revenue': canteen_income, 'orders': period_totals.count('canteen_sales')}
     }
     
     # Average transaction values
@@ -150,18 +126,19 @@ def admin_dashboard(request):
     
     # Investors and funding
     investors = Investor.objects.all()
-    total_investment = investors.aggregate(Sum('investment_amount'))['investment_amount__sum'] or 0
-    active_investors = investors.filter(is_active=True).count()
+    funding = tally(
+        investors,
+        total_investment=Sum('investment_amount'),
+        active_investors=Q(is_active=True),
+    )
+    total_investment = funding['total_investment']
+    active_investors = funding['active_investors']
     
     # Outstanding payments and dues
-    outstanding_lab_payments = LabOrder.objects.filter(
-        is_paid=False
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
+    outstanding_lab_payments = all_time_totals.total('lab_unpaid')
     
-    # PharmacySale doesn't have is_paid field, so we calculate unpaid sales
-    outstanding_pharmacy_payments = PharmacySale.objects.filter(
-        amount_paid__lt=F('total_amount')
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
+    # PharmacySale doesn't have is_paid field, so unpaid means amount_paid < total
+    outstanding_pharmacy_payments = all_time_totals.total('pharmacy_unpaid')
     
     # Recent transactions (last 15 for better overview)
     recent_income = Income.objects.filter(
@@ -231,6 +208,7 @@ def admin_dashboard(request):
 
 
 @login_required
+@counted_queries
 def doctor_dashboard(request):
     """Enhanced Doctor dashboard with comprehensive patient management"""
     today = timezone.now().date()
@@ -241,11 +219,21 @@ def doctor_dashboard(request):
         appointment_date=today
     ).select_related('patient').order_by('serial_number')
     
-    # Queue statistics
-    waiting_count = appointments.filter(status='waiting').count()
-    in_consultation_count = appointments.filter(status='in_consultation').count()
-    completed_count = appointments.filter(status='completed').count()
-    cancelled_count = appointments.filter(status='cancelled').count()
+    # Queue, weekly and upcoming statistics in one aggregate
+    week_start = today - timedelta(days=today.weekday())
+    upcoming_end = today + timedelta(days=3)
+    stats = tally(
+        Appointment.objects.filter(
+            doctor=request.user,
+            appointment_date__range=[week_start, upcoming_end]
+        ),
+        waiting_count=Q(appointment_date=today, status='waiting'),
+        in_consultation_count=Q(appointment_date=today, status='in_consultation'),
+        completed_count=Q(appointment_date=today, status='completed'),
+        cancelled_count=Q(appointment_date=today, status='cancelled'),
+        weekly_appointments=Q(appointment_date__gte=week_start, appointment_date__lte=today, status='completed'),
+        upcoming_appointments=Q(appointment_date__gt=today, status='waiting'),
+    )
     
     # Current patient (if any in consultation)
     current_patient = appointments.filter(status='in_consultation').first()
@@ -269,14 +257,6 @@ def doctor_dashboard(request):
         description__icontains=request.user.get_full_name()
     ).aggregate(Sum('amount'))['amount__sum'] or 0
     
-    # Weekly statistics
-    week_start = today - timedelta(days=today.weekday())
-    weekly_appointments = Appointment.objects.filter(
-        doctor=request.user,
-        appointment_date__gte=week_start,
-        status='completed'
-    ).count()
-    
     # Most common diagnoses (last 30 days)
     thirty_days_ago = today - timedelta(days=30)
     recent_prescriptions = Prescription.objects.filter(
@@ -307,14 +287,6 @@ def doctor_dashboard(request):
     except:
         patient_ratings = {'avg_rating': None, 'total_feedback': 0}
     
-    # Upcoming appointments (next few days)
-    upcoming_appointments = Appointment.objects.filter(
-        doctor=request.user,
-        appointment_date__gt=today,
-        appointment_date__lte=today + timedelta(days=3),
-        status='confirmed'
-    ).count()
-    
     # Recent patient visits (for quick reference)
     recent_patients = Patient.objects.filter(
         appointments__doctor=request.user,
@@ -332,20 +304,20 @@ def doctor_dashboard(request):
     
     context = {
         'appointments': appointments,
-        'waiting_count': waiting_count,
-        'in_consultation_count': in_consultation_count,
-        'completed_count': completed_count,
-        'cancelled_count': cancelled_count,
+        'waiting_count': stats['waiting_count'],
+        'in_consultation_count': stats['in_consultation_count'],
+        'completed_count': stats['completed_count'],
+        'cancelled_count': stats['cancelled_count'],
         'current_patient': current_patient,
         'next_patient': next_patient,
         'current_patient_history': current_patient_history,
         'today_revenue': today_revenue,
-        'weekly_appointments': weekly_appointments,
+        'weekly_appointments': stats['weekly_appointments'],
         'recent_prescriptions': recent_prescriptions,
         'pending_lab_orders': pending_lab_orders,
         'prescriptions_written_today': prescriptions_written_today,
         'patient_ratings': patient_ratings,
-        'upcoming_appointments': upcoming_appointments,
+        'upcoming_appointments': stats['upcoming_appointments'],
         'recent_patients': recent_patients,
         'urgent_appointments': urgent_appointments,
     }
@@ -353,7 +325,16 @@ def doctor_dashboard(request):
     return render(request, 'accounts/doctor_dashboard.html', context)
 
 
+def pending_prescriptions(date):
+    """The day's prescriptions not printed yet"""
+    return Prescription.objects.filter(
+        appointment__appointment_date=date,
+        is_printed=False
+    ).select_related('appointment__patient', 'appointment__doctor')
+
+
 @login_required
+@counted_queries
 def receptionist_dashboard(request):
     """Enhanced Receptionist dashboard with comprehensive patient and payment management"""
     today = timezone.now().date()
@@ -363,10 +344,16 @@ def receptionist_dashboard(request):
         appointment_date=today
     ).select_related('doctor', 'patient')
     
-    today_appointments_count = today_appointments.count()
-    completed_appointments = today_appointments.filter(status='completed').count()
-    waiting_appointments = today_appointments.filter(status='waiting').count()
-    in_consultation = today_appointments.filter(status='in_consultation').count()
+    stats = tally(
+        today_appointments,
+        today_appointments_count=None,
+        completed_appointments=Q(status='completed'),
+        waiting_appointments=Q(status='waiting'),
+        in_consultation=Q(status='in_consultation'),
+        # Walk-in patients (appointments created today for today)
+        walk_in_patients=Q(check_in_time__date=today),
+    )
+    today_appointments_count = stats['today_appointments_count']
     
     # New patient registrations today
     new_patients_today = Patient.objects.filter(
@@ -389,10 +376,7 @@ def receptionist_dashboard(request):
     )
     
     # Prescriptions ready for printing
-    prescriptions_to_print = Prescription.objects.filter(
-        appointment__appointment_date=today,
-        is_printed=False
-    ).select_related('appointment__patient', 'appointment__doctor')
+    prescriptions_to_print = pending_prescriptions(today)
     
     # Payment collection summary
     today_collections = Income.objects.filter(
@@ -421,16 +405,13 @@ def receptionist_dashboard(request):
     except:
         insurance_pending = []
     
-    # Appointment scheduling statistics
-    total_slots_today = 100  # This could be dynamic based on doctor schedules
-    occupied_slots = today_appointments_count
-    available_slots = total_slots_today - occupied_slots
-    
-    # Walk-in patients (appointments created today for today)
-    walk_in_patients = Appointment.objects.filter(
-        appointment_date=today,
-        check_in_time__date=today
-    ).count()
+    # Appointment scheduling statistics, from the doctors' schedules
+    from appointments import availability, roster
+    doctor_ids = [doctor['id'] for doctor in roster.get_roster() if doctor['is_active']]
+    slots = availability.summary(doctor_ids, today)
+    total_slots_today = slots['total']
+    occupied_slots = slots['taken']
+    available_slots = slots['left']
     
     # Next few appointments (for preparation)
     next_appointments = Appointment.objects.filter(
@@ -453,9 +434,9 @@ def receptionist_dashboard(request):
     
     context = {
         'today_appointments_count': today_appointments_count,
-        'completed_appointments': completed_appointments,
-        'waiting_appointments': waiting_appointments,
-        'in_consultation': in_consultation,
+        'completed_appointments': stats['completed_appointments'],
+        'waiting_appointments': stats['waiting_appointments'],
+        'in_consultation': stats['in_consultation'],
         'new_patients_today': new_patients_today,
         'recent_patients': recent_patients,
         'appointments_by_doctor': appointments_by_doctor,
@@ -467,7 +448,7 @@ def receptionist_dashboard(request):
         'total_slots_today': total_slots_today,
         'occupied_slots': occupied_slots,
         'available_slots': available_slots,
-        'walk_in_patients': walk_in_patients,
+        'walk_in_patients': stats['walk_in_patients'],
         'next_appointments': next_appointments,
         'pending_feedback': pending_feedback,
     }
@@ -476,6 +457,7 @@ def receptionist_dashboard(request):
 
 
 @login_required
+@counted_queries
 def lab_dashboard(request):
     """Lab staff dashboard with pending tests"""
     from lab.models import LabOrder
@@ -492,6 +474,7 @@ def lab_dashboard(request):
 
 
 @login_required
+@counted_queries
 def pharmacy_dashboard(request):
     """Enhanced Pharmacy dashboard with comprehensive inventory and sales management"""
     from pharmacy.models import Drug, PharmacySale, SaleItem
@@ -504,10 +487,11 @@ def pharmacy_dashboard(request):
     low_stock_drugs = Drug.objects.filter(
         quantity_in_stock__lte=F('reorder_level')
     ).order_by('quantity_in_stock')
-    low_stock_count = low_stock_drugs.count()
-    
-    # Out of stock drugs
-    out_of_stock = Drug.objects.filter(quantity_in_stock=0).count()
+    stock = tally(
+        Drug.objects.all(),
+        low_stock_count=Q(quantity_in_stock__lte=F('reorder_level')),
+        out_of_stock=Q(quantity_in_stock=0),
+    )
     
     # Expiry alerts (drugs expiring within 30 days)
     thirty_days_later = today + timedelta(days=30)
@@ -516,17 +500,16 @@ def pharmacy_dashboard(request):
         expiry_date__gt=today
     ).order_by('expiry_date')[:10]
     
-    # Sales statistics
-    today_sales = PharmacySale.objects.filter(sale_date__date=today).count()
-    today_revenue = PharmacySale.objects.filter(
-        sale_date__date=today
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    
-    # Weekly revenue trend
+    # Sales statistics, weekly revenue trend and unpaid sales in one aggregate
+    # (PharmacySale doesn't have is_paid, so unpaid means amount_paid < total)
     week_start = today - timedelta(days=6)
-    weekly_revenue = PharmacySale.objects.filter(
-        sale_date__date__gte=week_start
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
+    sales = tally(
+        PharmacySale.objects.all(),
+        today_sales=Q(sale_date__date=today),
+        today_revenue=Sum('total_amount', filter=Q(sale_date__date=today)),
+        weekly_revenue=Sum('total_amount', filter=Q(sale_date__date__gte=week_start)),
+        pending_payments=Sum('total_amount', filter=Q(amount_paid__lt=F('total_amount'))),
+    )
     
     # Pending prescriptions (prescriptions not yet processed)
     try:
@@ -549,7 +532,7 @@ def pharmacy_dashboard(request):
     # Top selling drugs (this week)
     top_selling_drugs = SaleItem.objects.filter(
         sale__sale_date__date__gte=week_start
-    ).values('drug__name').annotate(
+    ).values('drug__brand_name').annotate(
         total_quantity=Sum('quantity'),
         total_revenue=Sum(F('quantity') * F('unit_price'))
     ).order_by('-total_quantity')[:5]
@@ -560,89 +543,58 @@ def pharmacy_dashboard(request):
         quantity_in_stock__gt=0
     ).order_by('quantity_in_stock')[:10]
     
-    # Payment status summary - PharmacySale doesn't have is_paid, calculate unpaid
-    pending_payments = PharmacySale.objects.filter(
-        amount_paid__lt=F('total_amount')
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    
     context = {
         'low_stock_drugs': low_stock_drugs,
-        'low_stock_count': low_stock_count,
-        'out_of_stock': out_of_stock,
+        'low_stock_count': stock['low_stock_count'],
+        'out_of_stock': stock['out_of_stock'],
         'expiring_soon': expiring_soon,
-        'today_sales': today_sales,
-        'today_revenue': today_revenue,
-        'weekly_revenue': weekly_revenue,
+        'today_sales': sales['today_sales'],
+        'today_revenue': sales['today_revenue'],
+        'weekly_revenue': sales['weekly_revenue'],
         'pending_prescriptions': pending_prescriptions_count,
         'pending_prescriptions_list': pending_prescriptions,
         'today_sales_list': today_sales_list,
         'top_selling_drugs': top_selling_drugs,
         'reorder_suggestions': reorder_suggestions,
-        'pending_payments': pending_payments,
+        'pending_payments': sales['pending_payments'],
     }
     
     return render(request, 'accounts/pharmacy_dashboard.html', context)
 
 
 @login_required
+@counted_queries
 def canteen_dashboard(request):
     """Enhanced Canteen dashboard with comprehensive order and inventory management"""
-    from survey.models import CanteenSale, CanteenOrder, CanteenMenuItem, CanteenOrderItem
+    from survey.models import CanteenSale, CanteenSaleItem
     
     today = timezone.now().date()
     
-    # Order statistics
-    today_orders = CanteenOrder.objects.filter(order_date__date=today).count()
-    
-    # Revenue calculations
-    today_revenue = CanteenSale.objects.filter(sale_date__date=today).aggregate(
-        Sum('total_amount')
-    )['total_amount__sum'] or 0
-    
-    # Weekly revenue for comparison
+    # Order count and revenue (today and this week) in one aggregate
     week_start = today - timedelta(days=today.weekday())
-    weekly_revenue = CanteenSale.objects.filter(
-        sale_date__date__gte=week_start
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    
-    # Active orders (pending, preparing, ready)
-    active_orders_list = CanteenOrder.objects.filter(
-        order_date__date=today,
-        status__in=['pending', 'preparing', 'ready']
-    ).select_related('customer').order_by('order_time')
-    
-    active_orders_count = active_orders_list.count()
-    
-    # Orders by status
-    pending_orders = active_orders_list.filter(status='pending').count()
-    preparing_orders = active_orders_list.filter(status='preparing').count()
-    ready_orders = active_orders_list.filter(status='ready').count()
-    
-    # Completed orders today
-    completed_orders = CanteenOrder.objects.filter(
-        order_date__date=today,
-        status='delivered'
-    ).select_related('customer').order_by('-order_time')[:15]
+    sales = tally(
+        CanteenSale.objects.filter(sale_date__date__gte=week_start),
+        today_orders=Q(sale_date__date=today),
+        today_revenue=Sum('total_amount', filter=Q(sale_date__date=today)),
+        weekly_revenue=Sum('total_amount'),
+    )
     
     # Popular items today
-    popular_items_today = CanteenOrderItem.objects.filter(
-        order__order_date__date=today
+    popular_items_today = CanteenSaleItem.objects.filter(
+        sale__sale_date__date=today
     ).values(
         'item__name'
     ).annotate(
         quantity_sold=Sum('quantity'),
-        revenue=Sum(F('quantity') * F('unit_price'))
+        revenue=Sum('total_price')
     ).order_by('-quantity_sold')[:5]
     
-    # Menu management statistics - using CanteenItem (not CanteenMenuItem)
-    try:
-        total_menu_items = CanteenItem.objects.filter(is_available=True).count()
-        out_of_stock_items = CanteenItem.objects.filter(
-            is_available=False
-        ).count()
-    except:
-        total_menu_items = 0
-        out_of_stock_items = 0
+    # Menu management statistics
+    menu = tally(
+        CanteenItem.objects.all(),
+        total_menu_items=Q(is_available=True),
+        out_of_stock_items=Q(is_available=False),
+    )
     
     # Customer satisfaction (if feedback available)
     try:
@@ -674,12 +626,12 @@ def canteen_dashboard(request):
     ).order_by('-total_spent')[:5]
     
     context = {
-        'today_orders': today_orders,
-        'today_revenue': today_revenue,
-        'weekly_revenue': weekly_revenue,
+        'today_orders': sales['today_orders'],
+        'today_revenue': sales['today_revenue'],
+        'weekly_revenue': sales['weekly_revenue'],
         'popular_items_today': popular_items_today,
-        'total_menu_items': total_menu_items,
-        'out_of_stock_items': out_of_stock_items,
+        'total_menu_items': menu['total_menu_items'],
+        'out_of_stock_items': menu['out_of_stock_items'],
         'customer_ratings': customer_ratings,
         'payment_methods': payment_methods,
         'top_customers': top_customers,
@@ -817,33 +769,16 @@ def doctor_management(request):
         messages.error(request, "Access denied. Admin only.")
         return redirect('accounts:dashboard')
     
-    from django.contrib.auth import get_user_model
-    from appointments.models import DoctorSchedule
-    from django.db.models import Count
+    from appointments import roster
     
-    User = get_user_model()
-    
-    # Get all doctors
-    doctors = User.objects.filter(role='DOCTOR').order_by('username')
-    
-    # Get doctor statistics
-    doctor_stats = []
-    for doctor in doctors:
-        schedules_count = DoctorSchedule.objects.filter(doctor=doctor).count()
-        appointments_count = Appointment.objects.filter(doctor=doctor).count()
-        
-        doctor_stats.append({
-            'doctor': doctor,
-            'schedules': schedules_count,
-            'total_appointments': appointments_count,
-            'specialization': getattr(doctor, 'specialization', 'General'),
-        })
+    # One entry per doctor with schedule/appointment counts, today's queue
+    # and next available slot (cached, see appointments.roster)
+    doctor_stats = roster.get_roster()
     
     context = {
-        'doctors': doctors,
         'doctor_stats': doctor_stats,
-        'total_doctors': doctors.count(),
-        'active_doctors': doctors.filter(is_active=True).count(),
+        'total_doctors': len(doctor_stats),
+        'active_doctors': sum(1 for stat in doctor_stats if stat['is_active']),
     }
     
     return render(request, 'accounts/doctor_management.html', context)
@@ -919,6 +854,28 @@ def activity_logs(request):
     return render(request, 'accounts/activity_logs.html', context)
 
 
+@login_required
+def query_report(request):
+    """Admin report of queries, DB time and template time per view"""
+    from . import profiling
+    
+    if not request.user.is_admin:
+        messages.error(request, "Access denied. Admin privileges required.")
+        return redirect('accounts:dashboard')
+    
+    if request.method == 'POST' and 'reset' in request.POST:
+        profiling.store.reset()
+        messages.success(request, "Query report has been reset.")
+        return redirect('accounts:query_report')
+    
+    context = {
+        'rows': profiling.store.report(),
+        'hours': profiling.store.hours,
+    }
+    
+    return render(request, 'accounts/query_report.html', context)
+
+
 #@login_required
 def patient_vitals_entry(request, appointment_id):
     """Doctor sub-feature: Enter patient vitals"""
@@ -1015,14 +972,10 @@ def call_next_patient(request):
     import json
     
     try:
-        today = timezone.now().date()
-        
-        # Get next waiting patient for this doctor
-        next_appointment = Appointment.objects.filter(
-            doctor=request.user,
-            appointment_date=today,
-            status='waiting'
-        ).order_by('serial_number').first()
+        # Claim the next waiting patient for this doctor in a conditional
+        # UPDATE, so two clicks or tabs never claim the same patient
+        # (screens are notified by appointments.signals once this commits)
+        next_appointment = claim_next(request.user, timezone.localdate(), IN_CONSULTATION)
         
         if not next_appointment:
             return JsonResponse({
@@ -1030,26 +983,6 @@ def call_next_patient(request):
                 'message': 'No patients waiting'
             })
         
-        # Update status to in_consultation
-        next_appointment.status = 'in_consultation'
-        next_appointment.save()
-        
-        # Send WebSocket notification for display monitor
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            'display_monitor',
-            {
-                'type': 'patient_called',
-                'patient_name': next_appointment.patient.get_full_name(),
-                'queue_number': next_appointment.serial_number,
-                'doctor_name': next_appointment.doctor.get_full_name(),
-                'room_number': next_appointment.room_number or 'N/A'
-            }
-        )
-        
         return JsonResponse({
             'success': True,
             'patient_name': next_appointment.patient.get_full_name(),
@@ -1065,6 +998,71 @@ def call_next_patient(request):
         }, status=500)
 
 
+@login_required
+def reception_print_voucher(request, appointment_id):
+    """Appointment voucher for the patient (as PDF with ?format=pdf)"""
+    from django.shortcuts import get_object_or_404
+    from accounts import documents
+    from accounts.models import PCTransaction
+    
+    appointment = get_object_or_404(Appointment.objects.select_related('patient', 'doctor'), pk=appointment_id)
+    context = {
+        'appointment': appointment,
+        'pc_transaction': PCTransaction.objects.filter(appointment=appointment).select_related('pc_member').first(),
+        # Issue time rather than now, so reprints are identical (and cached)
+        'print_date': appointment.check_in_time,
+    }
+    return documents.print_response(
+        request, 'accounts/reception_voucher_print.html', context, f'{appointment.appointment_number}.pdf'
+    )
+
+
+@login_required
+def reception_print_prescription(request, prescription_id):
+    """Compact prescription print for the reception desk (as PDF with ?format=pdf)"""
+    from django.shortcuts import get_object_or_404
+    from accounts import documents
+    
+    prescription = get_object_or_404(
+        Prescription.objects.select_related('appointment__patient', 'appointment__doctor'), pk=prescription_id
+    )
+    context = {
+        'prescription': prescription,
+        'print_date': prescription.created_at,
+    }
+    return documents.print_response(
+        request, 'accounts/reception_prescription_print.html', context, f'{prescription.prescription_number}.pdf'
+    )
+
+
+@login_required
+def reception_print_prescriptions(request):
+    """Today's unprinted prescriptions (or ?id=...) as one PDF"""
+    from django.http import HttpResponse
+    from django.template.loader import render_to_string
+    from accounts import documents
+    
+    prescriptions = pending_prescriptions(timezone.now().date()).prefetch_related('medicines').order_by('created_at', 'pk')
+    ids = request.GET.getlist('id')
+    if ids:
+        prescriptions = Prescription.objects.filter(pk__in=[pk for pk in ids if pk.isdigit()]).select_related(
+            'appointment__patient', 'appointment__doctor'
+        ).prefetch_related('medicines').order_by('created_at', 'pk')
+    pages = [
+        render_to_string('appointments/prescription_print.html', {'prescription': prescription}, request=request)
+        for prescription in prescriptions
+    ]
+    if not pages:
+        return HttpResponse('No prescriptions to print', status=404, content_type='text/plain')
+    try:
+        pdf = documents.render_batch(pages, request.build_absolute_uri('/'))
+    except documents.PDFUnavailable as error:
+        return HttpResponse(f'PDF rendering is not available: {error}', status=503, content_type='text/plain')
+    response = documents.pdf_response(pdf, f'prescriptions-{timezone.now():%Y%m%d}.pdf')
+    response['X-Prescription-Ids'] = ','.join(str(prescription.pk) for prescription in prescriptions)
+    return response
+
+
 @require_POST
 #@login_required
 def mark_prescription_printed(request, prescription_id):
@@ -1145,7 +1143,10 @@ def admin_finance_dashboard(request):
         total=Sum('amount'),
         count=Count('id')
     )
-    gross_income = income_data['total'] or 0
+    # Income moved out by accounts.archive still counts
+    from accounts import archive
+    archived_income = archive.total('finance.Income', start_date, end_date, by_kind=True)
+    gross_income = (income_data['total'] or 0) + sum(row['total'] for row in archived_income.values())
     
     # Income by source
     income_by_source = Income.objects.filter(
@@ -1160,6 +1161,9 @@ def admin_finance_dashboard(request):
     for item in income_by_source:
         income_sources[item['source']] = item['total']
         income_counts[item['source']] = item['count']
+    for source, item in archived_income.items():
+        income_sources[source] = income_sources.get(source, 0) + item['total']
+        income_counts[source] = income_counts.get(source, 0) + item['count']
     
     # Fill in missing sources with 0
     for source in ['CONSULTATION', 'LAB_TEST', 'PHARMACY', 'CANTEEN', 'OTHER']:
@@ -1167,18 +1171,13 @@ def admin_finance_dashboard(request):
             income_sources[source] = 0
             income_counts[source] = 0
     
-    # PC Commission Calculations
-    pc_data = PCTransaction.objects.filter(
-        transaction_date__date__range=[start_date, end_date]
-    ).aggregate(
-        total_commission=Sum('commission_amount'),
-        total_admin_share=Sum('admin_amount'),
-        count=Count('id')
-    )
+    # PC Commission Calculations (from the daily rollups)
+    from accounts import rollups
+    pc_totals = rollups.totals(start_date, end_date, metrics=('pc_commission', 'pc_admin'))
     
-    pc_commission_expense = pc_data['total_commission'] or 0
-    admin_revenue_from_pc = pc_data['total_admin_share'] or 0
-    pc_transaction_count = pc_data['count'] or 0
+    pc_commission_expense = pc_totals.total('pc_commission')
+    admin_revenue_from_pc = pc_totals.total('pc_admin')
+    pc_transaction_count = pc_totals.count('pc_commission')
     
     # Net Income (Gross Income + Admin PC Revenue - PC Commission)
     net_income = gross_income + admin_revenue_from_pc
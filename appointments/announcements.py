@@ -0,0 +1,300 @@
+"""
+Announcement audio
+
+The display monitors announce a called patient as "serial N, room R, doctor
+D" in Bengali and English. The clips are rendered on the server by a
+text-to-speech engine (ENGINES, chosen with ANNOUNCEMENT_TTS_ENGINE) and
+kept on disk under ANNOUNCEMENT_AUDIO_ROOT, one file per engine, language
+and phrase, so a clip is synthesized once and then served as a plain file
+(ANNOUNCEMENT_AUDIO_URL). The phrase holds no patient name, which keeps it
+reusable from day to day.
+
+Rendering is slow, so it never happens on a request: ``manage.py
+warm_announcements`` renders a day's serials ahead (every serial the
+doctors' sessions have room for, plus the appointments already booked),
+and saving a schedule (warm_schedule()) or booking an appointment queues
+its clips for a background worker. The
+``patient_called`` event carries the URLs of the clips that are ready
+(see signals.publish_call); monitors fall back to the browser's speech
+synthesis when there are none.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+# name -> (render function, file extension)
+ENGINES = {}
+
+PHRASES = {
+    'bn': 'সিরিয়াল নম্বর {serial}, রুম {room}, ডাক্তার {doctor}',
+    'en': 'Serial number {serial}, room {room}, doctor {doctor}',
+}
+
+# Phrases for appointments without a room
+PHRASES_WITHOUT_ROOM = {
+    'bn': 'সিরিয়াল নম্বর {serial}, ডাক্তার {doctor}',
+    'en': 'Serial number {serial}, doctor {doctor}',
+}
+
+BENGALI_DIGITS = str.maketrans('0123456789', '০১২৩৪৫৬৭৮৯')
+
+
+class EngineUnavailable(Exception):
+    """The engine cannot run here, or has no voice for the language"""
+
+
+def engine(name, extension):
+    """Register ``func(text, language, path)`` as a text-to-speech engine"""
+    def decorator(func):
+        ENGINES[name] = (func, extension)
+        return func
+    return decorator
+
+
+def _matches(voice, language):
+    languages = [
+        value.decode(errors='ignore').lstrip('\x05') if isinstance(value, bytes) else str(value)
+        for value in getattr(voice, 'languages', None) or []
+    ]
+    return any(value.split('-')[0].split('_')[0] == language for value in languages) or (
+        voice.id.rsplit('/', 1)[-1].split('-')[0] == language
+    )
+
+
+@engine('pyttsx3', 'wav')
+def pyttsx3_engine(text, language, path):
+    """Offline synthesis with the system voices (eSpeak NG on Linux)"""
+    try:
+        import pyttsx3
+        tts = pyttsx3.init()
+    except (ImportError, OSError, RuntimeError) as error:
+        raise EngineUnavailable(f'pyttsx3: {error}')
+    voice = next((voice for voice in tts.getProperty('voices') if _matches(voice, language)), None)
+    if voice is None:
+        raise EngineUnavailable(f'pyttsx3 has no {language} voice')
+    tts.setProperty('voice', voice.id)
+    tts.setProperty('rate', getattr(settings, 'ANNOUNCEMENT_TTS_RATE', 140))
+    tts.save_to_file(text, path)
+    tts.runAndWait()
+
+
+@engine('gtts', 'mp3')
+def gtts_engine(text, language, path):
+    """Google Translate's voices; needs network access while rendering"""
+    try:
+        from gtts import gTTS
+    except ImportError as error:
+        raise EngineUnavailable(f'gTTS: {error}')
+    gTTS(text, lang=language).save(path)
+
+
+def _engine():
+    """``(name, render function, extension)`` of the configured engine"""
+    name = getattr(settings, 'ANNOUNCEMENT_TTS_ENGINE', 'pyttsx3')
+    if name in ENGINES:
+        return (name,) + ENGINES[name]
+    # A dotted path to a function with an ``extension`` attribute
+    func = import_string(name)
+    return name, func, getattr(func, 'extension', 'wav')
+
+
+def languages():
+    return getattr(settings, 'ANNOUNCEMENT_LANGUAGES', ('bn', 'en'))
+
+
+def audio_root():
+    return str(getattr(settings, 'ANNOUNCEMENT_AUDIO_ROOT', os.path.join(settings.MEDIA_ROOT, 'announcements')))
+
+
+def audio_url():
+    return getattr(settings, 'ANNOUNCEMENT_AUDIO_URL', f'{settings.MEDIA_URL}announcements/')
+
+
+def phrase(language, serial_number, room_number, doctor_name):
+    """Announcement text for one call"""
+    serial = str(serial_number)
+    if language == 'bn':
+        serial = serial.translate(BENGALI_DIGITS)
+        room_number = (room_number or '').translate(BENGALI_DIGITS)
+    templates = PHRASES if room_number else PHRASES_WITHOUT_ROOM
+    return templates[language].format(serial=serial, room=room_number, doctor=doctor_name)
+
+
+def filename(language, text):
+    """Cache file name of a phrase, for the configured engine"""
+    name, _, extension = _engine()
+    digest = hashlib.sha1(f'{name}\n{language}\n{text}'.encode()).hexdigest()[:24]
+    return f'{language}-{digest}.{extension}'
+
+
+def clips(serial_number, room_number, doctor_name):
+    """``[(language, text, file name)]`` of one call, in announcement order"""
+    result = []
+    for language in languages():
+        text = phrase(language, serial_number, room_number, doctor_name)
+        result.append((language, text, filename(language, text)))
+    return result
+
+
+def appointment_clips(appointment):
+    return clips(appointment.serial_number, appointment.room_number, appointment.doctor.get_full_name())
+
+
+def render(language, text, name):
+    """Render one clip unless it is on disk already.
+
+    The clip is rendered to a temporary file and moved into place, so a
+    monitor never fetches half a file and concurrent renders do no harm.
+    Raises EngineUnavailable when the engine cannot render it.
+    """
+    root = audio_root()
+    path = os.path.join(root, name)
+    if os.path.exists(path):
+        return
+    _, func, extension = _engine()
+    with tempfile.TemporaryDirectory() as workdir:
+        rendered = os.path.join(workdir, name)
+        func(text, language, rendered)
+        if not os.path.exists(rendered) or not os.path.getsize(rendered):
+            raise EngineUnavailable(f'Nothing was rendered for {text!r}')
+        os.makedirs(root, exist_ok=True)
+        fd, partial = tempfile.mkstemp(suffix=f'.{extension}', dir=root)
+        os.close(fd)
+        try:
+            shutil.copyfile(rendered, partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+
+def ready(clip_list):
+    """``[{'language', 'url'}]`` for the clips already on disk"""
+    root = audio_root()
+    return [
+        {'language': language, 'url': f'{audio_url()}{name}'}
+        for language, _, name in clip_list
+        if os.path.exists(os.path.join(root, name))
+    ]
+
+
+def expected_clips(start, end=None, doctor_ids=None):
+    """Clips of every serial expected from ``start`` to ``end``, in call order.
+
+    Serials run from 1 to the capacity of each doctor's sessions (in the
+    session's room), and booked appointments add their own serial and room.
+    ``doctor_ids`` limits it to those doctors.
+    """
+    from django.contrib.auth import get_user_model
+
+    from . import roster
+    from .models import Appointment
+
+    end = end or start
+    doctors = get_user_model().objects.filter(role='DOCTOR', is_active=True)
+    if doctor_ids is not None:
+        doctors = doctors.filter(pk__in=doctor_ids)
+    doctors = {doctor.pk: doctor.get_full_name() for doctor in doctors}
+    calls = set()
+    day_sessions = roster.sessions(list(doctors), start, end)
+    for (doctor_id, _), sessions in day_sessions.items():
+        serial_number = 0
+        for session in sessions:
+            for _ in range(session['max_patients']):
+                serial_number += 1
+                calls.add((serial_number, session['room_number'], doctors[doctor_id]))
+    for appointment in Appointment.objects.filter(
+        appointment_date__range=[start, end], doctor_id__in=list(doctors)
+    ).exclude(status__in=roster.FREED_STATUSES).select_related('doctor'):
+        calls.add((appointment.serial_number, appointment.room_number, appointment.doctor.get_full_name()))
+
+    return [
+        clip
+        for call in sorted(calls, key=lambda call: (call[2], call[0], call[1] or ''))
+        for clip in clips(*call)
+    ]
+
+
+def warm(date):
+    """Render the clips of every serial expected on ``date``.
+
+    Returns the number of clips ready and the number that failed.
+    """
+    ready_count = failed = 0
+    unavailable = set()
+    for clip in expected_clips(date):
+        if clip[0] in unavailable:
+            # No point trying a language the engine failed on
+            failed += 1
+            continue
+        try:
+            render(*clip)
+            ready_count += 1
+        except EngineUnavailable as error:
+            logger.warning('Announcement not rendered: %s', error)
+            unavailable.add(clip[0])
+            failed += 1
+    return ready_count, failed
+
+
+def warm_schedule(doctor_id, date=None):
+    """Queue the clips a changed schedule expects for the renderer.
+
+    Runs on the broadcast worker after a schedule (``date`` None) or a date
+    override of ``doctor_id`` is saved (see signals.schedule_changed). A
+    weekly schedule is warmed for the coming week, which holds every weekday.
+    """
+    today = timezone.localdate()
+    if date is None:
+        start, end = today, today + datetime.timedelta(days=6)
+    elif date < today:
+        return
+    else:
+        start = end = date
+    renderer.enqueue(expected_clips(start, end, doctor_ids=[doctor_id]))
+
+
+class Renderer(BackgroundWorker):
+    """Renders queued clips one at a time in a background thread"""
+
+    name = 'announcement-audio'
+
+    def __init__(self):
+        super().__init__()
+        self._warned = set()
+
+    def enqueue(self, clip_list):
+        """Queue the clips not rendered yet; returns immediately"""
+        root = audio_root()
+        for clip in clip_list:
+            if not os.path.exists(os.path.join(root, clip[2])):
+                self.put(clip)
+
+    def _run(self):
+        while True:
+            clip = self._queue.get()
+            try:
+                render(*clip)
+            except EngineUnavailable as error:
+                # Logged once per reason: an engine without a voice fails every time
+                if str(error) not in self._warned:
+                    self._warned.add(str(error))
+                    logger.warning('Announcement not rendered: %s', error)
+            except Exception:
+                logger.exception('Could not render announcement %s', clip[2])
+            finally:
+                self._queue.task_done()
+
+
+renderer = Renderer()
@@ -0,0 +1,237 @@
+"""
+Slot availability
+
+Each doctor's bookable slots for a day come from the weekly DoctorSchedule
+(or that date's DoctorAvailability overrides, see roster.sessions): every
+session is cut into consultation_duration slots, at most max_patients of
+them. Booked appointments take the slot at their appointment_time, or the
+earliest free one when they have no time, the same order the roster uses.
+
+A day is cached as sorted slot start minutes (free slots plus a map of
+appointment id -> slot taken). Appointment saves update the cached days in
+place (see signals.py), under a lock in the cache shared by every worker,
+so "next free slot" and "slots left" are a cache read and a bisect.
+Schedule changes drop the doctor's cached days.
+
+Appointments moved to another doctor or date are not followed; the cached
+days expire after AVAILABILITY_TIMEOUT seconds.
+"""
+import bisect
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import queue_state, roster
+
+
+def cache_key(doctor_id, date):
+    return f'availability:{doctor_id}:{date.isoformat()}'
+
+
+def _timeout():
+    return getattr(settings, 'AVAILABILITY_TIMEOUT', 600)
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _format(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def _slots(day_sessions):
+    """``{start minute: [end minute, room]}`` for a day's sessions"""
+    slots = {}
+    for session in day_sessions:
+        start, end = _minutes(session['start']), _minutes(session['end'])
+        duration = max(session['duration'] or roster.DEFAULT_DURATION, 1)
+        count = min(session['max_patients'], (end - start) // duration)
+        for index in range(max(count, 0)):
+            slot = start + index * duration
+            slots.setdefault(slot, [slot + duration, session['room_number']])
+    return slots
+
+
+def _take(day, appointment_id, time=None):
+    """Give the appointment its slot: the one at ``time`` if free, else the earliest"""
+    free = day['free']
+    if not free:
+        return
+    index = 0
+    if time is not None:
+        wanted = bisect.bisect_left(free, _minutes(time))
+        if wanted < len(free) and free[wanted] == _minutes(time):
+            index = wanted
+    day['taken'][appointment_id] = free.pop(index)
+
+
+def _release(day, appointment_id):
+    slot = day['taken'].pop(appointment_id, None)
+    if slot is not None:
+        bisect.insort(day['free'], slot)
+
+
+def build(doctor_ids, start, end=None):
+    """Compute ``{(doctor_id, date): day}`` for the days ``start`` to ``end`` from the database"""
+    from .models import Appointment
+
+    end = end or start
+    day_sessions = roster.sessions(doctor_ids, start, end)
+    days = {}
+    for key, sessions in day_sessions.items():
+        slots = _slots(sessions)
+        days[key] = {'slots': slots, 'free': sorted(slots), 'taken': {}}
+
+    booked = Appointment.objects.filter(
+        doctor_id__in=doctor_ids, appointment_date__range=[start, end]
+    ).exclude(status__in=roster.FREED_STATUSES).order_by('serial_number', 'pk').values_list(
+        'id', 'doctor_id', 'appointment_date', 'appointment_time'
+    )
+    # Appointments with a time first, so an earlier untimed booking can't
+    # take their slot
+    for appointment_id, doctor_id, date, time in sorted(booked, key=lambda row: row[3] is None):
+        _take(days[(doctor_id, date)], appointment_id, time)
+    return days
+
+
+def get_range(doctor_ids, start, days=1):
+    """Cached ``{(doctor_id, date): day}`` for ``days`` days from ``start``.
+
+    The days not cached are built together, in a fixed number of queries.
+    """
+    dates = [start + datetime.timedelta(days=offset) for offset in range(days)]
+    keys = {(doctor_id, date): cache_key(doctor_id, date) for doctor_id in doctor_ids for date in dates}
+    found = cache.get_many(keys.values())
+    result = {pair: found[key] for pair, key in keys.items() if key in found}
+    missing = [pair for pair in keys if pair not in result]
+    if missing:
+        built = build(
+            sorted({doctor_id for doctor_id, _ in missing}),
+            min(date for _, date in missing), max(date for _, date in missing),
+        )
+        built = {pair: built[pair] for pair in missing}
+        cache.set_many({keys[pair]: day for pair, day in built.items()}, _timeout())
+        result.update(built)
+    return result
+
+
+def get_days(doctor_ids, date):
+    """Cached days for ``doctor_ids`` on one date"""
+    days = get_range(doctor_ids, date)
+    return {doctor_id: days[(doctor_id, date)] for doctor_id in doctor_ids}
+
+
+def _now():
+    return timezone.localtime().replace(tzinfo=None)
+
+
+def _upcoming(day, date, now):
+    """Index of the first free slot not yet started"""
+    if date != now.date():
+        return 0 if date > now.date() else len(day['free'])
+    return bisect.bisect_left(day['free'], _minutes(now))
+
+
+def _describe(day, date, start):
+    end, room = day['slots'][start]
+    return {'date': date.isoformat(), 'time': _format(start), 'end': _format(end), 'room_number': room}
+
+
+def free_slots(doctor_id, date, now=None):
+    """Free slots on ``date`` that have not started yet"""
+    now = now or _now()
+    day = get_days([doctor_id], date)[doctor_id]
+    return [_describe(day, date, start) for start in day['free'][_upcoming(day, date, now):]]
+
+
+def slots_left(doctor_id, date=None, now=None):
+    """Number of free slots on ``date`` (default today) that have not started yet"""
+    now = now or _now()
+    date = date or now.date()
+    day = get_days([doctor_id], date)[doctor_id]
+    return len(day['free']) - _upcoming(day, date, now)
+
+
+def next_free_slots(doctor_ids, now=None, days=roster.LOOKAHEAD_DAYS):
+    """``{doctor_id: first free slot from now on within days days, or None}``"""
+    now = now or _now()
+    found = get_range(doctor_ids, now.date(), days)
+    slots = {}
+    for doctor_id in doctor_ids:
+        slots[doctor_id] = None
+        for offset in range(days):
+            date = now.date() + datetime.timedelta(days=offset)
+            day = found[(doctor_id, date)]
+            index = _upcoming(day, date, now)
+            if index < len(day['free']):
+                slots[doctor_id] = _describe(day, date, day['free'][index])
+                break
+    return slots
+
+
+def next_free_slot(doctor_id, now=None, days=roster.LOOKAHEAD_DAYS):
+    """First free slot from now on within ``days`` days, or None"""
+    return next_free_slots([doctor_id], now, days)[doctor_id]
+
+
+def summary(doctor_ids, date=None, now=None):
+    """Slot totals over several doctors for one day (reception dashboard)"""
+    now = now or _now()
+    date = date or now.date()
+    totals = {'total': 0, 'taken': 0, 'left': 0}
+    for day in get_days(doctor_ids, date).values():
+        totals['total'] += len(day['slots'])
+        totals['taken'] += len(day['taken'])
+        totals['left'] += len(day['free']) - _upcoming(day, date, now)
+    return totals
+
+
+def is_free(doctor_id, date, time):
+    """Whether the slot starting at ``time`` is free (True on days without slots)"""
+    day = get_days([doctor_id], date)[doctor_id]
+    if not day['slots']:
+        return True
+    minutes = _minutes(time)
+    index = bisect.bisect_left(day['free'], minutes)
+    return index < len(day['free']) and day['free'][index] == minutes
+
+
+def lock_key(doctor_id, date):
+    return f'availability_lock:{doctor_id}:{date.isoformat()}'
+
+
+def apply(appointment, deleted=False):
+    """Take or release the appointment's slot in the cached day, if cached.
+
+    The update holds the day's lock in the cache, so workers sharing it do
+    not overwrite each other's changes; without the lock the day is dropped
+    and rebuilt on its next read.
+    """
+    key = cache_key(appointment.doctor_id, appointment.appointment_date)
+    occupies = not deleted and appointment.status not in roster.FREED_STATUSES
+    with queue_state.cache_lock(lock_key(appointment.doctor_id, appointment.appointment_date)) as acquired:
+        if not acquired:
+            cache.delete(key)
+            return
+        day = cache.get(key)
+        if day is None:
+            return
+        if occupies and appointment.id not in day['taken']:
+            _take(day, appointment.id, appointment.appointment_time)
+        elif not occupies and appointment.id in day['taken']:
+            _release(day, appointment.id)
+        else:
+            return
+        cache.set(key, day, _timeout())
+
+
+def invalidate(doctor_id, date=None, days=roster.LOOKAHEAD_DAYS):
+    """Drop a doctor's cached days (one date, or the next ``days`` days)"""
+    if date is not None:
+        cache.delete(cache_key(doctor_id, date))
+        return
+    today = timezone.localdate()
+    cache.delete_many([cache_key(doctor_id, today + datetime.timedelta(days=offset)) for offset in range(days)])
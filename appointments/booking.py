@@ -0,0 +1,130 @@
+"""
+Booking serials and capacity
+
+Each doctor/day has a BookingCounter row with the last serial handed out,
+the number of appointments taking up a place and the day's capacity (the
+max_patients of its sessions, see roster.sessions). allocate() takes a place
+with a single conditional UPDATE, so simultaneous bookings always get
+different serials and a full day is rejected without counting appointments.
+
+The row is seeded from the day's appointments the first time it is needed,
+and signals.py keeps it in step when appointments are created with an
+explicit serial, cancelled or deleted, and when schedules change.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from accounts.sqlite import retry_on_locked
+
+from . import roster
+from .models import Appointment, BookingCounter, DoctorAvailability, DoctorSchedule
+
+
+class BookingFull(Exception):
+    """The doctor has no places left that day"""
+
+    def __init__(self, doctor_id, date, capacity):
+        self.doctor_id = doctor_id
+        self.date = date
+        self.capacity = capacity
+        super().__init__(f'Doctor {doctor_id} is fully booked on {date} ({capacity} places)')
+
+
+def capacity(doctor_id, date):
+    """Places on ``date``; None when the doctor has no schedule to go by"""
+    day_sessions = roster.sessions([doctor_id], date, date)[(doctor_id, date)]
+    if day_sessions:
+        return sum(session['max_patients'] for session in day_sessions)
+    scheduled = (
+        DoctorSchedule.objects.filter(doctor_id=doctor_id, is_active=True).exists()
+        or DoctorAvailability.objects.filter(doctor_id=doctor_id, date=date).exists()
+    )
+    # A scheduled doctor with no session that day is not seeing patients
+    return 0 if scheduled else None
+
+
+def _seed(doctor_id, date):
+    """Counter values for a doctor/day from the appointments already booked"""
+    appointments = Appointment.objects.filter(doctor_id=doctor_id, appointment_date=date)
+    return {
+        'last_serial': appointments.aggregate(Max('serial_number'))['serial_number__max'] or 0,
+        'booked': appointments.exclude(status__in=roster.FREED_STATUSES).count(),
+        'capacity': capacity(doctor_id, date),
+    }
+
+
+def allocate(doctor_id, date, enforce_capacity=True):
+    """Take a place on ``date`` and return its serial number.
+
+    Raises BookingFull when ``enforce_capacity`` and the day is full. Call it
+    in the transaction that saves the appointment, so a rollback gives the
+    place back.
+    """
+    counters = BookingCounter.objects.filter(doctor_id=doctor_id, date=date)
+    has_room = Q(capacity__isnull=True) | Q(booked__lt=F('capacity')) if enforce_capacity else Q()
+    with transaction.atomic():
+        while True:
+            if counters.filter(has_room).update(last_serial=F('last_serial') + 1, booked=F('booked') + 1):
+                return counters.values_list('last_serial', flat=True).get()
+            # Only a full day leaves an existing row untouched
+            places = counters.values_list('capacity', flat=True).first()
+            if places is not None:
+                raise BookingFull(doctor_id, date, places)
+            try:
+                with transaction.atomic():
+                    BookingCounter.objects.create(doctor_id=doctor_id, date=date, **_seed(doctor_id, date))
+            except IntegrityError:
+                # Another booking created the row first
+                pass
+
+
+@retry_on_locked
+def book(doctor, date, enforce_capacity=True, **fields):
+    """Create an appointment with the next serial on ``date``.
+
+    Raises BookingFull when the day is full (unless ``enforce_capacity`` is
+    False, for walk-ins and emergencies at the desk).
+    """
+    with transaction.atomic():
+        appointment = Appointment(
+            doctor=doctor,
+            appointment_date=date,
+            serial_number=allocate(doctor.pk, date, enforce_capacity),
+            **fields
+        )
+        appointment._counted = True
+        appointment.save()
+    return appointment
+
+
+def record(appointment, previous_status=None, created=False, deleted=False):
+    """Adjust the counter for an appointment saved or deleted outside allocate()"""
+    counters = BookingCounter.objects.filter(doctor_id=appointment.doctor_id, date=appointment.appointment_date)
+    takes_place = appointment.status not in roster.FREED_STATUSES
+    if created:
+        if getattr(appointment, '_counted', False):
+            return
+        counters.update(
+            last_serial=Greatest(F('last_serial'), Value(appointment.serial_number)),
+            booked=F('booked') + int(takes_place),
+        )
+        return
+    if deleted:
+        took_place, takes_place = takes_place, False
+    else:
+        took_place = previous_status not in roster.FREED_STATUSES
+    if took_place and not takes_place:
+        counters.filter(booked__gt=0).update(booked=F('booked') - 1)
+    elif takes_place and not took_place:
+        counters.update(booked=F('booked') + 1)
+
+
+def refresh_capacity(doctor_id, date=None):
+    """Recompute stored capacities (from today on) after a schedule change"""
+    counters = BookingCounter.objects.filter(doctor_id=doctor_id, date__gte=timezone.localdate())
+    if date is not None:
+        counters = counters.filter(date=date)
+    for counter_date in counters.values_list('date', flat=True):
+        counters.filter(date=counter_date).update(capacity=capacity(doctor_id, counter_date))
@@ -0,0 +1,110 @@
+"""
+Queue broadcast pipeline
+
+Appointment changes are published after commit by enqueueing channel
+messages here. A per-process worker thread collects everything enqueued
+within QUEUE_BROADCAST_WINDOW seconds and sends one ``queue_batch`` message
+per affected group, so a burst of changes (e.g. a receptionist booking a
+stack of walk-ins) costs one group_send per screen group instead of one per
+change, and the request thread never waits on the channel layer. The work
+that produces the messages (queue patches, wait estimates, worklist
+snapshots) is submitted to the same thread, so the request does not wait
+for that either.
+"""
+import logging
+import queue
+import time
+from collections import OrderedDict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster(BackgroundWorker):
+    """Coalesces channel messages and sends them from a background thread"""
+
+    name = 'queue-broadcast'
+
+    @property
+    def window(self):
+        return getattr(settings, 'QUEUE_BROADCAST_WINDOW', 0.05)
+
+    def enqueue(self, group, message):
+        """Queue ``message`` for ``group``; returns immediately"""
+        self.put((group, message))
+
+    def submit(self, task, *args):
+        """Run ``task(*args)`` on the worker thread; returns immediately.
+
+        For the work behind the messages (patches, estimates, snapshots),
+        so the request does not wait for it either; what the task enqueues
+        goes out with the next batch. A caller still inside a transaction
+        runs the task itself: the worker's own connection could not see
+        the rows it has not committed.
+        """
+        if connection.in_atomic_block:
+            task(*args)
+        else:
+            self.put((task, args))
+
+    def _collect(self):
+        """Wait for one message, then gather the rest of the burst"""
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                batches = OrderedDict()
+                for first, second in items:
+                    if callable(first):
+                        self.run_task(first, second)
+                    else:
+                        batches.setdefault(first, []).append(second)
+                if batches:
+                    self.send(batches)
+            except Exception:
+                logger.exception('Could not publish %d queue messages', len(items))
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def run_task(self, task, args):
+        close_old_connections()
+        try:
+            task(*args)
+        except Exception:
+            logger.exception('Queue broadcast task %s failed', getattr(task, '__name__', task))
+        finally:
+            close_old_connections()
+
+    def send(self, batches):
+        """Send one queue_batch per group"""
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+
+        async def send_all():
+            for group, messages in batches.items():
+                await channel_layer.group_send(group, {'type': 'queue_batch', 'events': messages})
+
+        async_to_sync(send_all)()
+
+
+broadcaster = Broadcaster()
@@ -1,13 +1,143 @@
+"""
+WebSocket consumers for queue screens and display monitors
+
+Queue protocol (version 2):
+
+* On connect the server sends either a full ``queue_snapshot`` or, when the
+  client reconnects with ``?since=<seq>`` (or sends ``{"type": "resume",
+  "since": <seq>}``), a ``queue_patches`` message with just the patches it
+  missed. If the server can no longer replay from ``since`` it falls back to
+  a snapshot.
+* Changes afterwards arrive as ``queue_patches`` frames (bursts are
+  coalesced by ``appointments.broadcast``). Each patch carries the queue's
+  new ``seq`` and an ``op`` of ``insert`` (full entry), ``update`` (changed
+  fields only) or ``remove``, keyed by appointment ``id``.
+* Clients drop patches with ``seq`` <= the sequence they already hold and
+  send ``refresh_queue`` to resync if they see a gap.
+* A ``wait_estimates`` frame follows the snapshot (or patches) with the
+  expected wait of every waiting patient in the queue, and again whenever a
+  doctor's queue changes. Frames with a ``doctor_id`` replace that doctor's
+  estimates only. Each estimate has ``expected_at`` so screens can count
+  down between frames.
+* ``patient_called`` frames on the display monitors carry ``audio``: URLs
+  of the pre-rendered announcement clips, in the order to play them (see
+  appointments.announcements). It is empty when none are ready yet.
+"""
 import json
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.utils import timezone
 
-class QueueConsumer(AsyncWebsocketConsumer):
+PROTOCOL_VERSION = 2
+
+
+class QueueStateMixin:
+    """Snapshot/resume handling shared by the queue consumers"""
+    
+    queue_id = 'all'
+    
+    @staticmethod
+    def sequence(value):
+        """A client's ``since`` as an int; None (a snapshot is sent) when it is not one"""
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    
+    def requested_since(self):
+        """Sequence the client asked to resume from (``?since=N``), if any"""
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        return self.sequence(query.get('since', [None])[0])
+    
+    @database_sync_to_async
+    def get_queue_state(self, since=None):
+        from appointments import queue_state
+        
+        if since is not None:
+            patches = queue_state.patches_since(self.queue_id, since)
+            if patches is not None:
+                return {'patches': patches}
+        state = queue_state.get_state(self.queue_id)
+        return {'seq': state['seq'], 'queue': queue_state.ordered(state)}
+    
+    @database_sync_to_async
+    def get_wait_estimates(self):
+        from appointments import waittimes
+        
+        return waittimes.queue_estimates(self.queue_id)
+    
+    async def send_queue_state(self, since=None):
+        """Send the patches missed since ``since``, or a full snapshot, then the wait estimates"""
+        state = await self.get_queue_state(since)
+        if 'patches' in state:
+            await self.send(text_data=json.dumps({
+                'type': 'queue_patches',
+                'protocol': PROTOCOL_VERSION,
+                'queue': str(self.queue_id),
+                'since': since,
+                'seq': state['patches'][-1]['seq'] if state['patches'] else since,
+                'patches': state['patches'],
+            }))
+        else:
+            await self.send(text_data=json.dumps({
+                'type': 'queue_snapshot',
+                'protocol': PROTOCOL_VERSION,
+                'queue': str(self.queue_id),
+                'seq': state['seq'],
+                'entries': state['queue'],
+            }))
+        await self.send(text_data=json.dumps({
+            'type': 'wait_estimates',
+            'queue': str(self.queue_id),
+            'doctor_id': None,
+            'estimates': await self.get_wait_estimates(),
+        }))
+    
+    async def queue_patch(self, event):
+        """Forward one queue patch from the group"""
+        message = {key: value for key, value in event.items() if key != 'type'}
+        await self.send(text_data=json.dumps({'type': 'queue_patch', **message}))
+    
+    async def wait_estimates(self, event):
+        """Forward a doctor's refreshed wait estimates"""
+        await self.send(text_data=json.dumps({
+            'type': 'wait_estimates',
+            'queue': str(self.queue_id),
+            'doctor_id': event['doctor_id'],
+            'estimates': event['estimates'],
+        }))
+    
+    async def queue_batch(self, event):
+        """Receive a burst of events coalesced by the broadcast pipeline.
+        
+        Patches go out as one queue_patches frame; anything else (e.g.
+        patient_called) is handled as if it had been sent on its own.
+        """
+        patches = [message for message in event['events'] if message['type'] == 'queue_patch']
+        if patches:
+            await self.send(text_data=json.dumps({
+                'type': 'queue_patches',
+                'protocol': PROTOCOL_VERSION,
+                'queue': patches[0]['queue'],
+                'since': patches[0]['seq'] - 1,
+                'seq': patches[-1]['seq'],
+                'patches': [
+                    {key: value for key, value in patch.items() if key not in ('type', 'queue')}
+                    for patch in patches
+                ],
+            }))
+        for message in event['events']:
+            if message['type'] != 'queue_patch':
+                await self.dispatch(message)
+
+
+class QueueConsumer(QueueStateMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for real-time queue updates"""
     
     async def connect(self):
         self.doctor_id = self.scope['url_route']['kwargs'].get('doctor_id', 'all')
+        self.queue_id = int(self.doctor_id) if self.doctor_id.isdigit() else 'all'
         self.room_group_name = f'queue_{self.doctor_id}'
         
         # Join room group
@@ -18,12 +148,8 @@ class QueueConsumer(AsyncWebsocketConsumer):
         
         await self.accept()
         
-        # Send current queue status
-        queue_data = await self.get_queue_data()
-        await self.send(text_data=json.dumps({
-            'type': 'queue_update',
-            'queue': queue_data
-        }))
+        # Send current queue status (or what was missed since the last seq)
+        await self.send_queue_state(self.requested_since())
     
     async def disconnect(self, close_code):
         # Leave room group
@@ -43,12 +169,11 @@ class QueueConsumer(AsyncWebsocketConsumer):
             await self.call_next_patient(appointment_id)
         
         elif message_type == 'refresh_queue':
-            # Refresh queue data
-            queue_data = await self.get_queue_data()
-            await self.send(text_data=json.dumps({
-                'type': 'queue_update',
-                'queue': queue_data
-            }))
+            # Full resync
+            await self.send_queue_state()
+        
+        elif message_type == 'resume':
+            await self.send_queue_state(self.sequence(data.get('since')))
     
     async def queue_update(self, event):
         """Receive queue update from room group"""
@@ -66,51 +191,17 @@ class QueueConsumer(AsyncWebsocketConsumer):
             'room_number': event['room_number']
         }))
     
-    @database_sync_to_async
-    def get_queue_data(self):
-        """Get current queue data from database"""
-        from appointments.models import Appointment
-        from django.db.models import Q
-        
-        today = timezone.now().date()
-        
-        # Build query
-        query = Q(appointment_date=today) & (
-            Q(status='WAITING') | Q(status='CALLED') | Q(status='IN_PROGRESS')
-        )
-        
-        if self.doctor_id != 'all':
-            query &= Q(doctor_id=self.doctor_id)
-        
-        appointments = Appointment.objects.filter(query).select_related(
-            'patient', 'doctor'
-        ).order_by('serial_number')
-        
-        queue_list = []
-        for apt in appointments:
-            queue_list.append({
-                'id': apt.id,
-                'appointment_number': apt.appointment_number,
-                'serial_number': apt.serial_number,
-                'patient_name': apt.patient.get_full_name(),
-                'patient_id': apt.patient.patient_id,
-                'doctor_name': apt.doctor.get_full_name(),
-                'status': apt.status,
-                'check_in_time': apt.check_in_time.isoformat() if apt.check_in_time else None,
-                'called_time': apt.called_time.isoformat() if apt.called_time else None,
-                'room_number': apt.room_number,
-            })
-        
-        return queue_list
-    
     @database_sync_to_async
     def call_next_patient(self, appointment_id):
         """Call next patient and broadcast"""
         from appointments.models import Appointment
+        from appointments.transitions import InvalidTransition
         
         try:
             appointment = Appointment.objects.select_related('patient', 'doctor').get(id=appointment_id)
-            appointment.call_next()
+            if not appointment.call_next():
+                # Someone else called or moved this patient first
+                return None
             
             # Broadcast to all clients in this room
             return {
@@ -120,11 +211,11 @@ class QueueConsumer(AsyncWebsocketConsumer):
                 'patient_name': appointment.patient.get_full_name(),
                 'room_number': appointment.room_number or 'Consultation Room',
             }
-        except Appointment.DoesNotExist:
+        except (Appointment.DoesNotExist, InvalidTransition):
             return None
 
 
-class DisplayMonitorConsumer(AsyncWebsocketConsumer):
+class DisplayMonitorConsumer(QueueStateMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for display monitors showing current patient"""
     
     async def connect(self):
@@ -137,6 +228,9 @@ class DisplayMonitorConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        
+        # Send current queue across all doctors
+        await self.send_queue_state(self.requested_since())
     
     async def disconnect(self, close_code):
         # Leave room group
@@ -145,6 +239,13 @@ class DisplayMonitorConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
     
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        if data.get('type') == 'resume':
+            await self.send_queue_state(self.sequence(data.get('since')))
+        elif data.get('type') == 'refresh_queue':
+            await self.send_queue_state()
+    
     async def patient_called(self, event):
         """Receive patient called event and display on monitor"""
         await self.send(text_data=json.dumps({
@@ -153,6 +254,7 @@ class DisplayMonitorConsumer(AsyncWebsocketConsumer):
             'queue_number': event.get('queue_number', ''),
             'doctor_name': event.get('doctor_name', ''),
             'room_number': event.get('room_number', 'N/A'),
+            'audio': event.get('audio', []),
             'message': f"Patient {event.get('patient_name', '')} - Queue #{event.get('queue_number', '')}, please proceed to Room {event.get('room_number', 'N/A')}"
         }))
     
@@ -1,5 +1,7 @@
 from django import forms
 from .models import Appointment, Prescription, Medicine, DoctorSchedule, DoctorAvailability
+from . import booking
+from patients import dedup
 from patients.models import Patient
 from accounts.models import User
 from django.utils import timezone
@@ -135,6 +137,18 @@ class QuickAppointmentForm(forms.Form):
         
         # Set minimum date to today
         self.fields['appointment_date'].widget.attrs['min'] = date.today().isoformat()
+        self.fields['appointment_date'].initial = timezone.localdate()
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        doctor = cleaned_data.get('doctor')
+        appointment_date = cleaned_data.get('appointment_date')
+        appointment_time = cleaned_data.get('appointment_time')
+        if doctor and appointment_date and appointment_time:
+            from . import availability
+            if not availability.is_free(doctor.pk, appointment_date, appointment_time):
+                self.add_error('appointment_time', 'This time slot is no longer available')
+        return cleaned_data
     
     def save(self, created_by=None):
         """Create or get patient and create appointment"""
@@ -157,12 +171,8 @@ class QuickAppointmentForm(forms.Form):
         year_of_birth = today.year - age
         date_of_birth = date(year_of_birth, 1, 1)  # Use Jan 1st as default
         
-        # Check if patient exists by phone AND name (both must match)
-        patient = Patient.objects.filter(
-            phone=phone,
-            first_name__iexact=first_name,
-            last_name__iexact=last_name
-        ).first()
+        # Existing patient with this phone (in any format) and a similar name
+        patient = dedup.existing(first_name, last_name, phone, gender=gender)
         
         if not patient:
             # Create new patient with minimal info
@@ -181,14 +191,15 @@ class QuickAppointmentForm(forms.Form):
                 registered_by=created_by
             )
         
-        # Create appointment for the selected date/time
-        appointment = Appointment.objects.create(
+        # Create appointment for the selected date/time; raises
+        # booking.BookingFull when the doctor has no places left that day
+        appointment = booking.book(
+            doctor,
+            appointment_date,
             patient=patient,
-            doctor=doctor,
-            appointment_date=appointment_date,
             appointment_time=appointment_time,
             reason=reason,
-            status='WAITING',
+            status='waiting',
             created_by=created_by
         )
         
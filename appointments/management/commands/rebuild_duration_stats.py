@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from appointments import waittimes
+
+
+class Command(BaseCommand):
+    help = 'Recompute the consultation and waiting time statistics from completed appointments'
+
+    def handle(self, *args, **options):
+        written = waittimes.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} duration statistics rows'))
@@ -0,0 +1,34 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from appointments import announcements
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the display monitor announcements for every serial expected '
+        'on a day ahead of time (appointments/announcements.py). Clips already '
+        'on disk are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='First day (YYYY-MM-DD, default today)')
+        parser.add_argument('--days', type=int, default=1, help='Number of days from --date')
+
+    def handle(self, *args, **options):
+        start = timezone.localdate()
+        if options['date']:
+            start = parse_date(options['date'])
+            if start is None:
+                raise CommandError(f"Invalid date: {options['date']}")
+
+        for offset in range(options['days']):
+            date = start + datetime.timedelta(days=offset)
+            ready, failed = announcements.warm(date)
+            self.stdout.write(f'{date}: {ready} clips ready, {failed} failed')
+            if failed and not ready:
+                raise CommandError('No announcement could be rendered; see the log')
+        self.stdout.write(self.style.SUCCESS('Announcements warmed'))
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+# Statuses written by older booking code, mapped to Appointment.STATUS_CHOICES
+LEGACY_STATUSES = {
+    'WAITING': 'waiting',
+    'CALLED': 'called',
+    'IN_PROGRESS': 'in_consultation',
+    'IN_CONSULTATION': 'in_consultation',
+    'COMPLETED': 'completed',
+    'CANCELLED': 'cancelled',
+    'NO_SHOW': 'no_show',
+}
+
+
+def normalize_statuses(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    BookingCounter = apps.get_model('appointments', 'BookingCounter')
+    DailyRollup = apps.get_model('accounts', 'DailyRollup')
+
+    for legacy, status in LEGACY_STATUSES.items():
+        Appointment.objects.filter(status=legacy).update(status=status)
+
+    # Dashboard rollups count appointments per status: fold the legacy rows in
+    for row in DailyRollup.objects.filter(metric='appointments', source__in=list(LEGACY_STATUSES)):
+        target, _ = DailyRollup.objects.get_or_create(
+            metric=row.metric, date=row.date, source=LEGACY_STATUSES[row.source],
+            department_id=row.department_id, doctor_id=row.doctor_id,
+        )
+        target.count += row.count
+        target.total += row.total
+        target.save()
+        row.delete()
+
+    # Places taken depend on the status; counters are reseeded on next use
+    BookingCounter.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_dailyrollup'),
+        ('appointments', '0006_alter_appointment_status_bookingcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_statuses, migrations.RunPython.noop),
+    ]
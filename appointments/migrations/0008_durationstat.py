@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_normalize_appointment_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DurationStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('consultation', 'Consultation'), ('wait', 'Waiting')], max_length=20)),
+                ('weekday', models.PositiveSmallIntegerField(help_text='0 = Monday')),
+                ('hour', models.PositiveSmallIntegerField(help_text='Local hour the wait or consultation started')),
+                ('bucket', models.PositiveSmallIntegerField(help_text='Index into waittimes.BUCKETS')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.PositiveBigIntegerField(default=0)),
+                ('doctor', models.ForeignKey(limit_choices_to={'role': 'DOCTOR'}, on_delete=django.db.models.deletion.CASCADE, related_name='duration_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('doctor', 'metric', 'weekday', 'hour', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_durationstat'),
+        ('patients', '0002_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['-appointment_date', 'serial_number', 'id'], name='appointment_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', '-appointment_date', 'serial_number', 'id'], name='appointment_doctor_list_idx'),
+        ),
+    ]
@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from accounts.sequences import next_number
+from accounts.sqlite import retry_on_locked
 from patients.models import Patient
 
 class Appointment(models.Model):
@@ -14,6 +16,9 @@ class Appointment(models.Model):
         ('no_show', 'No Show'),
     ]
     
+    # Keyset order of the appointment list (see accounts.pagination)
+    LIST_ORDERING = ('-appointment_date', 'serial_number', 'id')
+    
     # Appointment details
     appointment_number = models.CharField(max_length=20, unique=True, editable=False)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointments')
@@ -72,59 +77,53 @@ class Appointment(models.Model):
         indexes = [
             models.Index(fields=['appointment_date', 'doctor', 'status']),
             models.Index(fields=['appointment_number']),
+            # Keyset pages of the appointment list, unfiltered and by doctor
+            models.Index(fields=['-appointment_date', 'serial_number', 'id'], name='appointment_list_idx'),
+            models.Index(fields=['doctor', '-appointment_date', 'serial_number', 'id'], name='appointment_doctor_list_idx'),
         ]
     
     def __str__(self):
         return f"{self.appointment_number} - {self.patient.get_full_name()} (Serial: {self.serial_number})"
     
+    @retry_on_locked
     def save(self, *args, **kwargs):
         if not self.appointment_number:
             # Generate appointment number: APT + date + sequential
             from django.utils import timezone
             date_str = self.appointment_date.strftime('%Y%m%d')
-            last_apt = Appointment.objects.filter(
-                appointment_number__startswith=f'APT{date_str}'
-            ).order_by('appointment_number').last()
-            
-            if last_apt:
-                last_number = int(last_apt.appointment_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.appointment_number = f'APT{date_str}{new_number:04d}'
+            self.appointment_number = next_number('APT', date_str, Appointment, 'appointment_number')
         
-        # Auto-assign serial number if not set
+        # Auto-assign serial number if not set (no capacity check: desk bookings)
         if not self.serial_number:
-            last_serial = Appointment.objects.filter(
-                doctor=self.doctor,
-                appointment_date=self.appointment_date
-            ).aggregate(models.Max('serial_number'))['serial_number__max']
-            
-            self.serial_number = (last_serial or 0) + 1
+            from .booking import allocate
+            try:
+                with transaction.atomic():
+                    self.serial_number = allocate(self.doctor_id, self.appointment_date, enforce_capacity=False)
+                    self._counted = True
+                    super().save(*args, **kwargs)
+            except Exception:
+                # The serial was rolled back with the insert
+                self.serial_number = None
+                self._counted = False
+                raise
+            return
         
         super().save(*args, **kwargs)
     
     def call_next(self):
-        """Mark this appointment as called"""
-        from django.utils import timezone
-        self.status = 'called'
-        self.called_time = timezone.now()
-        self.save()
+        """Mark this appointment as called; False if its status changed meanwhile"""
+        from .transitions import CALLED, transition
+        return transition(self, CALLED)
     
     def start_consultation(self):
-        """Start the consultation"""
-        from django.utils import timezone
-        self.status = 'in_consultation'
-        self.started_time = timezone.now()
-        self.save()
+        """Start the consultation; False if its status changed meanwhile"""
+        from .transitions import IN_CONSULTATION, transition
+        return transition(self, IN_CONSULTATION)
     
     def complete(self):
-        """Complete the appointment"""
-        from django.utils import timezone
-        self.status = 'completed'
-        self.completed_time = timezone.now()
-        self.save()
+        """Complete the appointment; False if its status changed meanwhile"""
+        from .transitions import COMPLETED, transition
+        return transition(self, COMPLETED)
 
 
 class Prescription(models.Model):
@@ -171,17 +170,7 @@ class Prescription(models.Model):
         if not self.prescription_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_rx = Prescription.objects.filter(
-                prescription_number__startswith=f'RX{date_str}'
-            ).order_by('prescription_number').last()
-            
-            if last_rx:
-                last_number = int(last_rx.prescription_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.prescription_number = f'RX{date_str}{new_number:04d}'
+            self.prescription_number = next_number('RX', date_str, Prescription, 'prescription_number')
         
         super().save(*args, **kwargs)
 
@@ -264,3 +253,52 @@ class DoctorAvailability(models.Model):
     def __str__(self):
         status = "Available" if self.is_available else "Unavailable"
         return f"Dr. {self.doctor.get_full_name()} - {self.date} ({status})"
+
+
+class BookingCounter(models.Model):
+    """Serial and capacity counter per doctor and day (see appointments.booking)"""
+    
+    doctor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='booking_counters',
+        limit_choices_to={'role': 'DOCTOR'}
+    )
+    date = models.DateField()
+    last_serial = models.PositiveIntegerField(default=0)
+    booked = models.PositiveIntegerField(default=0, help_text="Appointments taking up a place")
+    capacity = models.PositiveIntegerField(null=True, blank=True, help_text="Empty = no limit")
+    
+    class Meta:
+        unique_together = ['doctor', 'date']
+    
+    def __str__(self):
+        return f"Dr. {self.doctor.get_full_name()} - {self.date} ({self.booked}/{self.capacity or '-'})"
+
+
+class DurationStat(models.Model):
+    """Histogram bucket of consultation or waiting times (see appointments.waittimes)"""
+    
+    METRIC_CHOICES = [
+        ('consultation', 'Consultation'),
+        ('wait', 'Waiting'),
+    ]
+    
+    doctor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='duration_stats',
+        limit_choices_to={'role': 'DOCTOR'}
+    )
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    weekday = models.PositiveSmallIntegerField(help_text="0 = Monday")
+    hour = models.PositiveSmallIntegerField(help_text="Local hour the wait or consultation started")
+    bucket = models.PositiveSmallIntegerField(help_text="Index into waittimes.BUCKETS")
+    count = models.PositiveIntegerField(default=0)
+    total_seconds = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['doctor', 'metric', 'weekday', 'hour', 'bucket']
+    
+    def __str__(self):
+        return f"Dr. {self.doctor.get_full_name()} - {self.metric} day {self.weekday} {self.hour}:00 #{self.bucket} ({self.count})"
@@ -0,0 +1,264 @@
+"""
+Live queue state
+
+Keeps a per-doctor, per-day snapshot of the active queue in the cache so the
+WebSocket consumers can answer connects and refreshes without touching the
+database. Appointment saves patch the snapshot in place (see signals.py) and
+produce compact patches describing what changed.
+
+Every queue (one per doctor plus 'all') has a monotonically increasing
+sequence number. Each patch carries the sequence it brings the queue to, and
+the last LOG_SIZE patches are kept with the snapshot so a reconnecting client
+can resume from the sequence it last saw instead of pulling the full queue.
+
+Point CACHES at Redis when running more than one process, otherwise each
+process keeps its own copy. Updates to a queue's snapshot take a lock in the
+cache (an ``add`` of the queue's lock key), so workers sharing Redis do not
+overwrite each other's changes; a snapshot whose sequence is behind the
+queue's counter all the same (an update lost to a lock timeout) is rebuilt
+on its next read.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+ACTIVE_STATUSES = ('waiting', 'called', 'in_consultation')
+
+# Action shown on screens for each status an appointment moves into
+STATUS_ACTIONS = {
+    'waiting': 'added',
+    'called': 'called',
+    'in_consultation': 'started',
+    'completed': 'completed',
+}
+
+STATE_TIMEOUT = 60 * 60 * 24
+LOG_SIZE = 200
+
+
+def state_key(queue, date):
+    return f'queue_state:{queue}:{date.isoformat()}'
+
+
+def seq_key(queue, date):
+    return f'queue_seq:{queue}:{date.isoformat()}'
+
+
+def lock_timeout():
+    # Seconds a queue's update lock is held at most (it expires after a crash)
+    return getattr(settings, 'QUEUE_LOCK_TIMEOUT', 5)
+
+
+def lock_key(queue, date):
+    return f'queue_lock:{queue}:{date.isoformat()}'
+
+
+@contextmanager
+def cache_lock(key, timeout=None):
+    """Hold the lock ``key``, shared by every process using the cache.
+
+    Yields whether the lock was taken; after waiting ``timeout`` seconds
+    (default QUEUE_LOCK_TIMEOUT) the caller goes on without it and must not
+    write what the lock guards.
+    """
+    token = uuid.uuid4().hex
+    timeout = lock_timeout() if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    acquired = cache.add(key, token, timeout)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(0.01)
+        acquired = cache.add(key, token, timeout)
+    try:
+        yield acquired
+    finally:
+        # Only release our own lock, not one taken after ours expired
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def _locked(queue, date):
+    """Hold a queue's update lock (see cache_lock())"""
+    return cache_lock(lock_key(queue, date))
+
+
+def _seq_start():
+    # Counters start at the current time in ms so a counter evicted from the
+    # cache restarts above any sequence a client may still hold.
+    return int(time.time() * 1000)
+
+
+def current_seq(queue, date):
+    key = seq_key(queue, date)
+    cache.add(key, _seq_start(), STATE_TIMEOUT)
+    return cache.get(key)
+
+
+def _next_seq(queue, date):
+    key = seq_key(queue, date)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _seq_start(), STATE_TIMEOUT)
+        return cache.incr(key)
+
+
+def serialize(appointment):
+    """Queue entry for one appointment, as sent to clients"""
+    return {
+        'id': appointment.id,
+        'appointment_number': appointment.appointment_number,
+        'serial_number': appointment.serial_number,
+        'patient_name': appointment.patient.get_full_name(),
+        'patient_id': appointment.patient.patient_id,
+        'doctor_id': appointment.doctor_id,
+        'doctor_name': appointment.doctor.get_full_name(),
+        'status': appointment.status,
+        'check_in_time': appointment.check_in_time.isoformat() if appointment.check_in_time else None,
+        'called_time': appointment.called_time.isoformat() if appointment.called_time else None,
+        'started_time': appointment.started_time.isoformat() if appointment.started_time else None,
+        'room_number': appointment.room_number,
+    }
+
+
+def _load(queue, date):
+    """Build a snapshot from the database"""
+    from .models import Appointment
+
+    seq = current_seq(queue, date)
+    appointments = Appointment.objects.filter(
+        appointment_date=date,
+        status__in=ACTIVE_STATUSES,
+    ).select_related('patient', 'doctor')
+    if queue != 'all':
+        appointments = appointments.filter(doctor_id=queue)
+
+    return {
+        'seq': seq,
+        'entries': {apt.id: serialize(apt) for apt in appointments},
+        'log': [],
+    }
+
+
+def get_state(queue='all', date=None):
+    """Return the cached state for a queue, building it on a miss.
+
+    A cached state behind the queue's sequence missed an update and is
+    rebuilt too.
+    """
+    date = date or timezone.now().date()
+    key = state_key(queue, date)
+    state = cache.get(key)
+    if state is None:
+        state = _load(queue, date)
+        cache.add(key, state, STATE_TIMEOUT)
+    elif state['seq'] != current_seq(queue, date):
+        state = _load(queue, date)
+        cache.set(key, state, STATE_TIMEOUT)
+    return state
+
+
+def ordered(state):
+    return sorted(state['entries'].values(), key=lambda entry: (entry['serial_number'], entry['id']))
+
+
+def snapshot(queue='all', date=None):
+    """Return the active queue for a doctor (or 'all') ordered by serial"""
+    return ordered(get_state(queue, date))
+
+
+def patches_since(queue, since, date=None):
+    """Patches after sequence ``since``, or None if the client must resync.
+
+    A resync is needed when the log no longer reaches back to ``since`` or
+    has a gap (e.g. the cached state was rebuilt or an update was lost).
+    """
+    date = date or timezone.now().date()
+    state = cache.get(state_key(queue, date))
+    if state is None or since > state['seq'] or since < state['seq'] - len(state['log']):
+        return None
+    patches = [patch for patch in state['log'] if patch['seq'] > since]
+    expected = list(range(since + 1, state['seq'] + 1))
+    if [patch['seq'] for patch in patches] != expected or state['seq'] != current_seq(queue, date):
+        return None
+    return patches
+
+
+def _diff(previous, entry):
+    return {field: value for field, value in entry.items() if previous.get(field) != value}
+
+
+def _make_patch(appointment, state, deleted):
+    """Describe the change for one queue, or None if the queue is unaffected"""
+    previous = state['entries'].get(appointment.id) if state is not None else None
+
+    if not deleted and appointment.status in ACTIVE_STATUSES:
+        entry = serialize(appointment)
+        if previous is None:
+            patch = {'op': 'insert', 'entry': entry}
+        else:
+            fields = _diff(previous, entry)
+            if not fields:
+                return None
+            patch = {'op': 'update', 'fields': fields}
+        patch['action'] = STATUS_ACTIONS[appointment.status] if (
+            previous is None or previous['status'] != entry['status']) else 'updated'
+    else:
+        if state is not None and previous is None:
+            return None
+        patch = {
+            'op': 'remove',
+            'action': 'removed' if deleted else STATUS_ACTIONS.get(appointment.status, 'removed'),
+        }
+
+    patch['id'] = appointment.id
+    return patch
+
+
+def apply(appointment, deleted=False):
+    """Update the cached queues after an appointment changed.
+
+    Returns {queue: patch} for the doctor's queue and 'all'. Queues that are
+    not affected (e.g. a cancelled appointment was edited again) are left out.
+
+    Patches are upserts keyed by appointment id, so applying one twice is
+    harmless. When the server did not hold the previous entry, an
+    'insert' is sent with the full entry.
+    """
+    date = appointment.appointment_date
+    patches = {}
+    for queue in (appointment.doctor_id, 'all'):
+        key = state_key(queue, date)
+        with _locked(queue, date) as acquired:
+            state = cache.get(key)
+            patch = _make_patch(appointment, state, deleted)
+            if patch is None:
+                continue
+            patch['seq'] = _next_seq(queue, date)
+            patches[queue] = patch
+
+            if state is None:
+                continue
+            if not acquired or state['seq'] != patch['seq'] - 1:
+                # Someone else may be writing it, or it already missed an
+                # update: drop it to be rebuilt rather than patch it
+                cache.delete(key)
+                continue
+            if patch['op'] == 'remove':
+                state['entries'].pop(appointment.id, None)
+            elif patch['op'] == 'insert':
+                state['entries'][appointment.id] = dict(patch['entry'])
+            else:
+                state['entries'][appointment.id] = {**state['entries'][appointment.id], **patch['fields']}
+            state['seq'] = patch['seq']
+            state['log'] = (state['log'] + [patch])[-LOG_SIZE:]
+            cache.set(key, state, STATE_TIMEOUT)
+    return patches
+
+
+def invalidate(doctor_id, date):
+    """Drop cached snapshots so the next read rebuilds them"""
+    cache.delete_many([state_key(doctor_id, date), state_key('all', date)])
@@ -0,0 +1,139 @@
+"""
+Doctor roster
+
+One entry per doctor with schedule and appointment counts, today's queue
+length and the next bookable slot (from appointments.availability, the
+booking page's engine), built in a fixed number of queries (doctors with
+counts, then weekly schedules, date overrides and bookings for the days
+not cached) however many doctors there are. The roster is cached per day
+and dropped whenever a doctor, schedule, availability or appointment is
+written (see appointments.signals).
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Appointment, DoctorAvailability, DoctorSchedule
+from .queue_state import ACTIVE_STATUSES
+
+# Appointments that do not take up a slot
+FREED_STATUSES = ('cancelled', 'no_show')
+
+# Days ahead searched for the next available slot
+LOOKAHEAD_DAYS = 7
+
+DEFAULT_MAX_PATIENTS = 20
+DEFAULT_DURATION = 15
+
+
+def cache_key(date):
+    return f'doctor_roster:{date.isoformat()}'
+
+
+def _count(queryset):
+    """Correlated COUNT(*) of ``queryset`` per doctor, 0 when empty"""
+    counts = queryset.filter(doctor=OuterRef('pk')).order_by().values('doctor').annotate(
+        total=Count('pk')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def sessions(doctor_ids, start, end):
+    """``{(doctor_id, date): [session, ...]}`` from weekly schedules and overrides"""
+    weekly = {}
+    for schedule in DoctorSchedule.objects.filter(doctor_id__in=doctor_ids, is_active=True).order_by('start_time'):
+        weekly.setdefault((schedule.doctor_id, schedule.day_of_week), []).append({
+            'start': schedule.start_time,
+            'end': schedule.end_time,
+            'max_patients': schedule.max_patients,
+            'duration': schedule.consultation_duration,
+            'room_number': schedule.room_number,
+        })
+
+    overrides = {}
+    for availability in DoctorAvailability.objects.filter(
+        doctor_id__in=doctor_ids, date__range=[start, end]
+    ).order_by('start_time'):
+        overrides.setdefault((availability.doctor_id, availability.date), []).append(availability)
+
+    by_day = {}
+    for doctor_id in doctor_ids:
+        day = start
+        while day <= end:
+            rows = overrides.get((doctor_id, day))
+            if rows is None:
+                by_day[(doctor_id, day)] = weekly.get((doctor_id, day.strftime('%A').upper()), [])
+            elif any(not row.is_available for row in rows):
+                by_day[(doctor_id, day)] = []
+            else:
+                # Date-specific hours replace the weekly schedule
+                by_day[(doctor_id, day)] = [
+                    {
+                        'start': row.start_time,
+                        'end': row.end_time,
+                        'max_patients': row.max_patients or DEFAULT_MAX_PATIENTS,
+                        'duration': DEFAULT_DURATION,
+                        'room_number': row.room_number,
+                    }
+                    for row in rows if row.start_time and row.end_time
+                ]
+            day += datetime.timedelta(days=1)
+    return by_day
+
+
+def build(date=None):
+    """Compute the roster for ``date`` (default today) from the database"""
+    from . import availability
+
+    now = timezone.localtime().replace(tzinfo=None)
+    date = date or now.date()
+    if date != now.date():
+        now = datetime.datetime.combine(date, datetime.time.min)
+
+    doctors = list(
+        get_user_model().objects.filter(role='DOCTOR').annotate(
+            schedule_count=_count(DoctorSchedule.objects.all()),
+            appointment_count=_count(Appointment.objects.all()),
+            queue_length=_count(Appointment.objects.filter(
+                appointment_date=date, status__in=ACTIVE_STATUSES
+            )),
+        ).order_by('username')
+    )
+    # The booking page's engine, so both offer the same next slot
+    next_slots = availability.next_free_slots([doctor.id for doctor in doctors if doctor.is_active], now)
+
+    roster = []
+    for doctor in doctors:
+        roster.append({
+            'id': doctor.id,
+            'username': doctor.username,
+            'name': doctor.get_full_name(),
+            'specialization': doctor.specialization or 'General',
+            'is_active': doctor.is_active,
+            'schedules': doctor.schedule_count,
+            'total_appointments': doctor.appointment_count,
+            'queue_length': doctor.queue_length,
+            'next_slot': next_slots.get(doctor.id),
+        })
+    return roster
+
+
+def get_roster():
+    """Today's roster, from the cache when possible"""
+    date = timezone.localdate()
+    key = cache_key(date)
+    roster = cache.get(key)
+    if roster is None:
+        roster = build(date)
+        cache.set(key, roster, getattr(settings, 'DOCTOR_ROSTER_TIMEOUT', 300))
+    return roster
+
+
+def invalidate(**kwargs):
+    """Drop today's cached roster (usable as a signal receiver)"""
+    cache.delete(cache_key(timezone.localdate()))
@@ -0,0 +1,143 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import announcements, availability, booking, queue_state, roster, waittimes
+from .broadcast import broadcaster
+from .models import Appointment, DoctorAvailability, DoctorSchedule
+
+# Status changes that mean the patient has been called to the room
+CALL_TRANSITIONS = {
+    ('waiting', 'called'),
+    ('waiting', 'in_consultation'),
+}
+
+
+def queue_groups(queue):
+    """Channel groups that follow a queue"""
+    if queue == 'all':
+        return ['queue_all', 'display_monitor']
+    return [f'queue_{queue}']
+
+
+def publish_patches(patches):
+    """Queue patches for the queue screens and display monitors"""
+    for queue, patch in patches.items():
+        message = {'type': 'queue_patch', 'queue': str(queue), **patch}
+        for group in queue_groups(queue):
+            broadcaster.enqueue(group, message)
+
+
+def publish_call(appointment):
+    """Announce a called patient on the display monitors and the doctor's screens"""
+    clips = announcements.appointment_clips(appointment)
+    message = {
+        'type': 'patient_called',
+        'appointment': queue_state.serialize(appointment),
+        'appointment_id': appointment.id,
+        'serial_number': appointment.serial_number,
+        'queue_number': appointment.serial_number,
+        'patient_name': appointment.patient.get_full_name(),
+        'doctor_name': appointment.doctor.get_full_name(),
+        'room_number': appointment.room_number or 'N/A',
+        'audio': announcements.ready(clips),
+    }
+    for group in ('display_monitor', f'queue_{appointment.doctor_id}'):
+        broadcaster.enqueue(group, message)
+    # Clips missing now are rendered for the next call (e.g. a recall)
+    announcements.renderer.enqueue(clips)
+
+
+def publish_estimates(doctor_id):
+    """Send the doctor's refreshed wait estimates to the queue screens and monitors"""
+    message = {
+        'type': 'wait_estimates',
+        'doctor_id': doctor_id,
+        'estimates': waittimes.queue_estimates(doctor_id),
+    }
+    for group in (f'queue_{doctor_id}', 'queue_all', 'display_monitor'):
+        broadcaster.enqueue(group, message)
+
+
+def appointment_changed(appointment, previous_status=None, created=False, deleted=False):
+    """Bring the caches and screens up to date with a committed appointment change.
+
+    Runs on the broadcast worker (see _on_commit()). A saved appointment is
+    read again with its patient and doctor, as committed.
+    """
+    status = appointment.status
+    if not deleted:
+        current = Appointment.objects.select_related('patient', 'doctor').filter(pk=appointment.pk).first()
+        if current is None:
+            # Deleted since: its delete is on its way, take it out now
+            deleted = True
+        else:
+            appointment = current
+    roster.invalidate()
+    availability.apply(appointment, deleted=deleted)
+    patches = queue_state.apply(appointment, deleted=deleted)
+    if patches:
+        publish_patches(patches)
+        if appointment.appointment_date == timezone.now().date():
+            publish_estimates(appointment.doctor_id)
+    if not deleted and (previous_status, status) in CALL_TRANSITIONS:
+        publish_call(appointment)
+    if created and not deleted:
+        # Have the call announcement ready by the time the patient is called
+        announcements.renderer.enqueue(announcements.appointment_clips(appointment))
+
+
+def _on_commit(appointment, previous_status=None, created=False, deleted=False):
+    # The request only queues the work: it runs on the broadcast worker
+    transaction.on_commit(
+        lambda: broadcaster.submit(appointment_changed, appointment, previous_status, created, deleted)
+    )
+
+
+@receiver(post_init, sender=Appointment)
+def remember_status(sender, instance, **kwargs):
+    # Status as loaded, so post_save can tell which transition happened
+    instance._loaded_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, created, **kwargs):
+    previous_status = None if created else instance._loaded_status
+    instance._loaded_status = instance.status
+    booking.record(instance, previous_status, created=created)
+    waittimes.record(instance, previous_status)
+    _on_commit(instance, previous_status, created=created)
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    booking.record(instance, deleted=True)
+    _on_commit(instance, deleted=True)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+@receiver(post_save, sender=DoctorSchedule)
+@receiver(post_delete, sender=DoctorSchedule)
+@receiver(post_save, sender=DoctorAvailability)
+@receiver(post_delete, sender=DoctorAvailability)
+def roster_changed(sender, instance, **kwargs):
+    if sender in (DoctorSchedule, DoctorAvailability) or getattr(instance, 'role', None) == 'DOCTOR':
+        transaction.on_commit(roster.invalidate)
+
+
+@receiver(post_save, sender=DoctorSchedule)
+@receiver(post_delete, sender=DoctorSchedule)
+@receiver(post_save, sender=DoctorAvailability)
+@receiver(post_delete, sender=DoctorAvailability)
+def schedule_changed(sender, instance, **kwargs):
+    date = getattr(instance, 'date', None)
+    booking.refresh_capacity(instance.doctor_id, date)
+    transaction.on_commit(lambda: availability.invalidate(instance.doctor_id, date))
+    # Have the serials the schedule expects announced from cached audio
+    transaction.on_commit(lambda: broadcaster.submit(announcements.warm_schedule, instance.doctor_id, date))
+    if sender is DoctorSchedule:
+        # The scheduled consultation length is the estimate without history
+        transaction.on_commit(lambda: waittimes.invalidate(instance.doctor_id))
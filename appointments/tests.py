@@ -1,3 +1,1106 @@
-from django.test import TestCase
+"""
+Tests for appointment queue services
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import announcements, availability, booking, queue_state, roster, transitions, waittimes
+from .broadcast import broadcaster
+from .forms import QuickAppointmentForm
+from .models import Appointment, BookingCounter, DoctorAvailability, DoctorSchedule, DurationStat
+from accounts.models import DailyRollup
+from patients.models import Patient
+
+User = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+
+
+def create_patient(first_name='Rahim', phone='01700000000'):
+    return Patient.objects.create(
+        first_name=first_name,
+        last_name='Uddin',
+        date_of_birth='1990-01-01',
+        gender='M',
+        phone=phone,
+        address='Bazar Road',
+        city='Naogaon',
+        emergency_contact_name='Karim',
+        emergency_contact_phone='01800000000',
+        emergency_contact_relation='Brother',
+    )
+
+
+# Phrases rendered by fake_engine, in order
+RENDERED = []
+
+
+def fake_engine(text, language, path):
+    RENDERED.append((language, text))
+    with open(path, 'w', encoding='utf-8') as clip:
+        clip.write(text)
+
+
+fake_engine.extension = 'txt'
+
+
+def broken_engine(text, language, path):
+    raise announcements.EngineUnavailable('no voices here')
+
+
+class QueueTestMixin:
+    """Shared doctor/patient fixtures for queue tests"""
+
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.now().date()
+        self.doctor = User.objects.create_user(
+            username='doctor', password='testpass123', role='DOCTOR',
+            first_name='Abul', last_name='Kalam'
+        )
+        self.patient = create_patient()
+
+    def book(self, status='waiting', **kwargs):
+        kwargs.setdefault('patient', self.patient)
+        kwargs.setdefault('doctor', self.doctor)
+        kwargs.setdefault('appointment_date', self.today)
+        return Appointment.objects.create(
+            serial_number=kwargs.pop('serial_number', None),
+            status=status,
+            **kwargs
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class QueueStateTestCase(QueueTestMixin, TestCase):
+    """Test the cached live queue state"""
+
+    def test_snapshot_is_served_from_cache(self):
+        """Only the first read hits the database"""
+        first = self.book()
+        self.book(status='completed')
+
+        with self.assertNumQueries(1):
+            queue = queue_state.snapshot(self.doctor.id)
+        self.assertEqual([entry['id'] for entry in queue], [first.id])
+
+        with self.assertNumQueries(0):
+            queue_state.snapshot(self.doctor.id)
+
+    def test_status_changes_patch_snapshot(self):
+        """Status changes update the cached queue incrementally"""
+        appointment = self.book()
+        queue_state.snapshot(self.doctor.id)
+        queue_state.snapshot('all')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.call_next()
+        with self.assertNumQueries(0):
+            queue = queue_state.snapshot(self.doctor.id)
+            everyone = queue_state.snapshot('all')
+        self.assertEqual(queue[0]['status'], 'called')
+        self.assertEqual(everyone[0]['status'], 'called')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.complete()
+        self.assertEqual(queue_state.snapshot(self.doctor.id), [])
+
+    def test_new_booking_is_added(self):
+        """New appointments appear in an already cached queue"""
+        queue_state.snapshot(self.doctor.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = self.book()
+        self.assertEqual([entry['id'] for entry in queue_state.snapshot(self.doctor.id)], [appointment.id])
+
+    def test_apply_returns_patches(self):
+        """Patches carry only what changed, with a new sequence per queue"""
+        appointment = self.book()
+        state = queue_state.get_state(self.doctor.id)
+
+        appointment.status = 'in_consultation'
+        patches = queue_state.apply(appointment)
+        patch = patches[self.doctor.id]
+        self.assertEqual(patch['op'], 'update')
+        self.assertEqual(patch['action'], 'started')
+        self.assertEqual(patch['fields'], {'status': 'in_consultation'})
+        self.assertEqual(patch['seq'], state['seq'] + 1)
+
+        appointment.status = 'completed'
+        patch = queue_state.apply(appointment)[self.doctor.id]
+        self.assertEqual((patch['op'], patch['action']), ('remove', 'completed'))
+
+        # Already out of the queue: nothing to tell clients
+        self.assertNotIn(self.doctor.id, queue_state.apply(appointment))
+
+    def test_patches_since_replays_missed_changes(self):
+        """A client can resume from the sequence it last saw"""
+        first = self.book()
+        second = self.book(patient=create_patient('Jamal', '01711111111'))
+        seq = queue_state.get_state(self.doctor.id)['seq']
+
+        first.status = 'called'
+        queue_state.apply(first)
+        second.status = 'cancelled'
+        queue_state.apply(second)
+
+        patches = queue_state.patches_since(self.doctor.id, seq)
+        self.assertEqual([patch['seq'] for patch in patches], [seq + 1, seq + 2])
+        self.assertEqual([patch['op'] for patch in patches], ['update', 'remove'])
+        self.assertEqual(queue_state.patches_since(self.doctor.id, seq + 2), [])
+
+    def test_patches_since_requires_resync_when_log_is_gone(self):
+        """Unknown or evicted history falls back to a snapshot"""
+        appointment = self.book()
+        seq = queue_state.get_state(self.doctor.id)['seq']
+        self.assertIsNone(queue_state.patches_since(self.doctor.id, seq - 1))
+        self.assertIsNone(queue_state.patches_since(self.doctor.id, seq + 5))
+
+        queue_state.invalidate(self.doctor.id, self.today)
+        appointment.status = 'called'
+        queue_state.apply(appointment)
+        self.assertIsNone(queue_state.patches_since(self.doctor.id, seq))
+        # Sequence keeps increasing across the rebuild
+        self.assertGreater(queue_state.get_state(self.doctor.id)['seq'], seq)
+
+    def test_state_behind_sequence_is_rebuilt(self):
+        """A snapshot that missed an update is not served again"""
+        appointment = self.book()
+        queue_state.get_state(self.doctor.id)
+        # Another worker moved the queue on without writing the snapshot
+        Appointment.objects.filter(pk=appointment.pk).update(status='called')
+        queue_state._next_seq(self.doctor.id, self.today)
+
+        state = queue_state.get_state(self.doctor.id)
+        self.assertEqual(state['seq'], queue_state.current_seq(self.doctor.id, self.today))
+        self.assertEqual(state['entries'][appointment.id]['status'], 'called')
+
+    def test_update_waits_for_queue_lock(self):
+        """A held lock is not written through; the snapshot is rebuilt instead"""
+        appointment = self.book()
+        queue_state.get_state(self.doctor.id)
+        cache.add(queue_state.lock_key(self.doctor.id, self.today), 'other worker')
+
+        Appointment.objects.filter(pk=appointment.pk).update(status='called')
+        appointment.status = 'called'
+        with self.settings(QUEUE_LOCK_TIMEOUT=0):
+            patches = queue_state.apply(appointment)
+        self.assertIn(self.doctor.id, patches)
+        self.assertIsNone(cache.get(queue_state.state_key(self.doctor.id, self.today)))
+        self.assertEqual(queue_state.snapshot(self.doctor.id)[0]['status'], 'called')
+
+    def listen(self, *groups):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        for group in groups:
+            async_to_sync(channel_layer.group_add)(group, channel)
+        return channel
+
+    def receive(self, channel):
+        broadcaster.flush()
+        return async_to_sync(get_channel_layer().receive)(channel)
+
+    def test_patch_is_published_to_queue_groups(self):
+        """Committed changes are pushed to the doctor's group and the displays"""
+        doctor_channel = self.listen(f'queue_{self.doctor.id}')
+        display_channel = self.listen('display_monitor')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = self.book()
+
+        message = self.receive(doctor_channel)
+        self.assertEqual(message['type'], 'queue_batch')
+        patch = message['events'][0]
+        self.assertEqual(patch['type'], 'queue_patch')
+        self.assertEqual(patch['queue'], str(self.doctor.id))
+        self.assertEqual((patch['op'], patch['action']), ('insert', 'added'))
+        self.assertEqual(patch['entry']['id'], appointment.id)
+
+        message = self.receive(display_channel)
+        self.assertEqual(message['events'][0]['queue'], 'all')
+
+    @override_settings(QUEUE_BROADCAST_WINDOW=0.5)
+    def test_burst_is_sent_as_one_batch(self):
+        """Several changes in one burst cost one group_send per group"""
+        doctor_channel = self.listen(f'queue_{self.doctor.id}')
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(3):
+                self.book(patient=create_patient(f'Walkin{index}', f'0171000000{index}'))
+
+        message = self.receive(doctor_channel)
+        patches = [event for event in message['events'] if event['type'] == 'queue_patch']
+        self.assertEqual([event['op'] for event in patches], ['insert'] * 3)
+        seqs = [event['seq'] for event in patches]
+        self.assertEqual(seqs, list(range(seqs[0], seqs[0] + 3)))
+
+    def test_calling_a_patient_is_announced(self):
+        """Moving out of waiting announces the patient on the display monitors"""
+        appointment = self.book()
+        display_channel = self.listen('display_monitor')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.status = 'in_consultation'
+            appointment.save()
+
+        message = self.receive(display_channel)
+        called = [event for event in message['events'] if event['type'] == 'patient_called']
+        self.assertEqual(len(called), 1)
+        self.assertEqual(called[0]['appointment_id'], appointment.id)
+        self.assertEqual(called[0]['patient_name'], self.patient.get_full_name())
+
+        # Finishing the consultation is not another call
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.status = 'completed'
+            appointment.save()
+        message = self.receive(display_channel)
+        self.assertEqual({event['type'] for event in message['events']}, {'queue_patch', 'wait_estimates'})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class QueueConsumerTestCase(QueueTestMixin, TransactionTestCase):
+    """Test the snapshot/resume handshake"""
+
+    def connect(self, path):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from .routing import websocket_urlpatterns
+
+        async def handshake():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            message = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return message
+
+        return async_to_sync(handshake)()
+
+    def test_connect_sends_snapshot(self):
+        """A fresh client gets the whole queue with its sequence"""
+        appointment = self.book()
+        state = queue_state.get_state(self.doctor.id)
+
+        message = self.connect(f'/ws/queue/{self.doctor.id}/')
+        self.assertEqual(message['type'], 'queue_snapshot')
+        self.assertEqual(message['protocol'], 2)
+        self.assertEqual(message['seq'], state['seq'])
+        self.assertEqual([entry['id'] for entry in message['entries']], [appointment.id])
+
+    def test_reconnect_with_since_gets_patches(self):
+        """A reconnecting client only receives what it missed"""
+        appointment = self.book()
+        seq = queue_state.get_state(self.doctor.id)['seq']
+        appointment.status = 'called'
+        queue_state.apply(appointment)
+
+        message = self.connect(f'/ws/queue/{self.doctor.id}/?since={seq}')
+        self.assertEqual(message['type'], 'queue_patches')
+        self.assertEqual(message['seq'], seq + 1)
+        self.assertEqual(message['patches'][0]['fields'], {'status': 'called'})
+
+    def test_resume_message_coerces_since(self):
+        """A string sequence is read as a number; a bad one gets a snapshot"""
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from .routing import websocket_urlpatterns
+
+        appointment = self.book()
+        seq = queue_state.get_state(self.doctor.id)['seq']
+        appointment.status = 'called'
+        queue_state.apply(appointment)
+
+        async def resume(*values):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/queue/{self.doctor.id}/')
+            await communicator.connect()
+            await communicator.receive_json_from()
+            await communicator.receive_json_from()
+            types = []
+            for since in values:
+                await communicator.send_json_to({'type': 'resume', 'since': since})
+                types.append((await communicator.receive_json_from())['type'])
+                await communicator.receive_json_from()
+            await communicator.disconnect()
+            return types
+
+        self.assertEqual(
+            async_to_sync(resume)(str(seq), 'yesterday', None),
+            ['queue_patches', 'queue_snapshot', 'queue_snapshot'],
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BroadcastWorkerTestCase(QueueTestMixin, TransactionTestCase):
+    """Test the work done after commit off the request thread"""
+
+    def test_changes_are_applied_on_the_worker(self):
+        """The request only queues the update; the worker patches the caches"""
+        queue_state.snapshot(self.doctor.id)
+        threads = []
+        apply = queue_state.apply
+
+        def recording_apply(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return apply(*args, **kwargs)
+
+        queue_state.apply = recording_apply
+        try:
+            appointment = self.book()
+            broadcaster.flush()
+        finally:
+            queue_state.apply = apply
+        self.assertEqual(threads, [broadcaster.name])
+        self.assertEqual([entry['id'] for entry in queue_state.snapshot(self.doctor.id)], [appointment.id])
+
+    def test_task_inside_a_transaction_runs_in_place(self):
+        """The worker could not see uncommitted rows, so the caller runs the task"""
+        from django.db import transaction
+
+        threads = []
+        with transaction.atomic():
+            broadcaster.submit(lambda: threads.append(threading.current_thread().name))
+        broadcaster.submit(lambda: threads.append(threading.current_thread().name))
+        broadcaster.flush()
+        self.assertEqual(threads, [threading.current_thread().name, broadcaster.name])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DoctorRosterTestCase(QueueTestMixin, TestCase):
+    """Test the cached doctor roster"""
+
+    def setUp(self):
+        super().setUp()
+        self.tomorrow = self.today + datetime.timedelta(days=1)
+        DoctorSchedule.objects.create(
+            doctor=self.doctor, day_of_week=self.tomorrow.strftime('%A').upper(),
+            start_time=datetime.time(17, 0), end_time=datetime.time(19, 0),
+            max_patients=2, consultation_duration=20, room_number='201',
+        )
+
+    def entry(self, doctor=None):
+        doctor = doctor or self.doctor
+        return next(entry for entry in roster.build() if entry['id'] == doctor.id)
+
+    def test_counts_and_queue_length(self):
+        """Counts come back per doctor"""
+        self.book()
+        self.book(status='completed', patient=create_patient('Jamal', '01711111111'))
+        entry = self.entry()
+        self.assertEqual(entry['schedules'], 1)
+        self.assertEqual(entry['total_appointments'], 2)
+        self.assertEqual(entry['queue_length'], 1)
+        self.assertEqual(entry['name'], 'Abul Kalam')
+
+    def test_query_count_is_constant(self):
+        """More doctors do not mean more queries"""
+        for index in range(5):
+            User.objects.create_user(username=f'doctor{index}', password='testpass123', role='DOCTOR')
+        with self.assertNumQueries(4):
+            entries = roster.build()
+        self.assertEqual(len(entries), 6)
+
+    def test_next_slot_skips_full_sessions(self):
+        """Bookings fill a session before the next one is offered"""
+        self.assertEqual(
+            self.entry()['next_slot'],
+            {'date': self.tomorrow.isoformat(), 'time': '17:00', 'end': '17:20', 'room_number': '201'}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(appointment_date=self.tomorrow, serial_number=1)
+        self.assertEqual(self.entry()['next_slot']['time'], '17:20')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(appointment_date=self.tomorrow, serial_number=2,
+                      patient=create_patient('Jamal', '01711111111'))
+        # Full; next week's session is beyond the lookahead
+        self.assertIsNone(self.entry()['next_slot'])
+
+    def test_next_slot_agrees_with_booking_page(self):
+        """A booked time is skipped the way availability skips it"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(appointment_date=self.tomorrow, appointment_time=datetime.time(17, 20))
+        self.assertEqual(self.entry()['next_slot'], availability.next_free_slot(self.doctor.id))
+        self.assertEqual(self.entry()['next_slot']['time'], '17:00')
+
+    def test_unavailable_dates_are_skipped(self):
+        """A leave day removes the weekly session"""
+        with self.captureOnCommitCallbacks(execute=True):
+            DoctorAvailability.objects.create(doctor=self.doctor, date=self.tomorrow, is_available=False)
+        self.assertIsNone(self.entry()['next_slot'])
+
+    def test_roster_is_cached_until_a_write(self):
+        """Reads hit the cache; schedule and appointment writes drop it"""
+        roster.get_roster()
+        with self.assertNumQueries(0):
+            roster.get_roster()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DoctorSchedule.objects.update(room_number='202')
+            DoctorSchedule.objects.get().save()
+        self.assertEqual(roster.get_roster()[0]['next_slot']['room_number'], '202')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book()
+        self.assertEqual(roster.get_roster()[0]['queue_length'], 1)
+
+    def test_json_endpoint(self):
+        """The roster is served as JSON to staff"""
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse('appointments:doctor_roster'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['date'], self.today.isoformat())
+        self.assertEqual([entry['id'] for entry in data['doctors']], [self.doctor.id])
+
+
+class BookingFixturesMixin(QueueTestMixin):
+    """A doctor with a two-place session tomorrow"""
+
+    capacity = 2
+
+    def setUp(self):
+        super().setUp()
+        self.tomorrow = self.today + datetime.timedelta(days=1)
+        self.schedule = DoctorSchedule.objects.create(
+            doctor=self.doctor, day_of_week=self.tomorrow.strftime('%A').upper(),
+            start_time=datetime.time(17, 0), end_time=datetime.time(19, 0),
+            max_patients=self.capacity, room_number='201',
+        )
+
+    def counter(self, date=None):
+        return BookingCounter.objects.get(doctor=self.doctor, date=date or self.tomorrow)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BookingTestCase(BookingFixturesMixin, TestCase):
+    """Test serial allocation and capacity checks"""
+
+    def test_serials_continue_after_existing_appointments(self):
+        """The counter is seeded from appointments booked before it existed"""
+        self.book(appointment_date=self.tomorrow, serial_number=5)
+        self.assertFalse(BookingCounter.objects.exists())
+        appointment = booking.book(self.doctor, self.tomorrow, patient=self.patient)
+        self.assertEqual(appointment.serial_number, 6)
+        self.assertEqual(self.counter().booked, 2)
+
+    def test_full_day_is_rejected(self):
+        """Bookings beyond the session's max_patients raise BookingFull"""
+        serials = [booking.book(self.doctor, self.tomorrow, patient=self.patient).serial_number for _ in range(2)]
+        self.assertEqual(serials, [1, 2])
+        with CaptureQueriesContext(connection) as queries:
+            with self.assertRaises(booking.BookingFull):
+                booking.book(self.doctor, self.tomorrow, patient=self.patient)
+        # The conditional UPDATE and a look at the capacity, nothing else
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(Appointment.objects.filter(appointment_date=self.tomorrow).count(), 2)
+
+    def test_cancellation_frees_a_place(self):
+        first = booking.book(self.doctor, self.tomorrow, patient=self.patient)
+        booking.book(self.doctor, self.tomorrow, patient=self.patient)
+        first.status = 'cancelled'
+        first.save()
+        self.assertEqual(booking.book(self.doctor, self.tomorrow, patient=self.patient).serial_number, 3)
+        self.assertEqual(self.counter().booked, 2)
+
+    def test_desk_bookings_skip_the_capacity_check(self):
+        """Appointments saved without a serial still get the next one"""
+        for _ in range(2):
+            booking.book(self.doctor, self.tomorrow, patient=self.patient)
+        self.assertEqual(self.book(appointment_date=self.tomorrow).serial_number, 3)
+        self.assertEqual(self.counter().booked, 3)
+
+    def test_explicit_serials_move_the_counter(self):
+        booking.book(self.doctor, self.tomorrow, patient=self.patient)
+        self.book(appointment_date=self.tomorrow, serial_number=7, status='cancelled')
+        counter = self.counter()
+        self.assertEqual((counter.last_serial, counter.booked), (7, 1))
+        self.assertEqual(booking.book(self.doctor, self.tomorrow, patient=self.patient).serial_number, 8)
+
+    def test_schedule_changes_update_capacity(self):
+        for _ in range(2):
+            booking.book(self.doctor, self.tomorrow, patient=self.patient)
+        self.schedule.max_patients = 3
+        self.schedule.save()
+        self.assertEqual(self.counter().capacity, 3)
+        self.assertEqual(booking.book(self.doctor, self.tomorrow, patient=self.patient).serial_number, 3)
+
+        DoctorAvailability.objects.create(doctor=self.doctor, date=self.tomorrow, is_available=False)
+        self.assertEqual(self.counter().capacity, 0)
+
+    def test_days_without_a_session_are_closed(self):
+        with self.assertRaises(booking.BookingFull):
+            booking.book(self.doctor, self.today + datetime.timedelta(days=2), patient=self.patient)
+
+    def test_unscheduled_doctors_have_no_limit(self):
+        other = User.objects.create_user(username='walkin', password='testpass123', role='DOCTOR')
+        for serial in range(1, 4):
+            self.assertEqual(booking.book(other, self.tomorrow, patient=self.patient).serial_number, serial)
+        self.assertIsNone(BookingCounter.objects.get(doctor=other).capacity)
+
+    def test_public_booking(self):
+        """The public form books with a serial and explains a full day"""
+        data = {
+            'full_name': 'Jamal Hossain', 'age': 40, 'phone': '01711111111', 'gender': 'M',
+            'doctor': self.doctor.pk, 'appointment_date': self.tomorrow.isoformat(),
+        }
+        response = self.client.post(reverse('appointments:public_booking'), data)
+        self.assertRedirects(response, reverse('appointments:public_booking'))
+        appointment = Appointment.objects.get(doctor=self.doctor, appointment_date=self.tomorrow)
+        self.assertEqual(appointment.serial_number, 1)
+        self.assertEqual(appointment.patient.first_name, 'Jamal')
+
+        self.client.post(reverse('appointments:public_booking'), data)
+        response = self.client.post(reverse('appointments:public_booking'), data, follow=True)
+        self.assertContains(response, 'fully booked')
+        self.assertEqual(Appointment.objects.filter(appointment_date=self.tomorrow).count(), 2)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BookingConcurrencyTestCase(BookingFixturesMixin, TransactionTestCase):
+    """Book from many threads at once"""
+
+    capacity = 25
+    threads = 8
+    per_thread = 5
+
+    def _hammer(self, doctor):
+        serials = []
+        full = []
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(self.per_thread):
+                    try:
+                        serials.append(booking.book(doctor, self.tomorrow, patient=self.patient).serial_number)
+                    except booking.BookingFull:
+                        full.append(1)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return serials, full, errors
+
+    def test_capacity_is_never_exceeded(self):
+        """Exactly max_patients bookings succeed, with serials 1..max_patients"""
+        serials, full, errors = self._hammer(self.doctor)
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(serials), list(range(1, self.capacity + 1)))
+        self.assertEqual(len(full), self.threads * self.per_thread - self.capacity)
+        self.assertEqual(
+            sorted(Appointment.objects.filter(appointment_date=self.tomorrow).values_list('serial_number', flat=True)),
+            list(range(1, self.capacity + 1))
+        )
+        self.assertEqual(self.counter().booked, self.capacity)
+
+    def test_no_lost_bookings_without_a_limit(self):
+        """Every booking is stored, each with its own serial"""
+        other = User.objects.create_user(username='walkin', password='testpass123', role='DOCTOR')
+        serials, full, errors = self._hammer(other)
+        total = self.threads * self.per_thread
+        self.assertEqual(errors, [])
+        self.assertEqual(full, [])
+        self.assertEqual(sorted(serials), list(range(1, total + 1)))
+        self.assertEqual(Appointment.objects.filter(doctor=other).count(), total)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AvailabilityTestCase(QueueTestMixin, TestCase):
+    """Test slot availability"""
+
+    def setUp(self):
+        super().setUp()
+        self.tomorrow = self.today + datetime.timedelta(days=1)
+        self.schedule = DoctorSchedule.objects.create(
+            doctor=self.doctor, day_of_week=self.tomorrow.strftime('%A').upper(),
+            start_time=datetime.time(17, 0), end_time=datetime.time(18, 0),
+            max_patients=3, consultation_duration=20, room_number='201',
+        )
+
+    def times(self, date=None, now=None):
+        return [slot['time'] for slot in availability.free_slots(self.doctor.id, date or self.tomorrow, now)]
+
+    def test_slots_come_from_the_schedule(self):
+        self.assertEqual(self.times(), ['17:00', '17:20', '17:40'])
+        self.assertEqual(
+            availability.free_slots(self.doctor.id, self.tomorrow)[0],
+            {'date': self.tomorrow.isoformat(), 'time': '17:00', 'end': '17:20', 'room_number': '201'}
+        )
+        self.assertEqual(availability.slots_left(self.doctor.id, self.tomorrow), 3)
+
+    def test_max_patients_caps_the_slots(self):
+        DoctorSchedule.objects.update(max_patients=2)
+        self.assertEqual(self.times(), ['17:00', '17:20'])
+
+    def test_bookings_take_slots(self):
+        """A booked time takes its slot, untimed bookings the earliest free one"""
+        self.book(appointment_date=self.tomorrow, appointment_time=datetime.time(17, 20))
+        self.book(appointment_date=self.tomorrow)
+        self.book(appointment_date=self.tomorrow, status='cancelled')
+        self.assertEqual(self.times(), ['17:40'])
+
+    def test_cache_is_updated_in_place(self):
+        """Bookings and cancellations patch the cached day without a rebuild"""
+        self.assertEqual(availability.slots_left(self.doctor.id, self.tomorrow), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = self.book(appointment_date=self.tomorrow, appointment_time=datetime.time(17, 40))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.times(), ['17:00', '17:20'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.status = 'cancelled'
+            appointment.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.times(), ['17:00', '17:20', '17:40'])
+
+    def test_interleaved_writers_keep_both_changes(self):
+        """A worker holding the day's lock is waited for, not overwritten"""
+        self.times()
+        first = self.book(appointment_date=self.tomorrow, appointment_time=datetime.time(17, 0))
+        second = self.book(appointment_date=self.tomorrow, appointment_time=datetime.time(17, 20))
+        key = availability.cache_key(self.doctor.id, self.tomorrow)
+        read = threading.Event()
+        written = threading.Event()
+
+        def other_worker():
+            # Reads the day under the lock, then writes it back late
+            with queue_state.cache_lock(availability.lock_key(self.doctor.id, self.tomorrow)):
+                day = cache.get(key)
+                read.set()
+                time.sleep(0.2)
+                availability._take(day, first.id, first.appointment_time)
+                cache.set(key, day)
+            written.set()
+
+        worker = threading.Thread(target=other_worker)
+        worker.start()
+        read.wait()
+        availability.apply(second)
+        worker.join()
+        self.assertTrue(written.is_set())
+        self.assertEqual(self.times(), ['17:40'])
+
+        # A lock never released: the day is dropped and rebuilt
+        cache.add(availability.lock_key(self.doctor.id, self.tomorrow), 'stuck')
+        third = self.book(appointment_date=self.tomorrow, appointment_time=datetime.time(17, 40))
+        with self.settings(QUEUE_LOCK_TIMEOUT=0):
+            availability.apply(third)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(self.times(), [])
+
+    def test_overrides_and_schedule_changes(self):
+        """Date overrides replace the weekly hours and drop the cached day"""
+        self.times()
+        with self.captureOnCommitCallbacks(execute=True):
+            DoctorAvailability.objects.create(
+                doctor=self.doctor, date=self.tomorrow, start_time=datetime.time(9, 0),
+                end_time=datetime.time(10, 0), max_patients=2,
+            )
+        self.assertEqual(self.times(), ['09:00', '09:15'])
+
+    def test_started_slots_are_not_offered(self):
+        now = datetime.datetime.combine(self.tomorrow, datetime.time(17, 25))
+        self.assertEqual(self.times(now=now), ['17:40'])
+        self.assertEqual(availability.slots_left(self.doctor.id, now=now), 1)
+        self.assertEqual(availability.next_free_slot(self.doctor.id, now=now)['time'], '17:40')
+
+        later = now.replace(hour=18)
+        # Next week's session is beyond the lookahead
+        self.assertIsNone(availability.next_free_slot(self.doctor.id, now=later))
+        self.assertEqual(
+            availability.next_free_slot(self.doctor.id, now=now - datetime.timedelta(days=1)),
+            {'date': self.tomorrow.isoformat(), 'time': '17:00', 'end': '17:20', 'room_number': '201'}
+        )
+
+    def test_summary(self):
+        other = User.objects.create_user(username='other', password='testpass123', role='DOCTOR')
+        self.book(appointment_date=self.tomorrow)
+        now = datetime.datetime.combine(self.today, datetime.time(8, 0))
+        self.assertEqual(
+            availability.summary([self.doctor.id, other.id], self.tomorrow, now=now),
+            {'total': 3, 'taken': 1, 'left': 2}
+        )
+
+    def test_slots_endpoint(self):
+        """The booking form reads free slots without logging in"""
+        response = self.client.get(
+            reverse('appointments:doctor_slots', args=[self.doctor.id]), {'date': self.tomorrow.isoformat()}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([slot['time'] for slot in data['slots']], ['17:00', '17:20', '17:40'])
+        self.assertEqual(data['slots_left'], 3)
+
+        response = self.client.get(reverse('appointments:doctor_slots', args=[self.doctor.id]), {'date': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_booking_form_rejects_a_taken_slot(self):
+        self.book(appointment_date=self.tomorrow, appointment_time=datetime.time(17, 0))
+        data = {
+            'full_name': 'Jamal Hossain', 'age': 40, 'phone': '01711111111', 'gender': 'M',
+            'doctor': self.doctor.pk, 'appointment_date': self.tomorrow.isoformat(),
+        }
+        self.assertFalse(QuickAppointmentForm(dict(data, appointment_time='17:00')).is_valid())
+        self.assertTrue(QuickAppointmentForm(dict(data, appointment_time='17:20')).is_valid())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class TransitionTestCase(QueueTestMixin, TestCase):
+    """Test conditional status transitions"""
+
+    def test_only_changed_columns_are_written(self):
+        appointment = self.book()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(appointment.call_next())
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "appointments_appointment"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('SET "status" = \'called\', "called_time" = ', updates[0])
+        self.assertNotIn('"notes"', updates[0])
+        self.assertIn('"status" = \'waiting\'', updates[0].split('WHERE')[1])
+
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.status, 'called')
+        self.assertIsNotNone(appointment.called_time)
+
+    def test_stale_copy_loses(self):
+        """Of two copies loaded before the change only the first one wins"""
+        first = self.book()
+        second = Appointment.objects.get(pk=first.pk)
+        self.assertTrue(first.start_consultation())
+        self.assertFalse(second.call_next())
+        self.assertEqual(second.status, 'waiting')
+        self.assertEqual(Appointment.objects.get(pk=first.pk).status, 'in_consultation')
+
+    def test_invalid_transition(self):
+        appointment = self.book()
+        with self.assertRaises(transitions.InvalidTransition):
+            appointment.complete()
+        self.assertTrue(appointment.call_next())
+        self.assertTrue(appointment.complete())
+        with self.assertRaises(transitions.InvalidTransition):
+            transitions.transition(appointment, 'waiting')
+
+    def test_side_effects_follow_the_change(self):
+        """Rollups, booking counters and the queue see the transition"""
+        appointment = booking.book(self.doctor, self.today, patient=self.patient, status='waiting')
+        queue_state.snapshot(self.doctor.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(transitions.transition(appointment, 'cancelled'))
+
+        counts = dict(DailyRollup.objects.filter(metric='appointments').values_list('source', 'count'))
+        self.assertEqual(counts.get('waiting', 0), 0)
+        self.assertEqual(counts['cancelled'], 1)
+        self.assertEqual(BookingCounter.objects.get().booked, 0)
+        self.assertEqual(queue_state.snapshot(self.doctor.id), [])
+
+    def test_claim_next(self):
+        """Waiting patients are claimed in serial order, each once"""
+        second = self.book(serial_number=2)
+        first = self.book(serial_number=1, patient=create_patient('Jamal', '01711111111'))
+        self.assertEqual(transitions.claim_next(self.doctor, self.today), first)
+        claimed = transitions.claim_next(self.doctor, self.today)
+        self.assertEqual((claimed, claimed.status), (second, 'in_consultation'))
+        self.assertIsNone(transitions.claim_next(self.doctor, self.today))
+
+    def test_call_next_patient_view(self):
+        """Repeated clicks never return the same patient"""
+        self.book(serial_number=1)
+        self.book(serial_number=2, patient=create_patient('Jamal', '01711111111'))
+        self.client.force_login(self.doctor)
+        url = reverse('accounts:call_next_patient')
+        responses = [self.client.post(url).json() for _ in range(3)]
+        self.assertEqual([response.get('queue_number') for response in responses], [1, 2, None])
+        self.assertEqual(responses[2]['message'], 'No patients waiting')
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ClaimConcurrencyTestCase(QueueTestMixin, TransactionTestCase):
+    """Call the next patient from many threads at once"""
+
+    threads = 6
+    waiting = 4
+
+    def test_each_patient_is_claimed_once(self):
+        for serial_number in range(1, self.waiting + 1):
+            self.book(serial_number=serial_number)
+        claimed = []
+        errors = []
+
+        def worker():
+            try:
+                appointment = transitions.claim_next(self.doctor, self.today)
+                claimed.append(appointment and appointment.serial_number)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(serial for serial in claimed if serial), list(range(1, self.waiting + 1)))
+        self.assertEqual(claimed.count(None), self.threads - self.waiting)
+        self.assertFalse(Appointment.objects.filter(status='waiting').exists())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, WAIT_ESTIMATE_MIN_SAMPLES=2)
+class WaitTimeTestCase(QueueTestMixin, TestCase):
+    """Test the duration statistics and wait estimates"""
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+
+    def complete(self, started, minutes, waited=5):
+        """A completed appointment that waited ``waited`` and took ``minutes`` minutes"""
+        appointment = self.book(patient=create_patient(f'Patient{DurationStat.objects.count()}', '01711111111'))
+        Appointment.objects.filter(pk=appointment.pk).update(
+            check_in_time=started - datetime.timedelta(minutes=waited)
+        )
+        appointment.refresh_from_db()
+        transitions.transition(appointment, 'in_consultation', started_time=started)
+        transitions.transition(
+            appointment, 'completed', completed_time=started + datetime.timedelta(minutes=minutes)
+        )
+        return appointment
+
+    def test_completion_updates_the_statistics(self):
+        for minutes in (4, 8, 12):
+            self.complete(self.now, minutes)
+        stats = waittimes.summary(self.doctor.id)
+        self.assertEqual((stats['count'], stats['mean']), (3, 480))
+        self.assertTrue(360 <= stats['p50'] <= 600)
+        self.assertEqual(waittimes.summary(self.doctor.id, waittimes.WAIT)['mean'], 300)
+
+        local = timezone.localtime(self.now)
+        self.assertEqual(waittimes.summary(self.doctor.id, weekday=local.weekday(), hour=local.hour)['count'], 3)
+        self.assertEqual(waittimes.summary(self.doctor.id, weekday=(local.weekday() + 1) % 7)['count'], 0)
+
+    def test_each_completion_is_one_update(self):
+        self.complete(self.now, 10)
+        appointment = self.book(serial_number=50)
+        transitions.transition(appointment, 'in_consultation', started_time=self.now)
+        with CaptureQueriesContext(connection) as queries:
+            transitions.transition(appointment, 'completed', completed_time=self.now + datetime.timedelta(minutes=10))
+        stat_queries = [query['sql'] for query in queries if 'appointments_durationstat' in query['sql']]
+        self.assertEqual(len(stat_queries), 1)
+        self.assertTrue(stat_queries[0].startswith('UPDATE'))
+
+    def test_rebuild_matches_incremental_rows(self):
+        for minutes in (3, 7, 7, 30):
+            self.complete(self.now, minutes)
+        rows = set(DurationStat.objects.values_list('metric', 'weekday', 'hour', 'bucket', 'count', 'total_seconds'))
+        self.assertEqual(waittimes.rebuild(), len(rows))
+        self.assertEqual(
+            set(DurationStat.objects.values_list('metric', 'weekday', 'hour', 'bucket', 'count', 'total_seconds')),
+            rows,
+        )
+
+    def test_estimates_follow_the_queue(self):
+        for _ in range(2):
+            self.complete(self.now - datetime.timedelta(minutes=30), 10)
+        current = self.book(serial_number=10)
+        transitions.transition(current, 'in_consultation', started_time=self.now - datetime.timedelta(minutes=4))
+        first = self.book(serial_number=11)
+        second = self.book(serial_number=12)
+
+        with self.settings(WAIT_ESTIMATE_MIN_SAMPLES=100):
+            # Without enough history the scheduled length is used
+            waittimes.invalidate(self.doctor.id)
+            estimates = waittimes.queue_estimates(self.doctor.id, now=self.now)
+        self.assertEqual([item['wait_minutes'] for item in estimates], [11, 26])
+
+        waittimes.invalidate(self.doctor.id)
+        estimates = waittimes.queue_estimates('all', now=self.now)
+        self.assertEqual([item['id'] for item in estimates], [first.id, second.id])
+        self.assertEqual([item['wait_minutes'] for item in estimates], [6, 16])
+
+    def test_estimates_are_pushed_to_the_screens(self):
+        display_channel = async_to_sync(get_channel_layer().new_channel)()
+        async_to_sync(get_channel_layer().group_add)('display_monitor', display_channel)
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = self.book()
+        broadcaster.flush()
+        message = async_to_sync(get_channel_layer().receive)(display_channel)
+        estimates = [event for event in message['events'] if event['type'] == 'wait_estimates']
+        self.assertEqual(estimates[0]['doctor_id'], self.doctor.id)
+        self.assertEqual([item['id'] for item in estimates[0]['estimates']], [appointment.id])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AppointmentListTestCase(QueueTestMixin, TestCase):
+    """Test the keyset-paginated appointment list"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.doctor)
+        self.url = reverse('appointments:appointment_list')
+        for offset in range(3):
+            for serial_number in range(1, 11):
+                self.book(
+                    serial_number=serial_number,
+                    appointment_date=self.today - datetime.timedelta(days=offset),
+                    status='completed' if serial_number % 2 else 'waiting',
+                )
+
+    def walk(self, url):
+        """Follow ``next`` links to the end, returning every page's ids"""
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        return pages
+
+    def test_pages_cover_the_list_in_order(self):
+        pages = self.walk(self.url + '?format=json')
+        self.assertEqual([len(page) for page in pages], [25, 5])
+        expected = list(Appointment.objects.order_by('-appointment_date', 'serial_number').values_list('id', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_previous_returns_the_same_page(self):
+        first = self.client.get(self.url, {'format': 'json'}).json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_filters(self):
+        pages = self.walk(f'{self.url}?format=json&status=waiting&date={self.today.isoformat()}')
+        self.assertEqual(len(sum(pages, [])), 5)
+        self.assertEqual(self.walk(f'{self.url}?format=json&doctor=0'), [[]])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        first = self.client.get(self.url, {'format': 'json'}).json()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first['next'])
+        with CaptureQueriesContext(connection) as later:
+            self.client.get(first['next'])
+        self.assertEqual(len(queries), len(later))
+        select = [query['sql'] for query in queries if 'FROM "appointments_appointment"' in query['sql']][0]
+        self.assertIn('LIMIT 26', select)
+        self.assertNotIn('OFFSET', select)
+
+    def test_html_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['appointments']), 25)
+        self.assertEqual(response.context['stats']['today_total'], 10)
+        self.assertContains(response, 'after=')
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'after': 'bm9wZQ'}).status_code, 400)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, ANNOUNCEMENT_TTS_ENGINE='appointments.tests.fake_engine')
+class AnnouncementTestCase(QueueTestMixin, TestCase):
+    """Test the cached announcement audio"""
+
+    def setUp(self):
+        super().setUp()
+        RENDERED.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        settings_override = self.settings(ANNOUNCEMENT_AUDIO_ROOT=self.root, ANNOUNCEMENT_AUDIO_URL='/media/announcements/')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_phrases_are_rendered_once(self):
+        (bn, bn_text, bn_name), (en, en_text, en_name) = announcements.clips(12, '201', 'Abul Kalam')
+        self.assertEqual(bn_text, 'সিরিয়াল নম্বর ১২, রুম ২০১, ডাক্তার Abul Kalam')
+        self.assertEqual(en_text, 'Serial number 12, room 201, doctor Abul Kalam')
+        self.assertTrue(bn_name.endswith('.txt'))
+
+        for _ in range(2):
+            announcements.render(en, en_text, en_name)
+        self.assertEqual(RENDERED, [('en', en_text)])
+        self.assertEqual(
+            announcements.ready(announcements.clips(12, '201', 'Abul Kalam')),
+            [{'language': 'en', 'url': f'/media/announcements/{en_name}'}],
+        )
+
+    def test_warm_renders_the_days_serials(self):
+        DoctorSchedule.objects.create(
+            doctor=self.doctor, day_of_week=self.today.strftime('%A').upper(),
+            start_time=datetime.time(17, 0), end_time=datetime.time(19, 0),
+            max_patients=2, room_number='201',
+        )
+        # A walk-in beyond the schedule's places, in another room
+        self.book(serial_number=7, room_number='105')
+
+        self.assertEqual(announcements.warm(self.today), (6, 0))
+        self.assertEqual(
+            sorted(text for language, text in RENDERED if language == 'en'),
+            [
+                'Serial number 1, room 201, doctor Abul Kalam',
+                'Serial number 2, room 201, doctor Abul Kalam',
+                'Serial number 7, room 105, doctor Abul Kalam',
+            ],
+        )
+        self.assertEqual(len(os.listdir(self.root)), 6)
+
+        RENDERED.clear()
+        announcements.warm(self.today)
+        self.assertEqual(RENDERED, [])
+
+    def test_saving_a_schedule_queues_its_serials(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            DoctorAvailability.objects.create(
+                doctor=self.doctor, date=self.today, start_time=datetime.time(17, 0),
+                end_time=datetime.time(19, 0), max_patients=2, room_number='201',
+            )
+        announcements.renderer.flush()
+        self.assertEqual(
+            sorted(text for language, text in RENDERED if language == 'en'),
+            ['Serial number 1, room 201, doctor Abul Kalam', 'Serial number 2, room 201, doctor Abul Kalam'],
+        )
+
+    def test_called_patient_comes_with_the_clips(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = self.book(room_number='201')
+        # Booking queued the clips in the background
+        announcements.renderer.flush()
+        self.assertEqual(len(RENDERED), 2)
+
+        display_channel = async_to_sync(get_channel_layer().new_channel)()
+        async_to_sync(get_channel_layer().group_add)('display_monitor', display_channel)
+        with self.captureOnCommitCallbacks(execute=True):
+            transitions.transition(appointment, 'called')
+        broadcaster.flush()
+        message = async_to_sync(get_channel_layer().receive)(display_channel)
+        called, = [event for event in message['events'] if event['type'] == 'patient_called']
+        self.assertEqual([clip['language'] for clip in called['audio']], ['bn', 'en'])
+        self.assertTrue(all(clip['url'].startswith('/media/announcements/') for clip in called['audio']))
+
+    def test_unavailable_engine_renders_nothing(self):
+        self.book(serial_number=1)
+        with self.settings(ANNOUNCEMENT_TTS_ENGINE='appointments.tests.broken_engine'):
+            with self.assertLogs('appointments.announcements', 'WARNING'):
+                self.assertEqual(announcements.warm(self.today), (0, 2))
+        self.assertEqual(os.listdir(self.root), [])
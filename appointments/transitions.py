@@ -0,0 +1,108 @@
+"""
+Appointment status transitions
+
+Every status change goes through transition(): it checks the move is
+allowed and writes it as one conditional UPDATE of the changed columns
+(``... WHERE id = <pk> AND status = <status as loaded>``). When another
+request changed the appointment first, nothing is written and False comes
+back, so a double click cannot call or complete a patient twice.
+
+The UPDATE bypasses Model.save(), so pre_save/post_save are sent by hand
+with ``update_fields``; the queue screens, rollups, booking counters and
+slot availability follow the change exactly as after a save().
+"""
+from django.db import router
+from django.db.models.signals import post_save, pre_save
+from django.utils import timezone
+
+WAITING = 'waiting'
+CALLED = 'called'
+IN_CONSULTATION = 'in_consultation'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+NO_SHOW = 'no_show'
+
+ALLOWED = {
+    WAITING: {CALLED, IN_CONSULTATION, CANCELLED, NO_SHOW},
+    CALLED: {IN_CONSULTATION, COMPLETED, WAITING, CANCELLED, NO_SHOW},
+    IN_CONSULTATION: {COMPLETED},
+    # A patient marked absent who turns up after all
+    NO_SHOW: {WAITING},
+    COMPLETED: set(),
+    CANCELLED: set(),
+}
+
+# Timestamp set when an appointment enters a status
+TIMESTAMPS = {
+    CALLED: 'called_time',
+    IN_CONSULTATION: 'started_time',
+    COMPLETED: 'completed_time',
+}
+
+
+class InvalidTransition(ValueError):
+    """The status cannot move from its current value to the requested one"""
+
+    def __init__(self, from_status, to_status):
+        self.from_status = from_status
+        self.to_status = to_status
+        super().__init__(f'Cannot move an appointment from {from_status!r} to {to_status!r}')
+
+
+def can_transition(from_status, to_status):
+    return to_status in ALLOWED.get(from_status, ())
+
+
+def transition(appointment, to_status, **fields):
+    """Move ``appointment`` to ``to_status`` if nobody changed its status meanwhile.
+
+    ``fields`` are written in the same UPDATE. Returns True when the change
+    was applied (and updates the instance), False when the appointment no
+    longer has the status it was loaded with. Raises InvalidTransition for a
+    move ALLOWED does not list.
+    """
+    from .models import Appointment
+
+    from_status = appointment.status
+    if not can_transition(from_status, to_status):
+        raise InvalidTransition(from_status, to_status)
+
+    values = {'status': to_status, **fields}
+    if to_status in TIMESTAMPS:
+        values.setdefault(TIMESTAMPS[to_status], timezone.now())
+    using = router.db_for_write(Appointment, instance=appointment)
+    update_fields = frozenset(values)
+
+    pre_save.send(sender=Appointment, instance=appointment, raw=False, using=using, update_fields=update_fields)
+    updated = Appointment._base_manager.using(using).filter(
+        pk=appointment.pk, status=from_status
+    ).update(**values)
+    if not updated:
+        return False
+
+    for name, value in values.items():
+        setattr(appointment, name, value)
+    post_save.send(
+        sender=Appointment, instance=appointment, created=False,
+        raw=False, using=using, update_fields=update_fields,
+    )
+    return True
+
+
+def claim_next(doctor, date=None, to_status=IN_CONSULTATION):
+    """Move the doctor's first waiting appointment to ``to_status``.
+
+    Returns the appointment, or None when nobody is waiting. When another
+    request claims the same appointment first, the next one in line is tried.
+    """
+    from .models import Appointment
+
+    waiting = Appointment.objects.filter(
+        doctor=doctor, appointment_date=date or timezone.localdate(), status=WAITING
+    ).select_related('patient', 'doctor').order_by('serial_number')
+    while True:
+        appointment = waiting.first()
+        if appointment is None:
+            return None
+        if transition(appointment, to_status):
+            return appointment
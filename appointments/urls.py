@@ -6,6 +6,7 @@ app_name = 'appointments'
 urlpatterns = [
     # Public booking (no login required)
     path('book/', views.public_booking, name='public_booking'),
+    path('book/slots/<int:doctor_id>/', views.doctor_slots, name='doctor_slots'),
     
     # Staff-only URLs (login required)
     path('', views.appointment_list, name='appointment_list'),
@@ -15,6 +16,7 @@ urlpatterns = [
     path('<int:pk>/complete/', views.complete_appointment, name='complete_appointment'),
     path('queue/', views.queue_display, name='queue_display'),
     path('monitor/', views.display_monitor, name='display_monitor'),
+    path('doctors/roster/', views.doctor_roster, name='doctor_roster'),
     
     # Prescriptions
     path('<int:appointment_id>/prescription/create/', views.prescription_create, name='prescription_create'),
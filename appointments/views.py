@@ -3,10 +3,11 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.utils import timezone
-from django.db.models import Max
+from . import booking
 from .models import Appointment, Prescription, Medicine
 from .forms import QuickAppointmentForm
-from patients.models import Patient
+from .queue_state import ACTIVE_STATUSES
+from .transitions import InvalidTransition
 from accounts.models import User
 
 def public_booking(request):
@@ -14,65 +15,28 @@ def public_booking(request):
     if request.method == 'POST':
         form = QuickAppointmentForm(request.POST)
         if form.is_valid():
+            doctor = form.cleaned_data['doctor']
             try:
-                # Get or create patient
-                phone = form.cleaned_data['phone']
-                patient, created = Patient.objects.get_or_create(
-                    phone=phone,
-                    defaults={
-                        'name': form.cleaned_data['full_name'],
-                        'age': form.cleaned_data['age'],
-                        'gender': form.cleaned_data['gender'],
-                    }
-                )
-                
-                # Update patient info if exists
-                if not created:
-                    patient.name = form.cleaned_data['full_name']
-                    patient.age = form.cleaned_data['age']
-                    patient.gender = form.cleaned_data['gender']
-                    patient.save()
-                
-                # Get doctor
-                doctor = form.cleaned_data['doctor']
-                
-                # Get next serial number for today
-                today = timezone.now().date()
-                last_serial = Appointment.objects.filter(
-                    doctor=doctor,
-                    appointment_date=today
-                ).aggregate(Max('serial_number'))['serial_number__max']
-                
-                next_serial = (last_serial or 0) + 1
-                
-                # Generate appointment number
-                appointment_number = f"APT-{today.strftime('%Y%m%d')}-{doctor.id}-{next_serial:03d}"
-                
-                # Create appointment
-                appointment = Appointment.objects.create(
-                    appointment_number=appointment_number,
-                    patient=patient,
-                    doctor=doctor,
-                    serial_number=next_serial,
-                    appointment_date=today,
-                    status='WAITING',
-                    reason=form.cleaned_data.get('reason', ''),
-                    created_by=None  # Public booking
+                appointment, patient = form.save(created_by=None)  # Public booking
+            except booking.BookingFull as full:
+                messages.error(
+                    request,
+                    f'দুঃখিত, এই দিনের সব সিরিয়াল পূর্ণ হয়ে গেছে।<br>'
+                    f'Sorry, Dr. {doctor.get_full_name()} is fully booked on '
+                    f'{full.date:%d %b %Y}. Please choose another date.'
                 )
-                
+            else:
                 messages.success(
                     request,
-                    f'✅ সিরিয়াল নিশ্চিত করা হয়েছে! আপনার সিরিয়াল নম্বর: {next_serial}<br>'
-                    f'Appointment confirmed! Your serial number: {next_serial}<br>'
+                    f'✅ সিরিয়াল নিশ্চিত করা হয়েছে! আপনার সিরিয়াল নম্বর: {appointment.serial_number}<br>'
+                    f'Appointment confirmed! Your serial number: {appointment.serial_number}<br>'
                     f'ডাক্তার: {doctor.get_full_name()}<br>'
-                    f'Phone: {phone}'
+                    f'Date: {appointment.appointment_date:%d %b %Y}<br>'
+                    f'Phone: {patient.phone}'
                 )
                 
                 # Redirect to success or back to form
                 return redirect('appointments:public_booking')
-                
-            except Exception as e:
-                messages.error(request, f'Error: {str(e)}')
         else:
             messages.error(request, 'দয়া করে সকল তথ্য সঠিকভাবে পূরণ করুন / Please fill all fields correctly')
     else:
@@ -82,9 +46,74 @@ def public_booking(request):
 
 @login_required
 def appointment_list(request):
-    """List all appointments"""
-    appointments = Appointment.objects.all().select_related('patient', 'doctor').order_by('-appointment_date', 'serial_number')
-    return render(request, 'appointments/appointment_list.html', {'appointments': appointments})
+    """Appointments, latest day first, one keyset page at a time (?format=json for infinite scroll)"""
+    from datetime import date as date_type
+    from django.core.exceptions import BadRequest
+    from django.db.models import Count, Q
+    from accounts.pagination import InvalidCursor, cursor_url, paginate
+    
+    appointments = Appointment.objects.select_related('patient', 'doctor').prefetch_related('prescriptions')
+    doctor = request.GET.get('doctor', '')
+    if doctor.isdigit():
+        appointments = appointments.filter(doctor_id=doctor)
+    status = request.GET.get('status')
+    if status in dict(Appointment.STATUS_CHOICES):
+        appointments = appointments.filter(status=status)
+    if request.GET.get('date'):
+        try:
+            appointments = appointments.filter(appointment_date=date_type.fromisoformat(request.GET['date']))
+        except ValueError:
+            raise BadRequest('Invalid date')
+    search = request.GET.get('search', '').strip()
+    if search:
+        appointments = appointments.filter(
+            Q(appointment_number__icontains=search) |
+            Q(patient__first_name__icontains=search) |
+            Q(patient__last_name__icontains=search) |
+            Q(patient__patient_id__icontains=search) |
+            Q(doctor__first_name__icontains=search) |
+            Q(doctor__last_name__icontains=search)
+        )
+    
+    try:
+        page = paginate(
+            appointments, Appointment.LIST_ORDERING,
+            after=request.GET.get('after') or None, before=request.GET.get('before') or None,
+        )
+    except InvalidCursor:
+        raise BadRequest('Invalid cursor')
+    
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'results': [
+                {
+                    'id': appointment.id,
+                    'appointment_number': appointment.appointment_number,
+                    'serial_number': appointment.serial_number,
+                    'appointment_date': appointment.appointment_date.isoformat(),
+                    'appointment_time': appointment.appointment_time.strftime('%H:%M') if appointment.appointment_time else None,
+                    'patient_name': appointment.patient.get_full_name(),
+                    'patient_id': appointment.patient.patient_id,
+                    'doctor_id': appointment.doctor_id,
+                    'doctor_name': appointment.doctor.get_full_name(),
+                    'status': appointment.status,
+                }
+                for appointment in page
+            ],
+            'next': cursor_url(request, after=page.next_cursor) if page.has_next else None,
+            'previous': cursor_url(request, before=page.previous_cursor) if page.has_previous else None,
+        })
+    
+    stats = dict(
+        Appointment.objects.filter(appointment_date=timezone.localdate())
+        .values_list('status').annotate(total=Count('pk')).order_by()
+    )
+    stats['today_total'] = sum(stats.values())
+    return render(request, 'appointments/appointment_list.html', {
+        'appointments': page,
+        'doctors': User.objects.filter(role='DOCTOR').order_by('first_name', 'last_name'),
+        'stats': stats,
+    })
 
 @login_required
 def appointment_create(request):
@@ -105,16 +134,28 @@ def appointment_detail(request, pk):
 def call_patient(request, pk):
     """Call next patient"""
     appointment = get_object_or_404(Appointment, pk=pk)
-    appointment.call_next()
-    messages.success(request, f'Patient {appointment.serial_number} called!')
+    try:
+        called = appointment.call_next()
+    except InvalidTransition:
+        called = False
+    if called:
+        messages.success(request, f'Patient {appointment.serial_number} called!')
+    else:
+        messages.warning(request, f'Patient {appointment.serial_number} was already called or is no longer waiting.')
     return redirect('appointments:queue_display')
 
 @login_required
 def complete_appointment(request, pk):
     """Complete appointment"""
     appointment = get_object_or_404(Appointment, pk=pk)
-    appointment.complete()
-    messages.success(request, 'Appointment completed!')
+    try:
+        completed = appointment.complete()
+    except InvalidTransition:
+        completed = False
+    if completed:
+        messages.success(request, 'Appointment completed!')
+    else:
+        messages.warning(request, 'This appointment cannot be completed from its current status.')
     return redirect('appointments:appointment_list')
 
 @login_required
@@ -125,7 +166,7 @@ def queue_display(request):
     
     appointments = Appointment.objects.filter(
         appointment_date=today,
-        status__in=['WAITING', 'CALLED', 'IN_PROGRESS']
+        status__in=ACTIVE_STATUSES
     ).select_related('patient', 'doctor').order_by('serial_number')
     
     return render(request, 'appointments/queue_display.html', {'appointments': appointments})
@@ -135,11 +176,35 @@ def display_monitor(request):
     """Public display monitor"""
     return render(request, 'appointments/display_monitor.html')
 
+def doctor_slots(request, doctor_id):
+    """Free slots of a doctor on ?date= (default today), for the booking form (JSON)"""
+    from datetime import date as date_type
+    from . import availability
+    doctor = get_object_or_404(User, pk=doctor_id, role='DOCTOR', is_active=True)
+    try:
+        date = date_type.fromisoformat(request.GET['date']) if request.GET.get('date') else timezone.localdate()
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date'}, status=400)
+    return JsonResponse({
+        'date': date.isoformat(),
+        'slots': availability.free_slots(doctor.id, date),
+        'slots_left': availability.slots_left(doctor.id, date),
+        'next_free_slot': availability.next_free_slot(doctor.id),
+    })
+
+@login_required
+def doctor_roster(request):
+    """All doctors with counts, queue length and next available slot (JSON)"""
+    from . import roster
+    return JsonResponse({
+        'date': timezone.localdate().isoformat(),
+        'doctors': roster.get_roster(),
+    })
+
 @login_required
 def prescription_create(request, appointment_id):
     """Create or edit prescription - Doctors can write prescriptions"""
     from .forms import PrescriptionForm, MedicineFormSet
-    from datetime import datetime
     
     appointment = get_object_or_404(Appointment, pk=appointment_id)
     
@@ -173,22 +238,6 @@ def prescription_create(request, appointment_id):
             prescription.patient = appointment.patient
             prescription.doctor = request.user
             
-            # Generate prescription number if new
-            if not prescription.prescription_number:
-                today = datetime.now()
-                prefix = f"RX{today.strftime('%Y%m%d')}"
-                last_prescription = Prescription.objects.filter(
-                    prescription_number__startswith=prefix
-                ).order_by('prescription_number').last()
-                
-                if last_prescription:
-                    last_number = int(last_prescription.prescription_number[-4:])
-                    new_number = last_number + 1
-                else:
-                    new_number = 1
-                
-                prescription.prescription_number = f"{prefix}{new_number:04d}"
-            
             prescription.save()
             
             # Save medicines
@@ -237,6 +286,11 @@ def prescription_detail(request, pk):
 
 @login_required
 def prescription_print(request, pk):
-    """Print prescription"""
+    """Print prescription (as PDF with ?format=pdf)"""
+    from accounts import documents
+    
     prescription = get_object_or_404(Prescription, pk=pk)
-    return render(request, 'appointments/prescription_print.html', {'prescription': prescription})
+    return documents.print_response(
+        request, 'appointments/prescription_print.html', {'prescription': prescription},
+        f'{prescription.prescription_number}.pdf',
+    )
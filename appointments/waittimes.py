@@ -0,0 +1,290 @@
+"""
+Consultation and waiting time statistics
+
+Durations are kept per doctor, weekday and hour as histograms: one
+DurationStat row per bucket of BUCKETS holding the number of appointments
+that fell in it and their total seconds. Recording an appointment is a
+single F() update, so the statistics follow every completion without
+rescanning history, and any slice (a doctor's Monday mornings, or all of
+their days) is a sum of rows giving the mean and approximate percentiles.
+
+signals.py records both durations when an appointment is completed: the
+wait from check-in until the patient was called, and the consultation from
+its start until completion. Run ``manage.py rebuild_duration_stats`` after
+bulk edits.
+
+estimates() turns a doctor's live queue into an expected wait for every
+waiting patient: what is left of the consultations under way, then one
+mean consultation (for the weekday and hour it would fall in) per patient
+ahead.
+"""
+import bisect
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import queue_state, roster
+from .models import Appointment, DoctorSchedule, DurationStat
+
+CONSULTATION = 'consultation'
+WAIT = 'wait'
+
+# Bucket upper bounds in minutes; the last bucket is open-ended
+BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20, 25, 30, 40, 50, 60, 75, 90, 120, 180, 240)
+
+# Longer durations are left out (e.g. an appointment completed the next day)
+MAX_DURATION = datetime.timedelta(hours=12)
+
+PROFILE_TIMEOUT = 60 * 60
+
+# Queue order for estimates: patients in the room first, then called ones
+_ORDER = {'in_consultation': 0, 'called': 1, 'waiting': 2}
+
+
+def _local(value):
+    return timezone.localtime(value) if timezone.is_aware(value) else value
+
+
+def _bucket(seconds):
+    return bisect.bisect_left(BUCKETS, seconds / 60)
+
+
+def measure(appointment):
+    """``[(metric, start, seconds)]`` for a completed appointment"""
+    called = appointment.called_time or appointment.started_time
+    started = appointment.started_time or appointment.called_time
+    measured = []
+    if called and appointment.check_in_time and (
+        _local(appointment.check_in_time).date() == appointment.appointment_date
+    ):
+        # Booked on an earlier day: the check-in time is not an arrival
+        measured.append((WAIT, appointment.check_in_time, called - appointment.check_in_time))
+    if started and appointment.completed_time:
+        measured.append((CONSULTATION, started, appointment.completed_time - started))
+    return [
+        (metric, start, int(duration.total_seconds()))
+        for metric, start, duration in measured
+        if datetime.timedelta(0) <= duration <= MAX_DURATION
+    ]
+
+
+def _key(doctor_id, metric, start, seconds):
+    local = _local(start)
+    return (doctor_id, metric, local.weekday(), local.hour, _bucket(seconds))
+
+
+def add(doctor_id, metric, start, seconds):
+    """Count one duration of ``seconds`` that started at ``start``"""
+    doctor_id, metric, weekday, hour, bucket = _key(doctor_id, metric, start, seconds)
+    rows = DurationStat.objects.filter(
+        doctor_id=doctor_id, metric=metric, weekday=weekday, hour=hour, bucket=bucket
+    )
+    changes = {'count': F('count') + 1, 'total_seconds': F('total_seconds') + seconds}
+    if not rows.update(**changes):
+        try:
+            with transaction.atomic():
+                DurationStat.objects.create(
+                    doctor_id=doctor_id, metric=metric, weekday=weekday, hour=hour,
+                    bucket=bucket, count=1, total_seconds=seconds,
+                )
+        except IntegrityError:
+            # Another worker created the row first
+            rows.update(**changes)
+    transaction.on_commit(lambda: invalidate(doctor_id))
+
+
+def record(appointment, previous_status=None):
+    """Add a just completed appointment to its doctor's statistics"""
+    if appointment.status != 'completed' or previous_status in (None, 'completed'):
+        return
+    for metric, start, seconds in measure(appointment):
+        add(appointment.doctor_id, metric, start, seconds)
+
+
+def _percentile(buckets, fraction):
+    """Duration below which ``fraction`` of ``{bucket: [count, seconds]}`` falls"""
+    target = fraction * sum(count for count, _ in buckets.values())
+    seen = 0
+    for bucket in sorted(buckets):
+        count, seconds = buckets[bucket]
+        if count and seen + count >= target:
+            if bucket == len(BUCKETS):
+                return seconds / count
+            # Interpolate within the bucket
+            lower = BUCKETS[bucket - 1] * 60 if bucket else 0
+            return lower + (BUCKETS[bucket] * 60 - lower) * (target - seen) / count
+        seen += count
+    return None
+
+
+def summary(doctor_id, metric=CONSULTATION, weekday=None, hour=None):
+    """Count, mean and percentiles (in seconds) of a doctor's durations.
+
+    ``weekday`` and ``hour`` narrow the statistics to that slice.
+    """
+    rows = DurationStat.objects.filter(doctor_id=doctor_id, metric=metric)
+    if weekday is not None:
+        rows = rows.filter(weekday=weekday)
+    if hour is not None:
+        rows = rows.filter(hour=hour)
+    buckets = {
+        row['bucket']: [row['count'], row['seconds']]
+        for row in rows.values('bucket').annotate(count=Sum('count'), seconds=Sum('total_seconds'))
+    }
+    count = sum(count for count, _ in buckets.values())
+    if not count:
+        return {'count': 0, 'mean': None, 'p50': None, 'p90': None}
+    return {
+        'count': count,
+        'mean': round(sum(seconds for _, seconds in buckets.values()) / count),
+        'p50': round(_percentile(buckets, 0.5)),
+        'p90': round(_percentile(buckets, 0.9)),
+    }
+
+
+def profile_key(doctor_id):
+    return f'consultation_profile:{doctor_id}'
+
+
+def profile(doctor_id):
+    """Mean consultation seconds by ``(weekday, hour)``, cached.
+
+    ``None`` holds the mean over all hours; every mean comes with its count.
+    ``'default'`` is the scheduled consultation length, for doctors without
+    enough history.
+    """
+    key = profile_key(doctor_id)
+    result = cache.get(key)
+    if result is None:
+        result = {}
+        totals = [0, 0]
+        for row in DurationStat.objects.filter(doctor_id=doctor_id, metric=CONSULTATION).values(
+            'weekday', 'hour'
+        ).annotate(count=Sum('count'), seconds=Sum('total_seconds')):
+            result[(row['weekday'], row['hour'])] = (row['count'], row['seconds'] / row['count'])
+            totals[0] += row['count']
+            totals[1] += row['seconds']
+        if totals[0]:
+            result[None] = (totals[0], totals[1] / totals[0])
+        scheduled = DoctorSchedule.objects.filter(doctor_id=doctor_id, is_active=True).aggregate(
+            minutes=Avg('consultation_duration')
+        )['minutes']
+        result['default'] = (scheduled or roster.DEFAULT_DURATION) * 60
+        cache.set(key, result, PROFILE_TIMEOUT)
+    return result
+
+
+def invalidate(doctor_id):
+    """Drop a doctor's cached profile (after new statistics or schedule changes)"""
+    cache.delete(profile_key(doctor_id))
+
+
+def mean_consultation(stats, moment):
+    """Expected length in seconds of a consultation starting at ``moment``"""
+    min_samples = getattr(settings, 'WAIT_ESTIMATE_MIN_SAMPLES', 5)
+    local = _local(moment)
+    for key in ((local.weekday(), local.hour), None):
+        count, mean = stats.get(key, (0, 0))
+        if count >= min_samples:
+            return mean
+    return stats['default']
+
+
+def estimates(doctor_id, entries, now=None):
+    """Expected wait of each waiting patient in ``entries`` (a doctor's queue)"""
+    now = now or timezone.now()
+    stats = profile(doctor_id)
+    free_at = now
+    result = []
+    for entry in sorted(entries, key=lambda entry: (_ORDER[entry['status']], entry['serial_number'], entry['id'])):
+        if entry['status'] == 'in_consultation':
+            started = parse_datetime(entry['started_time']) if entry.get('started_time') else now
+            end = started + datetime.timedelta(seconds=mean_consultation(stats, started))
+            free_at += max(end - now, datetime.timedelta(0))
+            continue
+        if entry['status'] == 'waiting':
+            result.append({
+                'id': entry['id'],
+                'serial_number': entry['serial_number'],
+                'doctor_id': doctor_id,
+                'doctor_name': entry['doctor_name'],
+                'wait_minutes': round((free_at - now).total_seconds() / 60),
+                'expected_at': _local(free_at).isoformat(),
+            })
+        free_at += datetime.timedelta(seconds=mean_consultation(stats, free_at))
+    return result
+
+
+def _entries(queue, date):
+    """Active queue entries, from the cached queue state when there is one.
+
+    Building the queue state here would hide changes still waiting to be
+    patched in, so a missing state is read straight from the database.
+    """
+    state = cache.get(queue_state.state_key(queue, date))
+    if state is not None:
+        return list(state['entries'].values())
+    appointments = Appointment.objects.filter(
+        appointment_date=date, status__in=queue_state.ACTIVE_STATUSES
+    ).select_related('doctor').only(
+        'serial_number', 'status', 'started_time', 'doctor__first_name', 'doctor__last_name', 'doctor__username',
+    )
+    if queue != 'all':
+        appointments = appointments.filter(doctor_id=queue)
+    return [
+        {
+            'id': appointment.id,
+            'serial_number': appointment.serial_number,
+            'status': appointment.status,
+            'started_time': appointment.started_time.isoformat() if appointment.started_time else None,
+            'doctor_id': appointment.doctor_id,
+            'doctor_name': appointment.doctor.get_full_name(),
+        }
+        for appointment in appointments
+    ]
+
+
+def queue_estimates(queue='all', date=None, now=None):
+    """Estimates for everyone waiting in a queue (a doctor's or 'all'), each doctor's in queue order"""
+    by_doctor = defaultdict(list)
+    for entry in _entries(queue, date or timezone.now().date()):
+        by_doctor[entry['doctor_id']].append(entry)
+    result = []
+    for doctor_id, entries in by_doctor.items():
+        result.extend(estimates(doctor_id, entries, now))
+    return result
+
+
+def rebuild():
+    """Recompute every DurationStat row from the completed appointments.
+
+    Returns the number of rows written.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for appointment in Appointment.objects.filter(status='completed').only(
+        'doctor', 'appointment_date', 'check_in_time', 'called_time', 'started_time', 'completed_time',
+    ).iterator():
+        for metric, start, seconds in measure(appointment):
+            row = totals[_key(appointment.doctor_id, metric, start, seconds)]
+            row[0] += 1
+            row[1] += seconds
+
+    with transaction.atomic():
+        doctor_ids = set(DurationStat.objects.values_list('doctor_id', flat=True).distinct())
+        DurationStat.objects.all().delete()
+        DurationStat.objects.bulk_create([
+            DurationStat(
+                doctor_id=doctor_id, metric=metric, weekday=weekday, hour=hour,
+                bucket=bucket, count=count, total_seconds=seconds,
+            )
+            for (doctor_id, metric, weekday, hour, bucket), (count, seconds) in totals.items()
+        ], batch_size=500)
+    doctor_ids.update(doctor_id for doctor_id, *_ in totals)
+    cache.delete_many([profile_key(doctor_id) for doctor_id in doctor_ids])
+    return len(totals)
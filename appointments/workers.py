@@ -0,0 +1,48 @@
+"""
+Background workers
+
+Work a request should not wait for (sending channel messages, rendering
+announcement audio) is put on a queue and done by a daemon thread of the
+process. Each worker keeps one thread, started on first use and started
+again in a forked child, since gunicorn forks workers from a preloaded app
+and threads do not survive the fork.
+"""
+import os
+import queue
+import threading
+
+
+class BackgroundWorker:
+    """A queue drained by one daemon thread running ``_run()``"""
+
+    # Thread name, for logs and debuggers
+    name = 'background-worker'
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Started lazily, and again after a fork (gunicorn preloads the app)
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def put(self, item):
+        """Queue ``item`` for the worker thread; returns immediately"""
+        self._ensure_worker()
+        self._queue.put(item)
+
+    def flush(self):
+        """Block until everything queued so far has been handled"""
+        self._queue.join()
+
+    def _run(self):
+        """Take items off ``self._queue`` forever, calling ``task_done()`` for each"""
+        raise NotImplementedError
@@ -20,6 +20,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "diagcenter.settings")
 django_asgi_app = get_asgi_application()
 
 from appointments import routing as appointment_routing
+from lab import routing as lab_routing
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -27,6 +28,7 @@ application = ProtocolTypeRouter({
         AuthMiddlewareStack(
             URLRouter(
                 appointment_routing.websocket_urlpatterns
+                + lab_routing.websocket_urlpatterns
             )
         )
     ),
@@ -1,7 +1,7 @@
 """
 Production settings for nazipuruhs.com deployment
 Port: 8005
-Database: SQLite (production)
+Database: PostgreSQL (POSTGRES_* environment variables) or SQLite
 """
 
 from .settings import *
@@ -24,16 +24,67 @@ ALLOWED_HOSTS = [
     # 'YOUR.VPS.IP.ADDRESS',
 ]
 
-# Database - Production SQLite
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'data' / 'db_production.sqlite3',
-        'OPTIONS': {
-            'timeout': 20,
+# Database
+# PostgreSQL when POSTGRES_DB is set; otherwise the legacy SQLite file.
+# Move existing data across with:
+#   python manage.py migrate
+#   python manage.py migrate_from_sqlite data/db_production.sqlite3
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', 'hosp'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Keep connections open between requests (seconds), checked
+            # before reuse so a restarted server doesn't break requests
+            'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': 10,
+            },
         }
     }
-}
+    # Or a per-process psycopg pool (needs psycopg[pool]); Django requires
+    # CONN_MAX_AGE = 0 with it. Size it so workers * max_size stays below
+    # the server's max_connections.
+    if os.environ.get('POSTGRES_POOL_MAX_SIZE'):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', '1')),
+            'max_size': int(os.environ['POSTGRES_POOL_MAX_SIZE']),
+            'timeout': int(os.environ.get('POSTGRES_POOL_TIMEOUT', '10')),
+        }
+else:
+    # WAL journal, IMMEDIATE transactions and tuned PRAGMAs (see
+    # accounts/sqlite.py); compare with: python manage.py benchmark_sqlite
+    from accounts.sqlite import options as sqlite_options
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'data' / 'db_production.sqlite3',
+            'OPTIONS': sqlite_options(timeout=20),
+        }
+    }
+
+# Archived appointments, sales and income (see accounts/archive.py) go to a
+# separate SQLite file when ARCHIVE_SQLITE_PATH is set; create its table with
+#   python manage.py migrate accounts --database archive
+# and move old rows with: python manage.py archive_records
+if os.environ.get('ARCHIVE_SQLITE_PATH'):
+    from accounts.sqlite import options as sqlite_options
+
+    DATABASES['archive'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['ARCHIVE_SQLITE_PATH'],
+        'OPTIONS': sqlite_options(timeout=20),
+    }
+    ARCHIVE_DATABASE = 'archive'
+    DATABASE_ROUTERS = ['accounts.routers.ArchiveRouter']
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '365'))
 
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
@@ -47,6 +98,22 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Display monitor announcements (see appointments/announcements.py): clips
+# are cached under MEDIA_ROOT/announcements, which the web server must serve
+# at MEDIA_URL. pyttsx3 needs eSpeak NG with its Bengali voice installed;
+# warm the day's clips each morning with: python manage.py warm_announcements
+ANNOUNCEMENT_TTS_ENGINE = os.environ.get('ANNOUNCEMENT_TTS_ENGINE', 'pyttsx3')
+
+# Print pages as PDF (see accounts/documents.py). WeasyPrint needs Pango
+# installed; rendered PDFs are cached under data/pdf_cache and pruned by
+# close_day after DOCUMENT_CACHE_DAYS without a reprint.
+DOCUMENT_RENDER_WORKERS = int(os.environ.get('DOCUMENT_RENDER_WORKERS', '2'))
+
+# Lab worklist (see lab/worklist.py): one bench per test category unless
+# mapped here; routine tests waiting LAB_ESCALATE_AFTER minutes move up.
+LAB_BENCHES = {'BLOOD': 'haematology', 'BIOCHEMISTRY': 'biochemistry', 'STOOL': 'microbiology', 'MICROBIOLOGY': 'microbiology'}
+LAB_ESCALATE_AFTER = int(os.environ.get('LAB_ESCALATE_AFTER', '120'))
+
 # Security Settings
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -139,11 +206,13 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@nazipuruhs.com')
 
-# Cache Configuration (Optional - for better performance)
+# Cache Configuration
+# Shared between gunicorn and daphne workers (live queue state lives here),
+# so use the same Redis that backs the channel layer.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://127.0.0.1:6379/1'),
     }
 }
 
@@ -71,6 +71,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "accounts.middleware.QueryBudgetMiddleware",  # Per-view query report
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",  # CORS
     "django.middleware.common.CommonMiddleware",
@@ -84,7 +85,8 @@ ROOT_URLCONF = "diagcenter.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # Standard Django templates, timed for the query report
+        "BACKEND": "accounts.profiling.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -118,6 +120,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # File-backed test database so threaded tests see real SQLite locking
+        # (the default in-memory test database fails with "table is locked")
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
@@ -199,5 +204,13 @@ CORS_ALLOWED_ORIGINS = [
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
+# Query profiling (accounts.profiling): queries per request above the budget
+# are logged; the report covers the last QUERY_PROFILE_HOURS hours
+QUERY_PROFILING = True
+QUERY_BUDGET = 50
+QUERY_BUDGETS = {}
+QUERY_PROFILE_HOURS = 24
+QUERY_PROFILE_FLUSH_INTERVAL = 30  # seconds
+
 # Session Settings
 SESSION_COOKIE_AGE = 86400  # 24 hours
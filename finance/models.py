@@ -1,5 +1,7 @@
 from django.db import models
 from django.conf import settings
+from accounts.sequences import next_number
+from accounts.sqlite import retry_on_locked
 
 class Department(models.Model):
     """Departments in the diagnostic center"""
@@ -79,21 +81,12 @@ class Income(models.Model):
     def __str__(self):
         return f"{self.income_number} - {self.source} - {self.amount}"
     
+    @retry_on_locked
     def save(self, *args, **kwargs):
         if not self.income_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_income = Income.objects.filter(
-                income_number__startswith=f'INC{date_str}'
-            ).order_by('income_number').last()
-            
-            if last_income:
-                last_number = int(last_income.income_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.income_number = f'INC{date_str}{new_number:04d}'
+            self.income_number = next_number('INC', date_str, Income, 'income_number')
         
         super().save(*args, **kwargs)
 
@@ -172,17 +165,7 @@ class Expense(models.Model):
         if not self.expense_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_expense = Expense.objects.filter(
-                expense_number__startswith=f'EXP{date_str}'
-            ).order_by('expense_number').last()
-            
-            if last_expense:
-                last_number = int(last_expense.expense_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.expense_number = f'EXP{date_str}{new_number:04d}'
+            self.expense_number = next_number('EXP', date_str, Expense, 'expense_number')
         
         super().save(*args, **kwargs)
 
@@ -251,17 +234,7 @@ class InvestorPayout(models.Model):
         if not self.payout_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_payout = InvestorPayout.objects.filter(
-                payout_number__startswith=f'PAY{date_str}'
-            ).order_by('payout_number').last()
-            
-            if last_payout:
-                last_number = int(last_payout.payout_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.payout_number = f'PAY{date_str}{new_number:04d}'
+            self.payout_number = next_number('PAY', date_str, InvestorPayout, 'payout_number')
         
         super().save(*args, **kwargs)
 
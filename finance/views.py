@@ -59,10 +59,11 @@ class IncomeListView(LoginRequiredMixin, ListView):
         context['month_income'] = Income.objects.filter(date__gte=this_month_start).aggregate(Sum('amount'))['amount__sum'] or 0
         context['month_count'] = Income.objects.filter(date__gte=this_month_start).count()
         
-        context['total_income'] = Income.objects.aggregate(Sum('amount'))['amount__sum'] or 0
+        context['total_income'] = income_total()
         
         # Average income
-        total_count = Income.objects.count()
+        from accounts import archive
+        total_count = Income.objects.count() + archive.total('finance.Income')['count']
         context['avg_income'] = (context['total_income'] / total_count) if total_count > 0 else 0
         
         # Chart data - Last 7 days
@@ -297,13 +298,25 @@ def invoice_create(request):
 
 # ========== UTILITY VIEWS ==========
 
+def income_total(start=None, end=None):
+    """Income between two days (inclusive), archived entries included"""
+    from accounts import archive
+    incomes = Income.objects.all()
+    if start:
+        incomes = incomes.filter(date__gte=start)
+    if end:
+        incomes = incomes.filter(date__lte=end)
+    live = incomes.aggregate(Sum('amount'))['amount__sum'] or 0
+    return live + archive.total('finance.Income', start, end)['total']
+
+
 @login_required
 def finance_dashboard(request):
     """Finance dashboard"""
     today = timezone.now().date()
     this_month = today.replace(day=1)
     
-    total_income = Income.objects.aggregate(Sum('amount'))['amount__sum'] or 0
+    total_income = income_total()
     total_expense = Expense.objects.aggregate(Sum('amount'))['amount__sum'] or 0
     
     return render(request, 'finance/finance_dashboard.html', {
@@ -355,7 +368,7 @@ def financial_reports(request):
 def daily_report(request):
     """Daily financial report"""
     today = timezone.now().date()
-    income = Income.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
+    income = income_total(today, today)
     expense = Expense.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
     
     return render(request, 'finance/daily_report.html', {
@@ -371,7 +384,7 @@ def weekly_report(request):
     today = timezone.now().date()
     week_start = today - timedelta(days=today.weekday())
     
-    income = Income.objects.filter(date__gte=week_start).aggregate(Sum('amount'))['amount__sum'] or 0
+    income = income_total(week_start)
     expense = Expense.objects.filter(date__gte=week_start).aggregate(Sum('amount'))['amount__sum'] or 0
     
     return render(request, 'finance/weekly_report.html', {
@@ -387,7 +400,7 @@ def monthly_report(request):
     today = timezone.now().date()
     month_start = today.replace(day=1)
     
-    income = Income.objects.filter(date__gte=month_start).aggregate(Sum('amount'))['amount__sum'] or 0
+    income = income_total(month_start)
     expense = Expense.objects.filter(date__gte=month_start).aggregate(Sum('amount'))['amount__sum'] or 0
     
     return render(request, 'finance/monthly_report.html', {
@@ -403,7 +416,7 @@ def yearly_report(request):
     today = timezone.now().date()
     year_start = today.replace(month=1, day=1)
     
-    income = Income.objects.filter(date__gte=year_start).aggregate(Sum('amount'))['amount__sum'] or 0
+    income = income_total(year_start)
     expense = Expense.objects.filter(date__gte=year_start).aggregate(Sum('amount'))['amount__sum'] or 0
     
     return render(request, 'finance/yearly_report.html', {
@@ -1,3 +1,34 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import LabParameter, LabTest, ReferenceRange
+
+
+class LabParameterInline(admin.TabularInline):
+    model = LabParameter
+    extra = 1
+    fields = ['position', 'code', 'name', 'unit']
+    show_change_link = True
+
+
+class ReferenceRangeInline(admin.TabularInline):
+    model = ReferenceRange
+    extra = 1
+    fields = ['sex', 'min_age', 'max_age', 'low', 'high', 'critical_low', 'critical_high']
+
+
+@admin.register(LabTest)
+class LabTestAdmin(admin.ModelAdmin):
+    """Admin for lab tests and the parameters they measure"""
+    list_display = ['test_code', 'test_name', 'category', 'sample_type', 'price', 'is_active']
+    list_filter = ['category', 'is_active']
+    search_fields = ['test_code', 'test_name']
+    inlines = [LabParameterInline]
+
+
+@admin.register(LabParameter)
+class LabParameterAdmin(admin.ModelAdmin):
+    """Admin for test parameters and their reference ranges (see lab/results.py)"""
+    list_display = ['code', 'name', 'test', 'unit']
+    list_filter = ['test__category']
+    search_fields = ['code', 'name', 'test__test_name']
+    inlines = [ReferenceRangeInline]
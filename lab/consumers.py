@@ -0,0 +1,63 @@
+"""
+WebSocket consumer for lab worklist screens
+
+``ws/lab/worklist/`` follows every bench, ``ws/lab/bench/<bench>/`` one bench
+(see lab/worklist.py). On connect, and on ``{"type": "refresh"}``, the
+screen gets a ``worklist_snapshot`` with the queues and batches of its
+benches. Changes afterwards arrive as ``worklist_update`` frames whose
+``benches`` replace those benches' lists; a burst of changes (a run of
+results being entered) is coalesced into one frame by appointments.broadcast.
+"""
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+
+class LabWorklistConsumer(AsyncWebsocketConsumer):
+    """Live per-bench lab worklists"""
+    
+    async def connect(self):
+        from lab import worklist
+        
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        
+        self.bench = self.scope['url_route']['kwargs'].get('bench')
+        self.group_name = worklist.bench_group(self.bench) if self.bench else worklist.ALL_GROUP
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.send_snapshot()
+    
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+    
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        if data.get('type') == 'refresh':
+            await self.send_snapshot()
+    
+    @database_sync_to_async
+    def get_snapshot(self):
+        from lab import worklist
+        
+        return worklist.snapshot([self.bench] if self.bench else None)
+    
+    async def send_snapshot(self):
+        await self.send(text_data=json.dumps({
+            'type': 'worklist_snapshot',
+            'bench': self.bench,
+            'benches': await self.get_snapshot(),
+        }))
+    
+    async def queue_batch(self, event):
+        """A burst of worklist changes from the broadcast pipeline: the latest list of each bench"""
+        benches = {}
+        for message in event['events']:
+            if message['type'] == 'worklist':
+                benches[message['bench']] = {key: message[key] for key in ('name', 'queue', 'batches')}
+        if benches:
+            await self.send(text_data=json.dumps({'type': 'worklist_update', 'benches': benches}))
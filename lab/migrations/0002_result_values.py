@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lab', '0001_initial'),
+        ('patients', '0004_patient_merge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabParameter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(db_index=True, help_text='e.g., HB, K, HBA1C', max_length=20)),
+                ('name', models.CharField(max_length=200)),
+                ('unit', models.CharField(blank=True, help_text='e.g., g/dL, mmol/L', max_length=30)),
+                ('position', models.PositiveSmallIntegerField(default=0, help_text='Order on the report')),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameters', to='lab.labtest')),
+            ],
+            options={
+                'ordering': ['test', 'position', 'id'],
+                'unique_together': {('test', 'code')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ReferenceRange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sex', models.CharField(blank=True, choices=[('M', 'Male'), ('F', 'Female'), ('O', 'Other')], help_text='Blank for either', max_length=1)),
+                ('min_age', models.PositiveSmallIntegerField(default=0, help_text='Years, inclusive')),
+                ('max_age', models.PositiveSmallIntegerField(blank=True, help_text='Years, exclusive; blank for no limit', null=True)),
+                ('low', models.FloatField(blank=True, null=True)),
+                ('high', models.FloatField(blank=True, null=True)),
+                ('critical_low', models.FloatField(blank=True, null=True)),
+                ('critical_high', models.FloatField(blank=True, null=True)),
+                ('parameter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranges', to='lab.labparameter')),
+            ],
+            options={
+                'ordering': ['parameter', 'sex', 'min_age'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResultValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('measured_at', models.DateTimeField()),
+                ('value', models.FloatField()),
+                ('unit', models.CharField(blank=True, max_length=30)),
+                ('low', models.FloatField(blank=True, null=True)),
+                ('high', models.FloatField(blank=True, null=True)),
+                ('critical_low', models.FloatField(blank=True, null=True)),
+                ('critical_high', models.FloatField(blank=True, null=True)),
+                ('flag', models.CharField(blank=True, choices=[('', 'Normal'), ('L', 'Low'), ('H', 'High'), ('LL', 'Critically low'), ('HH', 'Critically high')], default='', max_length=2)),
+                ('parameter', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='values', to='lab.labparameter')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lab_values', to='patients.patient')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='values', to='lab.labresult')),
+            ],
+            options={
+                'ordering': ['measured_at', 'id'],
+                'indexes': [models.Index(fields=['parameter', 'patient', 'measured_at'], name='lab_value_patient_idx'), models.Index(fields=['parameter', 'flag', 'measured_at'], name='lab_value_flag_idx')],
+                'unique_together': {('result', 'parameter')},
+            },
+        ),
+    ]
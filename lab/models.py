@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from accounts.sequences import next_number
 from patients.models import Patient
 from appointments.models import Appointment
 
@@ -45,6 +46,49 @@ class LabTest(models.Model):
         return f"{self.test_code} - {self.test_name}"
 
 
+class LabParameter(models.Model):
+    """A value a test measures, e.g. Haemoglobin of a CBC (see lab/results.py)"""
+    
+    test = models.ForeignKey(LabTest, on_delete=models.CASCADE, related_name='parameters')
+    code = models.CharField(max_length=20, db_index=True, help_text="e.g., HB, K, HBA1C")
+    name = models.CharField(max_length=200)
+    unit = models.CharField(max_length=30, blank=True, help_text="e.g., g/dL, mmol/L")
+    position = models.PositiveSmallIntegerField(default=0, help_text="Order on the report")
+    
+    class Meta:
+        ordering = ['test', 'position', 'id']
+        unique_together = ['test', 'code']
+    
+    def __str__(self):
+        return f"{self.test.test_code} {self.name}"
+    
+    def save(self, *args, **kwargs):
+        # Looked up by code across tests (lab/results.py), so one spelling
+        self.code = self.code.strip().upper()
+        super().save(*args, **kwargs)
+
+
+class ReferenceRange(models.Model):
+    """Normal and critical limits of a parameter for a sex and age band"""
+    
+    parameter = models.ForeignKey(LabParameter, on_delete=models.CASCADE, related_name='ranges')
+    sex = models.CharField(max_length=1, choices=Patient.GENDER_CHOICES, blank=True, help_text="Blank for either")
+    min_age = models.PositiveSmallIntegerField(default=0, help_text="Years, inclusive")
+    max_age = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Years, exclusive; blank for no limit")
+    
+    low = models.FloatField(null=True, blank=True)
+    high = models.FloatField(null=True, blank=True)
+    critical_low = models.FloatField(null=True, blank=True)
+    critical_high = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['parameter', 'sex', 'min_age']
+    
+    def __str__(self):
+        ages = f"{self.min_age}-{self.max_age if self.max_age is not None else ''}"
+        return f"{self.parameter} {self.sex or 'any'} {ages}: {self.low}-{self.high}"
+
+
 class LabOrder(models.Model):
     """Lab test order from doctor"""
     
@@ -108,17 +152,7 @@ class LabOrder(models.Model):
         if not self.order_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_order = LabOrder.objects.filter(
-                order_number__startswith=f'LAB{date_str}'
-            ).order_by('order_number').last()
-            
-            if last_order:
-                last_number = int(last_order.order_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.order_number = f'LAB{date_str}{new_number:04d}'
+            self.order_number = next_number('LAB', date_str, LabOrder, 'order_number')
         
         super().save(*args, **kwargs)
     
@@ -180,3 +214,53 @@ class LabResult(models.Model):
         self.verified_by = user
         self.verified_at = timezone.now()
         self.save()
+
+
+class ResultValue(models.Model):
+    """One measured value of a result, flagged against its reference range.
+    
+    The limits it was flagged against are kept with it, so later changes to
+    the ranges do not change reported results. The patient and the time are
+    copied from the result for the indexes (see lab/results.py).
+    """
+    
+    FLAG_CHOICES = [
+        ('', 'Normal'),
+        ('L', 'Low'),
+        ('H', 'High'),
+        ('LL', 'Critically low'),
+        ('HH', 'Critically high'),
+    ]
+    
+    result = models.ForeignKey(LabResult, on_delete=models.CASCADE, related_name='values')
+    # Indexed through the composite indexes below, which start with the parameter
+    parameter = models.ForeignKey(LabParameter, on_delete=models.CASCADE, related_name='values', db_index=False)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='lab_values')
+    measured_at = models.DateTimeField()
+    
+    value = models.FloatField()
+    unit = models.CharField(max_length=30, blank=True)
+    
+    # The reference range applied
+    low = models.FloatField(null=True, blank=True)
+    high = models.FloatField(null=True, blank=True)
+    critical_low = models.FloatField(null=True, blank=True)
+    critical_high = models.FloatField(null=True, blank=True)
+    flag = models.CharField(max_length=2, choices=FLAG_CHOICES, blank=True, default='')
+    
+    class Meta:
+        ordering = ['measured_at', 'id']
+        unique_together = ['result', 'parameter']
+        indexes = [
+            # A patient's values of a parameter over time
+            models.Index(fields=['parameter', 'patient', 'measured_at'], name='lab_value_patient_idx'),
+            # Flagged (e.g. critical) values of a parameter by date
+            models.Index(fields=['parameter', 'flag', 'measured_at'], name='lab_value_flag_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.parameter.code} {self.value} {self.unit} {self.flag}".strip()
+    
+    @property
+    def is_critical(self):
+        return self.flag in ('LL', 'HH')
@@ -0,0 +1,207 @@
+"""
+Structured lab results
+
+A LabTest measures one or more LabParameters (a CBC: haemoglobin, WBC,
+platelets; a single test: one), each with a unit and ReferenceRanges by sex
+and age band. Entered values are stored one ResultValue per parameter, with
+the limits of the range that applied to the patient, and flagged L/H below
+or above the normal limits and LL/HH beyond the critical ones.
+
+Flags are computed by the database for a whole order at once: record()
+inserts every value of the order's panels with bulk_create and flags them
+with a single UPDATE (flag_expression()), not value by value in Python.
+
+ResultValue carries the patient and time of its result, indexed with the
+parameter, so history() ("a patient's HbA1c over time") and flagged() ("all
+critical potassium today") are index lookups instead of scans of
+LabResult.result_data. result_data keeps a copy of the values, flags
+included, for the report templates and the patient timeline.
+"""
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, Prefetch, Value, When
+from django.utils import timezone
+
+CRITICAL = ('LL', 'HH')
+ABNORMAL = ('L', 'H') + CRITICAL
+
+LIMITS = ('low', 'high', 'critical_low', 'critical_high')
+
+
+def select_range(ranges, sex, age):
+    """The range for a patient: the narrowest age band, a sex-specific one over one for either"""
+    matching = [
+        reference for reference in ranges
+        if reference.sex in ('', sex) and reference.min_age <= age
+        and (reference.max_age is None or age < reference.max_age)
+    ]
+    if not matching:
+        return None
+    return min(matching, key=lambda reference: (
+        (reference.max_age if reference.max_age is not None else 200) - reference.min_age,
+        reference.sex == '',
+    ))
+
+
+def flag_expression():
+    """The flag of a ResultValue row, as an SQL expression over its own limits"""
+    return Case(
+        When(value__lt=F('critical_low'), then=Value('LL')),
+        When(value__gt=F('critical_high'), then=Value('HH')),
+        When(value__lt=F('low'), then=Value('L')),
+        When(value__gt=F('high'), then=Value('H')),
+        default=Value(''),
+    )
+
+
+def flag(queryset):
+    """Recompute the flags of the ResultValues in ``queryset`` in one UPDATE"""
+    return queryset.update(flag=flag_expression())
+
+
+def parse_value(raw):
+    """A number from an entered value (``12.5``, ``12,5``); None for blank"""
+    text = str(raw).strip().replace(',', '.')
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        raise ValidationError(f'"{raw}" is not a number.')
+
+
+def _parameters():
+    from .models import LabParameter
+
+    return Prefetch('parameters', queryset=LabParameter.objects.prefetch_related('ranges'))
+
+
+def entry_panels(order):
+    """Each test of an order with its parameters and the range that applies to the patient"""
+    patient = order.patient
+    age = patient.age_on(timezone.localdate())
+    tests = order.tests.prefetch_related(_parameters())
+    return [
+        {
+            'test': test,
+            'parameters': [
+                {'parameter': parameter, 'range': select_range(parameter.ranges.all(), patient.gender, age)}
+                for parameter in test.parameters.all()
+            ],
+        }
+        for test in tests
+    ]
+
+
+def record(order, panels, tested_by=None):
+    """Store and flag the values of an order's panels; returns ``{test id: LabResult}``.
+
+    ``panels`` is ``{test: {parameter code: value}}``, values as entered
+    (blank ones are left out). Entering a panel again replaces its values.
+    Raises ValidationError for values that are not numbers or parameters
+    the test does not have.
+    """
+    from .models import LabResult, ResultValue
+
+    patient = order.patient
+    now = timezone.now()
+    age = patient.age_on(timezone.localdate(now))
+    tests = {
+        test.pk: test
+        for test in order.tests.filter(pk__in=[getattr(test, 'pk', test) for test in panels]).prefetch_related(
+            _parameters()
+        )
+    }
+
+    entered = {}
+    errors = []
+    for test, values in panels.items():
+        test = tests.get(getattr(test, 'pk', test))
+        if test is None:
+            errors.append('A test that is not on this order.')
+            continue
+        parameters = {parameter.code.upper(): parameter for parameter in test.parameters.all()}
+        for code, raw in values.items():
+            parameter = parameters.get(str(code).upper())
+            if parameter is None:
+                errors.append(f'{test.test_name} has no parameter {code}.')
+                continue
+            try:
+                value = parse_value(raw)
+            except ValidationError as error:
+                errors.append(f'{test.test_name} {parameter.name}: {error.messages[0]}')
+                continue
+            if value is not None:
+                entered.setdefault(test.pk, []).append((parameter, value))
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        results = {}
+        for test_id in entered:
+            result, _ = LabResult.objects.get_or_create(
+                order=order, test=tests[test_id], defaults={'tested_by': tested_by},
+            )
+            results[test_id] = result
+        ResultValue.objects.filter(result__in=results.values()).delete()
+
+        rows = []
+        for test_id, values in entered.items():
+            for parameter, value in values:
+                reference = select_range(parameter.ranges.all(), patient.gender, age)
+                rows.append(ResultValue(
+                    result=results[test_id], parameter=parameter, patient=patient, measured_at=now,
+                    value=value, unit=parameter.unit,
+                    **{limit: getattr(reference, limit, None) for limit in LIMITS},
+                ))
+        ResultValue.objects.bulk_create(rows)
+        # Every value of the order flagged at once
+        flag(ResultValue.objects.filter(result__in=results.values()))
+
+        data = {}
+        for code, unit, value, flag_value, result_id, low, high in ResultValue.objects.filter(
+            result__in=results.values()
+        ).order_by('parameter__position', 'parameter_id').values_list(
+            'parameter__code', 'unit', 'value', 'flag', 'result_id', 'low', 'high',
+        ):
+            data.setdefault(result_id, {})[code] = {
+                'value': value, 'unit': unit, 'flag': flag_value, 'low': low, 'high': high,
+            }
+        for result in results.values():
+            result.result_data = data.get(result.pk, {})
+            if tested_by and not result.tested_by_id:
+                result.tested_by = tested_by
+            result.save()
+    return results
+
+
+def parameter_ids(code):
+    """Ids of the parameters with ``code``, in every test that has one"""
+    from .models import LabParameter
+
+    return list(LabParameter.objects.filter(code=code.upper()).values_list('pk', flat=True))
+
+
+def history(patient, code, since=None):
+    """A patient's values of parameter ``code`` (any test), oldest first"""
+    from .models import ResultValue
+
+    # The parameters first, so the lookup is on (parameter, patient, measured_at)
+    values = ResultValue.objects.filter(parameter__in=parameter_ids(code), patient=patient)
+    if since:
+        values = values.filter(measured_at__gte=since)
+    return values.order_by('measured_at', 'id')
+
+
+def flagged(code, flags=CRITICAL, day=None):
+    """Values of parameter ``code`` with one of ``flags`` measured on ``day`` (default today)"""
+    from .models import ResultValue
+
+    day = day or timezone.localdate()
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return ResultValue.objects.filter(
+        parameter__in=parameter_ids(code), flag__in=flags,
+        measured_at__gte=start, measured_at__lt=start + datetime.timedelta(days=1),
+    ).select_related('patient', 'parameter', 'result__order')
@@ -0,0 +1,7 @@
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'ws/lab/worklist/$', consumers.LabWorklistConsumer.as_asgi()),
+    re_path(r'ws/lab/bench/(?P<bench>[\w.-]+)/$', consumers.LabWorklistConsumer.as_asgi()),
+]
@@ -0,0 +1,36 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import worklist
+from .models import LabOrder, LabResult
+
+
+@receiver(post_save, sender=LabOrder)
+def order_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        worklist.publish_after_commit(orders=[instance.pk])
+
+
+@receiver(post_delete, sender=LabOrder)
+def order_deleted(sender, instance, **kwargs):
+    # Its tests are gone with it: refresh every bench
+    worklist.publish_after_commit(worklist.all_benches())
+
+
+@receiver(post_save, sender=LabResult)
+@receiver(post_delete, sender=LabResult)
+def result_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        worklist.publish_after_commit(tests=[instance.test_id])
+
+
+@receiver(m2m_changed, sender=LabOrder.tests.through)
+def tests_changed(sender, instance, action, reverse, pk_set=None, **kwargs):
+    if action == 'post_clear':
+        worklist.publish_after_commit(worklist.all_benches())
+    elif action in ('post_add', 'post_remove'):
+        # The tests removed are off the order by now: name them too
+        if reverse:
+            worklist.publish_after_commit(orders=pk_set, tests=[instance.pk])
+        else:
+            worklist.publish_after_commit(orders=[instance.pk], tests=pk_set)
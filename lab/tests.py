@@ -1,13 +1,20 @@
 """
 Comprehensive tests for Lab module views and endpoints
 """
-from django.test import TestCase, Client
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
 
-from .models import LabTest, LabOrder, LabResult
+from . import results, worklist
+from .models import LabTest, LabOrder, LabParameter, LabResult, ReferenceRange, ResultValue
+from accounts.models import DailyRollup
 from patients.models import Patient
 
 User = get_user_model()
@@ -292,3 +299,336 @@ class LabOrderWorkflowTestCase(TestCase):
         )
         self.assertEqual(response.status_code, 200)
 
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+
+
+class LabWorklistMixin:
+    """Orders on two benches for the worklist tests"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='labtech', password='testpass123', role='LAB_TECH')
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth='1990-01-01', gender='M',
+            phone='01700000000', address='Bazar Road', city='Naogaon',
+            emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+        self.cbc = self.lab_test('CBC', 'Complete Blood Count', 'BLOOD', 'Blood')
+        self.esr = self.lab_test('ESR', 'ESR', 'BLOOD', 'blood ')
+        self.sugar = self.lab_test('FBS', 'Fasting Blood Sugar', 'BIOCHEMISTRY', 'Serum')
+        self.urine = self.lab_test('URE', 'Urine R/E', 'URINE', 'Urine')
+    
+    def lab_test(self, code, name, category, sample_type):
+        return LabTest.objects.create(
+            test_code=code, test_name=name, category=category, price=300,
+            sample_type=sample_type, turnaround_time='Same day',
+        )
+    
+    def order(self, *tests, priority=False, status='ORDERED', minutes_ago=0):
+        order = LabOrder.objects.create(patient=self.patient, ordered_by=self.user, priority=priority, status=status)
+        order.tests.add(*tests)
+        LabOrder.objects.filter(pk=order.pk).update(ordered_at=timezone.now() - timedelta(minutes=minutes_ago))
+        order.refresh_from_db()
+        return order
+
+
+class LabWorklistTestCase(LabWorklistMixin, TestCase):
+    """Test the per-bench lab worklist"""
+    
+    def test_queues_by_urgency_then_age(self):
+        routine = self.order(self.cbc, status='SAMPLE_COLLECTED', minutes_ago=30)
+        overdue = self.order(self.cbc, status='SAMPLE_COLLECTED', minutes_ago=200)
+        urgent = self.order(self.cbc, priority=True, status='SAMPLE_COLLECTED', minutes_ago=5)
+        older = self.order(self.cbc, status='SAMPLE_COLLECTED', minutes_ago=60)
+        
+        queue = worklist.snapshot()['blood']['queue']
+        self.assertEqual([entry['order_id'] for entry in queue], [urgent.pk, overdue.pk, older.pk, routine.pk])
+        self.assertEqual([entry['overdue'] for entry in queue], [False, True, False, False])
+    
+    def test_benches_and_batches(self):
+        waiting = self.order(self.cbc, self.urine)
+        collected = self.order(self.cbc, self.esr, self.sugar, self.urine, status='SAMPLE_COLLECTED', minutes_ago=10)
+        LabResult.objects.create(order=collected, test=self.urine, result_data={}, tested_by=self.user)
+        
+        with self.settings(LAB_BENCHES={'BLOOD': 'haematology', 'BIOCHEMISTRY': 'haematology'}):
+            benches = worklist.snapshot()
+        self.assertEqual(sorted(benches), ['collection', 'haematology'])
+        self.assertEqual(len(benches['collection']['queue']), 2)
+        self.assertEqual({entry['order_id'] for entry in benches['collection']['queue']}, {waiting.pk})
+        
+        # CBC and ESR share a tube whatever the spelling; the result entered is off the list
+        batches = benches['haematology']['batches']
+        self.assertEqual([batch['sample_type'] for batch in batches], ['Blood', 'Serum'])
+        self.assertEqual([entry['test_code'] for entry in batches[0]['items']], ['CBC', 'ESR'])
+        self.assertEqual(batches[0]['orders'], [collected.pk])
+        
+        # A bench asked for by name is there even when empty
+        self.assertEqual(worklist.snapshot(['urine'])['urine']['queue'], [])
+    
+    def test_fixed_number_of_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        self.order(self.cbc, status='SAMPLE_COLLECTED')
+        with CaptureQueriesContext(connection) as few:
+            worklist.snapshot()
+        for _ in range(5):
+            self.order(self.cbc, self.sugar, status='SAMPLE_COLLECTED')
+        with CaptureQueriesContext(connection) as many:
+            worklist.snapshot()
+        self.assertEqual(len(few), len(many))
+    
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+    def test_changes_are_pushed_to_the_benches(self):
+        from appointments.broadcast import broadcaster
+        
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(worklist.bench_group('blood'), channel)
+        order = self.order(self.cbc, status='SAMPLE_COLLECTED')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            LabResult.objects.create(order=order, test=self.cbc, result_data={'hb': 13}, tested_by=self.user)
+        broadcaster.flush()
+        message = async_to_sync(channel_layer.receive)(channel)
+        self.assertEqual(message['type'], 'queue_batch')
+        event = message['events'][-1]
+        self.assertEqual((event['type'], event['bench'], event['queue']), ('worklist', 'blood', []))
+    
+    def test_worklist_view_and_start_batch(self):
+        self.client.force_login(self.user)
+        first = self.order(self.cbc, status='SAMPLE_COLLECTED', minutes_ago=20)
+        second = self.order(self.esr, self.sugar, status='SAMPLE_COLLECTED')
+        self.order(self.urine, status='SAMPLE_COLLECTED')
+        
+        data = self.client.get(reverse('lab:worklist'), {'bench': 'blood', 'format': 'json'}).json()
+        self.assertEqual(list(data['benches']), ['blood'])
+        self.assertEqual(len(data['benches']['blood']['queue']), 2)
+        self.assertContains(self.client.get(reverse('lab:worklist')), 'Fasting Blood Sugar')
+        
+        response = self.client.post(
+            reverse('lab:start_batch') + '?format=json', {'bench': 'blood', 'sample_type': 'Blood'}
+        )
+        self.assertEqual(response.json()['orders'], [first.pk, second.pk])
+        self.assertEqual(
+            list(LabOrder.objects.order_by('pk').values_list('status', flat=True)),
+            ['IN_PROGRESS', 'IN_PROGRESS', 'SAMPLE_COLLECTED'],
+        )
+        
+        # The dashboard rollups follow the bulk update
+        by_status = dict(DailyRollup.objects.filter(metric='lab_orders').values_list('source', 'count'))
+        self.assertEqual((by_status['IN_PROGRESS'], by_status['SAMPLE_COLLECTED']), (2, 1))
+    
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+    def test_one_publish_per_transaction(self):
+        from appointments.broadcast import broadcaster
+        
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(worklist.ALL_GROUP, channel)
+        order = self.order(self.cbc, self.esr, self.sugar, status='SAMPLE_COLLECTED')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for test in (self.cbc, self.esr):
+                    result = LabResult.objects.create(order=order, test=test, result_data={}, tested_by=self.user)
+                    result.save()
+                order.save()
+        broadcaster.flush()
+        events = async_to_sync(channel_layer.receive)(channel)['events']
+        self.assertEqual(sorted(event['bench'] for event in events), ['biochemistry', 'blood', 'collection'])
+    
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+    def test_start_batch_publishes_every_bench_of_its_orders(self):
+        from appointments.broadcast import broadcaster
+        
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(worklist.bench_group('biochemistry'), channel)
+        order = self.order(self.cbc, self.sugar, status='SAMPLE_COLLECTED')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(worklist.start_batch('blood', 'Blood'), [order.pk])
+        broadcaster.flush()
+        event = async_to_sync(channel_layer.receive)(channel)['events'][-1]
+        self.assertEqual((event['bench'], event['queue'][0]['status']), ('biochemistry', 'IN_PROGRESS'))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class LabWorklistConsumerTestCase(LabWorklistMixin, TransactionTestCase):
+    """Test the worklist WebSocket"""
+    
+    def connect(self, path, user):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from .routing import websocket_urlpatterns
+        
+        async def handshake():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            message = await communicator.receive_json_from() if connected else None
+            await communicator.disconnect()
+            return connected, message
+        
+        return async_to_sync(handshake)()
+    
+    def test_connect_sends_the_bench_snapshot(self):
+        from django.contrib.auth.models import AnonymousUser
+        
+        order = self.order(self.cbc, status='SAMPLE_COLLECTED')
+        self.order(self.urine, status='SAMPLE_COLLECTED')
+        
+        connected, message = self.connect('/ws/lab/bench/blood/', self.user)
+        self.assertTrue(connected)
+        self.assertEqual(message['type'], 'worklist_snapshot')
+        self.assertEqual(list(message['benches']), ['blood'])
+        self.assertEqual(message['benches']['blood']['queue'][0]['order_id'], order.pk)
+        
+        self.assertFalse(self.connect('/ws/lab/worklist/', AnonymousUser())[0])
+
+    def test_snapshot_is_built_on_the_worker(self):
+        from appointments.broadcast import broadcaster
+
+        threads = []
+        snapshot = worklist.snapshot
+
+        def recording_snapshot(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return snapshot(*args, **kwargs)
+
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(worklist.bench_group('blood'), channel)
+        worklist.snapshot = recording_snapshot
+        try:
+            order = self.order(self.cbc, status='SAMPLE_COLLECTED')
+            broadcaster.flush()
+        finally:
+            worklist.snapshot = snapshot
+        self.assertEqual(set(threads), {broadcaster.name})
+        events = []
+        while not events or events[-1]['queue'] == []:
+            events += [event for event in async_to_sync(channel_layer.receive)(channel)['events'] if event['bench'] == 'blood']
+        self.assertEqual(events[-1]['queue'][0]['order_id'], order.pk)
+
+
+class LabResultValuesTestCase(LabWorklistMixin, TestCase):
+    """Test structured results, reference ranges and flagging"""
+    
+    def setUp(self):
+        super().setUp()
+        self.hb = self.parameter(self.cbc, 'hb', 'Haemoglobin', 'g/dL', [
+            ('M', 0, None, 13, 17, 7, 20), ('F', 0, None, 12, 15, 7, 20), ('', 0, 12, 11, 14, 7, 20),
+        ])
+        self.wbc = self.parameter(self.cbc, 'WBC', 'White Cells', '10^9/L', [('', 0, None, 4, 11, 2, 30)])
+        self.platelets = self.parameter(self.cbc, 'PLT', 'Platelets', '10^9/L', [('', 0, None, 150, 450, 50, 1000)])
+        self.k = self.parameter(self.sugar, 'K', 'Potassium', 'mmol/L', [('', 0, None, 3.5, 5.1, 2.5, 6.5)])
+        self.order_ = self.order(self.cbc, self.sugar, status='IN_PROGRESS')
+    
+    def parameter(self, test, code, name, unit, ranges):
+        parameter = LabParameter.objects.create(test=test, code=code, name=name, unit=unit, position=len(ranges))
+        for sex, min_age, max_age, low, high, critical_low, critical_high in ranges:
+            ReferenceRange.objects.create(
+                parameter=parameter, sex=sex, min_age=min_age, max_age=max_age,
+                low=low, high=high, critical_low=critical_low, critical_high=critical_high,
+            )
+        return parameter
+    
+    def test_range_for_sex_and_age(self):
+        ranges = list(self.hb.ranges.all())
+        self.assertEqual(results.select_range(ranges, 'F', 30).low, 12)
+        self.assertEqual(results.select_range(ranges, 'M', 30).low, 13)
+        self.assertEqual(results.select_range(ranges, 'M', 8).low, 11)
+        self.assertIsNone(results.select_range([ranges[2]], 'O', 40))
+    
+    def test_panel_is_stored_and_flagged(self):
+        saved = results.record(self.order_, {
+            self.cbc: {'HB': '6.5', 'wbc': '12,5', 'PLT': ''},
+            self.sugar: {'K': '7'},
+        }, tested_by=self.user)
+        
+        values = {value.parameter.code: value for value in ResultValue.objects.select_related('parameter')}
+        self.assertEqual(sorted(values), ['HB', 'K', 'WBC'])
+        self.assertEqual({code: value.flag for code, value in values.items()}, {'HB': 'LL', 'WBC': 'H', 'K': 'HH'})
+        self.assertEqual((values['HB'].low, values['HB'].high, values['HB'].unit), (13, 17, 'g/dL'))
+        self.assertEqual(values['K'].patient, self.patient)
+        cbc = saved[self.cbc.pk]
+        cbc.refresh_from_db()
+        self.assertEqual(cbc.result_data['WBC'], {'value': 12.5, 'unit': '10^9/L', 'flag': 'H', 'low': 4, 'high': 11})
+        
+        # Entered again: replaced, and flagged from the new values
+        results.record(self.order_, {self.cbc: {'HB': '14', 'WBC': '7'}})
+        self.assertEqual(
+            dict(ResultValue.objects.filter(result=cbc).values_list('parameter__code', 'flag')), {'HB': '', 'WBC': ''},
+        )
+    
+    def test_queries_do_not_grow_with_the_panel(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        results.record(self.order_, {self.cbc: {'HB': '14'}})
+        with CaptureQueriesContext(connection) as one:
+            results.record(self.order_, {self.cbc: {'HB': '14'}})
+        with CaptureQueriesContext(connection) as three:
+            results.record(self.order_, {self.cbc: {'HB': '14', 'WBC': '7', 'PLT': '200'}})
+        self.assertEqual(len(one), len(three))
+    
+    def test_invalid_values_store_nothing(self):
+        from django.core.exceptions import ValidationError
+        
+        with self.assertRaises(ValidationError) as raised:
+            results.record(self.order_, {self.cbc: {'HB': 'high', 'ALT': '40'}})
+        self.assertEqual(len(raised.exception.messages), 2)
+        self.assertFalse(LabResult.objects.exists())
+    
+    def test_history_and_flagged_use_the_indexes(self):
+        from django.db import connection
+        
+        results.record(self.order_, {self.sugar: {'K': '7'}})
+        later = self.order(self.sugar, status='IN_PROGRESS')
+        results.record(later, {self.sugar: {'K': '4.2'}})
+        
+        self.assertEqual([value.value for value in results.history(self.patient, 'k')], [7, 4.2])
+        self.assertEqual([value.result.order for value in results.flagged('K')], [self.order_])
+        self.assertFalse(results.flagged('K', day=timezone.localdate() - timedelta(days=1)).exists())
+        
+        if connection.vendor == 'sqlite':
+            for queryset, index in (
+                (results.history(self.patient, 'K'), 'lab_value_patient_idx'),
+                (results.flagged('K'), 'lab_value_flag_idx'),
+            ):
+                self.assertIn(index, queryset.explain())
+    
+    def test_enter_results_view(self):
+        self.client.force_login(self.user)
+        self.order_.tests.add(self.urine)
+        url = reverse('lab:result_entry', args=[self.order_.pk])
+        response = self.client.get(url)
+        self.assertContains(response, f'name="param_{self.hb.pk}"')
+        self.assertContains(response, '13.0 – 17.0')
+        
+        response = self.client.post(url, {
+            'test_id[]': [self.cbc.pk, self.sugar.pk, self.urine.pk],
+            'result_value[]': ['', '', 'Clear'],
+            'status[]': ['', '', 'normal'],
+            'interpretation[]': ['Anaemia', '', ''],
+            f'param_{self.hb.pk}': '6',
+            f'param_{self.k.pk}': '4.0',
+            'action': 'submit_and_verify',
+        }, follow=True)
+        self.assertContains(response, 'Critical value: Haemoglobin 6 g/dL (Critically low)')
+        self.order_.refresh_from_db()
+        self.assertEqual(self.order_.status, 'COMPLETED')
+        self.assertEqual(
+            list(self.order_.results.order_by('test__test_code').values_list('test__test_code', 'is_verified')),
+            [('CBC', True), ('FBS', True), ('URE', True)],
+        )
+        self.assertEqual(self.order_.results.get(test=self.cbc).interpretation, 'Anaemia')
+        self.assertEqual(self.order_.results.get(test=self.urine).result_data, {'value': 'Clear', 'status': 'normal'})
+        
+        response = self.client.post(url, {'test_id[]': [self.cbc.pk], f'param_{self.hb.pk}': 'n/a'})
+        self.assertContains(response, 'is not a number')
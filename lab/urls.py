@@ -23,6 +23,10 @@ urlpatterns = [
     path('order/<int:pk>/report/print/', views.print_report, name='report_print'),
     path('order/<int:pk>/report/preview/', views.print_report, name='report_preview'),
     
+    # Worklist
+    path('worklist/', views.worklist_view, name='worklist'),
+    path('worklist/start-batch/', views.start_batch, name='start_batch'),
+    
     # Sample Collection & QC
     path('sample-collection/', views.sample_collection_view, name='sample_collection'),
     path('quality-control/', views.quality_control_view, name='quality_control'),
@@ -2,16 +2,19 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Sum, Count, Q
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponse
 from django.views.generic import ListView, CreateView, UpdateView, DetailView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.views.decorators.http import require_POST
 from datetime import timedelta
 import json
 
-from .models import LabTest, LabOrder, LabResult
+from .models import LabTest, LabOrder, LabResult, ResultValue
 from .forms import LabTestForm
+from . import worklist
 from patients.models import Patient
 
 
@@ -38,6 +41,9 @@ class LabOrderListView(LoginRequiredMixin, ListView):
         if self.request.GET.get('priority'):
             queryset = queryset.filter(priority=True)
         
+        # Work still to do: urgent first, then oldest first (see lab/worklist.py)
+        if status in worklist.AWAITING_SAMPLE + worklist.AT_BENCH:
+            return queryset.order_by('-priority', 'ordered_at')
         return queryset.order_by('-ordered_at')
     
     def get_context_data(self, **kwargs):
@@ -137,21 +143,75 @@ def cancel_order(request, pk):
 
 @login_required
 def enter_results(request, pk):
-    """Enter lab results"""
-    order = get_object_or_404(LabOrder, pk=pk)
+    """Enter lab results: numeric values per parameter, flagged on save (see lab/results.py)"""
+    from django.core.exceptions import ValidationError
+    
+    from . import results
+    
+    order = get_object_or_404(LabOrder.objects.select_related('patient'), pk=pk)
+    panels = results.entry_panels(order)
     
     if request.method == 'POST':
-        # Process result form
-        order.status = 'COMPLETED'
-        order.save()
+        test_ids = request.POST.getlist('test_id[]')
+        texts = request.POST.getlist('result_value[]')
+        statuses = request.POST.getlist('status[]')
+        interpretations = request.POST.getlist('interpretation[]')
         
-        messages.success(request, f'Results saved for order {order.order_number}')
-        return redirect('lab:order_list')
+        # Tests with parameters take a number per parameter; the others a text result
+        values = {}
+        texts_by_test = {}
+        for panel in panels:
+            test = panel['test']
+            if panel['parameters']:
+                values[test] = {
+                    entry['parameter'].code: request.POST.get(f"param_{entry['parameter'].pk}", '')
+                    for entry in panel['parameters']
+                }
+        for index, test_id in enumerate(test_ids):
+            texts_by_test[test_id] = {
+                'text': texts[index].strip() if index < len(texts) else '',
+                'status': statuses[index] if index < len(statuses) else 'normal',
+                'interpretation': interpretations[index].strip() if index < len(interpretations) else '',
+            }
+        
+        try:
+            with transaction.atomic():
+                saved = results.record(order, values, tested_by=request.user)
+                for panel in panels:
+                    test = panel['test']
+                    entry = texts_by_test.get(str(test.pk), {})
+                    result = saved.get(test.pk)
+                    if result is None and not panel['parameters'] and entry.get('text'):
+                        result, _ = LabResult.objects.get_or_create(
+                            order=order, test=test, defaults={'tested_by': request.user}
+                        )
+                        result.result_data = {'value': entry['text'], 'status': entry['status']}
+                    if result is None:
+                        continue
+                    result.interpretation = entry.get('interpretation', '')
+                    result.notes = request.POST.get('lab_notes', '').strip()
+                    result.save()
+                    if request.POST.get('action') == 'submit_and_verify':
+                        result.verify(request.user)
+                    saved[test.pk] = result
+                
+                order.status = 'COMPLETED'
+                order.save()
+        except ValidationError as error:
+            for message in error.messages:
+                messages.error(request, message)
+        else:
+            critical = ResultValue.objects.filter(result__order=order, flag__in=results.CRITICAL).select_related('parameter')
+            for value in critical:
+                messages.warning(request, f'Critical value: {value.parameter.name} {value.value:g} {value.unit} ({value.get_flag_display()})')
+            messages.success(request, f'Results saved for order {order.order_number}')
+            return redirect('lab:order_list')
     
     context = {
         'order': order,
-        'tests': order.tests.all(),
-        'total_tests': order.tests.count(),
+        'panels': panels,
+        'tests': [panel['test'] for panel in panels],
+        'total_tests': len(panels),
         'technicians': request.user.__class__.objects.filter(role='LAB_TECH') if hasattr(request.user, 'role') else [],
         'today': timezone.now().date().isoformat(),
         'now': timezone.now().time().strftime('%H:%M'),
@@ -178,16 +238,19 @@ def view_report(request, pk):
 
 @login_required
 def print_report(request, pk):
-    """Print lab report"""
+    """Print lab report (as PDF with ?format=pdf)"""
+    from accounts import documents
+    
     order = get_object_or_404(LabOrder, pk=pk)
     
     context = {
         'order': order,
         'tests': order.tests.all(),
+        'results': order.results.select_related('test').prefetch_related('values__parameter'),
         'patient': order.patient,
         'today': timezone.now(),
     }
-    return render(request, 'lab/lab_report_print.html', context)
+    return documents.print_response(request, 'lab/lab_report_print.html', context, f'{order.order_number}.pdf')
 
 
 @login_required
@@ -211,6 +274,13 @@ def lab_dashboard(request):
         ).count(),
         'total_orders': LabOrder.objects.count(),
         'recent_orders': LabOrder.objects.select_related('patient', 'ordered_by').order_by('-ordered_at')[:10],
+        # Urgent first, then oldest first, as on the worklist
+        'pending_lab_orders': LabOrder.objects.filter(status='ORDERED').select_related(
+            'patient', 'ordered_by'
+        ).order_by('-priority', 'ordered_at')[:10],
+        'in_progress_lab_orders': LabOrder.objects.filter(status__in=worklist.AT_BENCH).select_related(
+            'patient'
+        ).order_by('-priority', 'ordered_at')[:10],
     }
     return render(request, 'accounts/lab_dashboard.html', context)
 
@@ -244,7 +314,10 @@ def verify_result(request, pk):
 @login_required
 def sample_collection_view(request):
     """Sample collection interface"""
-    pending_orders = LabOrder.objects.filter(status='ORDERED').select_related('patient', 'ordered_by')[:20]
+    # Urgent first, then oldest first (see lab/worklist.py)
+    pending_orders = LabOrder.objects.filter(status='ORDERED').select_related(
+        'patient', 'ordered_by'
+    ).order_by('-priority', 'ordered_at')[:20]
     
     # Recent collections (last 2 hours)
     two_hours_ago = timezone.now() - timedelta(hours=2)
@@ -260,6 +333,40 @@ def sample_collection_view(request):
     return render(request, 'lab/sample_collection.html', context)
 
 
+@login_required
+def worklist_view(request):
+    """Per-bench worklists, urgent and oldest first, batched by sample type"""
+    bench = request.GET.get('bench') or None
+    benches = worklist.snapshot([bench] if bench else None)
+    
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'benches': benches})
+    
+    context = {
+        'bench': bench,
+        'benches': benches,
+        'bench_choices': sorted(worklist.all_benches()),
+    }
+    return render(request, 'lab/worklist.html', context)
+
+
+@login_required
+@require_POST
+def start_batch(request):
+    """Start testing every collected sample of one batch on a bench"""
+    bench = request.POST.get('bench', '')
+    sample_type = request.POST.get('sample_type', '')
+    order_ids = worklist.start_batch(bench, sample_type)
+    
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'status': 'success', 'orders': order_ids})
+    if order_ids:
+        messages.success(request, f'Testing started for {len(order_ids)} order(s) of {sample_type} samples')
+    else:
+        messages.warning(request, 'No collected samples left in that batch.')
+    return redirect(f"{reverse('lab:worklist')}?bench={bench}")
+
+
 @login_required
 def quality_control_view(request):
     """Quality control dashboard"""
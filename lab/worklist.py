@@ -0,0 +1,230 @@
+"""
+Lab worklist
+
+What the lab has to do, as one queue per bench instead of a list of orders
+by arrival:
+
+- the ``collection`` bench holds the tests of orders still waiting for
+  their sample
+- every other bench holds the collected tests without a result yet; a
+  test's bench comes from its category (LAB_BENCHES, e.g. BLOOD ->
+  haematology), one bench per category by default
+
+Each queue is in order of urgency, then age: urgent orders (LabOrder.priority)
+first, then routine tests waiting longer than LAB_ESCALATE_AFTER minutes,
+then the rest, oldest first within each. The tests of a bench are also
+grouped in batches by sample type, so tubes that go on the same analyzer
+can be run together; a batch is as urgent as its most urgent test.
+
+snapshot() builds every queue in a fixed number of queries. Saves of orders
+and results, and changes to an order's tests, publish the queues they touch
+after commit (lab/signals.py) through the appointments broadcast pipeline:
+lab screens follow ``lab_worklist`` (every bench) or ``lab_bench_<bench>``
+(see lab/consumers.py) instead of polling. The benches touched in one
+transaction are published together, with one snapshot built on the
+broadcast worker rather than in the request, however many saves it made
+(publish_after_commit()).
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+COLLECTION = 'collection'
+
+# Order statuses with work left, by where the work is
+AWAITING_SAMPLE = ('ORDERED',)
+AT_BENCH = ('SAMPLE_COLLECTED', 'IN_PROGRESS')
+
+ALL_GROUP = 'lab_worklist'
+
+
+def escalate_after():
+    return getattr(settings, 'LAB_ESCALATE_AFTER', 120)
+
+
+def bench_of(category):
+    """Bench a test category is run on"""
+    benches = getattr(settings, 'LAB_BENCHES', {})
+    return benches.get(category, category.lower())
+
+
+def bench_name(bench):
+    return bench.replace('_', ' ').title()
+
+
+def bench_group(bench):
+    # Channel group names allow ASCII letters, digits, hyphens, underscores and periods
+    return 'lab_bench_' + re.sub(r'[^\w.-]', '_', bench, flags=re.ASCII)
+
+
+def _sample_key(sample_type):
+    return ' '.join(sample_type.lower().split())
+
+
+def item(order, test, now):
+    """One test of one order on the worklist"""
+    waiting = max(int((now - order.ordered_at).total_seconds() // 60), 0)
+    return {
+        'order_id': order.pk, 'order_number': order.order_number, 'status': order.status,
+        'patient': order.patient.get_full_name(), 'patient_id': order.patient.patient_id,
+        'test_id': test.pk, 'test_code': test.test_code, 'test_name': test.test_name,
+        'sample_type': test.sample_type,
+        'urgent': order.priority,
+        'overdue': not order.priority and waiting >= escalate_after(),
+        'ordered_at': order.ordered_at.isoformat(), 'waiting_minutes': waiting,
+    }
+
+
+def sort_key(entry):
+    """Urgent first, then overdue, then routine; oldest first within each"""
+    return not entry['urgent'], not entry['overdue'], entry['ordered_at'], entry['order_id'], entry['test_id']
+
+
+def batches(queue):
+    """The queue's tests grouped by sample type, most urgent batch first"""
+    grouped = {}
+    for entry in queue:
+        key = _sample_key(entry['sample_type'])
+        batch = grouped.setdefault(key, {'sample_type': entry['sample_type'], 'items': []})
+        batch['items'].append(entry)
+    result = []
+    for batch in grouped.values():
+        # Items are in queue order: the first is the batch's most urgent and oldest
+        first = batch['items'][0]
+        result.append({
+            **batch,
+            'urgent': first['urgent'], 'overdue': first['overdue'], 'oldest': first['ordered_at'],
+            'orders': sorted({entry['order_id'] for entry in batch['items']}),
+        })
+    result.sort(key=lambda batch: sort_key(batch['items'][0]))
+    return result
+
+
+def snapshot(benches=None, now=None):
+    """``{bench: {'name', 'queue', 'batches'}}`` of the benches with work, or of ``benches``.
+
+    Benches asked for by name are included even when empty, so a screen can
+    clear its list.
+    """
+    from .models import LabOrder, LabResult
+
+    now = now or timezone.now()
+    orders = LabOrder.objects.filter(status__in=AWAITING_SAMPLE + AT_BENCH).select_related('patient').prefetch_related('tests')
+    done = set(LabResult.objects.filter(order__in=orders).values_list('order_id', 'test_id'))
+
+    queues = {bench: [] for bench in benches or ()}
+    for order in orders:
+        for test in order.tests.all():
+            if (order.pk, test.pk) in done:
+                continue
+            bench = COLLECTION if order.status in AWAITING_SAMPLE else bench_of(test.category)
+            if benches is None or bench in queues:
+                queues.setdefault(bench, []).append(item(order, test, now))
+
+    result = {}
+    for bench, queue in sorted(queues.items()):
+        queue.sort(key=sort_key)
+        result[bench] = {'name': bench_name(bench), 'queue': queue, 'batches': batches(queue)}
+    return result
+
+
+def all_benches():
+    from .models import LabTest
+
+    return {COLLECTION} | {bench_of(category) for category, _ in LabTest.CATEGORY_CHOICES}
+
+
+def publish(benches):
+    """Send the current queues of ``benches`` to the lab screens following them"""
+    from appointments.broadcast import broadcaster
+
+    for bench, data in snapshot(benches).items():
+        message = {'type': 'worklist', 'bench': bench, **data}
+        for group in (ALL_GROUP, bench_group(bench)):
+            broadcaster.enqueue(group, message)
+
+
+def publish_changes(benches=(), orders=(), tests=()):
+    """Publish ``benches`` and the benches of ``orders`` and ``tests`` (ids)"""
+    from django.db.models import Q
+
+    from .models import LabTest
+
+    benches = set(benches)
+    if orders or tests:
+        categories = LabTest.objects.filter(Q(pk__in=tests) | Q(orders__in=orders)).values_list(
+            'category', flat=True
+        ).distinct()
+        benches.update(bench_of(category) for category in categories)
+    if orders:
+        # Orders waiting for their sample are on the collection bench
+        benches.add(COLLECTION)
+    if benches:
+        publish(benches)
+
+
+_pending = threading.local()
+
+
+def publish_after_commit(benches=(), orders=(), tests=()):
+    """Publish the benches touched by a change once the transaction commits.
+
+    ``orders`` and ``tests`` are ids, whose benches are looked up when
+    publishing rather than on every save. What is asked for during one
+    transaction is merged, and the first callback to run after commit hands
+    it all to the broadcast worker, which builds one snapshot; the others
+    find nothing left. What a rolled back transaction asked for is published
+    with the next one, which is harmless.
+    """
+    pending = getattr(_pending, 'changes', None)
+    if pending is None:
+        pending = _pending.changes = {'benches': set(), 'orders': set(), 'tests': set()}
+    pending['benches'].update(benches)
+    pending['orders'].update(orders)
+    pending['tests'].update(tests)
+    transaction.on_commit(_flush)
+
+
+def _flush():
+    from appointments.broadcast import broadcaster
+
+    changes = getattr(_pending, 'changes', None)
+    _pending.changes = None
+    if changes and any(changes.values()):
+        broadcaster.submit(publish_changes, changes['benches'], changes['orders'], changes['tests'])
+
+
+def start_batch(bench, sample_type):
+    """Mark the collected orders of a bench's batch in progress; returns their ids"""
+    from accounts import rollups
+    from patients import timeline
+
+    from .models import LabOrder
+
+    queue = snapshot([bench])[bench]['queue']
+    key = _sample_key(sample_type)
+    order_ids = sorted({
+        entry['order_id'] for entry in queue
+        if _sample_key(entry['sample_type']) == key and entry['status'] == 'SAMPLE_COLLECTED'
+    })
+    if not order_ids:
+        return []
+    orders = LabOrder.objects.filter(pk__in=order_ids, status='SAMPLE_COLLECTED')
+    fields = rollups.TRACKED['lab.LabOrder'][1]
+    with transaction.atomic():
+        before = list(orders.select_for_update().order_by('pk').values('pk', 'patient_id', *fields))
+        order_ids = [row['pk'] for row in before]
+        LabOrder.objects.filter(pk__in=order_ids).update(status='IN_PROGRESS')
+
+        # One UPDATE, so no signals: keep the rollups, drop the timelines
+        # and publish every bench the orders have tests on here
+        rollups.bulk_changed(
+            'lab.LabOrder', old=before, new=[{**row, 'status': 'IN_PROGRESS'} for row in before],
+        )
+        patient_ids = sorted({row['patient_id'] for row in before})
+        transaction.on_commit(lambda: timeline.invalidate(*patient_ids))
+        publish_after_commit(benches={bench}, orders=order_ids)
+    return order_ids
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class PatientsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "patients"
+
+    def ready(self):
+        from . import search, timeline
+        search.connect()
+        timeline.connect()
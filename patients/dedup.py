@@ -0,0 +1,268 @@
+"""
+Duplicate patients
+
+Public booking, walk-ins and registration each create patients, so one person
+often ends up with several records. candidates() finds them without
+comparing every patient with every other: patients are grouped into blocks
+by keys a duplicate is likely to share, and only pairs within a block are
+scored.
+
+- the phone number in local form (search.normalize_phone)
+- the sound-alike keys of first and last name (search.sound), which also
+  bring Bengali and Latin spellings together
+- the date of birth with the first name's key
+
+Blocks larger than DEDUP_BLOCK_LIMIT (a clinic's landline, the 1 January
+that age-only bookings get as birthday) say nothing and are skipped. A pair
+scores points for what it has in common (score()); pairs from
+DEDUP_THRESHOLD up are reported, the earlier registration as the one to keep.
+
+merge() moves every row pointing at the duplicates (appointments,
+prescriptions, lab orders, sales, surveys, PC transactions, history and the
+archived rows) to the patient kept, fills that patient's empty fields from
+the duplicates, records a PatientMerge and deletes the duplicates, all in
+one transaction with one UPDATE per related table.
+"""
+from collections import defaultdict
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+
+from . import search
+
+# What the records are compared on
+FIELDS = ('first_name', 'last_name', 'phone', 'date_of_birth', 'gender', 'registered_at')
+
+# Fields copied to the patient kept when it has them empty
+FILLED_FIELDS = (
+    'email', 'blood_group', 'city', 'allergies', 'chronic_conditions',
+    'emergency_contact_name', 'emergency_contact_phone', 'emergency_contact_relation',
+)
+
+# Address of patients created by a booking
+PLACEHOLDER_ADDRESS = 'Walk-in Patient'
+
+
+def threshold():
+    return getattr(settings, 'DEDUP_THRESHOLD', 0.6)
+
+
+def block_limit():
+    return getattr(settings, 'DEDUP_BLOCK_LIMIT', 50)
+
+
+def profile(pk, first_name, last_name, phone, date_of_birth, gender, registered_at=None):
+    """What a record is compared on, normalized once"""
+    first = ' '.join(search.words(first_name))
+    last = ' '.join(search.words(last_name))
+    return {
+        'pk': pk,
+        'name': f'{first} {last}'.strip(),
+        'first_key': ''.join(search.sound(word) for word in first.split()),
+        'last_key': ''.join(search.sound(word) for word in last.split()),
+        'phone': search.normalize_phone(phone),
+        'date_of_birth': date_of_birth,
+        'gender': gender,
+        'registered_at': registered_at,
+    }
+
+
+def blocking_keys(record):
+    keys = []
+    if len(record['phone']) >= 10:
+        keys.append(('phone', record['phone']))
+    if record['first_key'] and record['last_key']:
+        keys.append(('name', record['first_key'], record['last_key']))
+    if record['first_key'] and record['date_of_birth']:
+        keys.append(('born', record['date_of_birth'], record['first_key']))
+    return keys
+
+
+def score(a, b):
+    """``(score, reasons)`` of two profiles being the same person, 0 to 1"""
+    points = 0.0
+    reasons = []
+    if a['phone'] and a['phone'] == b['phone']:
+        points += 0.35
+        reasons.append('phone')
+    # Bookings only take a full name; a missing last name is no difference
+    last_names_agree = a['last_key'] == b['last_key'] or not a['last_key'] or not b['last_key']
+    if a['name'] and a['name'] == b['name']:
+        points += 0.4
+        reasons.append('same name')
+    elif a['first_key'] and a['first_key'] == b['first_key'] and last_names_agree:
+        points += 0.3
+        reasons.append('similar name')
+    if a['date_of_birth'] and a['date_of_birth'] == b['date_of_birth']:
+        points += 0.2
+        reasons.append('date of birth')
+    elif a['date_of_birth'] and b['date_of_birth'] and a['date_of_birth'].year == b['date_of_birth'].year:
+        points += 0.1
+        reasons.append('birth year')
+    if a['gender'] and b['gender'] and a['gender'] != b['gender']:
+        points -= 0.3
+        reasons.append('different gender')
+    return round(max(points, 0.0), 2), reasons
+
+
+def _ordered(a, b):
+    # The earlier registration is kept
+    return (a, b) if (a['registered_at'], a['pk']) <= (b['registered_at'], b['pk']) else (b, a)
+
+
+def candidates(queryset=None, min_score=None):
+    """Likely duplicate pairs among ``queryset`` (default all patients), best first.
+
+    Each is ``{'keep', 'duplicate', 'score', 'reasons'}`` with patient pks.
+    """
+    from .models import Patient
+
+    min_score = threshold() if min_score is None else min_score
+    queryset = Patient.objects.all() if queryset is None else queryset
+    records = {}
+    blocks = defaultdict(list)
+    for row in queryset.order_by().values_list('pk', *FIELDS).iterator():
+        record = profile(*row)
+        records[record['pk']] = record
+        for key in blocking_keys(record):
+            blocks[key].append(record['pk'])
+
+    pairs = set()
+    for members in blocks.values():
+        if 1 < len(members) <= block_limit():
+            pairs.update(combinations(sorted(members), 2))
+
+    found = []
+    for first, second in pairs:
+        value, reasons = score(records[first], records[second])
+        if value >= min_score:
+            keep, duplicate = _ordered(records[first], records[second])
+            found.append({'keep': keep['pk'], 'duplicate': duplicate['pk'], 'score': value, 'reasons': reasons})
+    found.sort(key=lambda pair: (-pair['score'], pair['keep'], pair['duplicate']))
+    return found
+
+
+def similar(first_name, last_name, phone, date_of_birth=None, gender=None, min_score=None):
+    """Existing patients that look like a new record, best first: ``[(patient, score, reasons)]``
+
+    Looks them up through the search index by phone and by name, so it is
+    cheap enough to run on every registration.
+    """
+    from .models import Patient
+
+    min_score = threshold() if min_score is None else min_score
+    new = profile(None, first_name, last_name, phone, date_of_birth, gender)
+    pks = set()
+    for query in (new['phone'], new['name']):
+        if query:
+            pks.update(patient.pk for patient in search.search(query, limit=20))
+    found = []
+    for patient in Patient.objects.filter(pk__in=pks):
+        value, reasons = score(new, profile(patient.pk, *[getattr(patient, field) for field in FIELDS]))
+        if value >= min_score:
+            found.append((patient, value, reasons))
+    found.sort(key=lambda match: (-match[1], match[0].pk))
+    return found
+
+
+def existing(first_name, last_name, phone, gender=None):
+    """The patient a booking is for: same phone and a similar name, or None"""
+    for patient, _, reasons in similar(first_name, last_name, phone, gender=gender, min_score=0):
+        if 'phone' in reasons and ('same name' in reasons or 'similar name' in reasons) and (
+            'different gender' not in reasons
+        ):
+            return patient
+    return None
+
+
+def relations():
+    """The foreign keys to Patient that a merge moves (all but one-to-ones)"""
+    from .models import Patient
+
+    return [relation for relation in Patient._meta.related_objects if relation.one_to_many]
+
+
+def merge(keep, duplicates, merged_by=None, score=None):
+    """Merge ``duplicates`` into ``keep``; returns ``{model label: rows moved}``"""
+    from accounts import archive
+
+    from .models import Patient, PatientMerge
+
+    with transaction.atomic():
+        keep = Patient.objects.select_for_update().get(pk=keep.pk if isinstance(keep, Patient) else keep)
+        duplicate_pks = [duplicate.pk if isinstance(duplicate, Patient) else duplicate for duplicate in duplicates]
+        duplicates = list(Patient.objects.select_for_update().filter(pk__in=duplicate_pks).exclude(pk=keep.pk).order_by('pk'))
+        if not duplicates:
+            return {}
+        duplicate_pks = [duplicate.pk for duplicate in duplicates]
+
+        moved = {}
+        for relation in relations():
+            model = relation.related_model
+            count = model._base_manager.filter(**{f'{relation.field.name}__in': duplicates}).update(
+                **{relation.field.name: keep}
+            )
+            if count:
+                moved[model._meta.label] = moved.get(model._meta.label, 0) + count
+        archived = archive.reassign_patient(duplicate_pks, keep.pk)
+        if archived:
+            moved['accounts.ArchivedRecord'] = archived
+
+        changed = []
+        for field in FILLED_FIELDS:
+            if not getattr(keep, field):
+                value = next((getattr(duplicate, field) for duplicate in duplicates if getattr(duplicate, field)), '')
+                if value:
+                    setattr(keep, field, value)
+                    changed.append(field)
+        if keep.address == PLACEHOLDER_ADDRESS:
+            address = next((duplicate.address for duplicate in duplicates if duplicate.address != PLACEHOLDER_ADDRESS), '')
+            if address:
+                keep.address = address
+                changed.append('address')
+        if changed:
+            keep.save(update_fields=changed + ['updated_at'])
+
+        PatientMerge.objects.bulk_create([
+            PatientMerge(
+                merged_into=keep, old_pk=duplicate.pk, old_patient_id=duplicate.patient_id,
+                name=duplicate.get_full_name(), phone=duplicate.phone, score=score, moved=moved, merged_by=merged_by,
+            )
+            for duplicate in duplicates
+        ])
+        for duplicate in duplicates:
+            duplicate.delete()
+
+        def invalidate():
+            from appointments import queue_state
+            from appointments.queue_state import ACTIVE_STATUSES
+
+            from . import timeline
+
+            timeline.invalidate(keep.pk, *duplicate_pks)
+            for doctor_id, date in keep.appointments.filter(status__in=ACTIVE_STATUSES).values_list(
+                'doctor_id', 'appointment_date'
+            ).distinct():
+                queue_state.invalidate(doctor_id, date)
+        transaction.on_commit(invalidate)
+    return moved
+
+
+def merge_all(pairs, merged_by=None):
+    """Merge candidate pairs in order, following earlier merges; returns how many were merged"""
+    from .models import Patient
+
+    survivor = {}
+    merged = 0
+    for pair in pairs:
+        keep = pair['keep']
+        while keep in survivor:
+            keep = survivor[keep]
+        duplicate = pair['duplicate']
+        if duplicate in survivor or keep == duplicate or not Patient.objects.filter(pk=duplicate).exists():
+            continue
+        merge(keep, [duplicate], merged_by=merged_by, score=pair['score'])
+        survivor[duplicate] = keep
+        merged += 1
+    return merged
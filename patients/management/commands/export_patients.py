@@ -0,0 +1,42 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patients import transfer
+from patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Export patients to a CSV or JSON Lines file (patients/transfer.py), streamed in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, or - for standard output')
+        parser.add_argument('--format', choices=transfer.FORMATS, help='File format (default from the file name, else csv)')
+        parser.add_argument('--active', action='store_true', help='Only active patients')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or transfer.detect_format(path)
+        queryset = Patient.objects.filter(is_active=True) if options['active'] else Patient.objects.all()
+
+        started = time.monotonic()
+        try:
+            output = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(f'Cannot write {path}: {error}')
+        count = 0
+        try:
+            for line in transfer.export_lines(queryset, format):
+                output.write(line)
+                count += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        if format == 'csv':
+            count -= 1  # the header
+        seconds = time.monotonic() - started
+        # Not on standard output, which is the export
+        (self.stderr if path == '-' else self.stdout).write(
+            f"Exported {count} patients in {seconds:.1f}s ({count / seconds if seconds else 0:.0f} rows/s)"
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from patients import dedup
+from patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = (
+        'List likely duplicate patients (patients/dedup.py), best match first; '
+        'with --merge, merge the pairs scoring at least --merge-above'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-score', type=float, help='Lowest score listed (default DEDUP_THRESHOLD)')
+        parser.add_argument('--merge', action='store_true', help='Merge the pairs scoring at least --merge-above')
+        parser.add_argument('--merge-above', type=float, default=0.9, help='Lowest score merged (default 0.9)')
+
+    def handle(self, *args, **options):
+        pairs = dedup.candidates(min_score=options['min_score'])
+        patients = Patient.objects.in_bulk({pk for pair in pairs for pk in (pair['keep'], pair['duplicate'])})
+        for pair in pairs:
+            keep, duplicate = patients[pair['keep']], patients[pair['duplicate']]
+            self.stdout.write(
+                f"{pair['score']:.2f}  {duplicate.patient_id} {duplicate.get_full_name()} -> "
+                f"{keep.patient_id} {keep.get_full_name()}  ({', '.join(pair['reasons'])})"
+            )
+        self.stdout.write(f'{len(pairs)} likely duplicates')
+
+        if options['merge']:
+            merged = dedup.merge_all([pair for pair in pairs if pair['score'] >= options['merge_above']])
+            self.stdout.write(self.style.SUCCESS(f'Merged {merged} patients'))
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patients import transfer
+
+
+class Command(BaseCommand):
+    help = (
+        'Import patients from a CSV or JSON Lines file (patients/transfer.py), '
+        'in chunks; rows with a patient ID already there are skipped, so a file '
+        'whose rows all have patient IDs is safe to run again after an interruption'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input')
+        parser.add_argument('--format', choices=transfer.FORMATS, help='File format (default from the file name, else csv)')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the rows')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or transfer.detect_format(path)
+
+        def progress(report):
+            self.stdout.write(f"{report['rows']} rows read, {report['created']} imported")
+
+        if path == '-':
+            report = transfer.import_patients(sys.stdin, format, dry_run=options['dry_run'], progress=progress)
+        else:
+            try:
+                stream = open(path, encoding='utf-8-sig', newline='')
+            except OSError as error:
+                raise CommandError(f'Cannot read {path}: {error}')
+            with stream:
+                report = transfer.import_patients(stream, format, dry_run=options['dry_run'], progress=progress)
+
+        for line, message in report['errors']:
+            self.stderr.write(f'Line {line}: {message}')
+        if report['invalid'] > len(report['errors']):
+            self.stderr.write(f"... and {report['invalid'] - len(report['errors'])} more invalid rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['rows']} rows in {report['seconds']:.1f}s ({report['per_second']:.0f} rows/s): "
+            f"{report['created']} imported, {report['skipped']} already there, {report['invalid']} invalid"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from patients import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate the patient search entries (patients/search.py), e.g. after a bulk import'
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} patients'))
@@ -0,0 +1,203 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:19
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'patients_searchentry_fts'
+
+SQLITE_INDEX = [
+    # External-content FTS5 table over patients_searchentry, matched by trigrams
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        document, phonetic, content='patients_searchentry', content_rowid='patient_id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER patients_searchentry_ai AFTER INSERT ON patients_searchentry BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, document, phonetic) VALUES (new.patient_id, new.document, new.phonetic);
+    END""",
+    f"""CREATE TRIGGER patients_searchentry_ad AFTER DELETE ON patients_searchentry BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document, phonetic)
+        VALUES ('delete', old.patient_id, old.document, old.phonetic);
+    END""",
+    f"""CREATE TRIGGER patients_searchentry_au AFTER UPDATE ON patients_searchentry BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document, phonetic)
+        VALUES ('delete', old.patient_id, old.document, old.phonetic);
+        INSERT INTO {FTS_TABLE}(rowid, document, phonetic) VALUES (new.patient_id, new.document, new.phonetic);
+    END""",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS patients_searchentry_ai',
+    'DROP TRIGGER IF EXISTS patients_searchentry_ad',
+    'DROP TRIGGER IF EXISTS patients_searchentry_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+POSTGRESQL_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX patients_searchentry_document_trgm ON patients_searchentry USING gin (document gin_trgm_ops)',
+    'CREATE INDEX patients_searchentry_phonetic_trgm ON patients_searchentry USING gin (phonetic gin_trgm_ops)',
+]
+
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS patients_searchentry_document_trgm',
+    'DROP INDEX IF EXISTS patients_searchentry_phonetic_trgm',
+]
+
+
+# The search text as built when this migration was written: a frozen copy of
+# patients.search.entry_text() and what it uses, so later changes to the
+# normalization do not change what this migration does. Entries are brought
+# up to date with a changed normalization by manage.py rebuild_patient_search.
+
+BENGALI_DIGITS = str.maketrans('০১২৩৪৫৬৭৮৯', '0123456789')
+
+BENGALI_VOWELS = {
+    'অ': 'o', 'আ': 'a', 'ই': 'i', 'ঈ': 'i', 'উ': 'u', 'ঊ': 'u', 'ঋ': 'ri',
+    'এ': 'e', 'ঐ': 'oi', 'ও': 'o', 'ঔ': 'ou',
+}
+
+BENGALI_VOWEL_SIGNS = {
+    'া': 'a', 'ি': 'i', 'ী': 'i', 'ু': 'u', 'ূ': 'u', 'ৃ': 'ri',
+    'ে': 'e', 'ৈ': 'oi', 'ো': 'o', 'ৌ': 'ou',
+}
+
+BENGALI_CONSONANTS = {
+    'ক': 'k', 'খ': 'kh', 'গ': 'g', 'ঘ': 'gh', 'ঙ': 'ng',
+    'চ': 'ch', 'ছ': 'chh', 'জ': 'j', 'ঝ': 'jh', 'ঞ': 'n',
+    'ট': 't', 'ঠ': 'th', 'ড': 'd', 'ঢ': 'dh', 'ণ': 'n',
+    'ত': 't', 'থ': 'th', 'দ': 'd', 'ধ': 'dh', 'ন': 'n',
+    'প': 'p', 'ফ': 'ph', 'ব': 'b', 'ভ': 'bh', 'ম': 'm',
+    'য': 'j', 'র': 'r', 'ল': 'l', 'শ': 'sh', 'ষ': 'sh', 'স': 's', 'হ': 'h',
+}
+
+# ড়, ঢ় and য়: after NFC always the letter followed by a nukta
+NUKTA = '\u09bc'
+NUKTA_CONSONANTS = {'ড': 'r', 'ঢ': 'rh', 'য': 'y'}
+
+# Letters that close a syllable (no inherent vowel of their own)
+BENGALI_FINALS = {'ৎ': 't', 'ং': 'ng', 'ঃ': 'h', 'ঁ': ''}
+
+HASANTA = '\u09cd'
+
+# Spellings of the same sound, replaced before vowels are dropped
+SOUND_ALIKES = (
+    ('ph', 'f'), ('ck', 'k'), ('q', 'k'), ('x', 'ks'), ('z', 'j'), ('v', 'b'),
+    ('sh', 's'), ('ch', 'c'), ('c', 'k'),
+)
+
+
+def transliterate(text):
+    """Bengali letters in ``text`` as Latin ones; other characters as they are"""
+    text = unicodedata.normalize('NFC', text)
+    result = []
+    for index, char in enumerate(text):
+        if char in BENGALI_CONSONANTS:
+            following = text[index + 1:index + 2]
+            if following == NUKTA:
+                result.append(NUKTA_CONSONANTS.get(char, BENGALI_CONSONANTS[char]))
+                following = text[index + 2:index + 3]
+            else:
+                result.append(BENGALI_CONSONANTS[char])
+            # The inherent vowel, unless a sign, hasanta or word end follows
+            if following in BENGALI_CONSONANTS or following in BENGALI_FINALS:
+                result.append('o')
+        elif char in BENGALI_VOWEL_SIGNS:
+            result.append(BENGALI_VOWEL_SIGNS[char])
+        elif char in BENGALI_VOWELS:
+            result.append(BENGALI_VOWELS[char])
+        elif char in BENGALI_FINALS:
+            result.append(BENGALI_FINALS[char])
+        elif char not in (HASANTA, NUKTA):
+            result.append(char)
+    return ''.join(result).translate(BENGALI_DIGITS)
+
+
+def sound(word):
+    """Sound-alike key of a name: consonants only, sound-alike spellings merged.
+
+    The first letter is kept (a leading vowel as ``a``), the rest lose their
+    vowels, ``h``, ``w`` and ``y``, and doubled letters count once.
+    """
+    word = re.sub('[^a-z]', '', transliterate(word).lower())
+    if not word:
+        return ''
+    for spelling, replacement in SOUND_ALIKES:
+        word = word.replace(spelling, replacement)
+    key = 'a' if word[0] in 'aeiouwy' else word[0]
+    for char in word[1:]:
+        if char not in 'aeiouhwy' and char != key[-1]:
+            key += char
+    return key
+
+
+def normalize_phone(value):
+    """Digits of a phone number in local form: +880 1712-345678 -> 01712345678"""
+    digits = re.sub(r'\D', '', str(value).translate(BENGALI_DIGITS))
+    if digits.startswith('880'):
+        digits = '0' + digits[3:]
+    elif len(digits) == 10 and digits.startswith('1'):
+        digits = '0' + digits
+    return digits
+
+
+def words(text):
+    return [word for word in re.split(r'[\s,;]+', transliterate(text).lower()) if word]
+
+
+def entry_text(patient):
+    """``(document, phonetic)`` of a patient's SearchEntry"""
+    names = words(f'{patient.first_name} {patient.last_name}')
+    document = names + [patient.patient_id.lower()]
+    phone = normalize_phone(patient.phone)
+    if phone:
+        document.append(phone)
+    if patient.email:
+        document.append(patient.email.lower())
+    keys = [sound(name) for name in names]
+    return (
+        ' '.join(f'^{word}' for word in document),
+        ' '.join(f'^{key}$' for key in keys if key),
+    )
+
+
+def run(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def create_index(apps, schema_editor):
+    """Create the trigram index of the entries and index the existing patients"""
+    run(schema_editor, {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX})
+    db_alias = schema_editor.connection.alias
+    Patient = apps.get_model('patients', 'Patient')
+    SearchEntry = apps.get_model('patients', 'SearchEntry')
+    entries = []
+    for patient in Patient.objects.using(db_alias).iterator():
+        document, phonetic = entry_text(patient)
+        entries.append(SearchEntry(patient=patient, document=document, phonetic=phonetic))
+    SearchEntry.objects.using(db_alias).bulk_create(entries, batch_size=500)
+
+
+def drop_index(apps, schema_editor):
+    run(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0002_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to='patients.patient')),
+                ('document', models.TextField()),
+                ('phonetic', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0003_search_entry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientMerge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_pk', models.PositiveBigIntegerField(db_index=True)),
+                ('old_patient_id', models.CharField(max_length=20)),
+                ('name', models.CharField(max_length=201)),
+                ('phone', models.CharField(max_length=20)),
+                ('score', models.FloatField(blank=True, help_text='Duplicate score when it was merged', null=True)),
+                ('moved', models.JSONField(default=dict, help_text='Rows moved over, by model')),
+                ('merged_at', models.DateTimeField(auto_now_add=True)),
+                ('merged_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='patient_merges', to=settings.AUTH_USER_MODEL)),
+                ('merged_into', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='merges', to='patients.patient')),
+            ],
+            options={
+                'ordering': ['-merged_at'],
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from accounts.sequences import next_number
 
 class Patient(models.Model):
     """Patient information"""
@@ -17,6 +18,9 @@ class Patient(models.Model):
         ('O+', 'O+'), ('O-', 'O-'),
     ]
     
+    # Keyset order of the patient list (see accounts.pagination)
+    LIST_ORDERING = ('-registered_at', '-id')
+    
     # Patient ID will be auto-generated
     patient_id = models.CharField(max_length=20, unique=True, editable=False)
     
@@ -60,7 +64,8 @@ class Patient(models.Model):
         indexes = [
             models.Index(fields=['patient_id']),
             models.Index(fields=['phone']),
-            models.Index(fields=['registered_at']),
+            # Also the keyset order of the patient list (LIST_ORDERING)
+            models.Index(fields=['registered_at', 'id'], name='patient_registered_idx'),
         ]
     
     def __str__(self):
@@ -74,31 +79,64 @@ class Patient(models.Model):
             # Generate patient ID: PAT + year + sequential number
             from django.utils import timezone
             year = timezone.now().year
-            last_patient = Patient.objects.filter(
-                patient_id__startswith=f'PAT{year}'
-            ).order_by('patient_id').last()
-            
-            if last_patient:
-                last_number = int(last_patient.patient_id[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.patient_id = f'PAT{year}{new_number:04d}'
+            self.patient_id = next_number('PAT', str(year), Patient, 'patient_id')
         
         super().save(*args, **kwargs)
     
     @property
     def age(self):
         from django.utils import timezone
-        today = timezone.now().date()
-        age = today.year - self.date_of_birth.year
-        if today.month < self.date_of_birth.month or \
-           (today.month == self.date_of_birth.month and today.day < self.date_of_birth.day):
+        return self.age_on(timezone.now().date())
+    
+    def age_on(self, day):
+        """Age in whole years on ``day``"""
+        age = day.year - self.date_of_birth.year
+        if day.month < self.date_of_birth.month or \
+           (day.month == self.date_of_birth.month and day.day < self.date_of_birth.day):
             age -= 1
         return age
 
 
+class SearchEntry(models.Model):
+    """Normalized search text of a patient (see patients/search.py)"""
+    
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='search_entry')
+    # Names (Bengali transliterated), patient ID, phone and email, one ^word each
+    document = models.TextField()
+    # Sound-alike keys of the names, one ^key$ each
+    phonetic = models.TextField(blank=True)
+    
+    def __str__(self):
+        return self.document
+
+
+class PatientMerge(models.Model):
+    """A duplicate record merged into another patient (see patients/dedup.py)"""
+    
+    merged_into = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='merges')
+    # The duplicate as it was: its id, patient ID and how to recognise it
+    old_pk = models.PositiveBigIntegerField(db_index=True)
+    old_patient_id = models.CharField(max_length=20)
+    name = models.CharField(max_length=201)
+    phone = models.CharField(max_length=20)
+    score = models.FloatField(null=True, blank=True, help_text="Duplicate score when it was merged")
+    moved = models.JSONField(default=dict, help_text="Rows moved over, by model")
+    merged_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='patient_merges'
+    )
+    merged_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-merged_at']
+    
+    def __str__(self):
+        return f"{self.old_patient_id} -> {self.merged_into.patient_id}"
+
+
 class PatientHistory(models.Model):
     """Medical history record for patients"""
     
@@ -0,0 +1,279 @@
+"""
+Patient search
+
+Every patient has a SearchEntry row with the text reception searches by,
+normalized once on save instead of on every keystroke:
+
+- names in lower-case Latin letters, Bengali names transliterated, so
+  "রহিম" and "Rahim" are the same word
+- sound-alike keys of the names (sound()), so "Mohammad", "Muhammad" and
+  "মোহাম্মদ" all match, as do "Chowdhury" and "Choudhury"
+- the phone number in local form (01XXXXXXXXX), whether it was typed with
+  +880, dashes or Bengali digits
+- the patient ID and email
+
+Each word is stored with a leading ``^``, so a two-letter prefix is still a
+three-character pattern. Keys are stored as ``^key$`` and only match whole.
+
+The entries are indexed for substring matching: an FTS5 trigram table on
+SQLite (kept in sync by triggers, see migration 0003) and a pg_trgm GIN
+index on PostgreSQL; other databases fall back to a scan of the entries.
+search() ranks the matches; matching() is the same filter unranked, for the
+patient list.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save
+
+FTS_TABLE = 'patients_searchentry_fts'
+
+# Fields the entry is made from; saves touching none of them skip the index
+INDEXED_FIELDS = {'first_name', 'last_name', 'patient_id', 'phone', 'email'}
+
+BENGALI_DIGITS = str.maketrans('০১২৩৪৫৬৭৮৯', '0123456789')
+
+BENGALI_VOWELS = {
+    'অ': 'o', 'আ': 'a', 'ই': 'i', 'ঈ': 'i', 'উ': 'u', 'ঊ': 'u', 'ঋ': 'ri',
+    'এ': 'e', 'ঐ': 'oi', 'ও': 'o', 'ঔ': 'ou',
+}
+
+BENGALI_VOWEL_SIGNS = {
+    'া': 'a', 'ি': 'i', 'ী': 'i', 'ু': 'u', 'ূ': 'u', 'ৃ': 'ri',
+    'ে': 'e', 'ৈ': 'oi', 'ো': 'o', 'ৌ': 'ou',
+}
+
+BENGALI_CONSONANTS = {
+    'ক': 'k', 'খ': 'kh', 'গ': 'g', 'ঘ': 'gh', 'ঙ': 'ng',
+    'চ': 'ch', 'ছ': 'chh', 'জ': 'j', 'ঝ': 'jh', 'ঞ': 'n',
+    'ট': 't', 'ঠ': 'th', 'ড': 'd', 'ঢ': 'dh', 'ণ': 'n',
+    'ত': 't', 'থ': 'th', 'দ': 'd', 'ধ': 'dh', 'ন': 'n',
+    'প': 'p', 'ফ': 'ph', 'ব': 'b', 'ভ': 'bh', 'ম': 'm',
+    'য': 'j', 'র': 'r', 'ল': 'l', 'শ': 'sh', 'ষ': 'sh', 'স': 's', 'হ': 'h',
+}
+
+# ড়, ঢ় and য়: after NFC always the letter followed by a nukta
+NUKTA = '\u09bc'
+NUKTA_CONSONANTS = {'ড': 'r', 'ঢ': 'rh', 'য': 'y'}
+
+# Letters that close a syllable (no inherent vowel of their own)
+BENGALI_FINALS = {'ৎ': 't', 'ং': 'ng', 'ঃ': 'h', 'ঁ': ''}
+
+HASANTA = '\u09cd'
+
+# Spellings of the same sound, replaced before vowels are dropped
+SOUND_ALIKES = (
+    ('ph', 'f'), ('ck', 'k'), ('q', 'k'), ('x', 'ks'), ('z', 'j'), ('v', 'b'),
+    ('sh', 's'), ('ch', 'c'), ('c', 'k'),
+)
+
+PHONE_LIKE = re.compile(r'[\d\s+\-()]+')
+
+
+def transliterate(text):
+    """Bengali letters in ``text`` as Latin ones; other characters as they are"""
+    text = unicodedata.normalize('NFC', text)
+    result = []
+    for index, char in enumerate(text):
+        if char in BENGALI_CONSONANTS:
+            following = text[index + 1:index + 2]
+            if following == NUKTA:
+                result.append(NUKTA_CONSONANTS.get(char, BENGALI_CONSONANTS[char]))
+                following = text[index + 2:index + 3]
+            else:
+                result.append(BENGALI_CONSONANTS[char])
+            # The inherent vowel, unless a sign, hasanta or word end follows
+            if following in BENGALI_CONSONANTS or following in BENGALI_FINALS:
+                result.append('o')
+        elif char in BENGALI_VOWEL_SIGNS:
+            result.append(BENGALI_VOWEL_SIGNS[char])
+        elif char in BENGALI_VOWELS:
+            result.append(BENGALI_VOWELS[char])
+        elif char in BENGALI_FINALS:
+            result.append(BENGALI_FINALS[char])
+        elif char not in (HASANTA, NUKTA):
+            result.append(char)
+    return ''.join(result).translate(BENGALI_DIGITS)
+
+
+def sound(word):
+    """Sound-alike key of a name: consonants only, sound-alike spellings merged.
+
+    The first letter is kept (a leading vowel as ``a``), the rest lose their
+    vowels, ``h``, ``w`` and ``y``, and doubled letters count once.
+    """
+    word = re.sub('[^a-z]', '', transliterate(word).lower())
+    if not word:
+        return ''
+    for spelling, replacement in SOUND_ALIKES:
+        word = word.replace(spelling, replacement)
+    key = 'a' if word[0] in 'aeiouwy' else word[0]
+    for char in word[1:]:
+        if char not in 'aeiouhwy' and char != key[-1]:
+            key += char
+    return key
+
+
+def normalize_phone(value):
+    """Digits of a phone number in local form: +880 1712-345678 -> 01712345678"""
+    digits = re.sub(r'\D', '', str(value).translate(BENGALI_DIGITS))
+    if digits.startswith('880'):
+        digits = '0' + digits[3:]
+    elif len(digits) == 10 and digits.startswith('1'):
+        digits = '0' + digits
+    return digits
+
+
+def words(text):
+    return [word for word in re.split(r'[\s,;]+', transliterate(text).lower()) if word]
+
+
+def entry_text(patient):
+    """``(document, phonetic)`` of a patient's SearchEntry"""
+    names = words(f'{patient.first_name} {patient.last_name}')
+    document = names + [patient.patient_id.lower()]
+    phone = normalize_phone(patient.phone)
+    if phone:
+        document.append(phone)
+    if patient.email:
+        document.append(patient.email.lower())
+    keys = [sound(name) for name in names]
+    return (
+        ' '.join(f'^{word}' for word in document),
+        ' '.join(f'^{key}$' for key in keys if key),
+    )
+
+
+def index(patient):
+    """Create or update the patient's SearchEntry"""
+    from .models import SearchEntry
+
+    document, phonetic = entry_text(patient)
+    SearchEntry.objects.update_or_create(patient=patient, defaults={'document': document, 'phonetic': phonetic})
+
+
+def rebuild():
+    """Recreate every SearchEntry; returns the number of patients indexed"""
+    from .models import Patient, SearchEntry
+
+    SearchEntry.objects.all().delete()
+    entries = []
+    for patient in Patient.objects.only(*INDEXED_FIELDS).iterator():
+        document, phonetic = entry_text(patient)
+        entries.append(SearchEntry(patient=patient, document=document, phonetic=phonetic))
+    SearchEntry.objects.bulk_create(entries, batch_size=500)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+    return len(entries)
+
+
+def _indexed(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields and not INDEXED_FIELDS & set(update_fields)):
+        return
+    index(instance)
+
+
+def connect():
+    """Keep the entries in sync with saves (called from PatientsConfig.ready)"""
+    from .models import Patient
+
+    post_save.connect(_indexed, sender=Patient, dispatch_uid='patients.search')
+
+
+def terms(query):
+    """``[(text, key)]`` to look for: each word and its sound-alike key.
+
+    A phone number is one term however it was typed. Words shorter than two
+    letters are left out.
+    """
+    query = query.strip()
+    if PHONE_LIKE.fullmatch(query):
+        phone = normalize_phone(query)
+        return [(phone, '')] if len(phone) >= 2 else []
+    result = []
+    for word in words(query):
+        if PHONE_LIKE.fullmatch(word):
+            word = normalize_phone(word)
+        if len(word) < 2:
+            continue
+        # IDs, phone numbers and emails are spelled out, not sounded
+        key = '' if re.search(r'[\d@]', word) else sound(word)
+        result.append((word, key if len(key) >= 2 else ''))
+    return result
+
+
+def _fts_pattern(text):
+    # Short words are matched as word prefixes (^ra), which trigrams can find
+    pattern = text if len(text) >= 3 else f'^{text}'
+    return '"{}"'.format(pattern.replace('"', '""'))
+
+
+def _fts_query(query_terms):
+    clauses = []
+    for text, key in query_terms:
+        clause = f'document : {_fts_pattern(text)}'
+        if key:
+            clause = f'({clause} OR phonetic : {_fts_pattern(f"^{key}$")})'
+        clauses.append(clause)
+    return ' AND '.join(clauses)
+
+
+def _entries(query_terms):
+    """SearchEntry rows containing every term (PostgreSQL and fallback)"""
+    from django.db.models import Q
+
+    from .models import SearchEntry
+
+    entries = SearchEntry.objects.all()
+    for text, key in query_terms:
+        condition = Q(document__contains=text if len(text) >= 3 else f'^{text}')
+        if key:
+            condition |= Q(phonetic__contains=f'^{key}$')
+        entries = entries.filter(condition)
+    return entries
+
+
+def matching(query):
+    """Primary keys of the patients matching ``query``, for ``pk__in``"""
+    query_terms = terms(query)
+    if not query_terms:
+        return []
+    if connection.vendor == 'sqlite':
+        return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [_fts_query(query_terms)])
+    return _entries(query_terms).values('patient_id')
+
+
+def search(query, limit=10):
+    """Active patients matching ``query``, best match first.
+
+    Whole-word spellings rank above sound-alikes and partial words.
+    """
+    from .models import Patient
+
+    query_terms = terms(query)
+    if not query_terms:
+        return []
+    if connection.vendor == 'sqlite':
+        # bm25: more weight on the spelled-out words than on the keys
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, 4.0, 1.0) LIMIT %s',
+                [_fts_query(query_terms), limit * 2],
+            )
+            ranked = [row[0] for row in cursor.fetchall()]
+    else:
+        entries = _entries(query_terms)
+        if connection.vendor == 'postgresql':
+            from django.contrib.postgres.search import TrigramWordSimilarity
+
+            similarity = sum((TrigramWordSimilarity(text, 'document') for text, _ in query_terms[1:]),
+                             TrigramWordSimilarity(query_terms[0][0], 'document'))
+            entries = entries.annotate(similarity=similarity).order_by('-similarity')
+        ranked = list(entries.values_list('patient_id', flat=True)[:limit * 2])
+    # Inactive patients are ranked too, then dropped here
+    patients = Patient.objects.filter(pk__in=ranked, is_active=True).in_bulk()
+    return [patients[pk] for pk in ranked if pk in patients][:limit]
@@ -1,3 +1,512 @@
-from django.test import TestCase
+import datetime
+import os
+import sys
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import dedup, search, timeline, transfer
+from .models import Patient, PatientHistory, PatientMerge, SearchEntry
+from accounts import rollups
+from accounts.models import DailyRollup
+
+User = get_user_model()
+
+
+class PatientListTestCase(TestCase):
+    """Test the keyset-paginated patient list"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reception', password='testpass123', role='RECEPTIONIST')
+        self.client.force_login(self.user)
+        self.url = reverse('patients:patient_list')
+        for index in range(30):
+            Patient.objects.create(
+                first_name=f'Patient{index}', last_name='Uddin', date_of_birth='1990-01-01',
+                gender='M' if index % 3 else 'F', phone=f'0170000{index:04d}', address='Bazar Road',
+                city='Naogaon', emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+                emergency_contact_relation='Brother',
+            )
+
+    def test_pages_cover_the_list_newest_first(self):
+        ids = []
+        url = self.url + '?format=json'
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(row['id'] for row in data['results'])
+            url = data['next']
+        self.assertEqual(ids, list(Patient.objects.order_by('-registered_at', '-id').values_list('id', flat=True)))
+
+    def test_filters_apply_to_every_page(self):
+        data = self.client.get(self.url, {'format': 'json', 'gender': 'F'}).json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertIsNone(data['next'])
+
+    def test_html_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['patients']), 25)
+        self.assertContains(response, 'after=')
+
+
+class PatientSearchTestCase(TestCase):
+    """Test the patient search index"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reception', password='testpass123', role='RECEPTIONIST')
+        self.client.force_login(self.user)
+        self.rahim = self.patient('Rahim', 'Chowdhury', '+880 1712-345678')
+        self.rahman = self.patient('Rahman', 'Uddin', '01819000111', gender='F')
+        self.rohman = self.patient('Rohman', 'Ali', '01911000222')
+        self.bengali = self.patient('মোহাম্মদ', 'হোসেন', '০১৫৫০০০০৩৩৩')
+
+    def patient(self, first_name, last_name, phone, **fields):
+        return Patient.objects.create(
+            first_name=first_name, last_name=last_name, date_of_birth='1990-01-01', gender=fields.pop('gender', 'M'),
+            phone=phone, address='Bazar Road', city='Naogaon', emergency_contact_name='Karim',
+            emergency_contact_phone='01800000000', emergency_contact_relation='Brother', **fields,
+        )
+
+    def found(self, query):
+        return [patient.pk for patient in search.search(query)]
+
+    def test_normalization(self):
+        self.assertEqual(search.normalize_phone('+880 1712-345678'), '01712345678')
+        self.assertEqual(search.normalize_phone('১৭১২৩৪৫৬৭৮'), '01712345678')
+        self.assertEqual(search.transliterate('রহিম'), 'rohim')
+        self.assertEqual(search.sound('রহিম'), search.sound('Rahim'))
+        self.assertEqual(search.sound('Mohammad'), search.sound('Muhammad'))
+        self.assertEqual(search.sound('Chowdhury'), search.sound('Choudhury'))
+
+    def test_phone_in_any_form(self):
+        for query in ('01712345678', '+8801712345678', '01712-345678', '০১৭১২৩৪৫৬৭৮', '345678'):
+            self.assertEqual(self.found(query), [self.rahim.pk], query)
+        self.assertEqual(self.found('01550000333'), [self.bengali.pk])
+
+    def test_names_across_scripts_and_spellings(self):
+        self.assertEqual(self.found('রহিম'), [self.rahim.pk])
+        self.assertEqual(self.found('rahim choudhury'), [self.rahim.pk])
+        self.assertEqual(self.found('Muhammad Hossain'), [self.bengali.pk])
+        self.assertEqual(set(self.found('ra')), {self.rahim.pk, self.rahman.pk})
+        self.assertEqual(self.found(self.rohman.patient_id), [self.rohman.pk])
+        self.assertEqual(self.found('x'), [])
+
+    def test_spelled_match_ranks_first(self):
+        self.assertEqual(self.found('Rahman'), [self.rahman.pk, self.rohman.pk])
+        self.assertEqual(self.found('Rohman'), [self.rohman.pk, self.rahman.pk])
+
+    def test_index_follows_saves(self):
+        self.rahim.first_name = 'Karim'
+        self.rahim.save()
+        self.assertEqual(self.found('karim'), [self.rahim.pk])
+        self.assertEqual(self.found('rahim'), [])
+        self.rahim.delete()
+        self.assertEqual(self.found('karim'), [])
+        self.assertEqual(SearchEntry.objects.count(), 3)
+
+    def test_rebuild(self):
+        SearchEntry.objects.all().delete()
+        self.assertEqual(self.found('rahim'), [])
+        out = StringIO()
+        call_command('rebuild_patient_search', stdout=out)
+        self.assertIn('Indexed 4 patients', out.getvalue())
+        self.assertEqual(self.found('rahim'), [self.rahim.pk])
+
+    def test_typeahead_endpoint(self):
+        Patient.objects.filter(pk=self.rohman.pk).update(is_active=False)
+        data = self.client.get(reverse('patients:patient_search'), {'q': 'rahman'}).json()
+        self.assertEqual([row['id'] for row in data['results']], [self.rahman.pk])
+        self.assertEqual(data['results'][0]['url'], reverse('patients:patient_detail', args=[self.rahman.pk]))
+        self.assertEqual(self.client.get(reverse('patients:patient_search')).json(), {'results': []})
+
+    def test_patient_list_uses_the_index(self):
+        url = reverse('patients:patient_list')
+        data = self.client.get(url, {'format': 'json', 'search_query': 'rahman'}).json()
+        self.assertEqual({row['id'] for row in data['results']}, {self.rahman.pk, self.rohman.pk})
+        data = self.client.get(url, {'format': 'json', 'search_query': 'rahman', 'gender': 'F'}).json()
+        self.assertEqual([row['id'] for row in data['results']], [self.rahman.pk])
+
+
+class PatientDedupTestCase(TestCase):
+    """Test the duplicate patient detector and merge"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass123', role='ADMIN')
+        self.doctor = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR')
+        self.client.force_login(self.admin)
+        self.rahim = self.patient('Rahim', 'Uddin', '01712345678', email='rahim@example.com')
+        self.copy = self.patient('রহিম', 'উদ্দিন', '+880 1712-345678', address='Walk-in Patient', blood_group='B+')
+        # Same phone, another member of the family
+        self.sister = self.patient('Fatema', 'Uddin', '01712345678', gender='F')
+        self.other = self.patient('Karim', 'Mia', '01911000222', date_of_birth='1975-05-05')
+
+    def patient(self, first_name, last_name, phone, gender='M', date_of_birth='1990-01-01', **fields):
+        fields.setdefault('address', 'Bazar Road')
+        return Patient.objects.create(
+            first_name=first_name, last_name=last_name, date_of_birth=date_of_birth, gender=gender, phone=phone,
+            city='Naogaon', emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother', **fields,
+        )
+
+    def test_candidates(self):
+        pairs = dedup.candidates()
+        self.assertEqual(len(pairs), 1)
+        self.assertEqual((pairs[0]['keep'], pairs[0]['duplicate']), (self.rahim.pk, self.copy.pk))
+        self.assertEqual(pairs[0]['reasons'], ['phone', 'similar name', 'date of birth'])
+        self.assertEqual(pairs[0]['score'], 0.85)
+
+    def test_command_merges_above_the_cutoff(self):
+        out = StringIO()
+        call_command('find_duplicate_patients', '--merge', stdout=out)
+        self.assertIn('1 likely duplicates', out.getvalue())
+        self.assertIn('Merged 0 patients', out.getvalue())
+        call_command('find_duplicate_patients', '--merge', '--merge-above', '0.8', stdout=out)
+        self.assertIn('Merged 1 patients', out.getvalue())
+        self.assertFalse(Patient.objects.filter(pk=self.copy.pk).exists())
+
+    @override_settings(DEDUP_BLOCK_LIMIT=2)
+    def test_oversized_blocks_are_skipped(self):
+        # Three patients share the phone; the name and birthday blocks still pair the copies
+        self.assertEqual([(pair['keep'], pair['duplicate']) for pair in dedup.candidates()], [(self.rahim.pk, self.copy.pk)])
+        self.patient('Rahim', 'Uddin', '01700000000')
+        self.assertEqual(dedup.candidates(), [])
+
+    def test_booking_reuses_the_patient(self):
+        self.assertEqual(dedup.existing('Rahim', 'Uddin', '১৭১২৩৪৫৬৭৮'), self.rahim)
+        self.assertEqual(dedup.existing('Fatema', '', '01712345678', gender='F'), self.sister)
+        self.assertIsNone(dedup.existing('Rahim', 'Uddin', '01999999999'))
+
+    def test_merge_moves_everything(self):
+        from accounts import archive
+        from accounts.models import ArchivedRecord, PCMember, PCTransaction
+        from appointments.models import Appointment, Prescription
+        from lab.models import LabOrder
+        from pharmacy.models import PharmacySale
+        from survey.models import CanteenSale, FeedbackSurvey
+
+        appointment = Appointment.objects.create(patient=self.copy, doctor=self.doctor, appointment_date=datetime.date.today())
+        Prescription.objects.create(appointment=appointment, patient=self.copy, doctor=self.doctor, diagnosis='Fever')
+        LabOrder.objects.create(patient=self.copy, appointment=appointment, ordered_by=self.doctor)
+        PharmacySale.objects.create(patient=self.copy)
+        CanteenSale.objects.create(patient=self.copy)
+        FeedbackSurvey.objects.create(
+            patient=self.copy, overall_experience=5, staff_behavior=5, cleanliness=5, waiting_time=5, facility_quality=5,
+        )
+        member = PCMember.objects.create(member_type='GENERAL', name='Karim', phone='01900000000', commission_percentage=10)
+        PCTransaction.objects.create(pc_member=member, patient=self.copy, total_amount=100, commission_percentage=10)
+        ArchivedRecord.objects.create(
+            model='appointments.Appointment', object_id=999, date=datetime.date(2020, 1, 1), patient_id=self.copy.pk,
+            data={'id': 999, 'patient_id': self.copy.pk, 'prescriptions': [{'id': 1, 'patient_id': self.copy.pk}]},
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            moved = dedup.merge(self.rahim, [self.copy], merged_by=self.admin, score=0.95)
+        self.assertEqual(moved, {
+            'appointments.Appointment': 1, 'appointments.Prescription': 1, 'lab.LabOrder': 1,
+            'pharmacy.PharmacySale': 1, 'survey.CanteenSale': 1, 'survey.FeedbackSurvey': 1,
+            'accounts.PCTransaction': 1, 'accounts.ArchivedRecord': 1,
+        })
+        self.assertFalse(Patient.objects.filter(pk=self.copy.pk).exists())
+        for model in (Appointment, Prescription, LabOrder, PharmacySale, CanteenSale, FeedbackSurvey, PCTransaction):
+            self.assertEqual(model.objects.get().patient_id, self.rahim.pk, model)
+        restored = archive.load('appointments.Appointment', patient_id=self.rahim.pk)[0]
+        self.assertEqual(restored.patient_id, self.rahim.pk)
+        self.assertEqual(restored.archived_related['prescriptions'][0].patient_id, self.rahim.pk)
+
+        self.rahim.refresh_from_db()
+        self.assertEqual((self.rahim.blood_group, self.rahim.email, self.rahim.address), ('B+', 'rahim@example.com', 'Bazar Road'))
+        merge = PatientMerge.objects.get()
+        self.assertEqual((merge.merged_into, merge.old_patient_id, merge.merged_by), (self.rahim, self.copy.patient_id, self.admin))
+        self.assertEqual(dedup.candidates(), [])
+
+        # Old links lead to the patient kept
+        response = self.client.get(reverse('patients:patient_detail', args=[self.copy.pk]))
+        self.assertRedirects(response, reverse('patients:patient_detail', args=[self.rahim.pk]), fetch_redirect_response=False)
+
+    def test_merge_view(self):
+        url = reverse('patients:merge_patients')
+        self.assertEqual(self.client.get(url).status_code, 405)
+        response = self.client.get(reverse('patients:duplicate_patients'))
+        self.assertEqual([pair['duplicate'] for pair in response.context['pairs']], [self.copy])
+
+        self.client.post(url, {'keep': self.rahim.pk, 'duplicate': self.copy.pk})
+        self.assertEqual(PatientMerge.objects.get().old_pk, self.copy.pk)
+
+        self.client.force_login(User.objects.create_user(username='reception', password='testpass123', role='RECEPTIONIST'))
+        self.client.post(url, {'keep': self.rahim.pk, 'duplicate': self.sister.pk})
+        self.assertTrue(Patient.objects.filter(pk=self.sister.pk).exists())
+
+    def test_registration_warns_about_duplicates(self):
+        data = {
+            'first_name': 'Rahim', 'last_name': 'Uddin', 'date_of_birth': '1990-01-01', 'gender': 'M',
+            'phone': '01712-345678', 'address': 'Bazar Road', 'city': 'Naogaon', 'emergency_contact_name': 'Karim',
+            'emergency_contact_phone': '01800000000', 'emergency_contact_relation': 'Brother',
+        }
+        count = Patient.objects.count()
+        response = self.client.post(reverse('patients:patient_register'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({patient for patient, _, _ in response.context['duplicates']}, {self.rahim, self.copy})
+        self.assertEqual(Patient.objects.count(), count)
+
+        response = self.client.post(reverse('patients:patient_register'), {**data, 'confirm_new': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Patient.objects.count(), count + 1)
+
+
+class PatientTimelineTestCase(TestCase):
+    """Test the unified patient timeline"""
+
+    def setUp(self):
+        from lab.models import LabTest
+        from pharmacy.models import Drug
+        from survey.models import CanteenItem
+
+        cache.clear()
+        self.user = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR', first_name='Abdul')
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth='1990-01-01', gender='M',
+            phone='01700000000', address='Bazar Road', city='Naogaon',
+            emergency_contact_name='Karim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+        self.test = LabTest.objects.create(
+            test_code='CBC', test_name='Complete Blood Count', category='BLOOD', price=500,
+            sample_type='Blood', turnaround_time='Same day',
+        )
+        self.drug = Drug.objects.create(
+            drug_code='D1', generic_name='Paracetamol', brand_name='Napa', form='TABLET', strength='500mg',
+            manufacturer='Beximco', quantity_in_stock=100, unit_price=1, selling_price=2,
+        )
+        self.item = CanteenItem.objects.create(item_code='TEA', name='Tea', category='BEVERAGE', price=10, cost=5)
+
+    def add_care(self, day):
+        """One of every kind of event on ``day``"""
+        from appointments.models import Appointment, Medicine, Prescription
+        from lab.models import LabOrder, LabResult
+        from pharmacy.models import PharmacySale, SaleItem
+        from survey.models import CanteenSale, CanteenSaleItem
+
+        appointment = Appointment.objects.create(patient=self.patient, doctor=self.user, appointment_date=day)
+        prescription = Prescription.objects.create(
+            appointment=appointment, patient=self.patient, doctor=self.user, diagnosis='Fever',
+        )
+        Medicine.objects.create(prescription=prescription, medicine_name='Napa', dosage='500mg', frequency='1+0+1', duration='5 days')
+        PatientHistory.objects.create(patient=self.patient, doctor=self.user, chief_complaint='Fever')
+        order = LabOrder.objects.create(patient=self.patient, appointment=appointment, ordered_by=self.user)
+        order.tests.add(self.test)
+        LabResult.objects.create(order=order, test=self.test, result_data={'hb': 13}, tested_by=self.user)
+        sale = PharmacySale.objects.create(patient=self.patient, total_amount=20)
+        SaleItem.objects.create(sale=sale, drug=self.drug, quantity=10, unit_price=2)
+        canteen = CanteenSale.objects.create(patient=self.patient, total_amount=10)
+        CanteenSaleItem.objects.create(sale=canteen, item=self.item, quantity=1, unit_price=10)
+        return appointment, prescription
+
+    def archive_appointment(self, appointment):
+        from accounts.models import ArchivedRecord
+
+        ArchivedRecord.objects.create(
+            model='appointments.Appointment', object_id=appointment.pk + 1000, date=datetime.date(2020, 1, 1),
+            patient_id=self.patient.pk, kind='completed',
+            data={
+                'id': appointment.pk + 1000, 'appointment_number': 'APT-OLD', 'patient_id': self.patient.pk,
+                'doctor_id': self.user.pk, 'appointment_date': '2020-01-01', 'serial_number': 1, 'status': 'completed',
+                'check_in_time': '2020-01-01T04:00:00+00:00',
+                'prescriptions': [{
+                    'id': 5000, 'prescription_number': 'RX-OLD', 'patient_id': self.patient.pk, 'doctor_id': self.user.pk,
+                    'diagnosis': 'Cough', 'created_at': '2020-01-01T05:00:00+00:00',
+                    'medicines': [{'id': 6000, 'medicine_name': 'Ace', 'dosage': '500mg', 'frequency': '1+1+1', 'duration': '3 days'}],
+                }],
+            },
+        )
+
+    def test_every_kind_of_event_newest_first(self):
+        appointment, _ = self.add_care(datetime.date.today())
+        self.archive_appointment(appointment)
+        events = timeline.build(self.patient.pk)
+        self.assertEqual(
+            sorted(event['kind'] for event in events),
+            sorted(['appointment', 'appointment', 'prescription', 'prescription', 'visit', 'lab_order', 'pharmacy_sale', 'canteen_sale']),
+        )
+        self.assertEqual([event['at'] for event in events], sorted((event['at'] for event in events), reverse=True))
+        archived = [event for event in events if event['archived']]
+        self.assertEqual([event['number'] for event in archived], ['RX-OLD', 'APT-OLD'])
+        self.assertEqual(archived[0]['medicines'][0]['name'], 'Ace')
+        self.assertEqual(archived[0]['doctor'], self.user.get_full_name())
+        lab_order = next(event for event in events if event['kind'] == 'lab_order')
+        self.assertEqual((lab_order['tests'], lab_order['results'][0]['data']), (['Complete Blood Count'], {'hb': 13}))
+        sale = next(event for event in events if event['kind'] == 'pharmacy_sale')
+        self.assertEqual(sale['items'], [{'name': str(self.drug), 'quantity': 10, 'total': '20.00'}])
+
+    def test_queries_do_not_grow_with_the_history(self):
+        def queries():
+            with CaptureQueriesContext(connection) as captured:
+                timeline.build(self.patient.pk)
+            return len(captured)
+
+        self.add_care(datetime.date.today())
+        few = queries()
+        for days in range(1, 4):
+            self.add_care(datetime.date.today() - datetime.timedelta(days=days))
+        self.assertEqual(queries(), few)
+
+    def test_cached_until_a_source_changes(self):
+        from appointments.models import Medicine
+
+        _, prescription = self.add_care(datetime.date.today())
+        timeline.get(self.patient.pk)
+        with self.assertNumQueries(0):
+            timeline.get(self.patient.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Medicine.objects.create(prescription=prescription, medicine_name='Fexo', dosage='120mg', frequency='0+0+1', duration='7 days')
+        event = next(event for event in timeline.get(self.patient.pk) if event['kind'] == 'prescription')
+        self.assertEqual([medicine['name'] for medicine in event['medicines']], ['Napa', 'Fexo'])
+
+    def test_pages_cover_the_timeline(self):
+        for days in range(3):
+            self.add_care(datetime.date.today() - datetime.timedelta(days=days))
+        everything = timeline.get(self.patient.pk)
+        seen, cursor = [], None
+        while True:
+            events, cursor = timeline.page(self.patient.pk, after=cursor, per_page=5)
+            seen.extend(events)
+            if not cursor:
+                break
+        self.assertEqual(seen, everything)
+
+        with self.assertRaises(timeline.InvalidCursor):
+            timeline.page(self.patient.pk, after='nonsense')
+
+    def test_views(self):
+        self.add_care(datetime.date.today())
+        url = reverse('patients:patient_history', args=[self.patient.pk])
+        data = self.client.get(url, {'format': 'json', 'kind': 'prescription'}).json()
+        self.assertEqual([event['kind'] for event in data['results']], ['prescription'])
+        self.assertIsNone(data['next'])
+
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['events']), 6)
+        self.assertContains(response, 'Complete Blood Count')
+        self.assertEqual(self.client.get(url, {'after': 'nonsense'}).status_code, 400)
+
+
+class PatientTransferTestCase(TestCase):
+    """Test bulk patient import and export"""
+
+    HEADER = 'patient_id,first_name,last_name,date_of_birth,gender,phone,address,city,emergency_contact_name,emergency_contact_phone,emergency_contact_relation\n'
+
+    def row(self, index, patient_id='', gender='M', date_of_birth='1990-01-01'):
+        return (
+            f'{patient_id},Rahim{index},Uddin,{date_of_birth},{gender},0171{index:07d},Bazar Road,Naogaon,'
+            f'Karim,01800000000,Brother\n'
+        )
+
+    def csv(self, rows):
+        return StringIO(self.HEADER + ''.join(rows))
+
+    def test_import_numbers_validates_and_indexes(self):
+        year = datetime.date.today().year
+        report = transfer.import_patients(self.csv([
+            self.row(1),
+            self.row(2, patient_id=f'PAT{year}0050'),
+            self.row(3, gender='X'),
+            self.row(4, date_of_birth='someday'),
+        ]))
+        self.assertEqual((report['rows'], report['created'], report['invalid']), (4, 2, 2))
+        self.assertEqual([line for line, _ in report['errors']], [4, 5])
+        self.assertIn('gender', report['errors'][0][1])
+        self.assertEqual(set(Patient.objects.values_list('patient_id', flat=True)), {f'PAT{year}0001', f'PAT{year}0050'})
+        self.assertEqual([patient.first_name for patient in search.search('rahim2')], ['Rahim2'])
+
+        # Registrations continue after the imported number
+        patient = Patient.objects.create(
+            first_name='Karim', last_name='Uddin', date_of_birth='1990-01-01', gender='M', phone='01900000000',
+            address='Bazar Road', city='Naogaon', emergency_contact_name='Rahim', emergency_contact_phone='01800000000',
+            emergency_contact_relation='Brother',
+        )
+        self.assertEqual(patient.patient_id, f'PAT{year}0051')
+
+    def test_queries_per_chunk_not_per_row(self):
+        def queries(count):
+            Patient.objects.all().delete()
+            with CaptureQueriesContext(connection) as captured:
+                transfer.import_patients(self.csv([self.row(index) for index in range(count)]))
+            return len(captured)
+
+        queries(1)  # creates the year's counter
+        self.assertEqual(queries(5), queries(50))
+        with override_settings(IMPORT_CHUNK_SIZE=10):
+            report = transfer.import_patients(self.csv([self.row(index) for index in range(100, 125)]))
+        self.assertEqual(report['created'], 25)
+        self.assertEqual(Patient.objects.values('patient_id').distinct().count(), 75)
+
+    def test_export_round_trip_and_reimport_skips(self):
+        transfer.import_patients(self.csv([self.row(index) for index in range(3)]))
+        Patient.objects.filter(first_name='Rahim2').update(is_active=False, email='rahim@example.com')
+        before = list(Patient.objects.order_by('pk').values(*transfer.FIELDS))
+        for format in transfer.FORMATS:
+            exported = ''.join(transfer.export_lines(format=format))
+            report = transfer.import_patients(StringIO(exported), format)
+            self.assertEqual((report['created'], report['skipped']), (0, 3))
+
+            Patient.objects.all().delete()
+            report = transfer.import_patients(StringIO(exported), format)
+            self.assertEqual((report['created'], report['invalid']), (3, 0))
+            self.assertEqual(list(Patient.objects.order_by('pk').values(*transfer.FIELDS)), before)
+
+    def test_commands(self):
+        directory = tempfile.mkdtemp()
+        source = os.path.join(directory, 'patients.csv')
+        with open(source, 'w', encoding='utf-8') as output:
+            output.write(self.csv([self.row(1), self.row(2, gender='X')]).getvalue())
+        out, err = StringIO(), StringIO()
+        call_command('import_patients', source, stdout=out, stderr=err)
+        self.assertIn('1 imported', out.getvalue())
+        self.assertIn('Line 3', err.getvalue())
+
+        target = os.path.join(directory, 'patients.jsonl')
+        out = StringIO()
+        call_command('export_patients', target, stdout=out)
+        self.assertIn('Exported 1 patients', out.getvalue())
+        with open(target, encoding='utf-8') as exported:
+            self.assertEqual(len(exported.readlines()), 1)
+
+        # Standard input is read, not closed
+        stdin = sys.stdin
+        sys.stdin = StringIO(self.csv([self.row(3)]).getvalue())
+        try:
+            call_command('import_patients', '-', stdout=StringIO())
+            self.assertFalse(sys.stdin.closed)
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(Patient.objects.count(), 2)
+
+    def test_import_updates_dashboard_rollups(self):
+        transfer.import_patients(self.csv([self.row(index) for index in range(3)]))
+        self.assertEqual(rollups.totals(metrics=['patients']).count('patients'), 3)
+        imported = list(DailyRollup.objects.values_list('metric', 'date', 'count'))
+        rollups.rebuild()
+        self.assertEqual(list(DailyRollup.objects.values_list('metric', 'date', 'count')), imported)
+
+    def test_admin_import_and_export(self):
+        admin = User.objects.create_superuser(username='admin', password='testpass123', role='ADMIN')
+        self.client.force_login(admin)
+        upload = SimpleUploadedFile('patients.csv', self.csv([self.row(1), self.row(2)]).getvalue().encode())
+        response = self.client.post(reverse('admin:patients_patient_import'), {'file': upload}, follow=True)
+        self.assertContains(response, '2 imported')
+
+        response = self.client.post(reverse('admin:patients_patient_changelist'), {
+            'action': 'export_csv', '_selected_action': list(Patient.objects.values_list('pk', flat=True)),
+        })
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('patient_id,first_name'))
@@ -0,0 +1,315 @@
+"""
+Patient timeline
+
+Everything that happened to a patient, newest first, in one list: visits
+(PatientHistory), appointments, prescriptions with their medicines, lab
+orders with their tests and results, and pharmacy and canteen purchases with
+their items, archived ones included (accounts.archive).
+
+build() assembles it in a fixed number of queries whatever the patient's
+history: one per kind of event plus one per prefetched relation, and one for
+the archive. The events are plain dicts, so the list is cached per patient
+(TIMELINE_TIMEOUT seconds) and paged from the cache with cursors (page()).
+
+Saves and deletes of any of the source models drop the patient's cached
+timeline (connect()); bulk updates that bypass the signals (no-shows at day
+close, archiving, merges) call invalidate() themselves.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Prefetch
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.urls import reverse
+from django.utils import timezone
+
+# Source model label -> path from an instance to its patient's id
+SOURCES = {
+    'patients.PatientHistory': 'patient_id',
+    'appointments.Appointment': 'patient_id',
+    'appointments.Prescription': 'patient_id',
+    'appointments.Medicine': 'prescription.patient_id',
+    'lab.LabOrder': 'patient_id',
+    'lab.LabResult': 'order.patient_id',
+    'pharmacy.PharmacySale': 'patient_id',
+    'pharmacy.SaleItem': 'sale.patient_id',
+    'survey.CanteenSale': 'patient_id',
+    'survey.CanteenSaleItem': 'sale.patient_id',
+}
+
+# Order of events at the same moment: the appointment before what came of it
+KINDS = ('appointment', 'visit', 'prescription', 'lab_order', 'pharmacy_sale', 'canteen_sale')
+
+
+class InvalidCursor(ValueError):
+    """The cursor was not produced by page()"""
+
+
+def cache_key(patient_id):
+    return f'patient_timeline:{patient_id}'
+
+
+def _timeout():
+    return getattr(settings, 'TIMELINE_TIMEOUT', 60 * 60)
+
+
+def _moment(value):
+    """ISO timestamp of a date or datetime, in local time so dates sort with times"""
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.replace(tzinfo=None).isoformat()
+    return datetime.datetime.combine(value, datetime.time.min).isoformat()
+
+
+def _money(value):
+    return str(value) if value is not None else None
+
+
+def _url(name, pk, archived):
+    return None if archived else reverse(name, args=[pk])
+
+
+def visit_event(visit):
+    return {
+        'kind': 'visit', 'id': visit.pk, 'at': _moment(visit.visit_date),
+        'doctor': visit.doctor.get_full_name() if visit.doctor else '',
+        'chief_complaint': visit.chief_complaint, 'diagnosis': visit.diagnosis,
+        'treatment': visit.treatment, 'notes': visit.notes,
+        'vitals': {
+            'temperature': _money(visit.temperature),
+            'blood_pressure': (
+                f'{visit.blood_pressure_systolic}/{visit.blood_pressure_diastolic}'
+                if visit.blood_pressure_systolic and visit.blood_pressure_diastolic else None
+            ),
+            'pulse_rate': visit.pulse_rate,
+            'weight': _money(visit.weight),
+        },
+        'archived': False, 'url': None,
+    }
+
+
+def appointment_event(appointment, doctors):
+    archived = getattr(appointment, 'archived', False)
+    # Booked ahead: the day and time booked; walk-ins: when they checked in
+    at = datetime.datetime.combine(appointment.appointment_date, appointment.appointment_time or datetime.time.min)
+    if appointment.check_in_time and timezone.localdate(appointment.check_in_time) == appointment.appointment_date:
+        at = appointment.check_in_time
+    return {
+        'kind': 'appointment', 'id': appointment.pk, 'at': _moment(at),
+        'number': appointment.appointment_number, 'serial_number': appointment.serial_number,
+        'doctor': doctors.get(appointment.doctor_id, ''), 'status': appointment.status,
+        'reason': appointment.reason,
+        'archived': archived, 'url': _url('appointments:appointment_detail', appointment.pk, archived),
+    }
+
+
+def prescription_event(prescription, medicines, doctors):
+    archived = getattr(prescription, 'archived', False)
+    return {
+        'kind': 'prescription', 'id': prescription.pk, 'at': _moment(prescription.created_at),
+        'number': prescription.prescription_number, 'doctor': doctors.get(prescription.doctor_id, ''),
+        'diagnosis': prescription.diagnosis, 'advice': prescription.advice,
+        'follow_up_date': prescription.follow_up_date.isoformat() if prescription.follow_up_date else None,
+        'medicines': [
+            {
+                'name': medicine.medicine_name, 'dosage': medicine.dosage, 'frequency': medicine.frequency,
+                'duration': medicine.duration, 'instructions': medicine.instructions,
+            }
+            for medicine in medicines
+        ],
+        'archived': archived, 'url': _url('appointments:prescription_detail', prescription.pk, archived),
+    }
+
+
+def lab_order_event(order):
+    return {
+        'kind': 'lab_order', 'id': order.pk, 'at': _moment(order.ordered_at),
+        'number': order.order_number, 'status': order.status, 'total': _money(order.total_amount),
+        'tests': [test.test_name for test in order.tests.all()],
+        'results': [
+            {
+                'test': result.test.test_name, 'data': result.result_data,
+                'interpretation': result.interpretation, 'verified': result.is_verified,
+            }
+            for result in order.results.all()
+        ],
+        'archived': False, 'url': _url('lab:order_detail', order.pk, False),
+    }
+
+
+def sale_event(kind, sale, items):
+    return {
+        'kind': kind, 'id': sale.pk, 'at': _moment(sale.sale_date),
+        'number': sale.sale_number, 'total': _money(sale.total_amount),
+        'items': [{'name': name, 'quantity': quantity, 'total': _money(total)} for name, quantity, total in items],
+        'archived': getattr(sale, 'archived', False), 'url': None,
+    }
+
+
+def build(patient_id):
+    """Every event of a patient, newest first (a fixed number of queries)"""
+    from django.contrib.auth import get_user_model
+
+    from accounts import archive
+    from appointments.models import Appointment, Prescription
+    from lab.models import LabOrder, LabResult
+    from pharmacy.models import Drug, PharmacySale, SaleItem
+    from survey.models import CanteenItem, CanteenSale, CanteenSaleItem
+
+    from .models import PatientHistory
+
+    events = [
+        visit_event(visit)
+        for visit in PatientHistory.objects.filter(patient_id=patient_id).select_related('doctor')
+    ]
+    archived = archive.load_patient(patient_id)
+
+    appointments = list(Appointment.objects.filter(patient_id=patient_id)) + archived['appointments.Appointment']
+    prescriptions = [
+        (prescription, prescription.medicines.all())
+        for prescription in Prescription.objects.filter(patient_id=patient_id).prefetch_related('medicines')
+    ] + [
+        (prescription, prescription.archived_related['medicines'])
+        for appointment in archived['appointments.Appointment']
+        for prescription in appointment.archived_related['prescriptions']
+    ]
+    # Doctors by id: archived rows only have the ids
+    doctor_ids = {appointment.doctor_id for appointment in appointments} | {
+        prescription.doctor_id for prescription, _ in prescriptions
+    }
+    doctors = {
+        doctor.pk: doctor.get_full_name()
+        for doctor in get_user_model().objects.filter(pk__in=doctor_ids).only('first_name', 'last_name')
+    } if doctor_ids else {}
+    events += [appointment_event(appointment, doctors) for appointment in appointments]
+    events += [prescription_event(prescription, medicines, doctors) for prescription, medicines in prescriptions]
+
+    events += [
+        lab_order_event(order)
+        for order in LabOrder.objects.filter(patient_id=patient_id).prefetch_related(
+            'tests', Prefetch('results', queryset=LabResult.objects.select_related('test')),
+        )
+    ]
+
+    for kind, model, item_model, product_model, product_field, archived_sales in (
+        ('pharmacy_sale', PharmacySale, SaleItem, Drug, 'drug', archived['pharmacy.PharmacySale']),
+        ('canteen_sale', CanteenSale, CanteenSaleItem, CanteenItem, 'item', archived['survey.CanteenSale']),
+    ):
+        for sale in model.objects.filter(patient_id=patient_id).prefetch_related(
+            Prefetch('items', queryset=item_model.objects.select_related(product_field)),
+        ):
+            events.append(sale_event(kind, sale, [
+                (str(getattr(item, product_field)), item.quantity, item.total_price) for item in sale.items.all()
+            ]))
+        if archived_sales:
+            products = product_model.objects.in_bulk({
+                getattr(item, f'{product_field}_id') for sale in archived_sales for item in sale.archived_related['items']
+            })
+            for sale in archived_sales:
+                events.append(sale_event(kind, sale, [
+                    (str(products.get(getattr(item, f'{product_field}_id'), '')), item.quantity, item.total_price)
+                    for item in sale.archived_related['items']
+                ]))
+
+    events.sort(key=sort_key, reverse=True)
+    return events
+
+
+def sort_key(event):
+    return event['at'], -KINDS.index(event['kind']), event['id']
+
+
+def get(patient_id):
+    """The patient's timeline, from the cache when it is there"""
+    events = cache.get(cache_key(patient_id))
+    if events is None:
+        events = build(patient_id)
+        cache.set(cache_key(patient_id), events, _timeout())
+    return events
+
+
+def encode_cursor(event):
+    data = json.dumps(list(sort_key(event)), separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        at, kind, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return str(at), int(kind), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def page(patient_id, after=None, per_page=20, kinds=None):
+    """``(events, next cursor or None)``: the events after cursor ``after``.
+
+    ``kinds`` narrows the timeline to some kinds of event. Raises
+    InvalidCursor for a cursor that cannot be decoded.
+    """
+    events = get(patient_id)
+    if kinds:
+        events = [event for event in events if event['kind'] in kinds]
+    if after:
+        boundary = decode_cursor(after)
+        events = [event for event in events if sort_key(event) < boundary]
+    more = len(events) > per_page
+    events = events[:per_page]
+    return events, encode_cursor(events[-1]) if more else None
+
+
+def invalidate(*patient_ids):
+    cache.delete_many([cache_key(patient_id) for patient_id in patient_ids if patient_id])
+
+
+def _patient_of(instance, path):
+    value = instance
+    for name in path.split('.'):
+        value = getattr(value, name, None)
+        if value is None:
+            return None
+    return value
+
+
+def _changed(sender, instance, **kwargs):
+    try:
+        patient_id = _patient_of(instance, SOURCES[sender._meta.label])
+    except ObjectDoesNotExist:
+        # Deleted along with its parent, which dropped the timeline already
+        return
+    # After commit, so a request reading in between cannot cache the old rows again
+    transaction.on_commit(lambda: invalidate(patient_id))
+
+
+def _tests_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    from lab.models import LabOrder
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # test.orders.add(...): the orders are in pk_set
+        patient_ids = list(LabOrder.objects.filter(pk__in=pk_set or ()).values_list('patient_id', flat=True))
+    else:
+        patient_ids = [instance.patient_id]
+    transaction.on_commit(lambda: invalidate(*patient_ids))
+
+
+def connect():
+    """Drop cached timelines on writes to the source models (called from PatientsConfig.ready)"""
+    from django.apps import apps
+
+    for label in SOURCES:
+        model = apps.get_model(label)
+        uid = f'patients.timeline.{label}'
+        post_save.connect(_changed, sender=model, dispatch_uid=uid)
+        post_delete.connect(_changed, sender=model, dispatch_uid=uid)
+    m2m_changed.connect(
+        _tests_changed, sender=apps.get_model('lab.LabOrder').tests.through, dispatch_uid='patients.timeline.tests'
+    )
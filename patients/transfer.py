@@ -0,0 +1,232 @@
+"""
+Patient import and export
+
+Clinics moving from paper or another system load their patients from CSV or
+JSON Lines files (one object per line), with the columns of FIELDS. The file
+is read as a stream and handled in chunks of IMPORT_CHUNK_SIZE rows, so
+memory stays the same whatever its size:
+
+- each row is validated like a registration (Patient.full_clean); invalid
+  rows are reported with their line number and skipped
+- rows keeping a patient ID already in the database are skipped, so an
+  interrupted import of a file with patient IDs can be run again; rows
+  without one are not recognised and would be imported twice
+- rows without a patient ID get one from a block reserved for the whole
+  chunk (accounts.sequences.reserve), not one counter query per patient
+- the chunk is inserted with bulk_create, search entries and dashboard
+  rollups included (bulk inserts send no post_save, see patients/search.py
+  and accounts/rollups.py), in one transaction
+
+Imported patient IDs of the PAT<year><n> form move that year's counter past
+them (sequences.advance), so registrations never mint them again.
+
+export_lines() streams patients the other way, in the same columns, for the
+export_patients command and the admin action.
+"""
+import csv
+import io
+import json
+import re
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from accounts import rollups, sequences
+
+from . import search
+
+FORMATS = ('csv', 'jsonl')
+
+# Columns of an import or export file; patient_id may be left empty
+FIELDS = (
+    'patient_id', 'first_name', 'last_name', 'date_of_birth', 'gender', 'blood_group',
+    'phone', 'email', 'address', 'city',
+    'emergency_contact_name', 'emergency_contact_phone', 'emergency_contact_relation',
+    'allergies', 'chronic_conditions', 'is_active',
+)
+
+# Exported for reference, not imported
+EXPORT_FIELDS = FIELDS + ('registered_at',)
+
+BOOLEANS = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}
+
+PATIENT_ID = re.compile(r'PAT(\d{4})(\d+)')
+
+
+def chunk_size():
+    return getattr(settings, 'IMPORT_CHUNK_SIZE', 1000)
+
+
+def error_limit():
+    # Errors kept for the report; the rest are only counted
+    return getattr(settings, 'IMPORT_ERROR_LIMIT', 100)
+
+
+def detect_format(filename, default='csv'):
+    """``csv`` or ``jsonl`` from a file name"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return {'jsonl': 'jsonl', 'ndjson': 'jsonl', 'csv': 'csv'}.get(extension, default)
+
+
+def read_rows(stream, format='csv'):
+    """``(line number, row dict)`` of each record in a text stream, lazily.
+
+    A line that is not JSON gives ``(line, None)``, reported as invalid.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else None
+
+
+def build(row, registered_by=None):
+    """An unsaved Patient from an import row; raises ValidationError"""
+    from .models import Patient
+
+    if row is None:
+        raise ValidationError('Not a JSON object')
+    values = {}
+    for field in FIELDS:
+        value = row.get(field)
+        value = '' if value is None else str(value).strip()
+        if field == 'is_active':
+            # Missing means active, as for a registration
+            value = BOOLEANS.get(value.lower(), value) if value else True
+        values[field] = value
+    # patient_id is not a form field: blank is allowed here, a new one is given
+    if len(values['patient_id']) > Patient._meta.get_field('patient_id').max_length:
+        raise ValidationError({'patient_id': ['Too long.']})
+    patient = Patient(registered_by=registered_by, **values)
+    patient.full_clean(exclude=['patient_id', 'registered_by'], validate_unique=False)
+    return patient
+
+
+def _message(error):
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _insert(patients):
+    """Number, insert and index one chunk; returns how many were new"""
+    from .models import Patient, SearchEntry
+
+    with transaction.atomic():
+        given = [patient.patient_id for patient in patients if patient.patient_id]
+        existing = set(Patient.objects.filter(patient_id__in=given).values_list('patient_id', flat=True))
+        new, seen = [], set()
+        for patient in patients:
+            if patient.patient_id:
+                if patient.patient_id in existing or patient.patient_id in seen:
+                    continue
+                seen.add(patient.patient_id)
+            new.append(patient)
+
+        unnumbered = [patient for patient in new if not patient.patient_id]
+        if unnumbered:
+            year = str(timezone.now().year)
+            first = sequences.reserve('PAT', year, len(unnumbered), Patient, 'patient_id')
+            for value, patient in enumerate(unnumbered, first):
+                patient.patient_id = f'PAT{year}{value:04d}'
+        # Imported numbers of our own form: registrations continue after them
+        highest = {}
+        for patient_id in seen:
+            match = PATIENT_ID.fullmatch(patient_id)
+            if match:
+                year, value = match.group(1), int(match.group(2))
+                highest[year] = max(highest.get(year, 0), value)
+        for year, value in highest.items():
+            sequences.advance('PAT', year, value, Patient, 'patient_id')
+
+        Patient.objects.bulk_create(new)
+        # bulk_create sends no post_save: count the registrations here
+        rollups.bulk_changed('patients.Patient', new=new)
+        entries = []
+        for patient in new:
+            document, phonetic = search.entry_text(patient)
+            entries.append(SearchEntry(patient=patient, document=document, phonetic=phonetic))
+        SearchEntry.objects.bulk_create(entries)
+    return len(new)
+
+
+def import_patients(stream, format='csv', registered_by=None, dry_run=False, progress=None):
+    """Import the patients in ``stream``; returns a report dict.
+
+    ``{'rows', 'created', 'skipped', 'invalid', 'errors', 'seconds', 'per_second'}``
+    where ``errors`` is ``[(line, message)]`` (the first IMPORT_ERROR_LIMIT)
+    and ``skipped`` counts rows whose patient ID was already there.
+    ``progress(report)`` is called after each chunk. With ``dry_run`` the
+    rows are only validated.
+    """
+    started = time.monotonic()
+    report = {'rows': 0, 'created': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+    for chunk in _chunks(read_rows(stream, format), chunk_size()):
+        patients = []
+        for line, row in chunk:
+            try:
+                patients.append(build(row, registered_by))
+            except ValidationError as error:
+                report['invalid'] += 1
+                if len(report['errors']) < error_limit():
+                    report['errors'].append((line, _message(error)))
+        report['rows'] += len(chunk)
+        created = 0 if dry_run or not patients else _insert(patients)
+        report['created'] += created
+        report['skipped'] += 0 if dry_run else len(patients) - created
+        if progress:
+            progress(report)
+    report['seconds'] = time.monotonic() - started
+    report['per_second'] = report['rows'] / report['seconds'] if report['seconds'] else 0
+    return report
+
+
+def _value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def export_lines(queryset=None, format='csv'):
+    """The lines of an export file of ``queryset`` (default all patients), lazily"""
+    from .models import Patient
+
+    queryset = Patient.objects.all() if queryset is None else queryset
+    rows = queryset.order_by('pk').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size())
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def line(values):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(values)
+            return buffer.getvalue()
+
+        yield line(EXPORT_FIELDS)
+        for row in rows:
+            yield line([_value(value) for value in row])
+    else:
+        for row in rows:
+            yield json.dumps(
+                {field: _value(value) for field, value in zip(EXPORT_FIELDS, row)}, ensure_ascii=False
+            ) + '\n'
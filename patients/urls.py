@@ -5,6 +5,9 @@ app_name = 'patients'
 
 urlpatterns = [
     path('', views.patient_list, name='patient_list'),
+    path('search/', views.patient_search, name='patient_search'),
+    path('duplicates/', views.duplicate_patients, name='duplicate_patients'),
+    path('duplicates/merge/', views.merge_patients, name='merge_patients'),
     path('register/', views.patient_register, name='patient_register'),
     path('<int:pk>/', views.patient_detail, name='patient_detail'),
     path('<int:pk>/edit/', views.patient_edit, name='patient_edit'),
@@ -1,15 +1,20 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
-from .models import Patient, PatientHistory
+from django.views.decorators.http import require_POST
+from .models import Patient
 from .forms import PatientRegistrationForm, PatientSearchForm
+from . import dedup, search
 
 @login_required
 def patient_list(request):
-    """List all patients with search"""
+    """Patients with search, newest first, one keyset page at a time (?format=json for infinite scroll)"""
+    from django.core.exceptions import BadRequest
+    from django.http import JsonResponse
+    from accounts.pagination import InvalidCursor, cursor_url, paginate
+    
     form = PatientSearchForm(request.GET or None)
-    patients = Patient.objects.all().order_by('-registered_at')
+    patients = Patient.objects.all()
     
     if form.is_valid():
         search_query = form.cleaned_data.get('search_query')
@@ -17,13 +22,8 @@ def patient_list(request):
         gender = form.cleaned_data.get('gender')
         
         if search_query:
-            patients = patients.filter(
-                Q(first_name__icontains=search_query) |
-                Q(last_name__icontains=search_query) |
-                Q(patient_id__icontains=search_query) |
-                Q(phone__icontains=search_query) |
-                Q(email__icontains=search_query)
-            )
+            # Names (Bengali or Latin, sound-alikes), ID, phone or email, from the search index
+            patients = patients.filter(pk__in=search.matching(search_query))
         
         if blood_group:
             patients = patients.filter(blood_group=blood_group)
@@ -31,21 +31,82 @@ def patient_list(request):
         if gender:
             patients = patients.filter(gender=gender)
     
+    try:
+        page = paginate(
+            patients, Patient.LIST_ORDERING,
+            after=request.GET.get('after') or None, before=request.GET.get('before') or None,
+        )
+    except InvalidCursor:
+        raise BadRequest('Invalid cursor')
+    
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'results': [
+                {
+                    'id': patient.id,
+                    'patient_id': patient.patient_id,
+                    'name': patient.get_full_name(),
+                    'gender': patient.gender,
+                    'blood_group': patient.blood_group,
+                    'phone': patient.phone,
+                    'registered_at': patient.registered_at.isoformat(),
+                }
+                for patient in page
+            ],
+            'next': cursor_url(request, after=page.next_cursor) if page.has_next else None,
+            'previous': cursor_url(request, before=page.previous_cursor) if page.has_previous else None,
+        })
+    
     context = {
-        'patients': patients,
+        'patients': page,
         'form': form,
     }
     return render(request, 'patients/patient_list.html', context)
 
+@login_required
+def patient_search(request):
+    """Typeahead: patients matching ?q=, best match first (JSON)"""
+    from django.conf import settings
+    from django.http import JsonResponse
+    from django.urls import reverse
+    
+    limit = getattr(settings, 'PATIENT_SEARCH_LIMIT', 10)
+    if request.GET.get('limit', '').isdigit():
+        limit = min(int(request.GET['limit']), 50) or limit
+    patients = search.search(request.GET.get('q', ''), limit=limit)
+    return JsonResponse({
+        'results': [
+            {
+                'id': patient.id,
+                'patient_id': patient.patient_id,
+                'name': patient.get_full_name(),
+                'phone': patient.phone,
+                'age': patient.age,
+                'gender': patient.gender,
+                'url': reverse('patients:patient_detail', args=[patient.pk]),
+            }
+            for patient in patients
+        ],
+    })
+
 @login_required
 def patient_register(request):
     """Register new patient"""
     if request.method == 'POST':
         form = PatientRegistrationForm(request.POST)
         if form.is_valid():
-            patient = form.save()
-            messages.success(request, f'Patient {patient.get_full_name()} registered successfully! ID: {patient.patient_id}')
-            return redirect('patients:patient_detail', pk=patient.pk)
+            data = form.cleaned_data
+            # Likely the same person: show them first, unless confirmed as new
+            duplicates = [] if request.POST.get('confirm_new') else dedup.similar(
+                data['first_name'], data['last_name'], data['phone'], data['date_of_birth'], data['gender'],
+            )
+            if not duplicates:
+                patient = form.save()
+                messages.success(request, f'Patient {patient.get_full_name()} registered successfully! ID: {patient.patient_id}')
+                return redirect('patients:patient_detail', pk=patient.pk)
+            return render(request, 'patients/patient_form.html', {
+                'form': form, 'title': 'Register New Patient', 'duplicates': duplicates,
+            })
     else:
         form = PatientRegistrationForm()
     
@@ -55,8 +116,18 @@ def patient_register(request):
 @login_required
 def patient_detail(request, pk):
     """View patient details"""
-    patient = get_object_or_404(Patient, pk=pk)
-    return render(request, 'patients/patient_detail.html', {'patient': patient})
+    from accounts import archive
+    from .models import PatientMerge
+    patient = Patient.objects.filter(pk=pk).first()
+    if patient is None:
+        # A duplicate merged away: its links and cards lead to the patient kept
+        merge = get_object_or_404(PatientMerge, old_pk=pk)
+        return redirect('patients:patient_detail', pk=merge.merged_into_id)
+    # Older appointments are read back from the archive (marked ``archived``)
+    appointments = list(
+        patient.appointments.select_related('doctor').prefetch_related('prescriptions').order_by('-appointment_date', '-serial_number')
+    ) + archive.load('appointments.Appointment', patient_id=patient.pk)
+    return render(request, 'patients/patient_detail.html', {'patient': patient, 'appointments': appointments})
 
 @login_required
 def patient_edit(request, pk):
@@ -70,10 +141,67 @@ def patient_edit(request, pk):
 
 @login_required
 def patient_history(request, pk):
-    """View patient medical history"""
+    """Patient timeline: visits, appointments, prescriptions, lab orders and purchases, newest first.
+    
+    Paged with ?after= cursors; ?kind= narrows it to some kinds of event and
+    ?format=json returns a page for infinite scroll.
+    """
+    from django.core.exceptions import BadRequest
+    from django.http import JsonResponse
+    from accounts.pagination import cursor_url
+    from . import timeline
+    
     patient = get_object_or_404(Patient, pk=pk)
-    history = PatientHistory.objects.filter(patient=patient).order_by('-visit_date')
+    kinds = [kind for kind in request.GET.getlist('kind') if kind in timeline.KINDS]
+    try:
+        events, next_cursor = timeline.page(patient.pk, after=request.GET.get('after') or None, kinds=kinds)
+    except timeline.InvalidCursor:
+        raise BadRequest('Invalid cursor')
+    next_url = cursor_url(request, after=next_cursor) if next_cursor else None
+    
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'results': events, 'next': next_url})
     return render(request, 'patients/patient_history.html', {
         'patient': patient,
-        'history': history
+        'events': events,
+        'next_url': next_url,
+        'kinds': [(kind, kind.replace('_', ' ').title()) for kind in timeline.KINDS],
+        'selected_kinds': kinds,
     })
+
+@login_required
+def duplicate_patients(request):
+    """Likely duplicate patients, best match first, to merge (Admin only)"""
+    if request.user.role != 'ADMIN':
+        messages.error(request, 'Access denied. Admin only.')
+        return redirect('accounts:dashboard')
+    
+    pairs = dedup.candidates()[:200]
+    patients = Patient.objects.in_bulk({pk for pair in pairs for pk in (pair['keep'], pair['duplicate'])})
+    for pair in pairs:
+        pair['keep'] = patients[pair['keep']]
+        pair['duplicate'] = patients[pair['duplicate']]
+    return render(request, 'patients/duplicates.html', {'pairs': pairs})
+
+@require_POST
+@login_required
+def merge_patients(request):
+    """Merge the patient ``duplicate`` into ``keep`` (Admin only)"""
+    if request.user.role != 'ADMIN':
+        messages.error(request, 'Access denied. Admin only.')
+        return redirect('accounts:dashboard')
+    
+    keep = get_object_or_404(Patient, pk=request.POST.get('keep'))
+    duplicate = get_object_or_404(Patient, pk=request.POST.get('duplicate'))
+    if keep.pk == duplicate.pk:
+        messages.error(request, 'A patient cannot be merged into itself.')
+        return redirect('patients:duplicate_patients')
+    score, _ = dedup.score(*[
+        dedup.profile(patient.pk, *[getattr(patient, field) for field in dedup.FIELDS]) for patient in (keep, duplicate)
+    ])
+    moved = dedup.merge(keep, [duplicate], merged_by=request.user, score=score)
+    messages.success(
+        request,
+        f'{duplicate.patient_id} merged into {keep.patient_id} ({sum(moved.values())} records moved).'
+    )
+    return redirect('patients:duplicate_patients')
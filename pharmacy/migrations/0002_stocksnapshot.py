@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('selling_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('drug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='pharmacy.drug')),
+            ],
+            options={
+                'ordering': ['-date', 'drug'],
+                'unique_together': {('date', 'drug')},
+            },
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 from django.conf import settings
+from accounts.sequences import next_number
+from accounts.sqlite import retry_on_locked
 from patients.models import Patient
 from appointments.models import Prescription
 
@@ -154,21 +156,12 @@ class PharmacySale(models.Model):
     def __str__(self):
         return f"{self.sale_number} - {self.total_amount}"
     
+    @retry_on_locked
     def save(self, *args, **kwargs):
         if not self.sale_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_sale = PharmacySale.objects.filter(
-                sale_number__startswith=f'PH{date_str}'
-            ).order_by('sale_number').last()
-            
-            if last_sale:
-                last_number = int(last_sale.sale_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.sale_number = f'PH{date_str}{new_number:04d}'
+            self.sale_number = next_number('PH', date_str, PharmacySale, 'sale_number')
         
         super().save(*args, **kwargs)
     
@@ -248,3 +241,20 @@ class StockAdjustment(models.Model):
         # Update drug stock
         self.drug.quantity_in_stock += self.quantity
         self.drug.save()
+
+
+class StockSnapshot(models.Model):
+    """A drug's stock as it stood when a day was closed (accounts.closing)"""
+    
+    date = models.DateField()
+    drug = models.ForeignKey(Drug, on_delete=models.CASCADE, related_name='snapshots')
+    quantity = models.IntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    selling_price = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        ordering = ['-date', 'drug']
+        unique_together = ['date', 'drug']
+    
+    def __str__(self):
+        return f"{self.date} {self.drug.brand_name}: {self.quantity}"
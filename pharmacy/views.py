@@ -327,14 +327,18 @@ def prescription_detail(request, pk):
 
 @login_required
 def prescription_print(request, pk):
-    """Print prescription"""
+    """Print prescription (as PDF with ?format=pdf)"""
+    from accounts import documents
+    
     prescription = get_object_or_404(Prescription, pk=pk)
     context = {
         'prescription': prescription,
         'patient': prescription.appointment.patient,
         'today': timezone.now(),
     }
-    return render(request, 'pharmacy/prescription_print.html', context)
+    return documents.print_response(
+        request, 'pharmacy/prescription_print.html', context, f'{prescription.prescription_number}.pdf'
+    )
 
 
 # ========== SUPPLIER MANAGEMENT ==========
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from accounts.sequences import next_number
 from patients.models import Patient
 
 class CanteenItem(models.Model):
@@ -76,17 +77,7 @@ class CanteenSale(models.Model):
         if not self.sale_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_sale = CanteenSale.objects.filter(
-                sale_number__startswith=f'CNT{date_str}'
-            ).order_by('sale_number').last()
-            
-            if last_sale:
-                last_number = int(last_sale.sale_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.sale_number = f'CNT{date_str}{new_number:04d}'
+            self.sale_number = next_number('CNT', date_str, CanteenSale, 'sale_number')
         
         super().save(*args, **kwargs)
     
@@ -165,17 +156,7 @@ class FeedbackSurvey(models.Model):
         if not self.survey_number:
             from django.utils import timezone
             date_str = timezone.now().strftime('%Y%m%d')
-            last_survey = FeedbackSurvey.objects.filter(
-                survey_number__startswith=f'SUR{date_str}'
-            ).order_by('survey_number').last()
-            
-            if last_survey:
-                last_number = int(last_survey.survey_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.survey_number = f'SUR{date_str}{new_number:04d}'
+            self.survey_number = next_number('SUR', date_str, FeedbackSurvey, 'survey_number')
         
         super().save(*args, **kwargs)
     